@@ -0,0 +1,254 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Captura compacta de ACKs en envíos masivos con memoria constante.
+
+De cada respuesta se guarda sólo un resumen de tamaño fijo: MSH-10, código
+MSA-1, segmento ERR (o MSA-3 si no hay ERR) recortados y latencia. Los
+resúmenes van en columnas respaldadas por `array`/`bytearray` que forman un
+buffer circular con las últimas `capacity` respuestas; además se acumulan
+contadores por código y la latencia media y máxima de todo el envío.
+
+Los bytes completos del ACK sólo se escriben en disco (diario con framing
+MLLP, legible por `hl7_query`) si la respuesta no es AA/CA o si toca por
+muestreo (1 de cada `sample_every`). Los resultados sin ACK (timeout,
+conexión rechazada) se registran con ese código y sin bytes. El diario no
+crece más de `max_spool_mb` (0 sin límite): al llegar al límite los ACK dejan
+de guardarse y sólo se cuentan (`spool_dropped`).
+
+La configuración (`ack_capture` en perfiles y destinos) es un dict:
+{"capacity": 16384, "sample_every": 0, "max_spool_mb": 1024}.
+"""
+
+import os
+import threading
+from array import array
+from collections import namedtuple
+
+from ack_tracker import STATUS_ACCEPT, classify
+from hl7_parser import LazyMessage, parse_ack
+from mllp import wrap
+from mllp_receiver import MessageJournal
+
+# Anchura (bytes) de las columnas de texto; los valores más largos se recortan
+CONTROL_ID_WIDTH = 32
+ERROR_WIDTH = 96
+DEFAULT_CAPACITY = 16384
+# Tamaño máximo por defecto del fichero de ACKs guardados (MB)
+DEFAULT_MAX_SPOOL_MB = 1024
+_FRAME_OVERHEAD = len(wrap(b""))
+# Máximo de códigos distintos (columna de un byte); el resto se cuenta como CODE_OTHER
+MAX_CODES = 255
+CODE_OTHER = "?"
+CODE_NO_MSA = "no MSA"
+
+AckSummary = namedtuple("AckSummary", "control_id code error latency spooled")
+
+
+def msa_code(ack):
+    """MSA-1 de un ACK buscándolo directamente, sin indexar el mensaje (b'' si no hay MSA)."""
+    separator = ack[3:4] if ack.startswith(b"MSH") else b"|"
+    marker = b"MSA" + separator
+    start = ack.find(marker)
+    while start > 0 and ack[start - 1] not in b"\r\n":
+        start = ack.find(marker, start + 4)
+    if start < 0:
+        return b""
+    begin = start + 4
+    stop = len(ack)
+    for delimiter in (separator, b"\r", b"\n"):
+        pos = ack.find(delimiter, begin, stop)
+        if pos >= 0:
+            stop = pos
+    return ack[begin:stop]
+
+
+def error_summary(ack, text=b""):
+    """Segmento ERR del ACK o, si no tiene, el texto de MSA-3."""
+    err = LazyMessage(ack).segment(b"ERR")
+    return bytes(err) if err is not None else text
+
+
+class AckCapture:
+    """Resumen por columnas de los ACK recibidos en un envío masivo (seguro entre hilos)."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, spool_path=None, sample_every=0,
+                 max_spool_bytes=DEFAULT_MAX_SPOOL_MB * 1024 * 1024):
+        self.capacity = max(1, capacity)
+        self.sample_every = max(0, sample_every)
+        self.lock = threading.Lock()
+        self.control_ids = bytearray(self.capacity * CONTROL_ID_WIDTH)
+        self.control_id_lengths = array("B", bytes(self.capacity))
+        self.codes = array("B", bytes(self.capacity))
+        self.errors = bytearray(self.capacity * ERROR_WIDTH)
+        self.error_lengths = array("B", bytes(self.capacity))
+        self.latencies = array("f", [0.0]) * self.capacity
+        self.spooled_flags = array("B", bytes(self.capacity))
+        self.code_names = []
+        self._code_index = {}
+        # Índices de los códigos de aceptación (AA/CA) para filtrar sin reconstruir filas
+        self._accepted = set()
+        self.count = 0
+        self.failed = 0
+        self.counts = {}
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.spooled = 0
+        self.spool_dropped = 0
+        self.spool_path = spool_path
+        self.max_spool_bytes = max(0, max_spool_bytes)
+        # Sin rotación: el límite es el tamaño total del fichero
+        self.journal = MessageJournal(spool_path) if spool_path else None
+
+    @classmethod
+    def from_dict(cls, data, spool_path=None):
+        data = data or {}
+        try:
+            max_spool_mb = float(data.get("max_spool_mb", DEFAULT_MAX_SPOOL_MB))
+            if max_spool_mb < 0:
+                raise ValueError(max_spool_mb)
+            return cls(int(data.get("capacity", DEFAULT_CAPACITY)), spool_path, int(data.get("sample_every", 0)),
+                       int(max_spool_mb * 1024 * 1024))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid ack_capture settings: {data!r}")
+
+    def _code(self, name):
+        index = self._code_index.get(name)
+        if index is None:
+            if len(self.code_names) >= MAX_CODES - 1 and name != CODE_OTHER:
+                # El último hueco queda para CODE_OTHER
+                return self._code(CODE_OTHER)
+            index = self._code_index[name] = len(self.code_names)
+            self.code_names.append(name)
+            if classify(name) == STATUS_ACCEPT:
+                self._accepted.add(index)
+        return index
+
+    def record(self, control_id, ack, latency, outcome=None):
+        """Registra una respuesta (bytes sin framing) o, con `ack` None, un resultado sin ACK (`outcome`)."""
+        if ack is not None:
+            # Los ACK de aceptación (casi todos) no se parsean: basta con MSA-1
+            code = msa_code(ack)
+            name = code.decode("ascii", errors="replace") or CODE_NO_MSA
+            failed = classify(code) != STATUS_ACCEPT
+            error = error_summary(ack, parse_ack(ack)[2]) if failed else b""
+        else:
+            name = outcome or CODE_NO_MSA
+            failed = True
+            error = b""
+        control_id = bytes(control_id[:CONTROL_ID_WIDTH])
+        error = error[:ERROR_WIDTH]
+        with self.lock:
+            row = self.count % self.capacity
+            spool = self.journal is not None and ack is not None and (
+                failed or (self.sample_every and self.count % self.sample_every == 0))
+            if spool and self.max_spool_bytes and \
+                    self.journal.size + len(ack) + _FRAME_OVERHEAD > self.max_spool_bytes:
+                spool = False
+                self.spool_dropped += 1
+            start = row * CONTROL_ID_WIDTH
+            self.control_ids[start:start + len(control_id)] = control_id
+            self.control_id_lengths[row] = len(control_id)
+            if error:
+                start = row * ERROR_WIDTH
+                self.errors[start:start + len(error)] = error
+            self.error_lengths[row] = len(error)
+            code_index = self._code(name)
+            name = self.code_names[code_index]
+            self.codes[row] = code_index
+            self.latencies[row] = latency
+            self.spooled_flags[row] = 1 if spool else 0
+            self.count += 1
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if failed:
+                self.failed += 1
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            if spool:
+                self.journal.write(ack)
+                self.spooled += 1
+
+    def _row(self, row):
+        start = row * CONTROL_ID_WIDTH
+        control_id = bytes(self.control_ids[start:start + self.control_id_lengths[row]])
+        start = row * ERROR_WIDTH
+        error = bytes(self.errors[start:start + self.error_lengths[row]])
+        return AckSummary(control_id, self.code_names[self.codes[row]], error, self.latencies[row],
+                          bool(self.spooled_flags[row]))
+
+    def recent(self, limit=10, failed_only=False):
+        """Últimos resúmenes (el más reciente primero), opcionalmente sólo los fallidos."""
+        found = []
+        with self.lock:
+            kept = min(self.count, self.capacity)
+            for back in range(1, kept + 1):
+                if len(found) >= limit:
+                    break
+                row = (self.count - back) % self.capacity
+                if failed_only and self.codes[row] in self._accepted:
+                    continue
+                found.append(self._row(row))
+        return found
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "failed": self.failed,
+                "counts": dict(self.counts),
+                "latency_avg": self.latency_sum / self.count if self.count else 0.0,
+                "latency_max": self.latency_max,
+                "spooled": self.spooled,
+                "spool_dropped": self.spool_dropped,
+                "spool_path": self.spool_path,
+            }
+
+    def flush(self):
+        if self.journal is not None:
+            with self.lock:
+                self.journal.flush()
+
+    def close(self):
+        if self.journal is not None:
+            with self.lock:
+                self.journal.close()
+                self.journal = None
+
+
+def spool_file(directory, name, shard=0):
+    """Fichero de ACKs guardados de un destino (y proceso) dentro de `directory`."""
+    safe_name = "".join(c if c.isalnum() or c in "-." else "_" for c in name)
+    return os.path.join(directory, f"acks-{safe_name}-{shard}.hl7")
+
+
+def add_ack_capture_arguments(parser):
+    """Añade --ack-spool, --ack-sample y --ack-spool-mb a un parser de argparse."""
+    parser.add_argument("--ack-spool", metavar="DIR",
+                        help="save the full ACK of every error (and sampled ones) in this directory")
+    parser.add_argument("--ack-sample", type=int, default=0, metavar="N",
+                        help="with --ack-spool, also save 1 of every N ACKs")
+    parser.add_argument("--ack-spool-mb", type=float, default=DEFAULT_MAX_SPOOL_MB, metavar="MB",
+                        help="stop saving ACKs once a spool file reaches this size (0: no limit)")
+
+
+def ack_capture_from_args(args):
+    """Configuración de captura (o None) a partir de los argumentos de add_ack_capture_arguments."""
+    if not args.ack_spool:
+        return None
+    if args.ack_spool_mb < 0:
+        raise ValueError(f"Invalid --ack-spool-mb: {args.ack_spool_mb:g}")
+    return {"dir": args.ack_spool, "sample_every": args.ack_sample, "max_spool_mb": args.ack_spool_mb}
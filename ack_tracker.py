@@ -0,0 +1,156 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Correlación de ACKs por MSA-2/MSH-10 y control de timeouts.
+
+Cada mensaje enviado se registra por su MSH-10 en un diccionario; los plazos
+se guardan en un heap con borrado perezoso, de modo que tanto la correlación
+como la expiración son O(log n) aunque haya decenas de miles en vuelo.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import namedtuple
+
+from hl7_parser import parse_ack
+
+# Categorías de ACK (modo original y modo mejorado)
+STATUS_ACCEPT = "accept"
+STATUS_ERROR = "error"
+STATUS_REJECT = "reject"
+STATUS_UNKNOWN = "unknown"
+STATUS_TIMEOUT = "timeout"
+
+ACK_CODES = {
+    b"AA": STATUS_ACCEPT, b"CA": STATUS_ACCEPT,
+    b"AE": STATUS_ERROR, b"CE": STATUS_ERROR,
+    b"AR": STATUS_REJECT, b"CR": STATUS_REJECT,
+}
+
+AckResult = namedtuple("AckResult", "control_id code status text latency context")
+
+
+def classify(code):
+    """Devuelve la categoría de un código MSA-1 (bytes o str)."""
+    if isinstance(code, str):
+        code = code.encode("ascii", errors="replace")
+    return ACK_CODES.get(code.strip(), STATUS_UNKNOWN)
+
+
+class _Pending:
+    __slots__ = ("control_id", "sent_at", "deadline", "context", "done")
+
+    def __init__(self, control_id, sent_at, deadline, context):
+        self.control_id = control_id
+        self.sent_at = sent_at
+        self.deadline = deadline
+        self.context = context
+        self.done = False
+
+
+class AckTracker:
+    """Índice de mensajes pendientes de ACK ordenado por plazo."""
+
+    def __init__(self, default_timeout=10.0, clock=time.monotonic):
+        self.default_timeout = default_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self.unmatched = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, control_id):
+        return control_id in self.pending
+
+    def track(self, control_id, timeout=None, context=None):
+        """Registra un mensaje enviado. Lanza ValueError si el MSH-10 ya está pendiente."""
+        now = self.clock()
+        deadline = now + (self.default_timeout if timeout is None else timeout)
+        entry = _Pending(control_id, now, deadline, context)
+        with self.lock:
+            if control_id in self.pending:
+                raise ValueError(f"Duplicate control ID in flight: {control_id!r}")
+            self.pending[control_id] = entry
+            heapq.heappush(self._heap, (deadline, next(self._counter), entry))
+        return entry
+
+    def discard(self, control_id):
+        """Deja de seguir un mensaje (p.ej. si falló el envío)."""
+        with self.lock:
+            entry = self.pending.pop(control_id, None)
+            if entry is not None:
+                self._retire(entry)
+        return entry
+
+    def _retire(self, entry):
+        entry.done = True
+        # Reconstruir el heap si acumula demasiadas entradas ya resueltas
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self.pending):
+            self._heap = [item for item in self._heap if not item[2].done]
+            heapq.heapify(self._heap)
+
+    def match(self, ack_payload):
+        """Correlaciona un ACK por MSA-2. Devuelve AckResult o None si no hay mensaje pendiente."""
+        code, control_id, text = parse_ack(ack_payload)
+        return self.resolve(control_id, code, text)
+
+    def resolve(self, control_id, code, text=b""):
+        now = self.clock()
+        with self.lock:
+            entry = self.pending.pop(control_id, None)
+            if entry is None:
+                self.unmatched += 1
+                return None
+            self._retire(entry)
+        return AckResult(control_id, code, classify(code), text, now - entry.sent_at, entry.context)
+
+    def expire(self, now=None):
+        """Retira y devuelve (como AckResult con estado timeout) los mensajes vencidos."""
+        if now is None:
+            now = self.clock()
+        expired = []
+        with self.lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, _, entry = heapq.heappop(heap)
+                if entry.done:
+                    continue
+                entry.done = True
+                del self.pending[entry.control_id]
+                expired.append(AckResult(entry.control_id, b"", STATUS_TIMEOUT, b"",
+                                         now - entry.sent_at, entry.context))
+        return expired
+
+    def next_deadline(self):
+        """Plazo más próximo (reloj de `clock`) o None si no hay pendientes."""
+        with self.lock:
+            heap = self._heap
+            while heap and heap[0][2].done:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def time_to_next_deadline(self):
+        """Segundos hasta el siguiente vencimiento, útil como timeout de select/poll."""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - self.clock())
@@ -0,0 +1,42 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Ubicación y lectura de la configuración compartida por la interfaz y las herramientas de línea de comandos."""
+
+import json
+import os
+import sys
+
+
+def get_app_config_path(app_name):
+    """Devuelve la ruta estándar para la configuración de la aplicación."""
+    if sys.platform == 'darwin':  # macOS
+        return os.path.join(os.path.expanduser('~/Library/Application Support'), app_name, 'hl7_sender_settings.json')
+    elif sys.platform == 'win32':  # Windows
+        return os.path.join(os.environ['APPDATA'], app_name, 'hl7_sender_settings.json')
+    else:  # Linux y otros
+        return os.path.join(os.path.expanduser('~/.config'), app_name, 'hl7_sender_settings.json')
+
+
+SETTINGS_FILE = get_app_config_path('HL7Sender')
+
+
+def load_profiles(path=SETTINGS_FILE):
+    """Perfiles de conexión guardados por la interfaz ({} si no hay configuración)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("profiles", {})
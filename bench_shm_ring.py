@@ -0,0 +1,137 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Comparativa de `shm_ring.ShmRing` frente a `multiprocessing.Queue` entre dos procesos.
+
+Para cada tamaño de mensaje un proceso productor envía el mismo volumen de
+datos por cada transporte y el proceso principal los consume:
+
+- ring (view): lectura como memoryview sin copiar (`read`/`release`).
+- ring (copy): lectura con copia a bytes (`get`).
+- queue: `multiprocessing.Queue` (pickle + tubería + unpickle).
+
+Uso:
+    python bench_shm_ring.py
+    python bench_shm_ring.py --sizes 200,4096,5000000 --volume-mb 512
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from shm_ring import ShmRing
+
+DEFAULT_SIZES = (200, 2_000, 20_000, 200_000, 1_000_000, 5_000_000)
+
+
+def _count_for(size, volume):
+    return max(20, min(200_000, volume // size))
+
+
+def _ring_producer(name, size, count, ready, go):
+    ring = ShmRing(name)
+    payload = b"M" * size
+    ready.set()
+    go.wait()
+    for _ in range(count):
+        ring.put(payload)
+    ring.close_writer()
+    ring.close()
+
+
+def _queue_producer(q, size, count, ready, go):
+    payload = b"M" * size
+    ready.set()
+    go.wait()
+    for _ in range(count):
+        q.put(payload)
+    q.put(None)
+
+
+def _run(context, target, args, consume):
+    """Arranca el productor, espera a que esté listo y mide el consumo completo."""
+    ready, go = context.Event(), context.Event()
+    process = context.Process(target=target, args=args + (ready, go), daemon=True)
+    process.start()
+    ready.wait()
+    start = time.perf_counter()
+    go.set()
+    received = consume()
+    elapsed = time.perf_counter() - start
+    process.join()
+    return received, elapsed
+
+
+def bench_ring(context, size, count, capacity, copy):
+    with ShmRing(capacity=capacity, create=True) as ring:
+        def consume():
+            received = 0
+            if copy:
+                for record in ring:
+                    received += len(record)
+                return received
+            while True:
+                view = ring.read()
+                if view is None:
+                    return received
+                received += len(view)
+                ring.release()
+        return _run(context, _ring_producer, (ring.name, size, count), consume)
+
+
+def bench_queue(context, size, count):
+    q = context.Queue(maxsize=1024)
+
+    def consume():
+        received = 0
+        while True:
+            record = q.get()
+            if record is None:
+                return received
+            received += len(record)
+    return _run(context, _queue_producer, (q, size, count), consume)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the shared-memory ring against multiprocessing.Queue")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="message sizes in bytes")
+    parser.add_argument("--volume-mb", type=int, default=256, help="data sent per size and transport")
+    parser.add_argument("--ring-mb", type=int, default=64, help="ring capacity")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context()
+    capacity = args.ring_mb * 1024 * 1024
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    print(f"{'size':>10} {'count':>8} {'ring view msg/s':>16} {'MB/s':>8} {'ring copy MB/s':>15} "
+          f"{'queue msg/s':>12} {'MB/s':>8} {'speedup':>8}")
+    for size in sizes:
+        count = _count_for(size, args.volume_mb * 1024 * 1024)
+        results = {
+            "view": bench_ring(context, size, count, capacity, copy=False),
+            "copy": bench_ring(context, size, count, capacity, copy=True),
+            "queue": bench_queue(context, size, count),
+        }
+        for name, (received, _) in results.items():
+            if received != size * count:
+                raise RuntimeError(f"{name}: received {received} bytes, expected {size * count}")
+        mb = size * count / (1024 * 1024)
+        view, copy, q = (results[k][1] for k in ("view", "copy", "queue"))
+        print(f"{size:>10} {count:>8} {count / view:>16.0f} {mb / view:>8.0f} {mb / copy:>15.0f} "
+              f"{count / q:>12.0f} {mb / q:>8.0f} {q / view:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Detección del juego de caracteres de cada mensaje y transcodificación.
+
+Orden de detección (`detect_charset`):
+
+1. BOM (UTF-8, UTF-16, UTF-32) o MSH en UTF-16 sin BOM.
+2. MSH-18 (tabla HL7 0211: "8859/1", "UNICODE UTF-8"...), si el mensaje se
+   puede decodificar con él.
+3. Heurística sobre los bytes: ASCII puro, UTF-8 válido, la codificación
+   preferida por el usuario, cp1252 si aparecen bytes 0x80-0x9F y, por último,
+   ISO-8859-1 (que acepta cualquier byte).
+
+`transcode` trabaja sobre bytes: si el origen y el destino coinciden, o el
+mensaje es ASCII y ambas codificaciones son compatibles con ASCII, o pasa de
+ISO-8859-1 a cp1252 sin bytes 0x80-0x9F, los bytes se devuelven tal cual sin
+pasar por str. Los errores no lanzan excepción: se devuelven por mensaje con la
+ruta HL7 (p.ej. PID-5) donde aparece el carácter problemático, para que un
+fichero heterogéneo se pueda reenviar entero informando de los mensajes que
+no se pueden convertir.
+
+Uso:
+    python hl7_charset.py mezcla/*.hl7 -o utf8.hl7 --to utf-8 --rejects rechazados.hl7
+"""
+
+import argparse
+import codecs
+import re
+import sys
+import time
+from collections import namedtuple
+
+from hl7_parser import detect_delimiters, get_field, iter_message_spans, is_mllp_framed, open_mapped
+from mllp import wrap
+
+# Tabla HL7 0211 (MSH-18) -> códec de Python
+HL7_CHARSETS = {
+    "ASCII": "ascii",
+    "8859/1": "iso8859-1",
+    "8859/2": "iso8859-2",
+    "8859/3": "iso8859-3",
+    "8859/4": "iso8859-4",
+    "8859/5": "iso8859-5",
+    "8859/6": "iso8859-6",
+    "8859/7": "iso8859-7",
+    "8859/8": "iso8859-8",
+    "8859/9": "iso8859-9",
+    "8859/15": "iso8859-15",
+    "ISO IR6": "ascii",
+    "ISO IR100": "iso8859-1",
+    "ISO IR192": "utf-8",
+    "ISO IR87": "iso2022_jp",
+    "GB 18030-2000": "gb18030",
+    "KS X 1001": "euc_kr",
+    "BIG-5": "big5",
+    "UNICODE": "utf-8",
+    "UNICODE UTF-8": "utf-8",
+    "UNICODE UTF-16": "utf-16",
+    "UNICODE UTF-32": "utf-32",
+}
+
+# Códec -> valor de MSH-18 al transcodificar (los que no están no se declaran)
+HL7_CHARSET_NAMES = {
+    "ascii": "ASCII",
+    "iso8859-1": "8859/1",
+    "iso8859-2": "8859/2",
+    "iso8859-5": "8859/5",
+    "iso8859-7": "8859/7",
+    "iso8859-9": "8859/9",
+    "iso8859-15": "8859/15",
+    "utf-8": "UNICODE UTF-8",
+    "gb18030": "GB 18030-2000",
+    "euc_kr": "KS X 1001",
+    "big5": "BIG-5",
+}
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+# Valor de la codificación de la interfaz y los perfiles que activa la detección por mensaje
+ENCODING_AUTO = "auto"
+
+SOURCE_BOM = "bom"
+SOURCE_MSH18 = "msh18"
+SOURCE_HEURISTIC = "heuristic"
+
+# Códec detectado, su origen y la longitud del BOM que hay que saltar
+Detection = namedtuple("Detection", "codec source bom")
+
+# Resultado de transcodificar un mensaje: si `error` no es None, `data` es el mensaje original
+Transcoded = namedtuple("Transcoded", "data source error")
+
+_C1_RE = re.compile(rb"[\x80-\x9f]")
+_ASCII_COMPATIBLE = {}
+
+
+def codec_name(name):
+    """Nombre normalizado del códec de Python para un nombre HL7 (MSH-18) o de Python.
+
+    Lanza LookupError si no se reconoce.
+    """
+    key = name.strip()
+    hl7 = HL7_CHARSETS.get(key.upper())
+    return codecs.lookup(hl7 or key).name
+
+
+def is_ascii_compatible(codec):
+    """Indica si los bytes ASCII significan lo mismo en `codec` (no en UTF-16/32)."""
+    compatible = _ASCII_COMPATIBLE.get(codec)
+    if compatible is None:
+        try:
+            compatible = b"MSH|^~\\&".decode(codec) == "MSH|^~\\&"
+        except (UnicodeDecodeError, LookupError):
+            compatible = False
+        _ASCII_COMPATIBLE[codec] = compatible
+    return compatible
+
+
+def _msh(data):
+    """Segmento MSH (hasta el primer terminador) de un mensaje compatible con ASCII."""
+    start = data.find(b"MSH")
+    if start < 0:
+        return b""
+    end = len(data)
+    for term in (b"\r", b"\n"):
+        pos = data.find(term, start)
+        if 0 <= pos < end:
+            end = pos
+    return data[start:end]
+
+
+def declared_charset(data):
+    """Códec declarado en MSH-18 (primera repetición) o None si no hay o no se reconoce."""
+    msh = _msh(data)
+    if not msh:
+        return None
+    delimiters = detect_delimiters(msh)
+    value = get_field(msh, 18, delimiters).split(delimiters.repetition)[0]
+    if not value.strip():
+        return None
+    try:
+        return codec_name(value.decode("ascii"))
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+
+def _decodes(data, codec):
+    try:
+        data.decode(codec)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_charset(data, preferred=None):
+    """Detecta el juego de caracteres de un mensaje (bytes) y devuelve una Detection."""
+    data = bytes(data)
+    for bom, codec in _BOMS:
+        if data.startswith(bom):
+            return Detection(codec, SOURCE_BOM, len(bom))
+    if data[:6] == b"M\x00S\x00H\x00":
+        return Detection("utf-16-le", SOURCE_HEURISTIC, 0)
+    if data[:6] == b"\x00M\x00S\x00H":
+        return Detection("utf-16-be", SOURCE_HEURISTIC, 0)
+    declared = declared_charset(data)
+    if declared is not None and (data.isascii() and is_ascii_compatible(declared) or _decodes(data, declared)):
+        return Detection(declared, SOURCE_MSH18, 0)
+    if data.isascii():
+        return Detection("ascii", SOURCE_HEURISTIC, 0)
+    if _decodes(data, "utf-8"):
+        return Detection("utf-8", SOURCE_HEURISTIC, 0)
+    if preferred:
+        preferred = codec_name(preferred)
+        if preferred not in ("utf-8", "ascii") and _decodes(data, preferred):
+            return Detection(preferred, SOURCE_HEURISTIC, 0)
+    # Los bytes 0x80-0x9F son controles en ISO-8859-1 pero letras y signos en cp1252
+    if _C1_RE.search(data) and _decodes(data, "cp1252"):
+        return Detection("cp1252", SOURCE_HEURISTIC, 0)
+    return Detection("iso8859-1", SOURCE_HEURISTIC, 0)
+
+
+def decode_message(data, preferred=None):
+    """Texto de un mensaje decodificado con el juego de caracteres detectado (nunca falla)."""
+    data = bytes(data)
+    detection = detect_charset(data, preferred)
+    return data[detection.bom:].decode(detection.codec, errors="replace")
+
+
+def _locate(data, offset):
+    """Ruta HL7 (p.ej. PID-5) del byte `offset` de un mensaje compatible con ASCII."""
+    start = max(data.rfind(b"\r", 0, offset), data.rfind(b"\n", 0, offset)) + 1
+    segment = data[start:offset]
+    name = segment[:3].decode("ascii", errors="replace")
+    field = detect_delimiters(data).field
+    index = segment.count(field)
+    if name == "MSH":
+        index += 1
+    return f"{name}-{index}" if index else name
+
+
+def set_declared_charset(data, codec):
+    """Escribe en MSH-18 el nombre HL7 de `codec` si ya hay un valor distinto o el mensaje no es ASCII."""
+    name = HL7_CHARSET_NAMES.get(codec)
+    msh = _msh(data)
+    if name is None or not msh:
+        return data
+    delimiters = detect_delimiters(msh)
+    fields = msh.split(delimiters.field)
+    # fields[0] es "MSH" y fields[i] es MSH-(i + 1)
+    current = fields[17] if len(fields) > 17 else b""
+    reps = current.split(delimiters.repetition)
+    if reps[0] == name.encode("ascii") or (not current and data.isascii()):
+        return data
+    reps[0] = name.encode("ascii")
+    fields += [b""] * (18 - len(fields))
+    fields[17] = delimiters.repetition.join(reps)
+    start = data.find(msh)
+    return data[:start] + delimiters.field.join(fields) + data[start + len(msh):]
+
+
+def transcode(data, target, source=None, update_header=True):
+    """Convierte un mensaje al códec `target`; devuelve Transcoded(datos, códec de origen, error).
+
+    Con `source` None se detecta. Con `update_header` se actualiza MSH-18.
+    """
+    data = bytes(data)
+    target = codec_name(target)
+    header_ok = False
+    if source is None:
+        detection = detect_charset(data)
+        source, data = detection.codec, data[detection.bom:]
+        # MSH-18 ya declara el destino, o no declara nada y el mensaje es ASCII
+        header_ok = source == target if detection.source == SOURCE_MSH18 else data.isascii()
+    else:
+        source = codec_name(source)
+    if source == target or (is_ascii_compatible(source) and is_ascii_compatible(target) and data.isascii()):
+        out = data
+    elif source == "iso8859-1" and target == "cp1252" and not _C1_RE.search(data):
+        out = data
+    else:
+        try:
+            text = data.decode(source)
+        except UnicodeDecodeError as e:
+            location = _locate(data, e.start) if is_ascii_compatible(source) else f"byte {e.start}"
+            return Transcoded(data, source, f"invalid {source} byte 0x{data[e.start]:02x} at {location}")
+        try:
+            out = text.encode(target)
+        except UnicodeEncodeError as e:
+            # Ruta calculada sobre el texto: los delimitadores son ASCII
+            location = _locate(text[:e.start].encode("ascii", errors="replace"), e.start)
+            return Transcoded(data, source, f"{text[e.start]!r} cannot be encoded with {target} at {location}")
+    if update_header and not header_ok and is_ascii_compatible(target):
+        out = set_declared_charset(out, target)
+    return Transcoded(out, source, None)
+
+
+def main(argv=None):
+    from hl7_generator import write_messages
+
+    parser = argparse.ArgumentParser(description="Detect the charset of each HL7 message and transcode")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--to", default="utf-8", help="target charset (Python or MSH-18 name)")
+    parser.add_argument("--from", dest="source", help="source charset (default: detected per message)")
+    parser.add_argument("--keep-header", action="store_true", help="do not update MSH-18")
+    parser.add_argument("--rejects", help="write the messages that cannot be converted to this file")
+    parser.add_argument("--framing", choices=["mllp", "none"], default="mllp")
+    args = parser.parse_args(argv)
+    try:
+        codec_name(args.to)
+        if args.source:
+            codec_name(args.source)
+    except LookupError as e:
+        parser.error(str(e))
+
+    detected = {}
+    errors = []
+    rejects = open(args.rejects, "wb") if args.rejects else None
+
+    def messages():
+        number = 0
+        for path in args.files:
+            mm = open_mapped(path)
+            if mm is None:
+                continue
+            try:
+                for start, end in iter_message_spans(mm, framed=is_mllp_framed(mm)):
+                    number += 1
+                    result = transcode(mm[start:end].rstrip(b"\r\n"), args.to, args.source,
+                                       not args.keep_header)
+                    detected[result.source] = detected.get(result.source, 0) + 1
+                    if result.error is None:
+                        yield result.data
+                        continue
+                    control_id = get_field(_msh(result.data), 10, detect_delimiters(result.data))
+                    errors.append((number, control_id.decode("ascii", errors="replace"), result.error))
+                    if rejects is not None:
+                        rejects.write(wrap(result.data) if args.framing == "mllp" else result.data + b"\r\n")
+            finally:
+                mm.close()
+
+    start = time.perf_counter()
+    try:
+        count = write_messages(messages(), args.output, args.framing)
+    finally:
+        if rejects is not None:
+            rejects.close()
+    elapsed = time.perf_counter() - start
+    charsets = ", ".join(f"{codec} {n}" for codec, n in sorted(detected.items(), key=lambda i: -i[1]))
+    print(f"{count} messages written in {elapsed:.2f} s, {len(errors)} rejected (source: {charsets})",
+          file=sys.stderr)
+    for number, control_id, error in errors[:10]:
+        print(f"  #{number} {control_id or '-'}: {error}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
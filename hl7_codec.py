@@ -0,0 +1,298 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Serialización de mensajes HL7 con secuencias de escape.
+
+Un mensaje es una lista de segmentos y un segmento una lista cuyo elemento 0 es
+el nombre y el elemento i el campo i con numeración HL7. En MSH, `seg[1]` es el
+separador de campo y `seg[2]` los caracteres de codificación.
+
+Cada nivel es un str (valor sin escapar) o una lista que se divide en el nivel
+siguiente: campo -> repeticiones -> componentes -> subcomponentes. Así,
+PID-5 = "DOE^JOHN" se representa como [["DOE", "JOHN"]] y "A~B" como ["A", "B"].
+Los valores `Escaped` se escriben tal cual (ya escapados).
+
+Escapes soportados: \\F\\ \\S\\ \\T\\ \\R\\ \\E\\ y \\Xhh..\\ (bytes en el juego de
+caracteres del mensaje). Los valores que no se pueden reproducir exactamente al
+volver a codificar (p.ej. \\H\\ o \\.br\\) se decodifican como `Escaped` con el
+texto original, de modo que decode + encode conserva los bytes.
+"""
+
+import re
+
+from hl7_parser import DEFAULT_DELIMITERS, detect_delimiters
+from mllp import VT, FS, CR
+
+
+class Escaped(str):
+    """Valor ya escapado que el codificador escribe sin modificar."""
+
+    __slots__ = ()
+
+
+class HL7EncodingError(ValueError):
+    """Un carácter del mensaje no se puede representar en la codificación elegida."""
+
+    def __init__(self, char, encoding, location):
+        super().__init__(f"{char!r} cannot be encoded with {encoding} at {location}")
+        self.char = char
+        self.encoding = encoding
+        self.location = location
+
+
+class _KeepEscaped(Exception):
+    pass
+
+
+class _Syntax:
+    """Tablas de escape y unescape compiladas para un juego de delimitadores."""
+
+    def __init__(self, delimiters, encoding):
+        d = [c.decode("latin-1") for c in delimiters]
+        self.field, self.component, self.repetition, self.escape, self.subcomponent = d
+        self.encoding = encoding
+        e = self.escape
+        self.escape_table = str.maketrans({
+            self.field: f"{e}F{e}",
+            self.component: f"{e}S{e}",
+            self.subcomponent: f"{e}T{e}",
+            self.repetition: f"{e}R{e}",
+            e: f"{e}E{e}",
+            "\r": f"{e}X0D{e}",
+            "\n": f"{e}X0A{e}",
+        })
+        self.unescape_map = {"F": self.field, "S": self.component, "T": self.subcomponent,
+                             "R": self.repetition, "E": e}
+        self.escape_re = re.compile(re.escape(e) + "([^" + re.escape(e) + "]*)" + re.escape(e))
+        self.encoding_chars = self.component + self.repetition + e + self.subcomponent
+
+    # --- Codificación ---
+
+    def field_text(self, value):
+        if type(value) is str:
+            return value.translate(self.escape_table)
+        if isinstance(value, str):  # Escaped
+            return value
+        if value is None:
+            return ""
+        if isinstance(value, (list, tuple)):
+            rep_text = self.rep_text
+            return self.repetition.join([rep_text(r) for r in value])
+        return str(value).translate(self.escape_table)
+
+    def rep_text(self, value):
+        if type(value) is str:
+            return value.translate(self.escape_table)
+        if isinstance(value, (list, tuple)):
+            comp_text = self.comp_text
+            return self.component.join([comp_text(c) for c in value])
+        return self.leaf_text(value)
+
+    def comp_text(self, value):
+        if type(value) is str:
+            return value.translate(self.escape_table)
+        if isinstance(value, (list, tuple)):
+            leaf_text = self.leaf_text
+            return self.subcomponent.join([leaf_text(s) for s in value])
+        return self.leaf_text(value)
+
+    def leaf_text(self, value):
+        if type(value) is str:
+            return value.translate(self.escape_table)
+        if isinstance(value, str):
+            return value
+        if value is None:
+            return ""
+        return str(value).translate(self.escape_table)
+
+    def segment_text(self, segment):
+        name = segment[0]
+        field_text = self.field_text
+        if name == "MSH":
+            # MSH-1 y MSH-2 definen la sintaxis: nunca se escapan
+            return "MSH" + self.field + self.encoding_chars + "".join(
+                [self.field + field_text(v) for v in segment[3:]])
+        return self.field.join([name] + [field_text(v) for v in segment[1:]])
+
+    # --- Decodificación ---
+
+    def _replace(self, match):
+        code = match.group(1)
+        char = self.unescape_map.get(code)
+        if char is not None:
+            return char
+        if code[:1] in ("X", "x") and len(code) > 1:
+            try:
+                return bytes.fromhex(code[1:]).decode(self.encoding)
+            except (ValueError, UnicodeDecodeError):
+                raise _KeepEscaped()
+        raise _KeepEscaped()
+
+    def unescape(self, value):
+        if self.escape not in value:
+            return value
+        try:
+            text = self.escape_re.sub(self._replace, value)
+        except _KeepEscaped:
+            return Escaped(value)
+        if text.translate(self.escape_table) != value:
+            # p.ej. \X41\ o un escape suelto: se conserva el original
+            return Escaped(value)
+        return text
+
+    def decode_field(self, value):
+        if self.repetition in value:
+            return [self.decode_rep(r) for r in value.split(self.repetition)]
+        if self.component in value or self.subcomponent in value:
+            return [self.decode_rep(value)]
+        return self.unescape(value)
+
+    def decode_rep(self, value):
+        if self.component in value:
+            return [self.decode_comp(c) for c in value.split(self.component)]
+        if self.subcomponent in value:
+            return [self.decode_comp(value)]
+        return self.unescape(value)
+
+    def decode_comp(self, value):
+        if self.subcomponent in value:
+            return [self.unescape(s) for s in value.split(self.subcomponent)]
+        return self.unescape(value)
+
+
+_SYNTAX_CACHE = {}
+
+
+def _syntax(delimiters, encoding):
+    key = (delimiters, encoding)
+    syntax = _SYNTAX_CACHE.get(key)
+    if syntax is None:
+        syntax = _SYNTAX_CACHE[key] = _Syntax(delimiters, encoding)
+    return syntax
+
+
+def message_delimiters(segments, default=DEFAULT_DELIMITERS):
+    """Delimitadores declarados en el MSH de un mensaje construido en código."""
+    if segments and segments[0][0] == "MSH" and len(segments[0]) > 2:
+        field = segments[0][1]
+        chars = segments[0][2]
+        if len(field) == 1 and chars:
+            enc = chars.encode("latin-1")
+            return default._replace(
+                field=field.encode("latin-1"),
+                **{k: enc[i:i + 1] for i, k in enumerate(("component", "repetition", "escape", "subcomponent"))
+                   if i < len(enc)})
+    return default
+
+
+def _locate(text, offset, syntax, terminator):
+    """Ruta HL7 (p.ej. PID-5) del carácter `offset` de un mensaje serializado."""
+    start = text.rfind(terminator, 0, offset) + 1
+    segment = text[start:offset]
+    name = segment[:3]
+    index = segment.count(syntax.field)
+    if name == "MSH":
+        index += 1
+    return f"{name}-{index}" if index else name
+
+
+class HL7Encoder:
+    """Serializa mensajes (listas de segmentos) a bytes, con el framing MLLP si se pide.
+
+    Los segmentos se unen como str y se codifican con una sola llamada a
+    `str.encode`: Python no puede codificar directamente en un buffer existente,
+    así que escribir en uno reutilizable sólo añadiría copias.
+    """
+
+    def __init__(self, encoding="utf-8", delimiters=None, terminator="\r"):
+        self.encoding = encoding
+        self.delimiters = delimiters
+        self.terminator = terminator
+
+    def to_text(self, segments):
+        syntax = _syntax(self.delimiters or message_delimiters(segments), self.encoding)
+        return self.terminator.join([syntax.segment_text(seg) for seg in segments])
+
+    def encode(self, segments, framed=False):
+        syntax = _syntax(self.delimiters or message_delimiters(segments), self.encoding)
+        text = self.terminator.join([syntax.segment_text(seg) for seg in segments])
+        try:
+            data = text.encode(self.encoding)
+        except UnicodeEncodeError as e:
+            raise HL7EncodingError(text[e.start], self.encoding, _locate(text, e.start, syntax, self.terminator))
+        if framed:
+            return b"".join((VT, data, FS, CR))
+        return data
+
+
+class HL7Decoder:
+    """Convierte bytes HL7 en la estructura que acepta `HL7Encoder`, resolviendo los escapes."""
+
+    def __init__(self, encoding="utf-8", errors="strict"):
+        self.encoding = encoding
+        self.errors = errors
+
+    def decode(self, data):
+        delimiters = detect_delimiters(data)
+        syntax = _syntax(delimiters, self.encoding)
+        text = bytes(data).decode(self.encoding, self.errors)
+        decode_field = syntax.decode_field
+        segments = []
+        for line in re.split(r"[\r\n]+", text):
+            if not line:
+                continue
+            fields = line.split(syntax.field)
+            if fields[0] == "MSH":
+                segment = ["MSH", syntax.field, fields[1] if len(fields) > 1 else ""]
+                segment += [decode_field(v) for v in fields[2:]]
+            else:
+                segment = [fields[0]] + [decode_field(v) for v in fields[1:]]
+            segments.append(segment)
+        return segments
+
+
+def escape(value, delimiters=DEFAULT_DELIMITERS):
+    """Escapa un valor (str) para los delimitadores dados."""
+    return value.translate(_syntax(delimiters, None).escape_table)
+
+
+def unescape(value, delimiters=DEFAULT_DELIMITERS, encoding="utf-8"):
+    """Resuelve los escapes de un valor; devuelve `Escaped` si no es reproducible."""
+    return _syntax(delimiters, encoding).unescape(value)
+
+
+def encode(segments, encoding="utf-8", framed=False):
+    return HL7Encoder(encoding).encode(segments, framed)
+
+
+def decode(data, encoding="utf-8"):
+    return HL7Decoder(encoding).decode(data)
+
+
+def encode_text(text, encoding="utf-8", delimiters=None):
+    """Codifica texto HL7 ya escapado (p.ej. el del editor) normalizando los terminadores a CR.
+
+    A diferencia de `str.encode(errors='replace')`, un carácter no representable
+    lanza HL7EncodingError indicando el segmento y campo donde aparece.
+    """
+    text = text.replace("\r\n", "\r").replace("\n", "\r")
+    try:
+        return text.encode(encoding)
+    except UnicodeEncodeError as e:
+        if delimiters is None:
+            delimiters = detect_delimiters(text[:512].encode("latin-1", errors="replace"))
+        syntax = _syntax(delimiters, encoding)
+        raise HL7EncodingError(text[e.start], encoding, _locate(text, e.start, syntax, "\r"))
@@ -0,0 +1,164 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Validadores de valores por tipo de dato, compilados desde las definiciones de `reference`.
+
+Cada tipo primitivo tiene una expresión regular precompilada (DTM, DT, TM,
+NM, SI, ID, IS...). Los tipos compuestos se compilan desde su compositeXXX.xml
+a una función que divide el valor por el separador de su nivel y llama sólo a
+los validadores de los componentes que comprueban algo; los tipos de texto
+(ST, TX, FT...) no se comprueban y los compuestos formados sólo por ellos no
+generan validador. Los validadores se compilan una vez por versión y tipo.
+
+Un validador se llama como `validator(value, separators, depth)`, donde
+`separators` es (componente, subcomponente) y `depth` el nivel del valor
+(0 para un campo). Devuelve None si el valor es válido o una lista de
+Violation con la ruta relativa (p.ej. '.1' para TS.1) y la posición en `value`.
+"""
+
+import re
+from collections import namedtuple
+
+# Infracción dentro de un valor: ruta relativa ('' o '.1', '.4.2'), [start, end) y tipo esperado
+Violation = namedtuple("Violation", "path start end datatype")
+
+_TZ = r"(?:[+-](?:[01]\d|2[0-3])[0-5]\d)?"
+_TIME = r"(?:[01]\d|2[0-3])(?:[0-5]\d(?:[0-5]\d(?:\.\d{1,4})?)?)?"
+_DATE = r"\d{4}(?:(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])?)?"
+_DTM = r"\d{4}(?:(?:0[1-9]|1[0-2])(?:(?:0[1-9]|[12]\d|3[01])(?:%s)?)?)?" % _TIME
+
+DTM_PATTERN = re.compile(_DTM + _TZ + r"\Z")
+DT_PATTERN = re.compile(_DATE + r"\Z")
+TM_PATTERN = re.compile(_TIME + _TZ + r"\Z")
+NM_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)\Z")
+SI_PATTERN = re.compile(r"\d{1,4}\Z")
+INTEGER_PATTERN = re.compile(r"[+-]?\d+\Z")
+# Valores codificados: sin espacios al principio ni al final
+CODE_PATTERN = re.compile(r"\S(?:.*\S)?\Z", re.DOTALL)
+
+# Tipos primitivos por nombre HL7
+PRIMITIVE_PATTERNS = {
+    "DTM": DTM_PATTERN,
+    "TS": DTM_PATTERN,  # En las versiones en que TS no es compuesto
+    "DT": DT_PATTERN,
+    "TM": TM_PATTERN,
+    "NM": NM_PATTERN,
+    "SI": SI_PATTERN,
+    "ID": CODE_PATTERN,
+    "IS": CODE_PATTERN,
+}
+
+# Tipos "hoja" de los XML (ver hl7_definitions.LEAF_TYPES). En 2.1-2.4 'Time' es también el
+# de TS.1 (fecha y hora completas), así que admite los dos formatos.
+LEAF_PATTERNS = {
+    "DateTime": DTM_PATTERN,
+    "Date": DT_PATTERN,
+    "Time": re.compile(r"(?:%s|%s)%s\Z" % (_DTM, _TIME, _TZ)),
+    "Double": NM_PATTERN,
+    "Integer": INTEGER_PATTERN,
+}
+
+# Profundidad máxima de los compuestos: componente y subcomponente
+MAX_DEPTH = 2
+
+
+def primitive_validator(datatype, pattern):
+    """Validador de un tipo primitivo a partir de su expresión regular."""
+    match = pattern.match
+
+    def validate(value, separators, depth=0):
+        if match(value) is None:
+            return [Violation("", 0, len(value), datatype)]
+        return None
+    return validate
+
+
+def composite_validator(children):
+    """Validador de un tipo compuesto; `children` es la lista de validadores (o None) por componente."""
+    active = tuple((i, child) for i, child in enumerate(children) if child is not None)
+    if not active:
+        return None
+
+    def validate(value, separators, depth=0):
+        if depth >= MAX_DEPTH:
+            return None
+        parts = value.split(separators[depth])
+        count = len(parts)
+        found = None
+        for i, child in active:
+            if i >= count:
+                break
+            part = parts[i]
+            if not part:
+                continue
+            errors = child(part, separators, depth + 1)
+            if errors:
+                # La posición sólo se calcula si hay infracciones
+                offset = sum(len(p) for p in parts[:i]) + i
+                if found is None:
+                    found = []
+                for error in errors:
+                    found.append(Violation(f".{i + 1}{error.path}", offset + error.start,
+                                           offset + error.end, error.datatype))
+        return found
+    return validate
+
+
+class DatatypeValidators:
+    """Validadores compilados por versión y tipo de dato a partir de un HL7DefinitionManager."""
+
+    def __init__(self, def_manager):
+        self.def_manager = def_manager
+        self._cache = {}
+        self._generation = def_manager.generation
+
+    def get(self, version, datatype):
+        """Validador de un tipo de dato, o None si no hay nada que comprobar (texto, desconocido)."""
+        if self._generation != self.def_manager.generation:
+            # Han cambiado las definiciones de un overlay
+            self._cache.clear()
+            self._generation = self.def_manager.generation
+        key = (version, datatype)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        # Marcador para tipos recursivos mientras se compilan
+        self._cache[key] = None
+        validator = self._compile(version, datatype)
+        self._cache[key] = validator
+        return validator
+
+    def _compile(self, version, datatype):
+        if not datatype:
+            return None
+        components = self.def_manager.get_datatype_components(version, datatype)
+        if components is not None:
+            return composite_validator([self.get(version, component.datatype) for component in components])
+        pattern = PRIMITIVE_PATTERNS.get(datatype) or LEAF_PATTERNS.get(datatype)
+        if pattern is None:
+            # Primitivo sin nombre conocido: se usa el tipo hoja de su compositeXXX.xml
+            root = self.def_manager.load_datatype_definition(version, datatype)
+            if root is not None:
+                pattern = LEAF_PATTERNS.get(root.findtext("elements/field/datatype", ""))
+        return primitive_validator(datatype, pattern) if pattern is not None else None
+
+    def compile_version(self, version):
+        """Compila de una vez los validadores de todos los tipos usados en los segmentos de una versión."""
+        for name in self.def_manager.get_segment_vocabulary(version):
+            for field in self.def_manager.get_segment_fields(version, name) or ():
+                self.get(version, field.datatype)
+        return {datatype: validator for (v, datatype), validator in self._cache.items() if v == version}
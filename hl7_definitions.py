@@ -0,0 +1,604 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Carga y compilación de las definiciones XML de HL7 de la carpeta `reference`."""
+
+import argparse
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from profiling import traced
+
+# Nombres de tipo "hoja" que usan los XML para los primitivos (p.ej. ST.1 -> String)
+LEAF_TYPES = frozenset(["String", "DateTime", "Date", "Time", "Double", "Integer"])
+
+# Índice de definiciones (vocabulario de segmentos por versión) guardado en `reference`
+INDEX_NAME = "index.json"
+INDEX_FORMAT = 1
+
+# Prefijos de los ficheros de definición y clave de su caché compilada
+DEFINITION_PREFIXES = (("segment", "seg"), ("composite", "dt"), ("message", "msg"))
+
+# Definición compilada de un campo o componente. max_occurs es None si es ilimitado.
+FieldDef = namedtuple("FieldDef", "name description datatype min_occurs max_occurs")
+
+# Nodos compilados de la gramática de un mensaje (messageXXX.xml)
+SegmentRef = namedtuple("SegmentRef", "name min_occurs max_occurs")
+GroupRef = namedtuple("GroupRef", "children min_occurs max_occurs")
+
+# Instancia de un grupo en un mensaje: children son índices de segmento o GroupInstance anidados
+GroupInstance = namedtuple("GroupInstance", "name repetition children")
+
+
+def _occurs(node, attr, default):
+    value = node.get(attr)
+    if value is None:
+        return default
+    if value == "unbounded":
+        return None
+    # En los XML maxOccurs="0" indica "sin repetición"
+    return max(int(value), 1) if attr == "maxOccurs" else int(value)
+
+
+def _compile_fields(root):
+    elements = root.find("elements")
+    if elements is None:
+        return ()
+    fields = []
+    for node in elements.findall("field"):
+        fields.append(FieldDef(
+            node.findtext("name", ""),
+            node.findtext("description", ""),
+            node.findtext("datatype", ""),
+            _occurs(node, "minOccurs", 0),
+            _occurs(node, "maxOccurs", 1),
+        ))
+    return tuple(fields)
+
+
+def _compile_structure(node):
+    children = []
+    for child in node:
+        min_occurs = _occurs(child, "minOccurs", 1)
+        max_occurs = _occurs(child, "maxOccurs", 1)
+        if child.tag == "segment":
+            children.append(SegmentRef(child.text.strip(), min_occurs, max_occurs))
+        elif child.tag == "group":
+            children.append(GroupRef(_compile_structure(child), min_occurs, max_occurs))
+    return tuple(children)
+
+
+def _match_nodes(nodes, names, pos, prefix, out):
+    """Casa `names[pos:]` con los nodos; devuelve (nueva posición, si se cumplieron los mínimos)."""
+    complete = True
+    size = len(names)
+    for index, node in enumerate(nodes):
+        count = 0
+        limit = node.max_occurs
+        while (limit is None or count < limit) and pos < size:
+            if type(node) is SegmentRef:
+                if names[pos] != node.name:
+                    break
+                out.append(prefix + ((index, count),))
+                pos += 1
+            else:
+                mark = len(out)
+                new_pos, ok = _match_nodes(node.children, names, pos, prefix + ((index, count),), out)
+                # Una instancia de grupo sin sus segmentos obligatorios no se abre (salvo la primera
+                # de un grupo obligatorio: así se informa de lo que falta en lugar de descartarla)
+                if new_pos == pos or not (ok or (count == 0 and node.min_occurs)):
+                    del out[mark:]
+                    break
+                pos = new_pos
+            count += 1
+        if count < node.min_occurs:
+            complete = False
+    return pos, complete
+
+
+def _structure_segment_names(nodes, names):
+    for node in nodes:
+        if type(node) is SegmentRef:
+            names.add(node.name)
+        else:
+            _structure_segment_names(node.children, names)
+    return names
+
+
+def structure_segment_names(structure):
+    """frozenset con los segmentos que aparecen en una gramática compilada."""
+    return frozenset(_structure_segment_names(structure, set()))
+
+
+def match_structure(structure, names, max_retries=32):
+    """Sitúa cada segmento de un mensaje en la gramática compilada.
+
+    Devuelve, por segmento, su dirección en la gramática: una tupla de pares
+    (posición del nodo entre sus hermanos, repetición) desde la raíz hasta el
+    segmento, p.ej. ((2, 0), (1, 3), (5, 1), (0, 0)) para el segundo OBX de la
+    cuarta observación. Dos mensajes del mismo tipo se pueden alinear por esta
+    dirección. Los segmentos que no encajan (Z-segments, fuera de orden) son None.
+    """
+    result = [None] * len(names)
+    known = _structure_segment_names(structure, set())
+    positions = [i for i, name in enumerate(names) if name in known]
+    for _ in range(max_retries + 1):
+        out = []
+        end, _ = _match_nodes(structure, [names[i] for i in positions], 0, (), out)
+        if end == len(positions):
+            break
+        # Segmento conocido pero fuera de lugar: se descarta y se vuelve a casar el resto
+        del positions[end]
+    else:
+        positions = positions[:len(out)]
+    for i, address in zip(positions, out):
+        result[i] = address
+    return result
+
+
+def _is_segment_id(name):
+    # Identificadores de segmento HL7: tres caracteres, el primero una letra (segmentED.xml no lo es)
+    return len(name) == 3 and name.isalnum() and name.isupper() and name[0].isalpha()
+
+
+def scan_segment_names(version_path):
+    """Identificadores de segmento con un segmentXXX.xml en el directorio de una versión."""
+    names = []
+    for entry in os.listdir(version_path):
+        if entry.startswith("segment") and entry.endswith(".xml"):
+            name = entry[7:-4]
+            if _is_segment_id(name):
+                names.append(name)
+    return sorted(names)
+
+
+def build_definition_index(base_path, previous=None):
+    """Construye el índice de `reference`: por versión, el mtime del directorio y sus segmentos.
+
+    Las versiones cuyo directorio no ha cambiado desde `previous` se copian sin volver a leerlas.
+    """
+    reference = os.path.join(base_path, "reference")
+    old = (previous or {}).get("versions", {})
+    versions = {}
+    for version in sorted(os.listdir(reference)) if os.path.isdir(reference) else ():
+        path = os.path.join(reference, version)
+        if not os.path.isdir(path):
+            continue
+        mtime = os.stat(path).st_mtime
+        entry = old.get(version)
+        if entry is None or entry.get("mtime") != mtime:
+            entry = {"mtime": mtime, "segments": scan_segment_names(path)}
+        versions[version] = entry
+    return {"format": INDEX_FORMAT, "versions": versions}
+
+
+def group_name(group):
+    """Nombre de un grupo a partir de sus primeros nodos hasta el primero obligatorio.
+
+    Los messageXXX.xml no dan nombre a los grupos: p.ej. en ORU^R01 el grupo de
+    observación es 'OBX', el de orden 'ORC/OBR' y el de resultado de paciente 'PID/ORC/OBR'.
+    """
+    parts = []
+    for child in group.children:
+        parts.append(child.name if type(child) is SegmentRef else group_name(child))
+        if child.min_occurs:
+            break
+    return "/".join(parts)
+
+
+def nest_segments(structure, names):
+    """Agrupa los segmentos de un mensaje según la gramática compilada.
+
+    Devuelve (raíz, inesperados): la raíz es una lista de índices de segmento y
+    GroupInstance en el orden del mensaje; los segmentos que no encajan en la
+    gramática (ver match_structure) se dejan junto al segmento anterior y se
+    devuelven también en la lista de inesperados.
+    """
+    root = []
+    unexpected = []
+    instances = {}
+    names_cache = {}
+    current = root
+    for i, address in enumerate(match_structure(structure, names)):
+        if address is None:
+            unexpected.append(i)
+            current.append(i)
+            continue
+        container, nodes = root, structure
+        for depth in range(len(address) - 1):
+            index, repetition = address[depth]
+            node = nodes[index]
+            instance = instances.get(address[:depth + 1])
+            if instance is None:
+                name = names_cache.get(id(node))
+                if name is None:
+                    name = names_cache[id(node)] = group_name(node)
+                instance = GroupInstance(name, repetition, [])
+                instances[address[:depth + 1]] = instance
+                container.append(instance)
+            container, nodes = instance.children, node.children
+        container.append(i)
+        current = container
+    return root, unexpected
+
+
+def _definition_kind(filename):
+    """('seg'|'dt'|'msg', nombre) de un fichero de definición, o None si no lo es."""
+    if not filename.endswith(".xml"):
+        return None
+    for prefix, kind in DEFINITION_PREFIXES:
+        if filename.startswith(prefix) and len(filename) > len(prefix) + 4:
+            return kind, filename[len(prefix):-4]
+    return None
+
+
+def scan_overlays(overlays):
+    """Ficheros de definición de los directorios de overlay.
+
+    Devuelve {(versión, fichero): (ruta, mtime)}; los ficheros de la raíz del
+    overlay valen para todas las versiones (versión ''), los de un subdirectorio
+    sólo para esa versión. Si varios overlays definen el mismo fichero gana el
+    primero de la lista.
+    """
+    files = {}
+    for directory in reversed(overlays):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    for child in os.scandir(entry.path):
+                        if _definition_kind(child.name) is not None:
+                            files[(entry.name, child.name)] = (child.path, child.stat().st_mtime_ns)
+                elif _definition_kind(entry.name) is not None:
+                    files[("", entry.name)] = (entry.path, entry.stat().st_mtime_ns)
+            except OSError:
+                continue
+    return files
+
+
+def message_structure_names(message_type):
+    """Nombres candidatos de fichero messageXXX.xml para un MSH-9 (p.ej. 'ORU^R01' -> ORUR01, ORU)."""
+    parts = message_type.split("^")
+    candidates = []
+    if len(parts) > 2 and parts[2]:
+        candidates.append(parts[2].replace("_", ""))
+    if len(parts) > 1 and parts[1]:
+        candidates.append(parts[0] + parts[1])
+    candidates.append(parts[0])
+    return candidates
+
+
+class HL7DefinitionManager:
+    """Clase para manejar las definiciones XML de HL7.
+
+    `overlays` son directorios con definiciones propias (Z-segments, uso local
+    de campos) que se superponen a las de `reference`: un segmentXXX.xml,
+    compositeXXX.xml o messageXXX.xml de un overlay sustituye al estándar del
+    mismo nombre. `refresh` detecta los ficheros de overlay añadidos, borrados
+    o modificados e invalida sólo sus definiciones; `generation` aumenta en cada
+    cambio para que las cachés derivadas (validadores...) sepan que deben vaciarse.
+    """
+    def __init__(self, base_path, overlays=()):
+        self.base_path = base_path
+        self.definitions_cache = {}
+        # Definiciones compiladas a tuplas (mucho más rápidas de consultar que el XML)
+        self.compiled_cache = {}
+        self._index = None
+        self._vocabularies = {}
+        self._all_segments = None
+        self.overlays = ()
+        self._overlay_files = {}
+        self.generation = 0
+        self.set_overlays(overlays)
+
+    def get_version_path(self, version):
+        """Devuelve la ruta al directorio de definiciones para una versión específica."""
+        # Mapeo simple de versiones a directorios si es necesario, o uso directo
+        return os.path.join(self.base_path, "reference", version)
+
+    def is_version_available(self, version):
+        """Verifica si existen definiciones para la versión dada."""
+        path = self.get_version_path(version)
+        return os.path.isdir(path) or any(v == version for v, _ in self._overlay_files)
+
+    def set_overlays(self, overlays):
+        """Cambia los directorios de overlay; devuelve True si cambian las definiciones."""
+        overlays = tuple(os.path.abspath(os.path.expanduser(path)) for path in overlays if path)
+        if overlays == self.overlays:
+            return False
+        self.overlays = overlays
+        return self.refresh()
+
+    def refresh(self):
+        """Vuelve a leer los overlays e invalida las definiciones de los ficheros que han cambiado.
+
+        Sólo se consultan los directorios y mtimes de los overlays (no los de
+        `reference`); devuelve True si algo ha cambiado.
+        """
+        files = scan_overlays(self.overlays)
+        old = self._overlay_files
+        changed = [key for key in set(old) | set(files) if old.get(key) != files.get(key)]
+        if not changed:
+            return False
+        self._overlay_files = files
+        versions = set(self.load_index()["versions"]) | {v for v, _ in old} | {v for v, _ in files}
+        versions.discard("")
+        for version, filename in changed:
+            kind, name = _definition_kind(filename)
+            for v in ([version] if version else versions):
+                if kind == "seg":
+                    self.definitions_cache.pop(f"{v}_{name}", None)
+                    self.compiled_cache.pop(("seg", v, name), None)
+                elif kind == "dt":
+                    self.definitions_cache.pop(f"{v}_dt_{name}", None)
+                    self.compiled_cache.pop(("dt", v, name), None)
+                else:
+                    self.definitions_cache.pop(f"{v}_msg_{name}", None)
+                    # Las gramáticas compiladas se guardan por MSH-9, no por fichero
+                    for key in [k for k in self.compiled_cache if k[0] == "msg" and k[1] == v]:
+                        del self.compiled_cache[key]
+        self._vocabularies = {}
+        self._all_segments = None
+        self.generation += 1
+        return True
+
+    def definition_path(self, version, filename):
+        """Ruta de un fichero de definición: el del overlay si lo hay, si no el de `reference`."""
+        entry = self._overlay_files.get((version, filename)) or self._overlay_files.get(("", filename))
+        if entry is not None:
+            return entry[0]
+        return os.path.join(self.get_version_path(version), filename)
+
+    @traced("load_segment_definition")
+    def load_segment_definition(self, version, segment_name):
+        """Carga la definición de un segmento desde el archivo XML."""
+        cache_key = f"{version}_{segment_name}"
+        if cache_key in self.definitions_cache:
+            return self.definitions_cache[cache_key]
+
+        # Intentar cargar segment{Name}.xml (de un overlay o de reference)
+        file_path = self.definition_path(version, f"segment{segment_name}.xml")
+        
+        if not os.path.exists(file_path):
+            # Fallback o intentar otro nombre si es necesario
+            return None
+
+        try:
+            tree = ET.parse(file_path)
+            root = tree.getroot()
+            self.definitions_cache[cache_key] = root
+            return root
+        except Exception as e:
+            print(f"Error loading segment definition {segment_name} for version {version}: {e}")
+            return None
+
+    @traced("load_datatype_definition")
+    def load_datatype_definition(self, version, datatype_name):
+        """Carga la definición de un tipo de dato compuesto."""
+        if not datatype_name:
+            return None
+            
+        cache_key = f"{version}_dt_{datatype_name}"
+        if cache_key in self.definitions_cache:
+            return self.definitions_cache[cache_key]
+
+        # Intentar cargar composite{Name}.xml
+        # A veces los tipos de datos tienen nombres como CE, CX, etc.
+        file_path = self.definition_path(version, f"composite{datatype_name}.xml")
+        
+        if not os.path.exists(file_path):
+             return None
+
+        try:
+            tree = ET.parse(file_path)
+            root = tree.getroot()
+            self.definitions_cache[cache_key] = root
+            return root
+        except Exception:
+            return None
+
+    def get_field_description(self, version, segment, field_index, definitions=None):
+        """Obtiene la descripción de un campo dado el segmento y el índice (1-based)."""
+        if definitions is None:
+            definitions = self.load_segment_definition(version, segment)
+        
+        if definitions is None:
+            return None
+
+        # Navegar el XML: elements -> field
+        # Nota: Los archivos XML de definición que hemos visto tienen una estructura específica.
+        # <elements>
+        #   <field> <name>PID.1</name> ... </field>
+        # </elements>
+        # Sin embargo, el índice de los fields en el XML suele corresponder al orden.
+        
+        try:
+            elements = definitions.find("elements")
+            if elements is not None:
+                fields = elements.findall("field")
+                # field_index es 1-based.
+                # Ajuste: PID.1 es el primer campo en la lista para PID?
+                # En muchos estándares HL7, MSH es especial.
+                if 0 <= field_index - 1 < len(fields):
+                    field_node = fields[field_index - 1]
+                    description = field_node.find("description").text
+                    datatype = field_node.find("datatype").text
+                    return description, datatype
+        except Exception:
+            pass
+        return None, None
+
+    def get_component_description(self, version, datatype, component_index):
+        """Obtiene la descripción de un componente de un tipo de dato compuesto."""
+        definitions = self.load_datatype_definition(version, datatype)
+        if definitions is None:
+            return None, None
+            
+        try:
+            elements = definitions.find("elements")
+            if elements is not None:
+                fields = elements.findall("field")
+                if 0 <= component_index - 1 < len(fields):
+                    field_node = fields[component_index - 1]
+                    description = field_node.find("description").text
+                    datatype = field_node.find("datatype").text # Puede ser subcomponente
+                    return description, datatype
+        except Exception:
+            pass
+        return None, None
+
+    def get_segment_fields(self, version, segment_name):
+        """Devuelve la tupla de FieldDef de un segmento o None si no está definido."""
+        cache_key = ("seg", version, segment_name)
+        try:
+            return self.compiled_cache[cache_key]
+        except KeyError:
+            pass
+        root = self.load_segment_definition(version, segment_name)
+        fields = _compile_fields(root) if root is not None else None
+        self.compiled_cache[cache_key] = fields
+        return fields
+
+    def get_datatype_components(self, version, datatype_name):
+        """Devuelve los componentes (FieldDef) de un tipo compuesto, o None si es primitivo/desconocido."""
+        cache_key = ("dt", version, datatype_name)
+        try:
+            return self.compiled_cache[cache_key]
+        except KeyError:
+            pass
+        root = self.load_datatype_definition(version, datatype_name)
+        components = _compile_fields(root) if root is not None else None
+        # ST, NM, DTM... se definen con un único elemento de tipo hoja: son primitivos
+        if components and len(components) == 1 and components[0].datatype in LEAF_TYPES:
+            components = None
+        self.compiled_cache[cache_key] = components
+        return components
+
+    @traced("load_message_definition")
+    def load_message_definition(self, version, structure_name):
+        """Carga la gramática messageXXX.xml de una estructura de mensaje."""
+        cache_key = f"{version}_msg_{structure_name}"
+        if cache_key in self.definitions_cache:
+            return self.definitions_cache[cache_key]
+        file_path = self.definition_path(version, f"message{structure_name}.xml")
+        if not os.path.exists(file_path):
+            return None
+        try:
+            root = ET.parse(file_path).getroot()
+            self.definitions_cache[cache_key] = root
+            return root
+        except Exception as e:
+            print(f"Error loading message definition {structure_name} for version {version}: {e}")
+            return None
+
+    def get_message_structure(self, version, message_type):
+        """Devuelve la gramática compilada (tupla de SegmentRef/GroupRef) de un tipo de mensaje."""
+        cache_key = ("msg", version, message_type)
+        try:
+            return self.compiled_cache[cache_key]
+        except KeyError:
+            pass
+        structure = None
+        for name in message_structure_names(message_type):
+            root = self.load_message_definition(version, name)
+            if root is not None and root.find("segments") is not None:
+                structure = _compile_structure(root.find("segments"))
+                break
+        self.compiled_cache[cache_key] = structure
+        return structure
+
+    @property
+    def index_path(self):
+        return os.path.join(self.base_path, "reference", INDEX_NAME)
+
+    @traced("load_definition_index")
+    def load_index(self):
+        """Carga `reference/index.json`, actualizando las versiones cuyo directorio ha cambiado."""
+        if self._index is not None:
+            return self._index
+        stored = None
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("format") != INDEX_FORMAT:
+                stored = None
+        except (OSError, ValueError, AttributeError):
+            stored = None
+        index = build_definition_index(self.base_path, stored)
+        if index != stored:
+            # El índice se reconstruye en memoria igualmente si `reference` es de sólo lectura
+            try:
+                with open(self.index_path, "w", encoding="utf-8") as f:
+                    json.dump(index, f, indent=1, sort_keys=True)
+            except OSError:
+                pass
+        self._index = index
+        return index
+
+    def get_segment_vocabulary(self, version):
+        """frozenset con los identificadores de segmento definidos para una versión (vacío si no existe)."""
+        try:
+            return self._vocabularies[version]
+        except KeyError:
+            pass
+        entry = self.load_index()["versions"].get(version)
+        names = set(entry["segments"]) if entry else set()
+        names.update(self._overlay_segments(version))
+        vocabulary = frozenset(names)
+        self._vocabularies[version] = vocabulary
+        return vocabulary
+
+    def _overlay_segments(self, version=None):
+        """Segmentos definidos en los overlays para una versión (o para cualquiera si es None)."""
+        for v, filename in self._overlay_files:
+            if version is None or v in ("", version):
+                kind, name = _definition_kind(filename)
+                if kind == "seg" and _is_segment_id(name):
+                    yield name
+
+    def get_all_segments(self):
+        """frozenset con los segmentos de todas las versiones (para cuando no se conoce la versión)."""
+        if self._all_segments is None:
+            names = set()
+            for entry in self.load_index()["versions"].values():
+                names.update(entry["segments"])
+            names.update(self._overlay_segments())
+            self._all_segments = frozenset(names)
+        return self._all_segments
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the HL7 definition index (reference/index.json).")
+    parser.add_argument("--base-path", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory containing 'reference' (default: this script's directory)")
+    args = parser.parse_args(argv)
+    manager = HL7DefinitionManager(args.base_path)
+    if not os.path.isdir(os.path.join(args.base_path, "reference")):
+        parser.error(f"no 'reference' directory in {args.base_path}")
+    index = manager.load_index()
+    for version, entry in index["versions"].items():
+        print(f"{version}: {len(entry['segments'])} segments")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
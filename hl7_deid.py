@@ -0,0 +1,406 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Desidentificación de mensajes HL7 (PHI) para reproducir tráfico real en pruebas.
+
+Los campos con datos personales se localizan por su tipo de dato en las
+definiciones de `reference/` y no por una lista fija de rutas:
+
+    XPN/PN    nombres            -> apellidos y nombres de una lista
+    XAD/AD    direcciones        -> calle, ciudad y código postal ficticios
+    XTN/TN    teléfonos y email  -> dígitos sustituidos conservando el formato
+    CX/CK/DLN identificadores    -> mismo patrón (dígitos/letras) y longitud
+    DTM/DT/TS fechas             -> desplazadas un número fijo de días
+
+Los seudónimos se derivan de un HMAC con clave: el mismo paciente recibe el
+mismo seudónimo en todos los mensajes y ficheros, y sin la clave no se puede
+revertir. Sólo se reescriben los valores sustituidos; delimitadores,
+terminadores y framing se conservan byte a byte.
+
+Uso:
+    python hl7_deid.py captura/*.hl7 -o anonimizado/ --key "$HL7_DEID_KEY" -j 4
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from hl7_definitions import HL7DefinitionManager
+from hl7_generator import FAMILY_NAMES, GIVEN_NAMES
+from hl7_parser import (LazyMessage, detect_delimiters, get_component, get_field, is_mllp_framed,
+                        iter_message_spans, open_mapped)
+from hl7_query import CHUNK_SIZE, plan_ranges
+
+KIND_NAME = "name"
+KIND_ADDRESS = "address"
+KIND_PHONE = "phone"
+KIND_IDENTIFIER = "identifier"
+KIND_DATE = "date"
+
+# Tipo de dato -> tipo de PHI
+PHI_DATATYPES = {
+    "XPN": KIND_NAME, "PN": KIND_NAME,
+    "XAD": KIND_ADDRESS, "AD": KIND_ADDRESS,
+    "XTN": KIND_PHONE, "TN": KIND_PHONE,
+    "CX": KIND_IDENTIFIER, "CK": KIND_IDENTIFIER, "DLN": KIND_IDENTIFIER,
+    "DTM": KIND_DATE, "DT": KIND_DATE, "TS": KIND_DATE, "DateTime": KIND_DATE, "Date": KIND_DATE,
+}
+
+# Campos con PHI cuyo tipo de dato es genérico (ST)
+EXTRA_PHI_FIELDS = {("PID", 19): KIND_IDENTIFIER, ("NK1", 37): KIND_IDENTIFIER}
+
+CITIES = ["SPRINGFIELD", "RIVERSIDE", "FAIRVIEW", "MADISON", "GEORGETOWN", "SALEM", "FRANKLIN",
+          "CLINTON", "GREENVILLE", "BRISTOL", "OAKLAND", "ASHLAND", "MILTON", "NEWPORT", "DOVER"]
+STREETS = ["MAIN ST", "OAK AVE", "PINE ST", "MAPLE AVE", "CEDAR LN", "ELM ST", "LAKE RD",
+           "HILL ST", "PARK AVE", "RIVER RD", "CHURCH ST", "MILL RD", "SCHOOL ST", "HIGH ST"]
+
+DEFAULT_VERSION = "2.5"
+CACHE_LIMIT = 200000
+# Seudónimos que reescriben el valor carácter a carácter: las secuencias de escape se copian sin cambios
+_IN_PLACE = ("identifier", "digits")
+
+
+def _escape_mask(value, escape):
+    """bytearray con 1 en las posiciones de las secuencias de escape (\\F\\, \\X0D\\...) de `value`."""
+    mask = bytearray(len(value))
+    start = value.find(escape)
+    while start >= 0:
+        end = value.find(escape, start + 1)
+        if end < 0:
+            # Escape sin cerrar: el resto se trata como texto
+            break
+        mask[start:end + 1] = b"\x01" * (end + 1 - start)
+        start = value.find(escape, end + 1)
+    return mask
+
+
+class Pseudonymizer:
+    """Seudónimos deterministas derivados de HMAC-SHA256 con caché por valor."""
+
+    def __init__(self, key, cache_limit=CACHE_LIMIT):
+        if not key:
+            raise ValueError("A de-identification key is required")
+        self.key = key.encode("utf-8") if isinstance(key, str) else key
+        self.cache = {}
+        self.cache_limit = cache_limit
+        shift = int.from_bytes(self._digest(b"date-shift", b"")[:4], "big")
+        self.date_shift = timedelta(days=shift % 365 + 1)
+
+    def _digest(self, kind, value):
+        return hmac.new(self.key, kind + b"\0" + value, hashlib.sha256).digest()
+
+    def _stream(self, kind, value, size):
+        """Bytes pseudoaleatorios (tantos como `size`) derivados del valor."""
+        digest = self._digest(kind, value)
+        out = digest
+        while len(out) < size:
+            digest = hashlib.sha256(digest).digest()
+            out += digest
+        return out
+
+    def pseudonym(self, kind, value, escape=b"\\"):
+        key = (kind, value, escape)
+        result = self.cache.get(key)
+        if result is None:
+            if len(self.cache) >= self.cache_limit:
+                self.cache.clear()
+            method = getattr(self, "_" + kind)
+            result = self.cache[key] = method(value, escape) if kind in _IN_PLACE else method(value)
+        return result
+
+    def _family(self, value):
+        d = self._digest(b"family", value)
+        return FAMILY_NAMES[int.from_bytes(d[:4], "big") % len(FAMILY_NAMES)].encode("ascii")
+
+    def _given(self, value):
+        d = self._digest(b"given", value)
+        return GIVEN_NAMES[int.from_bytes(d[:4], "big") % len(GIVEN_NAMES)].encode("ascii")
+
+    def _street(self, value):
+        d = self._digest(b"street", value)
+        number = int.from_bytes(d[4:6], "big") % 9000 + 100
+        return b"%d %s" % (number, STREETS[int.from_bytes(d[:4], "big") % len(STREETS)].encode("ascii"))
+
+    def _city(self, value):
+        d = self._digest(b"city", value)
+        return CITIES[int.from_bytes(d[:4], "big") % len(CITIES)].encode("ascii")
+
+    def _email(self, value):
+        return b"user" + self._digest(b"email", value)[:5].hex().encode("ascii") + b"@example.org"
+
+    def _pattern(self, value, kind=b"id", escape=b"\\"):
+        """Sustituye dígitos por dígitos y letras por letras, conservando el resto y las secuencias de escape."""
+        stream = self._stream(kind, value, len(value))
+        mask = _escape_mask(value, escape) if escape in value else None
+        out = bytearray(value)
+        for i, c in enumerate(value):
+            r = stream[i]
+            if mask is not None and mask[i]:
+                continue
+            if 48 <= c <= 57:
+                out[i] = 48 + r % 10
+            elif 65 <= c <= 90:
+                out[i] = 65 + r % 26
+            elif 97 <= c <= 122:
+                out[i] = 97 + r % 26
+        return bytes(out)
+
+    def _identifier(self, value, escape=b"\\"):
+        return self._pattern(value, b"id", escape)
+
+    def _digits(self, value, escape=b"\\"):
+        stream = self._stream(b"digits", value, len(value))
+        mask = _escape_mask(value, escape) if escape in value else bytes(len(value))
+        return bytes(48 + stream[i] % 10 if 48 <= c <= 57 and not mask[i] else c for i, c in enumerate(value))
+
+    def _date(self, value):
+        # YYYYMMDD[HHMM[SS[.S]]][+ZZZZ]: sólo se desplaza la parte de fecha
+        if len(value) < 8 or not value[:8].isdigit():
+            return value
+        try:
+            day = date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+        except ValueError:
+            return value
+        return (day - self.date_shift).strftime("%Y%m%d").encode("ascii") + value[8:]
+
+
+class Deidentifier:
+    """Aplica la desidentificación a mensajes completos (bytes)."""
+
+    def __init__(self, def_manager, key, version=None, shift_dates=True):
+        self.def_manager = def_manager
+        self.version = version
+        self.shift_dates = shift_dates
+        self.pseudonyms = Pseudonymizer(key)
+        self.plans = {}
+
+    # --- Plan por segmento ---
+
+    def _segment_plan(self, version, name):
+        """Lista de (índice del campo, componente o None, tipo de PHI) de un segmento."""
+        key = (version, name)
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+        seg = name.decode("ascii", errors="replace")
+        fields = self.def_manager.get_segment_fields(version, seg)
+        if fields is None and version != DEFAULT_VERSION:
+            fields = self.def_manager.get_segment_fields(DEFAULT_VERSION, seg)
+        plan = []
+        for number, field in enumerate(fields or (), start=1):
+            if seg == "MSH" and number <= 2:
+                continue
+            kind = EXTRA_PHI_FIELDS.get((seg, number)) or PHI_DATATYPES.get(field.datatype)
+            if kind == KIND_DATE and not self.shift_dates:
+                continue
+            if kind is not None:
+                plan.append((number, None, kind))
+                continue
+            # Compuestos que contienen fechas u otros tipos PHI en un componente (p.ej. XCN-19 TS)
+            components = self.def_manager.get_datatype_components(version, field.datatype) or ()
+            for index, comp in enumerate(components):
+                comp_kind = PHI_DATATYPES.get(comp.datatype)
+                if comp_kind is None or (comp_kind == KIND_DATE and not self.shift_dates):
+                    continue
+                plan.append((number, index, comp_kind))
+        self.plans[key] = plan
+        return plan
+
+    # --- Sustitución de valores ---
+
+    def _replace_rep(self, rep, kind, delims):
+        """Desidentifica una repetición de un campo de tipo PHI."""
+        pseudonym = self.pseudonyms.pseudonym
+        escape = delims.escape
+
+        def p(method, value):
+            return pseudonym(method, value, escape)
+        if kind == KIND_DATE:
+            # TS puede llevar componentes (fecha^precisión): sólo se desplaza la fecha inicial
+            return p(KIND_DATE, rep)
+        if kind == KIND_IDENTIFIER and delims.component not in rep:
+            return p(KIND_IDENTIFIER, rep)
+        comps = rep.split(delims.component)
+        if kind == KIND_NAME:
+            targets = ((0, "family"), (1, "given"), (2, "given"))
+        elif kind == KIND_ADDRESS:
+            targets = ((0, "street"), (1, "street"), (2, "city"), (4, "digits"))
+        elif kind == KIND_PHONE:
+            targets = ((0, "digits"), (3, "email"), (4, "digits"), (5, "digits"), (6, "digits"),
+                       (7, "digits"), (11, "digits"))
+        else:
+            # Identificador: el ID se sustituye y el dígito de control deja de ser válido
+            targets = ((0, "identifier"),)
+            if len(comps) > 1 and comps[1]:
+                comps[1] = b""
+        for index, method in targets:
+            if index < len(comps) and comps[index]:
+                subs = comps[index].split(delims.subcomponent)
+                comps[index] = delims.subcomponent.join([p(method, s) if s else s for s in subs])
+        return delims.component.join(comps)
+
+    def _replace_field(self, value, comp, kind, delims):
+        reps = value.split(delims.repetition)
+        for i, rep in enumerate(reps):
+            if not rep:
+                continue
+            if comp is None:
+                reps[i] = self._replace_rep(rep, kind, delims)
+            else:
+                comps = rep.split(delims.component)
+                if comp < len(comps) and comps[comp]:
+                    comps[comp] = self._replace_rep(comps[comp], kind, delims)
+                    reps[i] = delims.component.join(comps)
+        return delims.repetition.join(reps)
+
+    def deidentify(self, data):
+        """Devuelve el mensaje con los valores PHI sustituidos (mismo framing y terminadores)."""
+        delims = detect_delimiters(data)
+        msg = LazyMessage(data, delims)
+        version = self.version
+        if version is None:
+            msh = data[:data.find(b"\r")] if b"\r" in data else data
+            version = get_component(get_field(msh, 12, delims), 1, delims.component).decode(
+                "ascii", errors="replace") or DEFAULT_VERSION
+        sep = delims.field
+        pieces = []
+        pos = 0
+        for name, start, end in msg.index:
+            plan = self._segment_plan(version, name)
+            if not plan:
+                continue
+            fields = data[start:end].split(sep)
+            # En MSH el elemento 1 de la lista es MSH-2
+            shift = 1 if name == b"MSH" else 0
+            changed = False
+            for number, comp, kind in plan:
+                i = number - shift
+                if i >= len(fields) or not fields[i]:
+                    continue
+                new = self._replace_field(fields[i], comp, kind, delims)
+                if new != fields[i]:
+                    fields[i] = new
+                    changed = True
+            if changed:
+                pieces.append(data[pos:start])
+                pieces.append(sep.join(fields))
+                pos = end
+        if not pieces:
+            return data
+        pieces.append(data[pos:])
+        return b"".join(pieces)
+
+
+# --- Procesamiento de ficheros en paralelo ---
+
+_WORKER = {}
+
+
+def _worker_deidentifier(base_path, key, version, shift_dates):
+    """Un Deidentifier por proceso: las definiciones y la caché se reutilizan entre rangos."""
+    cache_key = (base_path, key, version, shift_dates)
+    deid = _WORKER.get(cache_key)
+    if deid is None:
+        _WORKER.clear()
+        deid = _WORKER[cache_key] = Deidentifier(HL7DefinitionManager(base_path), key, version, shift_dates)
+    return deid
+
+
+def _deidentify_range(args):
+    """Trabajo de un proceso: escribe en `part_path` la región del fichero que empieza en su primer mensaje."""
+    base_path, key, version, shift_dates, path, start, end, part_path = args
+    deid = _worker_deidentifier(base_path, key, version, shift_dates)
+    mm = open_mapped(path)
+    count = 0
+    with open(part_path, "wb") as out:
+        if mm is None:
+            return part_path, 0
+        try:
+            framed = is_mllp_framed(mm)
+            cursor = 0 if start == 0 else None
+            for msg_start, msg_end in iter_message_spans(mm, start, end, framed):
+                if cursor is not None:
+                    # Bytes entre mensajes (framing, líneas en blanco): se copian tal cual
+                    out.write(mm[cursor:msg_start])
+                out.write(deid.deidentify(mm[msg_start:msg_end]))
+                count += 1
+                # Hasta el inicio del siguiente mensaje, que puede pertenecer a otro rango
+                if framed:
+                    nxt = mm.find(b"\x0b", msg_end)
+                    stop = nxt + 1 if nxt >= 0 else len(mm)
+                else:
+                    stop = msg_end
+                out.write(mm[msg_end:stop])
+                cursor = None
+        finally:
+            mm.close()
+    return part_path, count
+
+
+def deidentify_files(paths, output_dir, key, base_path=None, version=None, shift_dates=True, workers=None,
+                     chunk_size=CHUNK_SIZE):
+    """Desidentifica los ficheros en paralelo y devuelve el número de mensajes procesados."""
+    base_path = base_path or os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    outputs = {}
+    for path, start, end in plan_ranges(paths, chunk_size):
+        target = os.path.join(output_dir, os.path.basename(path))
+        part_path = f"{target}.part{len(outputs.setdefault(target, []))}"
+        outputs[target].append(part_path)
+        tasks.append((base_path, key, version, shift_dates, path, start, end, part_path))
+    if workers == 1 or len(tasks) == 1:
+        results = list(map(_deidentify_range, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_deidentify_range, tasks))
+    # Concatenar las partes de cada fichero en orden
+    for target, parts in outputs.items():
+        with open(target, "wb") as out:
+            for part_path in parts:
+                with open(part_path, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+                os.remove(part_path)
+    return sum(count for _, count in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="De-identify HL7 files (PHI pseudonymization)")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--key", default=os.environ.get("HL7_DEID_KEY"), help="HMAC key (default: $HL7_DEID_KEY)")
+    parser.add_argument("--version", help="HL7 version of the definitions (default: MSH-12 of each message)")
+    parser.add_argument("--no-date-shift", action="store_true", help="keep dates unchanged")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes")
+    args = parser.parse_args(argv)
+    if not args.key:
+        parser.error("a key is required (--key or HL7_DEID_KEY)")
+
+    start = time.perf_counter()
+    count = deidentify_files(args.files, args.output, args.key, version=args.version,
+                             shift_dates=not args.no_date_shift, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{count} messages de-identified in {elapsed:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Comparación estructural de mensajes HL7 (y de ficheros de mensajes emparejados).
+
+Los segmentos de los dos mensajes se alinean por su posición en la gramática
+del tipo de mensaje (`match_structure`): el tercer OBX de la segunda
+observación se compara con el tercer OBX de la segunda observación del otro
+lado aunque un grupo anterior tenga más o menos segmentos opcionales. Sin
+gramática (versión o tipo desconocidos) se alinean por nombre y número de
+ocurrencia.
+
+Las diferencias se informan al nivel más profundo que cambia (campo,
+repetición, componente o subcomponente), con rutas en la sintaxis de
+`hl7_query` (p.ej. OBX[3]-5.2) y la descripción de las definiciones.
+
+En modo fichero los mensajes se emparejan por posición y se leen de los dos
+ficheros a la vez con mmap; los pares se comparan por lotes en varios procesos
+con un número acotado de lotes en vuelo, así que la memoria no depende del
+tamaño de los ficheros.
+
+Uso:
+    python hl7_diff.py legado.hl7 nuevo.hl7 --ignore MSH-7 --ignore MSH-10 -j 4
+    python hl7_diff.py acks_legado.hl7 acks_nuevo.hl7 -f jsonl -o diferencias.jsonl
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
+
+from hl7_definitions import HL7DefinitionManager, match_structure
+from hl7_parser import detect_delimiters, get_component, get_field, is_mllp_framed, iter_message_spans, open_mapped
+from hl7_query import FieldPath
+
+KIND_CHANGED = "changed"
+KIND_ADDED = "added"
+KIND_REMOVED = "removed"
+
+# Una diferencia: left/right son str (None si falta ese lado)
+Difference = namedtuple("Difference", "kind path description left right")
+
+DEFAULT_VERSION = "2.5"
+BATCH_SIZE = 256
+
+# Secuencias de segmentos distintas cuya alineación se guarda
+ADDRESS_CACHE_LIMIT = 4096
+
+
+class MessageDiffer:
+    """Compara pares de mensajes (bytes) usando las definiciones de `reference/`.
+
+    `ignore` son rutas de campo o componente (MSH-7, PID-3.4) que no se comparan.
+    """
+
+    def __init__(self, def_manager, version=None, ignore=(), encoding="utf-8"):
+        self.def_manager = def_manager
+        self.version = version
+        self.encoding = encoding
+        self._address_cache = {}
+        self._versions = {}
+        self.ignore_fields = set()
+        self.ignore_components = set()
+        for text in ignore:
+            path = FieldPath(text)
+            segment = path.segment.decode("ascii")
+            if path.component is None:
+                self.ignore_fields.add((segment, path.field))
+            else:
+                self.ignore_components.add((segment, path.field, path.component))
+
+    def _decode(self, value):
+        return None if value is None else bytes(value).decode(self.encoding, errors="replace")
+
+    def _version_of(self, msh, delimiters):
+        if self.version:
+            return self.version
+        version = get_component(get_field(msh, 12, delimiters), 1, delimiters.component)
+        version = version.decode("ascii", errors="replace")
+        available = self._versions.get(version)
+        if available is None:
+            available = self._versions[version] = bool(version) and self.def_manager.is_version_available(version)
+        return version if available else DEFAULT_VERSION
+
+    def _addresses(self, version, message_type, names):
+        """Direcciones en la gramática de una secuencia de segmentos (cacheadas: se repiten mucho)."""
+        cache_key = (version, message_type, names)
+        addresses = self._address_cache.get(cache_key)
+        if addresses is None:
+            structure = None
+            if names[:1] == ("MSH",):
+                structure = self.def_manager.get_message_structure(version, message_type)
+            addresses = match_structure(structure, names) if structure else [None] * len(names)
+            if len(self._address_cache) >= ADDRESS_CACHE_LIMIT:
+                self._address_cache.clear()
+            self._address_cache[cache_key] = addresses
+        return addresses
+
+    @staticmethod
+    def _segments(segments, names, addresses=None):
+        """Lista de (clave de alineación, nombre, ocurrencia, bytes) de los segmentos."""
+        occurrences = {}
+        extras = {}
+        keyed = []
+        for i, (name, segment) in enumerate(zip(names, segments)):
+            occurrence = occurrences[name] = occurrences.get(name, 0) + 1
+            address = addresses[i] if addresses is not None else None
+            if address is None:
+                # Fuera de la gramática: se alinea por nombre y orden entre los no casados
+                extra = extras[name] = extras.get(name, 0) + 1
+                address = (name, extra)
+            keyed.append((address, name, occurrence, segment))
+        return keyed
+
+    def diff(self, left, right):
+        """Lista de Difference entre dos mensajes, en el orden de los segmentos."""
+        left_segs = split_segments(left)
+        right_segs = split_segments(right)
+        left_delims = detect_delimiters(left_segs[0] if left_segs else b"")
+        right_delims = detect_delimiters(right_segs[0] if right_segs else b"")
+        left_msh = left_segs[0] if left_segs and left_segs[0][:3] == b"MSH" else b""
+        version = self._version_of(left_msh, left_delims)
+        left_names = tuple(seg[:3].decode("ascii", errors="replace") for seg in left_segs)
+        right_names = tuple(seg[:3].decode("ascii", errors="replace") for seg in right_segs)
+        differences = []
+        if left_names == right_names:
+            # Misma secuencia de segmentos (lo habitual): la alineación es posición a posición
+            for left_item, right_item in zip(self._segments(left_segs, left_names),
+                                             self._segments(right_segs, right_names)):
+                self._diff_segment(left_item, right_item, left_delims, right_delims, version, differences)
+            return differences
+        message_type = get_field(left_msh, 9, left_delims).decode("ascii", errors="replace")
+        left_segments = self._segments(left_segs, left_names, self._addresses(version, message_type, left_names))
+        right_segments = self._segments(right_segs, right_names,
+                                        self._addresses(version, message_type, right_names))
+        right_by_key = {item[0]: i for i, item in enumerate(right_segments)}
+        matched = set()
+        cursor = 0
+        for item in left_segments:
+            partner = right_by_key.get(item[0])
+            if partner is None:
+                differences.append(self._segment_difference(KIND_REMOVED, item, version))
+                continue
+            # Los segmentos que sólo están a la derecha se informan donde aparecen
+            for j in range(cursor, partner):
+                if j not in matched:
+                    matched.add(j)
+                    differences.append(self._segment_difference(KIND_ADDED, right_segments[j], version))
+            cursor = max(cursor, partner + 1)
+            matched.add(partner)
+            self._diff_segment(item, right_segments[partner], left_delims, right_delims, version, differences)
+        for j in range(cursor, len(right_segments)):
+            if j not in matched:
+                differences.append(self._segment_difference(KIND_ADDED, right_segments[j], version))
+        return differences
+
+    @staticmethod
+    def _segment_path(name, occurrence):
+        return name if occurrence == 1 else f"{name}[{occurrence}]"
+
+    def _segment_difference(self, kind, item, version):
+        _, name, occurrence, data = item
+        root = self.def_manager.load_segment_definition(version, name)
+        description = root.findtext("description", "") if root is not None else ""
+        text = self._decode(data)
+        left, right = (text, None) if kind == KIND_REMOVED else (None, text)
+        return Difference(kind, self._segment_path(name, occurrence), description, left, right)
+
+    def _diff_segment(self, left_item, right_item, left_delims, right_delims, version, out):
+        _, name, occurrence, left = left_item
+        right = right_item[3]
+        if left == right and left_delims == right_delims:
+            return
+        left_fields = left.split(left_delims.field)
+        right_fields = right.split(right_delims.field)
+        # En MSH el separador es MSH-1: el elemento i de la lista es el campo i + 1
+        shift = 1 if name == "MSH" else 0
+        if shift:
+            left_fields.insert(1, left_delims.field)
+            right_fields.insert(1, right_delims.field)
+        definitions = self.def_manager.get_segment_fields(version, name) or ()
+        seg_path = self._segment_path(name, occurrence)
+        for index in range(1, max(len(left_fields), len(right_fields))):
+            lv = left_fields[index] if index < len(left_fields) else None
+            rv = right_fields[index] if index < len(right_fields) else None
+            # Un campo final ausente equivale a uno vacío
+            if (lv or b"") == (rv or b"") or (name, index) in self.ignore_fields:
+                continue
+            field_def = definitions[index - 1] if index - 1 < len(definitions) else None
+            if shift and index <= 2:
+                # MSH-1 y MSH-2 son los delimitadores: no se dividen
+                self._add(out, f"{seg_path}-{index}", field_def.description if field_def else "", lv, rv)
+                continue
+            self._diff_field(out, name, seg_path, index, field_def, lv or b"", rv or b"",
+                             left_delims, right_delims, version)
+
+    def _diff_field(self, out, name, seg_path, index, field_def, left, right, left_delims, right_delims, version):
+        description = field_def.description if field_def else ""
+        components = self.def_manager.get_datatype_components(version, field_def.datatype) if field_def else None
+        left_reps = left.split(left_delims.repetition)
+        right_reps = right.split(right_delims.repetition)
+        multiple = len(left_reps) > 1 or len(right_reps) > 1
+        for rep in range(max(len(left_reps), len(right_reps))):
+            lr = left_reps[rep] if rep < len(left_reps) else None
+            rr = right_reps[rep] if rep < len(right_reps) else None
+            if lr == rr:
+                continue
+            path = f"{seg_path}-{index}({rep + 1})" if multiple else f"{seg_path}-{index}"
+            if lr is None or rr is None:
+                self._add(out, path, description, lr, rr)
+                continue
+            left_comps = lr.split(left_delims.component)
+            right_comps = rr.split(right_delims.component)
+            if len(left_comps) == 1 and len(right_comps) == 1:
+                self._add(out, path, description, lr, rr)
+                continue
+            for comp in range(1, max(len(left_comps), len(right_comps)) + 1):
+                if (name, index, comp) in self.ignore_components:
+                    continue
+                lc = get_component(lr, comp, left_delims.component)
+                rc = get_component(rr, comp, right_delims.component)
+                if lc == rc:
+                    continue
+                comp_def = components[comp - 1] if components and comp - 1 < len(components) else None
+                comp_description = f"{description} / {comp_def.description}" if comp_def else description
+                comp_path = f"{path}.{comp}"
+                left_subs = lc.split(left_delims.subcomponent)
+                right_subs = rc.split(right_delims.subcomponent)
+                if len(left_subs) == 1 and len(right_subs) == 1:
+                    self._add(out, comp_path, comp_description, lc, rc)
+                    continue
+                for sub in range(1, max(len(left_subs), len(right_subs)) + 1):
+                    ls = get_component(lc, sub, left_delims.subcomponent)
+                    rs = get_component(rc, sub, right_delims.subcomponent)
+                    if ls != rs:
+                        self._add(out, f"{comp_path}.{sub}", comp_description, ls, rs)
+
+    def _add(self, out, path, description, left, right):
+        out.append(Difference(KIND_CHANGED, path, description, self._decode(left), self._decode(right)))
+
+
+def format_difference(difference):
+    """Una línea de texto legible para una diferencia."""
+    kind, path, description, left, right = difference
+    label = f"{path} ({description})" if description else path
+    if kind == KIND_REMOVED:
+        return f"- {label}: {left}"
+    if kind == KIND_ADDED:
+        return f"+ {label}: {right}"
+    return f"~ {label}: {left!r} -> {right!r}"
+
+
+def split_segments(data):
+    """Segmentos (bytes) de un mensaje, con terminadores \\r, \\n o \\r\\n."""
+    data = bytes(data)
+    if b"\n" in data:
+        data = data.replace(b"\n", b"\r")
+    return [segment for segment in data.split(b"\r") if segment]
+
+
+# --- Comparación de ficheros en paralelo ---
+
+_WORKER = {}
+
+
+def _worker_differ(base_path, version, ignore, encoding):
+    """Un MessageDiffer por proceso: las definiciones compiladas se reutilizan entre lotes."""
+    cache_key = (base_path, version, ignore, encoding)
+    differ = _WORKER.get(cache_key)
+    if differ is None:
+        _WORKER.clear()
+        differ = _WORKER[cache_key] = MessageDiffer(HL7DefinitionManager(base_path), version, ignore, encoding)
+    return differ
+
+
+def _diff_batch(args):
+    """Trabajo de un proceso: compara un lote de pares y devuelve sólo los que difieren."""
+    base_path, version, ignore, encoding, first, pairs = args
+    differ = _worker_differ(base_path, version, ignore, encoding)
+    results = []
+    for number, (left, right) in enumerate(pairs, first):
+        if left == right:
+            continue
+        if left is None or right is None:
+            # Un fichero tiene más mensajes que el otro
+            data = left if right is None else right
+            kind = KIND_REMOVED if right is None else KIND_ADDED
+            text = data.decode(encoding, errors="replace")
+            differences = [Difference(kind, "MSH", "Message", text if right is None else None,
+                                      text if left is None else None)]
+        else:
+            differences = differ.diff(left, right)
+            if not differences:
+                continue
+        data = left or right
+        msh = data.split(b"\r", 1)[0].split(b"\n", 1)[0]
+        control_id = get_field(msh, 10, detect_delimiters(msh))
+        results.append((number, control_id.decode(encoding, errors="replace"), differences))
+    return results
+
+
+def _iter_pairs(left_mm, right_mm):
+    left_spans = iter_message_spans(left_mm, framed=is_mllp_framed(left_mm)) if left_mm is not None else ()
+    right_spans = iter_message_spans(right_mm, framed=is_mllp_framed(right_mm)) if right_mm is not None else ()
+    for left, right in zip_longest(left_spans, right_spans):
+        yield (left_mm[left[0]:left[1]].rstrip(b"\r\n") if left else None,
+               right_mm[right[0]:right[1]].rstrip(b"\r\n") if right else None)
+
+
+def diff_files(left_path, right_path, version=None, ignore=(), encoding="utf-8", workers=None,
+               batch_size=BATCH_SIZE, base_path=None, stats=None):
+    """Compara dos ficheros de mensajes emparejados por posición.
+
+    Itera (número de par 1-based, MSH-10, diferencias) de los pares que
+    difieren, en orden. Si se pasa `stats` (dict) se acumulan en él los pares
+    comparados ("pairs") y los distintos ("different").
+    """
+    base_path = base_path or os.path.dirname(os.path.abspath(__file__))
+    ignore = tuple(ignore)
+    workers = workers or os.cpu_count() or 1
+    stats = {} if stats is None else stats
+    stats.setdefault("pairs", 0)
+    stats.setdefault("different", 0)
+    left_mm = open_mapped(left_path)
+    right_mm = open_mapped(right_path)
+
+    def batches():
+        batch = []
+        first = 1
+        for pair in _iter_pairs(left_mm, right_mm):
+            batch.append(pair)
+            if len(batch) >= batch_size:
+                yield (base_path, version, ignore, encoding, first, batch)
+                first += len(batch)
+                batch = []
+        if batch:
+            yield (base_path, version, ignore, encoding, first, batch)
+
+    def count(task, results):
+        stats["pairs"] += len(task[5])
+        stats["different"] += len(results)
+        return results
+
+    try:
+        if workers == 1:
+            for task in batches():
+                yield from count(task, _diff_batch(task))
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Como mucho dos lotes en vuelo por proceso: la lectura no se adelanta a la comparación
+            pending = deque()
+            for task in batches():
+                pending.append((task, pool.submit(_diff_batch, task)))
+                if len(pending) >= workers * 2:
+                    done_task, future = pending.popleft()
+                    yield from count(done_task, future.result())
+            while pending:
+                done_task, future = pending.popleft()
+                yield from count(done_task, future.result())
+    finally:
+        for mm in (left_mm, right_mm):
+            if mm is not None:
+                mm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Structural diff of two HL7 messages or files of paired messages")
+    parser.add_argument("left", help="reference file (plain or MLLP framed)")
+    parser.add_argument("right", help="file to compare, paired message by message")
+    parser.add_argument("--ignore", action="append", default=[], help="field or component path to skip, e.g. MSH-7")
+    parser.add_argument("--version", help="HL7 version of the definitions (default: MSH-12 of each message)")
+    parser.add_argument("-f", "--format", choices=["text", "jsonl"], default="text")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes")
+    parser.add_argument("--encoding", default="utf-8")
+    args = parser.parse_args(argv)
+    try:
+        for path in args.ignore:
+            FieldPath(path)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    stats = {}
+    results = diff_files(args.left, args.right, args.version, args.ignore, args.encoding, args.workers, stats=stats)
+    if args.output:
+        out = open(args.output, "w", encoding="utf-8", newline="")
+    else:
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+    try:
+        for number, control_id, differences in results:
+            if args.format == "jsonl":
+                record = {"pair": number, "control_id": control_id,
+                          "differences": [d._asdict() for d in differences]}
+                out.write(json.dumps(record, ensure_ascii=False))
+                out.write("\n")
+            else:
+                out.write(f"#{number} {control_id}\n")
+                for difference in differences:
+                    out.write(f"  {format_difference(difference)}\n")
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{stats['pairs']} pairs compared, {stats['different']} different in {elapsed:.2f} s", file=sys.stderr)
+    sys.exit(1 if stats["different"] else 0)
+
+
+if __name__ == "__main__":
+    main()
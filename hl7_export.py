@@ -0,0 +1,252 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Exportación columnar de mensajes HL7 para análisis.
+
+Se genera una tabla por tipo de segmento (una fila por ocurrencia) con las
+columnas `message_index`, `control_id`, `occurrence` y un campo por columna,
+nombrado con la definición (p.ej. `PID.5 Patient Name`). Los campos que
+exceden la definición se guardan unidos en la columna `_extra`.
+
+El formato es Parquet o Arrow IPC si `pyarrow` está instalado y, si no,
+ficheros CSV por lote (`<SEG>/part-00000.csv`). Los mensajes se procesan por
+lotes: cada lote se traspone a columnas de golpe y se escribe, por lo que la
+memoria no depende del tamaño de la entrada.
+
+Uso:
+    python hl7_export.py mensajes.hl7 -o export/ --format parquet --batch-size 50000
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+from itertools import zip_longest
+
+from hl7_definitions import HL7DefinitionManager
+from hl7_parser import detect_delimiters, iter_messages, open_mapped
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional
+    pa = None
+    pq = None
+
+KEY_COLUMNS = ["message_index", "control_id", "occurrence"]
+EXTRA_COLUMN = "_extra"
+
+FORMAT_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+_SEGMENT_RE = re.compile(r"[^\r\n]+")
+
+
+def column_names(def_manager, version, segment, width):
+    """Nombres de las columnas de campo de un segmento: definición o `SEG.n` si no existe."""
+    fields = def_manager.get_segment_fields(version, segment) or ()
+    names = []
+    for i in range(1, width + 1):
+        if i <= len(fields) and fields[i - 1].description:
+            names.append(f"{segment}.{i} {fields[i - 1].description}")
+        else:
+            names.append(f"{segment}.{i}")
+    return names
+
+
+class _SegmentTable:
+    """Filas pendientes de un tipo de segmento y su esquema fijo."""
+
+    def __init__(self, name, width, columns):
+        self.name = name
+        self.width = width
+        self.columns = columns
+        self.keys = []
+        self.rows = []
+        self.part = 0
+        self.writer = None
+        self.separator = "|"
+
+    def to_columns(self):
+        """Traspone el lote de filas a columnas (padding incluido) en una sola pasada."""
+        width = self.width
+        rows = self.rows
+        extra = [self.separator.join(r[width:]) if len(r) > width else "" for r in rows]
+        if rows:
+            field_columns = list(zip_longest(*[r if len(r) <= width else r[:width] for r in rows], fillvalue=""))
+        else:
+            field_columns = []
+        # zip_longest no rellena columnas que ninguna fila alcanza
+        while len(field_columns) < width:
+            field_columns.append(("",) * len(rows))
+        key_columns = list(zip(*self.keys)) if self.keys else [(), (), ()]
+        return key_columns, field_columns, extra
+
+    def clear(self):
+        self.keys = []
+        self.rows = []
+
+
+class ColumnarExporter:
+    """Acumula mensajes por lotes y los escribe por columnas."""
+
+    def __init__(self, output_dir, def_manager, version=None, fmt=None, batch_size=50000, encoding="utf-8",
+                 unknown_width=25):
+        if fmt is None:
+            fmt = "parquet" if pa is not None else "csv"
+        if fmt in ("parquet", "arrow") and pa is None:
+            raise RuntimeError("pyarrow is required for Parquet/Arrow output")
+        self.output_dir = output_dir
+        self.def_manager = def_manager
+        self.version = version
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.encoding = encoding
+        self.unknown_width = unknown_width
+        self.tables = {}
+        self.pending = 0
+        self.message_count = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _table(self, name, observed_width, separator):
+        fields = self.def_manager.get_segment_fields(self.version, name)
+        width = len(fields) if fields else max(observed_width, self.unknown_width)
+        columns = KEY_COLUMNS + column_names(self.def_manager, self.version, name, width) + [EXTRA_COLUMN]
+        table = self.tables[name] = _SegmentTable(name, width, columns)
+        table.separator = separator
+        return table
+
+    def add(self, data):
+        """Añade un mensaje (bytes)."""
+        # Se decodifica el mensaje entero una sola vez; los campos se dividen ya como str
+        encoding = self.encoding
+        delimiters = detect_delimiters(data)
+        sep = delimiters.field.decode(encoding)
+        index = self.message_count
+        self.message_count += 1
+        control_id = ""
+        occurrences = {}
+        for segment in _SEGMENT_RE.findall(data.decode(encoding, errors="replace")):
+            fields = segment.split(sep)
+            seg_name = fields[0]
+            if seg_name == "MSH":
+                # MSH-1 es el propio separador: alinear índices con la numeración HL7
+                fields[0] = sep
+                control_id = fields[9] if len(fields) > 9 else ""
+                if self.version is None:
+                    version = fields[11] if len(fields) > 11 else ""
+                    self.version = version.split(delimiters.component.decode(encoding))[0] or "2.5"
+            else:
+                del fields[0]
+            occurrence = occurrences.get(seg_name, 0) + 1
+            occurrences[seg_name] = occurrence
+            table = self.tables.get(seg_name) or self._table(seg_name, len(fields), sep)
+            table.keys.append((index, control_id, occurrence))
+            table.rows.append(fields)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def add_many(self, messages):
+        for data in messages:
+            self.add(data)
+
+    def flush(self):
+        for table in self.tables.values():
+            if table.rows:
+                self._write(table)
+                table.clear()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        for table in self.tables.values():
+            if table.writer is not None:
+                table.writer.close()
+                table.writer = None
+
+    # --- Escritura ---
+
+    def _write(self, table):
+        key_columns, field_columns, extra = table.to_columns()
+        if self.fmt == "csv":
+            self._write_csv(table, key_columns, field_columns, extra)
+        else:
+            self._write_arrow(table, key_columns, field_columns, extra)
+
+    def _write_csv(self, table, key_columns, field_columns, extra):
+        directory = os.path.join(self.output_dir, table.name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{table.part:05d}.csv")
+        table.part += 1
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(table.columns)
+            writer.writerows(zip(*key_columns, *field_columns, extra))
+
+    def _write_arrow(self, table, key_columns, field_columns, extra):
+        arrays = [pa.array(key_columns[0], type=pa.int64()), pa.array(key_columns[1], type=pa.string()),
+                  pa.array(key_columns[2], type=pa.int32())]
+        arrays += [pa.array(col, type=pa.string()) for col in field_columns]
+        arrays.append(pa.array(extra, type=pa.string()))
+        batch = pa.Table.from_arrays(arrays, names=table.columns)
+        if table.writer is None:
+            path = os.path.join(self.output_dir, table.name + FORMAT_EXTENSIONS[self.fmt])
+            if self.fmt == "parquet":
+                table.writer = pq.ParquetWriter(path, batch.schema)
+            else:
+                table.writer = pa.ipc.new_file(path, batch.schema)
+        table.writer.write_table(batch)
+
+
+def export_files(paths, output_dir, def_manager, version=None, fmt=None, batch_size=50000, encoding="utf-8"):
+    """Exporta todos los mensajes de los ficheros y devuelve el número de mensajes procesados."""
+    exporter = ColumnarExporter(output_dir, def_manager, version, fmt, batch_size, encoding)
+    try:
+        for path in paths:
+            mm = open_mapped(path)
+            if mm is None:
+                continue
+            try:
+                exporter.add_many(iter_messages(mm))
+            finally:
+                mm.close()
+    finally:
+        exporter.close()
+    return exporter.message_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar export of HL7 messages")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTENSIONS), help="default: parquet if pyarrow is available, else csv")
+    parser.add_argument("--version", help="HL7 version used for column names (default: MSH-12 of the first message)")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--encoding", default="utf-8")
+    args = parser.parse_args(argv)
+
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    count = export_files(args.files, args.output, HL7DefinitionManager(base_path), args.version,
+                         args.format, args.batch_size, args.encoding)
+    elapsed = time.perf_counter() - start
+    print(f"{count} messages exported in {elapsed:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Generador de mensajes HL7 sintéticos a partir de las gramáticas de `reference`.
+
+La gramática (messageXXX.xml) y las definiciones de segmentos y compuestos se
+recorren una sola vez para construir unas pocas plantillas; cada mensaje
+generado sólo rellena los huecos dinámicos (MSH-7, MSH-10 y datos del PID),
+por lo que el coste por mensaje es un `join` de bytes.
+
+Uso:
+    python hl7_generator.py ORU^R01 --version 2.5 --count 100000 --obx 20 -o salida.hl7
+"""
+
+import argparse
+import base64
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+from hl7_definitions import HL7DefinitionManager, SegmentRef
+from mllp import wrap
+from rate_control import RateLimiter, add_rate_arguments, rate_limit_from_args
+
+FAMILY_NAMES = ["GARCIA", "MARTINEZ", "LOPEZ", "SANCHEZ", "PEREZ", "GOMEZ", "MARTIN", "JIMENEZ",
+                "RUIZ", "HERNANDEZ", "DIAZ", "MORENO", "SMITH", "JOHNSON", "WILLIAMS", "BROWN",
+                "JONES", "MILLER", "DAVIS", "WILSON", "ANDERSON", "TAYLOR", "THOMAS", "MOORE"]
+GIVEN_NAMES = ["MARIA", "JOSE", "ANTONIO", "CARMEN", "MANUEL", "ANA", "FRANCISCO", "LAURA",
+               "DAVID", "ISABEL", "JAVIER", "ELENA", "JOHN", "MARY", "JAMES", "PATRICIA",
+               "ROBERT", "JENNIFER", "MICHAEL", "LINDA", "WILLIAM", "ELIZABETH", "RICHARD", "SUSAN"]
+SEXES = [b"F", b"M", b"U"]
+
+# Huecos dinámicos de las plantillas
+SLOT_TIMESTAMP = "ts"
+SLOT_CONTROL_ID = "control_id"
+SLOT_MRN = "mrn"
+SLOT_NAME = "name"
+SLOT_DOB = "dob"
+SLOT_SEX = "sex"
+
+# Campos del PID rellenados por mensaje
+_PID_SLOTS = {3: SLOT_MRN, 5: SLOT_NAME, 7: SLOT_DOB, 8: SLOT_SEX}
+
+_WORDS = ["ALPHA", "BRAVO", "DELTA", "ECHO", "LIMA", "OSCAR", "SIERRA", "TANGO", "VICTOR",
+          "GLUCOSE", "SODIUM", "POTASSIUM", "HEMOGLOBIN", "CREATININE", "WARD", "UNIT", "CLINIC"]
+
+
+class _Template:
+    """Plantilla compilada: piezas estáticas y posiciones de los huecos."""
+
+    __slots__ = ("pieces", "slots")
+
+    def __init__(self, parts):
+        # Fusionar piezas estáticas consecutivas
+        pieces, slots = [], []
+        for part in parts:
+            if isinstance(part, bytes):
+                if pieces and isinstance(pieces[-1], bytes):
+                    pieces[-1] += part
+                else:
+                    pieces.append(part)
+            else:
+                slots.append((len(pieces), part))
+                pieces.append(None)
+        self.pieces = pieces
+        self.slots = tuple(slots)
+
+
+class MessageGenerator:
+    """Genera mensajes HL7 válidos (bytes, segmentos separados por \\r) de forma perezosa."""
+
+    def __init__(self, def_manager, message_type="ADT^A01", version="2.5", obx_count=5, base64_size=0,
+                 optional_ratio=0.3, variants=8, seed=None, sending_app="HL7GEN", sending_facility="LOADTEST",
+                 receiving_app="RECEIVER", receiving_facility="TEST", control_id_prefix="GEN"):
+        self.def_manager = def_manager
+        self.message_type = message_type
+        self.version = version
+        self.obx_count = obx_count
+        self.base64_size = base64_size
+        self.optional_ratio = optional_ratio
+        self.rng = random.Random(seed)
+        self.header = (sending_app, sending_facility, receiving_app, receiving_facility)
+        self.control_id_prefix = control_id_prefix.encode("ascii")
+        self.structure = def_manager.get_message_structure(version, message_type)
+        if self.structure is None:
+            raise ValueError(f"No message definition for {message_type} in HL7 {version}")
+        self._base64_blob = None
+        if base64_size:
+            raw = self.rng.randbytes(base64_size * 3 // 4 + 1)
+            self._base64_blob = base64.b64encode(raw)[:base64_size]
+        self.templates = [self._build_template() for _ in range(max(1, variants))]
+
+    # --- Construcción de plantillas ---
+
+    def _word(self):
+        return self.rng.choice(_WORDS).encode("ascii")
+
+    def _primitive_value(self, datatype):
+        rng = self.rng
+        if datatype in ("NM", "Double", "Integer", "SI"):
+            return str(rng.randint(1, 999)).encode("ascii")
+        if datatype in ("DT", "Date"):
+            return b"2024%02d%02d" % (rng.randint(1, 12), rng.randint(1, 28))
+        if datatype in ("DTM", "TS", "DateTime"):
+            return b"2024%02d%02d%02d%02d%02d" % (rng.randint(1, 12), rng.randint(1, 28),
+                                                rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+        if datatype in ("TM", "Time"):
+            return b"%02d%02d%02d" % (rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+        if datatype in ("ID", "IS"):
+            return rng.choice(string.ascii_uppercase).encode("ascii")
+        return self._word()
+
+    def _datatype_value(self, datatype, separator=b"^", depth=0):
+        components = self.def_manager.get_datatype_components(self.version, datatype)
+        if not components or depth > 1:
+            return self._primitive_value(datatype)
+        values = []
+        for i, comp in enumerate(components):
+            if i == 0 or self.rng.random() < self.optional_ratio / 2:
+                values.append(self._datatype_value(comp.datatype, b"&", depth + 1))
+            else:
+                values.append(b"")
+        while values and not values[-1]:
+            values.pop()
+        return separator.join(values)
+
+    def _segment_parts(self, name, set_id):
+        """Devuelve las piezas (bytes o huecos) de un segmento sin terminador."""
+        if name == "MSH":
+            return self._msh_parts()
+        fields_def = self.def_manager.get_segment_fields(self.version, name) or ()
+        fields = []
+        for idx, field in enumerate(fields_def, start=1):
+            if name == "PID" and idx in _PID_SLOTS:
+                fields.append(_PID_SLOTS[idx])
+            elif name == "OBX" and idx <= 11:
+                fields.append(self._obx_field(idx, set_id))
+            elif idx == 1 and field.datatype == "SI":
+                fields.append(str(set_id).encode("ascii"))
+            elif field.min_occurs or self.rng.random() < self.optional_ratio:
+                fields.append(self._datatype_value(field.datatype))
+            else:
+                fields.append(b"")
+        while fields and fields[-1] == b"":
+            fields.pop()
+        parts = [name.encode("ascii")]
+        for value in fields:
+            parts.append(b"|")
+            parts.append(value)
+        return parts
+
+    def _obx_field(self, idx, set_id):
+        if idx == 1:
+            return str(set_id).encode("ascii")
+        if idx == 2:
+            return b"NM"
+        if idx == 3:
+            return b"%d^%s^L" % (self.rng.randint(1000, 9999), self._word())
+        if idx == 5:
+            return b"%d.%d" % (self.rng.randint(0, 500), self.rng.randint(0, 9))
+        if idx == 11:
+            return b"F"
+        return b""
+
+    def _msh_parts(self):
+        sending_app, sending_fac, receiving_app, receiving_fac = self.header
+        head = f"MSH|^~\\&|{sending_app}|{sending_fac}|{receiving_app}|{receiving_fac}|".encode("ascii")
+        return [head, SLOT_TIMESTAMP, b"||", self.message_type.encode("ascii"), b"|",
+                SLOT_CONTROL_ID, b"|P|", self.version.encode("ascii")]
+
+    def _expand(self, nodes, out, state):
+        rng = self.rng
+        for node in nodes:
+            if isinstance(node, SegmentRef):
+                if node.name == "OBX" and not state["obx_done"] and node.max_occurs is None:
+                    reps = self.obx_count
+                    state["obx_done"] = True
+                elif node.min_occurs:
+                    reps = 1
+                else:
+                    reps = 1 if rng.random() < self.optional_ratio else 0
+                for _ in range(reps):
+                    self._emit_segment(node.name, out, state)
+            else:
+                first = node.children[0] if node.children else None
+                is_observation = isinstance(first, SegmentRef) and first.name == "OBX"
+                if is_observation and not state["obx_done"]:
+                    reps = self.obx_count
+                    state["obx_done"] = True
+                elif node.min_occurs or _contains(node, "OBX") and not state["obx_done"] and self.obx_count:
+                    reps = 1
+                else:
+                    reps = 1 if rng.random() < self.optional_ratio else 0
+                parent_counts = state["counts"]
+                leader = first.name if isinstance(first, SegmentRef) else None
+                for _ in range(reps):
+                    # Los set ID (NTE, ...) empiezan en 1 en cada repetición del grupo; el primer segmento
+                    # del grupo (p.ej. OBX en OBSERVATION) sigue la numeración del grupo padre
+                    counts = state["counts"] = {}
+                    if leader in parent_counts:
+                        counts[leader] = parent_counts[leader]
+                    self._expand(node.children, out, state)
+                    if leader in counts:
+                        parent_counts[leader] = counts[leader]
+                state["counts"] = parent_counts
+
+    def _emit_segment(self, name, out, state):
+        counts = state["counts"]
+        counts[name] = counts.get(name, 0) + 1
+        out.extend(self._segment_parts(name, counts[name]))
+        out.append(b"\r")
+        if name == "OBX" and self._base64_blob is not None and not state["base64_done"] \
+                and counts[name] >= self.obx_count:
+            # Observación adicional con un documento embebido en base64 (tipo ED)
+            state["base64_done"] = True
+            counts[name] += 1
+            out.append(b"OBX|%d|ED|PDF^Report^L||^AP^PDF^Base64^" % counts[name])
+            out.append(self._base64_blob)
+            out.append(b"||||||F\r")
+
+    def _build_template(self):
+        state = {"counts": {}, "obx_done": False, "base64_done": False}
+        parts = []
+        self._expand(self.structure, parts, state)
+        if parts and parts[-1] == b"\r":
+            parts.pop()
+        return _Template(parts)
+
+    # --- Generación ---
+
+    def generate(self, count=None):
+        """Itera `count` mensajes (infinitos si es None) como bytes."""
+        rng = self.rng
+        templates = self.templates
+        n_templates = len(templates)
+        prefix = self.control_id_prefix
+        families = [f.encode("ascii") for f in FAMILY_NAMES]
+        givens = [g.encode("ascii") for g in GIVEN_NAMES]
+        base_dob = datetime(1930, 1, 1)
+        dobs = [(base_dob + timedelta(days=d)).strftime("%Y%m%d").encode("ascii")
+                for d in range(0, 90 * 365, 7)]
+        choice = rng.choice
+        getrandbits = rng.getrandbits
+        values = {}
+        timestamp = b""
+        last_second = None
+        i = 0
+        while count is None or i < count:
+            if i & 1023 == 0:
+                now = int(time.time())
+                if now != last_second:
+                    last_second = now
+                    timestamp = time.strftime("%Y%m%d%H%M%S", time.localtime(now)).encode("ascii")
+            values[SLOT_TIMESTAMP] = timestamp
+            values[SLOT_CONTROL_ID] = b"%s%d" % (prefix, i + 1)
+            values[SLOT_MRN] = b"%d^^^%s^MR" % (getrandbits(30), self.header[1].encode("ascii"))
+            values[SLOT_NAME] = choice(families) + b"^" + choice(givens)
+            values[SLOT_DOB] = choice(dobs)
+            values[SLOT_SEX] = choice(SEXES)
+            template = templates[i % n_templates]
+            buf = template.pieces[:]
+            for pos, key in template.slots:
+                buf[pos] = values[key]
+            yield b"".join(buf)
+            i += 1
+
+    __iter__ = generate
+
+
+def _contains(group, segment_name):
+    for child in group.children:
+        if isinstance(child, SegmentRef):
+            if child.name == segment_name:
+                return True
+        elif _contains(child, segment_name):
+            return True
+    return False
+
+
+def write_messages(messages, path, framing="mllp", batch_size=1024):
+    """Escribe los mensajes en un fichero, con framing MLLP o separados por líneas en blanco."""
+    written = 0
+    with open(path, "wb") as f:
+        batch = []
+        for msg in messages:
+            batch.append(wrap(msg) if framing == "mllp" else msg + b"\r\n")
+            if len(batch) >= batch_size:
+                f.write(b"".join(batch))
+                written += len(batch)
+                batch.clear()
+        if batch:
+            f.write(b"".join(batch))
+            written += len(batch)
+    return written
+
+
+def send_messages(messages, host, port, timeout=10.0, spool_root=None, batch_size=1024, rate_limit=None,
+                  max_pending=16 * 1024):
+    """Encola los mensajes en la cola store-and-forward del destino y la drena hasta vaciarla.
+
+    La cola admite como mucho `max_pending` mensajes: si el destino (o el
+    límite de ritmo) va más lento, la generación se detiene hasta que haya sitio.
+    """
+    from outbound_queue import OutboundQueue, QueueDrainer, spool_dir_for
+
+    spool_root = spool_root or os.path.join(os.getcwd(), "spool")
+    queue = OutboundQueue(spool_dir_for(spool_root, host, port), max_pending=max_pending)
+    drainer = QueueDrainer(queue, host, port, timeout, rate_limiter=RateLimiter.from_dict(rate_limit))
+    drainer.start()
+    batch = []
+    for msg in messages:
+        batch.append(msg)
+        if len(batch) >= batch_size:
+            queue.enqueue_many(batch)
+            batch = []
+    if batch:
+        queue.enqueue_many(batch)
+    while len(queue):
+        time.sleep(0.1)
+    drainer.stop()
+    drainer.join()
+    queue.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic HL7 message generator")
+    parser.add_argument("message_type", help="MSH-9, e.g. ADT^A01 or ORU^R01")
+    parser.add_argument("--version", default="2.5")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--obx", type=int, default=5, help="OBX repetitions per message")
+    parser.add_argument("--base64", type=int, default=0, help="size of an embedded base64 OBX (bytes)")
+    parser.add_argument("--optional-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--framing", choices=["mllp", "lines"], default="mllp")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--send", metavar="HOST:PORT", help="send through the store-and-forward queue")
+    add_rate_arguments(parser)
+    args = parser.parse_args(argv)
+
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    generator = MessageGenerator(HL7DefinitionManager(base_path), args.message_type, args.version,
+                                 obx_count=args.obx, base64_size=args.base64,
+                                 optional_ratio=args.optional_ratio, seed=args.seed)
+    messages = generator.generate(args.count)
+    start = time.perf_counter()
+    if args.send:
+        host, _, port = args.send.rpartition(":")
+        send_messages(messages, host, int(port), rate_limit=rate_limit_from_args(args))
+    elif args.output:
+        write_messages(messages, args.output, args.framing)
+    else:
+        out = sys.stdout.buffer
+        for msg in messages:
+            out.write(wrap(msg) if args.framing == "mllp" else msg + b"\r\n")
+    elapsed = time.perf_counter() - start
+    print(f"{args.count} messages in {elapsed:.2f} s ({args.count / max(elapsed, 1e-9):,.0f} msg/s)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,740 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Pruebas de carga descritas en un escenario: fases con rampas de ritmo, varias conexiones y mezcla de mensajes.
+
+Un escenario (JSON, o YAML si está instalado PyYAML) indica el destino, el
+número de conexiones, la mezcla de mensajes sintéticos de `hl7_generator` y
+una secuencia de fases con ritmo constante (`rate`) o rampa lineal
+(`from` → `to`, en mensajes/s):
+
+    name: rampa-qa
+    target: {profile: QA}
+    connections: 8
+    window: 16
+    mix:
+      - {type: ADT^A08, weight: 70}
+      - {type: ORU^R01, weight: 30, size: 20KB}
+    phases:
+      - {name: rampa, duration: 5m, from: 10, to: 500}
+      - {name: sostenido, duration: 30m, rate: 500}
+
+Cada conexión es una corrutina de asyncio que envía su parte del calendario
+común: el mensaje k sale en el instante en que la integral del ritmo de la
+fase llega a k, y los mensajes se reparten por turnos entre las conexiones,
+con `window` como máximo pendientes de ACK en cada una. La latencia se mide
+desde el instante programado, no desde el envío real: si la ventana o el
+destino retrasan los envíos, el retraso aparece en la latencia en lugar de
+ocultarse. Por fase se recogen un histograma logarítmico de latencias y los
+errores por tipo (AE, AR, timeout, conexión...).
+
+Uso:
+    python hl7_loadtest.py escenario.yaml
+    python hl7_loadtest.py escenario.json --dest 127.0.0.1:2575 --report informe.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import socket
+import ssl
+import sys
+from collections import namedtuple
+
+from ack_tracker import STATUS_ACCEPT, classify
+from app_config import SETTINGS_FILE, load_profiles
+from hl7_definitions import HL7DefinitionManager
+from hl7_generator import MessageGenerator
+from hl7_parser import parse_ack
+from hl7_pipeline import control_id_of, destination_from_profile, parse_destination
+from mllp import MLLPDecoder, MLLPFramingError, RECV_SIZE, TLSConfig, wrap
+
+Phase = namedtuple("Phase", "name duration rate_from rate_to")
+MixEntry = namedtuple("MixEntry", "message_type weight size obx version")
+Scenario = namedtuple("Scenario", "name target connections window timeout seed mix phases")
+
+DEFAULT_VERSION = "2.5"
+DEFAULT_WINDOW = 16
+DEFAULT_OBX = 5
+RECONNECT_DELAY = 1.0
+PROGRESS_INTERVAL = 5.0
+# Envíos con más retraso que esto respecto a su instante programado cuentan como tardíos
+LATE_THRESHOLD = 0.01
+
+# Histograma: cubos logarítmicos desde 10 µs con 8 cubos por octava (~9 % de error)
+HISTOGRAM_MIN = 1e-5
+HISTOGRAM_STEPS = 8
+# Límites (s) del histograma resumido del informe
+REPORT_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Tipos de error además de los códigos MSA-1 distintos de AA/CA
+ERROR_TIMEOUT = "timeout"
+ERROR_CONNECTION = "connection"
+ERROR_FRAMING = "framing"
+ERROR_UNSENT = "unsent"
+ERROR_NO_MSA = "no_msa"
+
+_DURATION_RE = re.compile(r"\s*(\d+(?:\.\d*)?)\s*(ms|s|m|h)?\s*\Z", re.IGNORECASE)
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+_SIZE_RE = re.compile(r"\s*(\d+(?:\.\d*)?)\s*(b|kb|mb)?\s*\Z", re.IGNORECASE)
+_SIZE_UNITS = {"b": 1, "kb": 1024, "mb": 1024 * 1024}
+
+
+# --- Escenarios ---
+
+def parse_duration(value):
+    """Segundos a partir de un número o de un texto como '90', '30s', '5m' o '1.5h'."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _DURATION_RE.match(str(value))
+    if match is None:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[(match.group(2) or "s").lower()]
+
+
+def parse_size(value):
+    """Bytes a partir de un número o de un texto como '512', '20KB' o '1MB'."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    match = _SIZE_RE.match(str(value))
+    if match is None:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[(match.group(2) or "b").lower()])
+
+
+def _number(data, key, default, minimum, context):
+    value = data.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{context}: {key!r} must be a number")
+    if value < minimum:
+        raise ValueError(f"{context}: {key!r} must be at least {minimum}")
+    return value
+
+
+def _parse_phase(index, data):
+    context = f"phase {index + 1}"
+    if not isinstance(data, dict):
+        raise ValueError(f"{context}: expected an object")
+    name = str(data.get("name") or context)
+    if "duration" not in data:
+        raise ValueError(f"{context}: 'duration' is required")
+    duration = parse_duration(data["duration"])
+    if duration <= 0:
+        raise ValueError(f"{context}: 'duration' must be positive")
+    if "rate" in data:
+        rate_from = rate_to = _number(data, "rate", 0, 0, context)
+    elif "from" in data and "to" in data:
+        rate_from = _number(data, "from", 0, 0, context)
+        rate_to = _number(data, "to", 0, 0, context)
+    else:
+        raise ValueError(f"{context}: expected 'rate' or 'from' and 'to'")
+    return Phase(name, duration, rate_from, rate_to)
+
+
+def _parse_mix_entry(index, data, version):
+    context = f"mix entry {index + 1}"
+    if isinstance(data, str):
+        data = {"type": data}
+    if not isinstance(data, dict) or not data.get("type"):
+        raise ValueError(f"{context}: 'type' is required")
+    weight = _number(data, "weight", 1, 0, context)
+    if weight <= 0:
+        raise ValueError(f"{context}: 'weight' must be positive")
+    return MixEntry(str(data["type"]), weight, parse_size(data.get("size", 0)),
+                    int(_number(data, "obx", DEFAULT_OBX, 0, context)), str(data.get("version") or version))
+
+
+def parse_scenario(data):
+    """Valida un escenario ya leído (dict) y lo convierte en un Scenario."""
+    if not isinstance(data, dict):
+        raise ValueError("The scenario must be an object")
+    phases = data.get("phases")
+    if not phases or not isinstance(phases, list):
+        raise ValueError("The scenario needs a non-empty 'phases' list")
+    version = str(data.get("version") or DEFAULT_VERSION)
+    mix = data.get("mix") or [{"type": "ADT^A01"}]
+    if not isinstance(mix, list):
+        raise ValueError("'mix' must be a list")
+    target = data.get("target")
+    if isinstance(target, str):
+        target = {"dest": target}
+    elif target is not None and not isinstance(target, dict):
+        raise ValueError("'target' must be 'host:port' or an object with 'profile' or 'host' and 'port'")
+    timeout = data.get("timeout")
+    return Scenario(
+        name=str(data.get("name") or "scenario"),
+        target=target,
+        connections=int(_number(data, "connections", 1, 1, "scenario")),
+        window=int(_number(data, "window", DEFAULT_WINDOW, 1, "scenario")),
+        timeout=parse_duration(timeout) if timeout is not None else None,
+        seed=data.get("seed"),
+        mix=[_parse_mix_entry(i, entry, version) for i, entry in enumerate(mix)],
+        phases=[_parse_phase(i, phase) for i, phase in enumerate(phases)],
+    )
+
+
+def load_scenario(path):
+    """Lee un escenario JSON o YAML (.yaml/.yml, requiere PyYAML)."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required to read YAML scenarios (pip install pyyaml)")
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid YAML in {path}: {e}")
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in {path}: {e}")
+    return parse_scenario(data)
+
+
+def resolve_target(target, settings=SETTINGS_FILE, timeout=10.0):
+    """Destino (como en hl7_pipeline) a partir del 'target' del escenario."""
+    if not target:
+        raise ValueError("No target: set 'target' in the scenario or use --profile/--dest")
+    if target.get("profile"):
+        name = target["profile"]
+        profiles = load_profiles(settings)
+        if name not in profiles:
+            raise ValueError(f"Unknown profile: {name}")
+        return destination_from_profile(name, profiles[name])
+    if target.get("dest"):
+        return parse_destination(target["dest"], timeout)
+    if target.get("host") and target.get("port"):
+        return parse_destination(f"{target['host']}:{target['port']}", timeout)
+    raise ValueError("'target' needs 'profile', 'dest' or 'host' and 'port'")
+
+
+# --- Calendario ---
+
+def phase_count(phase):
+    """Mensajes de una fase: la integral de su ritmo."""
+    return int((phase.rate_from + phase.rate_to) * phase.duration / 2 + 1e-9)
+
+
+def phase_offset(phase, k):
+    """Instante (s desde el inicio de la fase) en que sale el mensaje k de la fase.
+
+    Con un ritmo r(t) = a + (b - a)·t/T el número de mensajes enviados hasta t
+    es a·t + (b - a)·t²/2T; se despeja t para que valga k.
+    """
+    a = phase.rate_from
+    slope = (phase.rate_to - a) / phase.duration
+    if slope == 0:
+        return k / a
+    return (math.sqrt(max(0.0, a * a + 2 * slope * k)) - a) / slope
+
+
+def phase_rate(phase, offset):
+    """Ritmo objetivo (mensajes/s) a `offset` segundos del inicio de la fase."""
+    return phase.rate_from + (phase.rate_to - phase.rate_from) * min(offset, phase.duration) / phase.duration
+
+
+def schedule(phases, connection=0, connections=1):
+    """Itera (índice de fase, instante) de los mensajes que tocan a una conexión, por turnos."""
+    start = 0.0
+    base = 0
+    for index, phase in enumerate(phases):
+        count = phase_count(phase)
+        for k in range((connection - base) % connections, count, connections):
+            yield index, start + phase_offset(phase, k)
+        start += phase.duration
+        base += count
+
+
+# --- Mensajes ---
+
+class MessageMix:
+    """Elige cada mensaje según los pesos de la mezcla y lo genera con `MessageGenerator`."""
+
+    def __init__(self, def_manager, entries, seed=None):
+        self.entries = entries
+        self.rng = random.Random(seed)
+        self.weights = []
+        self.streams = []
+        total = 0.0
+        for i, entry in enumerate(entries):
+            entry_seed = None if seed is None else seed + i
+            prefix = f"LT{i + 1}_"
+            generator = MessageGenerator(def_manager, entry.message_type, entry.version,
+                                         obx_count=entry.obx, seed=entry_seed, control_id_prefix=prefix)
+            if entry.size:
+                # El tamaño pedido se completa con una observación en base64 (OBX de tipo ED)
+                base = len(next(generator.generate(1)))
+                if entry.size > base:
+                    generator = MessageGenerator(def_manager, entry.message_type, entry.version,
+                                                 obx_count=entry.obx, base64_size=entry.size - base,
+                                                 seed=entry_seed, control_id_prefix=prefix)
+                    if len(next(generator.generate(1))) < entry.size * 0.9:
+                        raise ValueError(f"{entry.message_type} has no OBX segment to reach {entry.size} bytes")
+            total += entry.weight
+            self.weights.append(total)
+            self.streams.append(generator.generate())
+
+    def next_message(self):
+        point = self.rng.random() * self.weights[-1]
+        for weight, stream in zip(self.weights, self.streams):
+            if point < weight:
+                return next(stream)
+        return next(self.streams[-1])
+
+
+# --- Métricas ---
+
+class LatencyHistogram:
+    """Histograma logarítmico de latencias con memoria constante."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds > HISTOGRAM_MIN:
+            index = int(math.log2(seconds / HISTOGRAM_MIN) * HISTOGRAM_STEPS)
+        else:
+            index = 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def upper(index):
+        return HISTOGRAM_MIN * 2 ** ((index + 1) / HISTOGRAM_STEPS)
+
+    def percentile(self, fraction):
+        """Límite superior del cubo que contiene el percentil (nunca mayor que el máximo observado)."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.upper(index), self.max)
+        return self.max
+
+    def summary_buckets(self, edges=REPORT_EDGES):
+        """Recuentos por los límites del informe; el último cubo acumula lo que supera el mayor."""
+        counts = [0] * (len(edges) + 1)
+        for index, count in self.buckets.items():
+            # Centro geométrico del cubo
+            value = HISTOGRAM_MIN * 2 ** ((index + 0.5) / HISTOGRAM_STEPS)
+            slot = 0
+            while slot < len(edges) and value > edges[slot]:
+                slot += 1
+            counts[slot] += count
+        return counts
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "percentiles": {f"p{fraction * 100:g}": self.percentile(fraction) for fraction in PERCENTILES},
+            "buckets": {f"<={edge:g}s" if i < len(REPORT_EDGES) else f">{REPORT_EDGES[-1]:g}s": count
+                        for i, (edge, count) in enumerate(zip(REPORT_EDGES + (None,), self.summary_buckets()))},
+        }
+
+
+class PhaseStats:
+    """Contadores de una fase (sólo los modifica el bucle de asyncio)."""
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.scheduled = phase_count(phase)
+        self.sent = 0
+        self.bytes = 0
+        self.acks = {}
+        self.errors = {}
+        self.latency = LatencyHistogram()
+        self.late = 0
+        self.lag_max = 0.0
+
+    def error(self, kind, count=1):
+        self.errors[kind] = self.errors.get(kind, 0) + count
+
+    @property
+    def failed(self):
+        return sum(self.errors.values())
+
+    def to_dict(self):
+        phase = self.phase
+        return {
+            "name": phase.name,
+            "duration": phase.duration,
+            "rate_from": phase.rate_from,
+            "rate_to": phase.rate_to,
+            "scheduled": self.scheduled,
+            "sent": self.sent,
+            "bytes": self.bytes,
+            "rate": self.sent / phase.duration,
+            "acks": dict(self.acks),
+            "errors": dict(self.errors),
+            "failed": self.failed,
+            "late": self.late,
+            "lag_max": self.lag_max,
+            "latency": self.latency.to_dict(),
+        }
+
+
+# --- Envío ---
+
+class _Connection:
+    """Una conexión MLLP del escenario: envía su parte del calendario y correlaciona los ACK por MSA-2."""
+
+    def __init__(self, test, index):
+        self.test = test
+        self.index = index
+        self.writer = None
+        self.receiver = None
+        # MSH-10 → (instante programado, instante de envío, índice de fase), en orden de envío
+        self.inflight = {}
+        # Se activa cada vez que se libera hueco en la ventana
+        self.space = asyncio.Event()
+        self.retry_at = 0.0
+
+    async def connect(self):
+        test = self.test
+        loop = asyncio.get_running_loop()
+        destination = test.destination
+        host = destination["host"]
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, destination["port"], ssl=test.ssl_context,
+                                        server_hostname=(test.server_name or host) if test.ssl_context else None),
+                test.timeout)
+        except (OSError, asyncio.TimeoutError):
+            test.connect_errors += 1
+            self.retry_at = loop.time() + RECONNECT_DELAY
+            return False
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer = writer
+        self.receiver = asyncio.create_task(self._receive(reader))
+        return True
+
+    def _drop(self, kind):
+        """Cierra la conexión y cuenta como fallidos los mensajes pendientes."""
+        for _, _, phase_index in self.inflight.values():
+            self.test.phases[phase_index].error(kind)
+        self.inflight.clear()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.receiver is not None and self.receiver is not asyncio.current_task():
+            self.receiver.cancel()
+        self.receiver = None
+        self.space.set()
+
+    def _expire(self, now):
+        timeout = self.test.timeout
+        inflight = self.inflight
+        phases = self.test.phases
+        while inflight:
+            control_id, (_, sent, phase_index) = next(iter(inflight.items()))
+            if sent + timeout > now:
+                break
+            del inflight[control_id]
+            phases[phase_index].error(ERROR_TIMEOUT)
+        self.space.set()
+
+    def _acknowledge(self, frame, now):
+        test = self.test
+        code, control_id, _ = parse_ack(frame)
+        entry = self.inflight.pop(control_id, None)
+        if entry is None:
+            # ACK de un mensaje ya dado por perdido (timeout) o sin MSA-2 reconocible
+            test.unmatched += 1
+            return
+        scheduled, _, phase_index = entry
+        stats = test.phases[phase_index]
+        stats.latency.add(now - scheduled)
+        label = code.decode("ascii", errors="replace") or ERROR_NO_MSA
+        stats.acks[label] = stats.acks.get(label, 0) + 1
+        if classify(code) != STATUS_ACCEPT:
+            stats.error(label)
+        self.space.set()
+
+    async def _receive(self, reader):
+        loop = asyncio.get_running_loop()
+        timeout = self.test.timeout
+        decoder = MLLPDecoder()
+        try:
+            while True:
+                wait = timeout
+                if self.inflight:
+                    oldest = next(iter(self.inflight.values()))
+                    wait = max(0.0, oldest[1] + timeout - loop.time())
+                try:
+                    data = await asyncio.wait_for(reader.read(RECV_SIZE), wait)
+                except asyncio.TimeoutError:
+                    self._expire(loop.time())
+                    continue
+                if not data:
+                    raise ConnectionResetError("Connection closed by peer")
+                now = loop.time()
+                for frame in decoder.feed(data):
+                    self._acknowledge(frame, now)
+                if decoder.has_garbage():
+                    raise MLLPFramingError(bytes(decoder.buffer[:256]))
+        except MLLPFramingError:
+            self._drop(ERROR_FRAMING)
+        except (OSError, asyncio.IncompleteReadError):
+            self._drop(ERROR_CONNECTION)
+
+    async def run(self, start):
+        test = self.test
+        loop = asyncio.get_running_loop()
+        window = test.scenario.window
+        expect_ack = test.expect_ack
+        for phase_index, offset in schedule(test.scenario.phases, self.index, test.scenario.connections):
+            due = start + offset
+            # sleep(0) también cede el turno cuando se va con retraso
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            stats = test.phases[phase_index]
+            if self.writer is None and (loop.time() < self.retry_at or not await self.connect()):
+                stats.error(ERROR_UNSENT)
+                continue
+            while len(self.inflight) >= window and self.writer is not None:
+                self.space.clear()
+                await self.space.wait()
+            if self.writer is None:
+                stats.error(ERROR_UNSENT)
+                continue
+            message = test.mix.next_message()
+            now = loop.time()
+            lag = now - due
+            if lag > LATE_THRESHOLD:
+                stats.late += 1
+            if lag > stats.lag_max:
+                stats.lag_max = lag
+            if expect_ack:
+                self.inflight[control_id_of(message)] = (due, now, phase_index)
+            stats.sent += 1
+            stats.bytes += len(message)
+            self.writer.write(wrap(message))
+            try:
+                await self.writer.drain()
+            except OSError:
+                self._drop(ERROR_CONNECTION)
+        # Esperar los ACK pendientes (los timeouts garantizan que la espera termina)
+        while self.inflight and self.writer is not None:
+            self.space.clear()
+            await self.space.wait()
+        if self.writer is not None:
+            self._drop(ERROR_CONNECTION)
+
+
+class LoadTest:
+    """Ejecuta un escenario contra un destino (dict de `hl7_pipeline`) y acumula las métricas por fase.
+
+    `on_progress(progress)` se llama cada `progress_interval` segundos con un
+    dict con la fase actual, el ritmo objetivo y el conseguido.
+    """
+
+    def __init__(self, scenario, destination, def_manager, on_progress=None, progress_interval=PROGRESS_INTERVAL):
+        self.scenario = scenario
+        self.destination = destination
+        self.timeout = scenario.timeout or destination.get("timeout") or 10.0
+        self.expect_ack = destination.get("expect_ack", True)
+        tls = TLSConfig.from_dict(destination.get("tls", {}))
+        self.ssl_context = tls.context() if tls.enabled else None
+        self.server_name = tls.server_name
+        self.mix = MessageMix(def_manager, scenario.mix, scenario.seed)
+        self.phases = [PhaseStats(phase) for phase in scenario.phases]
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.connections = []
+        self.connect_errors = 0
+        self.unmatched = 0
+        self.elapsed = 0.0
+
+    @property
+    def duration(self):
+        return sum(phase.duration for phase in self.scenario.phases)
+
+    def current_phase(self, offset):
+        """(índice de fase, segundos desde su inicio) para un instante del escenario."""
+        for index, phase in enumerate(self.scenario.phases):
+            if offset < phase.duration or index == len(self.scenario.phases) - 1:
+                return index, offset
+            offset -= phase.duration
+
+    def progress(self, offset, sent_before, interval):
+        index, within = self.current_phase(offset)
+        sent = sum(stats.sent for stats in self.phases)
+        return {
+            "elapsed": offset,
+            "phase": self.scenario.phases[index].name,
+            "target_rate": phase_rate(self.scenario.phases[index], within),
+            "rate": (sent - sent_before) / interval if interval else 0.0,
+            "sent": sent,
+            "failed": sum(stats.failed for stats in self.phases),
+            "inflight": sum(len(connection.inflight) for connection in self.connections),
+            "p99": self.phases[index].latency.percentile(0.99),
+        }
+
+    async def _report_progress(self, start):
+        loop = asyncio.get_running_loop()
+        sent_before = 0
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            progress = self.progress(loop.time() - start, sent_before, self.progress_interval)
+            sent_before = progress["sent"]
+            self.on_progress(progress)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self.connections = [_Connection(self, i) for i in range(self.scenario.connections)]
+        # Abrir las conexiones antes de empezar para que el primer envío no pague el handshake
+        await asyncio.gather(*(connection.connect() for connection in self.connections))
+        start = loop.time()
+        reporter = asyncio.create_task(self._report_progress(start)) if self.on_progress else None
+        try:
+            await asyncio.gather(*(connection.run(start) for connection in self.connections))
+        finally:
+            self.elapsed = loop.time() - start
+            if reporter is not None:
+                reporter.cancel()
+            for connection in self.connections:
+                if connection.writer is not None:
+                    connection._drop(ERROR_CONNECTION)
+
+    def run(self):
+        asyncio.run(self._run())
+        return self.report()
+
+    def report(self):
+        phases = [stats.to_dict() for stats in self.phases]
+        return {
+            "scenario": self.scenario.name,
+            "target": f"{self.destination['host']}:{self.destination['port']}",
+            "connections": self.scenario.connections,
+            "window": self.scenario.window,
+            "elapsed": self.elapsed,
+            "sent": sum(p["sent"] for p in phases),
+            "failed": sum(p["failed"] for p in phases),
+            "connect_errors": self.connect_errors,
+            "unmatched_acks": self.unmatched,
+            "phases": phases,
+        }
+
+
+# --- Informe ---
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}"
+
+
+def format_report(report):
+    """Resumen en texto: una línea por fase, errores e histograma resumido."""
+    lines = [f"Scenario {report['scenario']} -> {report['target']}: {report['connections']} connections, "
+             f"window {report['window']}, {report['elapsed']:.1f} s",
+             f"{report['sent']} sent, {report['failed']} failed, {report['connect_errors']} connection attempts "
+             f"failed, {report['unmatched_acks']} unmatched ACKs", ""]
+    header = (f"{'phase':<16} {'target/s':>11} {'rate/s':>8} {'sent':>9} {'failed':>7} {'p50 ms':>8} "
+              f"{'p90 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8} {'lag max':>8}")
+    lines.append(header)
+    for phase in report["phases"]:
+        latency = phase["latency"]
+        percentiles = latency["percentiles"]
+        target = (f"{phase['rate_from']:g}" if phase["rate_from"] == phase["rate_to"]
+                  else f"{phase['rate_from']:g}-{phase['rate_to']:g}")
+        lines.append(f"{phase['name'][:16]:<16} {target:>11} {phase['rate']:>8.1f} {phase['sent']:>9} "
+                     f"{phase['failed']:>7} {_ms(percentiles['p50']):>8} {_ms(percentiles['p90']):>8} "
+                     f"{_ms(percentiles['p99']):>8} {_ms(percentiles['p99.9']):>9} {_ms(latency['max']):>8} "
+                     f"{_ms(phase['lag_max']):>8}")
+    for phase in report["phases"]:
+        lines.append("")
+        lines.append(f"[{phase['name']}] ACK {phase['acks'] or '-'}, errors {phase['errors'] or '-'}, "
+                     f"{phase['late']} late sends")
+        counts = phase["latency"]["buckets"]
+        peak = max(counts.values()) if counts else 0
+        if not peak:
+            continue
+        for label, count in counts.items():
+            if count:
+                bar = "#" * max(1, round(40 * count / peak))
+                lines.append(f"  {label:>8} {count:>9} {bar}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a declarative HL7 load-test scenario (JSON or YAML)")
+    parser.add_argument("scenario", help="scenario file (.json, or .yaml/.yml with PyYAML)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--profile", help="saved connection profile (overrides the scenario target)")
+    target.add_argument("--dest", help="destination host:port (overrides the scenario target)")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file with the profiles")
+    parser.add_argument("--report", help="write the full report as JSON to this file")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help="seconds between progress lines on stderr (0 = none)")
+    args = parser.parse_args(argv)
+
+    try:
+        scenario = load_scenario(args.scenario)
+        target = scenario.target
+        if args.profile:
+            target = {"profile": args.profile}
+        elif args.dest:
+            target = {"dest": args.dest}
+        destination = resolve_target(target, args.settings, scenario.timeout or 10.0)
+        def_manager = HL7DefinitionManager(os.path.dirname(os.path.abspath(__file__)),
+                                           destination.get("definitions", []))
+        def show(progress):
+            print(f"{progress['elapsed']:7.1f} s  {progress['phase']}: target {progress['target_rate']:.0f}/s, "
+                  f"sent {progress['rate']:.0f}/s, {progress['sent']} sent, {progress['failed']} failed, "
+                  f"{progress['inflight']} in flight, p99 {_ms(progress['p99'])} ms", file=sys.stderr)
+        test = LoadTest(scenario, destination, def_manager, show if args.progress_interval > 0 else None,
+                        args.progress_interval)
+    except (OSError, ValueError, ssl.SSLError) as e:
+        parser.error(str(e))
+
+    total = sum(stats.scheduled for stats in test.phases)
+    print(f"Scenario {scenario.name}: {len(scenario.phases)} phases, {test.duration:.0f} s, {total} messages "
+          f"to {destination['host']}:{destination['port']}", file=sys.stderr)
+    try:
+        report = test.run()
+    except KeyboardInterrupt:
+        print("Interrupted: partial report", file=sys.stderr)
+        report = test.report()
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
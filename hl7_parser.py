@@ -0,0 +1,255 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Parser HL7 ligero basado en offsets de delimitadores (sin dependencias de Qt)."""
+
+import mmap
+import re
+from collections import namedtuple
+
+# Delimitadores de un mensaje HL7 (todos como bytes de longitud 1)
+Delimiters = namedtuple("Delimiters", "field component repetition escape subcomponent")
+
+DEFAULT_DELIMITERS = Delimiters(b"|", b"^", b"~", b"\\", b"&")
+
+# Un segmento es cualquier secuencia de bytes entre terminadores \r o \n
+_SEGMENT_RE = re.compile(rb"[^\r\n]+")
+
+
+def detect_delimiters(data):
+    """Obtiene los delimitadores declarados en MSH-1/MSH-2 o los valores por defecto."""
+    start = data.find(b"MSH")
+    if start < 0 or len(data) < start + 4:
+        return DEFAULT_DELIMITERS
+    field = data[start + 3:start + 4]
+    end = data.find(field, start + 4)
+    if end < 0:
+        return DEFAULT_DELIMITERS
+    encoding_chars = data[start + 4:end]
+    defaults = DEFAULT_DELIMITERS
+    chars = [encoding_chars[i:i + 1] for i in range(len(encoding_chars))]
+    return Delimiters(
+        field,
+        chars[0] if len(chars) > 0 else defaults.component,
+        chars[1] if len(chars) > 1 else defaults.repetition,
+        chars[2] if len(chars) > 2 else defaults.escape,
+        chars[3] if len(chars) > 3 else defaults.subcomponent,
+    )
+
+
+def get_field(segment, index, delimiters=DEFAULT_DELIMITERS):
+    """Devuelve el campo `index` (1-based, numeración HL7) de un segmento sin dividirlo entero."""
+    sep = delimiters.field
+    is_msh = segment[:3] == b"MSH"
+    if is_msh:
+        if index == 1:
+            return sep
+        # MSH-2 es el primer elemento tras el nombre: desplazar un índice
+        index -= 1
+    pos = 3
+    for _ in range(index - 1):
+        pos = segment.find(sep, pos + 1)
+        if pos < 0:
+            return b""
+    if pos >= len(segment) or segment[pos:pos + 1] != sep:
+        return b""
+    end = segment.find(sep, pos + 1)
+    return segment[pos + 1:] if end < 0 else segment[pos + 1:end]
+
+
+def get_component(value, index, separator):
+    """Devuelve el componente `index` (1-based) de un valor."""
+    pos = 0
+    for _ in range(index - 1):
+        pos = value.find(separator, pos)
+        if pos < 0:
+            return value[:0]
+        pos += 1
+    end = value.find(separator, pos)
+    return value[pos:] if end < 0 else value[pos:end]
+
+
+class LazyMessage:
+    """Mensaje HL7 sobre bytes con un índice perezoso de offsets de segmentos.
+
+    Los segmentos sólo se localizan (nunca se copian ni se dividen) hasta que se
+    accede a un campo concreto.
+    """
+
+    __slots__ = ("data", "delimiters", "_index")
+
+    def __init__(self, data, delimiters=None):
+        self.data = data
+        self.delimiters = delimiters or detect_delimiters(data)
+        self._index = None
+
+    @property
+    def index(self):
+        """Lista de tuplas (nombre, inicio, fin) de cada segmento."""
+        if self._index is None:
+            data = self.data
+            self._index = [(data[m.start():m.start() + 3], m.start(), m.end())
+                           for m in _SEGMENT_RE.finditer(data)]
+        return self._index
+
+    def find_segments(self, name):
+        """Itera (inicio, fin) de los segmentos `name` buscando directamente su nombre.
+
+        No construye el índice completo: los segmentos que no interesan ni
+        siquiera se delimitan.
+        """
+        data = self.data
+        has_cr = data.find(b"\r") >= 0
+        if has_cr and data.find(b"\n") >= 0:
+            # Terminadores mezclados (\r\n): recurrir al índice completo
+            for seg_name, start, end in self.index:
+                if seg_name == name:
+                    yield start, end
+            return
+        term = b"\r" if has_cr else b"\n"
+        needle = term + name
+        size = len(name)
+        pos = 0 if data[:size] == name else data.find(needle)
+        if pos > 0:
+            pos += 1
+        while pos >= 0:
+            end = data.find(term, pos)
+            if end < 0:
+                end = len(data)
+            if data[pos + size:pos + size + 1] == self.delimiters.field or pos + size == end:
+                yield pos, end
+            nxt = data.find(needle, end)
+            pos = nxt + 1 if nxt >= 0 else -1
+
+    def segment_names(self):
+        return [name for name, _, _ in self.index]
+
+    def segments(self, name=None):
+        """Itera los segmentos (bytes), opcionalmente filtrando por nombre."""
+        data = self.data
+        for seg_name, start, end in self.index:
+            if name is None or seg_name == name:
+                yield data[start:end]
+
+    def segment(self, name, occurrence=0):
+        """Devuelve la ocurrencia `occurrence` (0-based) del segmento o None."""
+        for i, seg in enumerate(self.segments(name)):
+            if i == occurrence:
+                return seg
+        return None
+
+    def field(self, name, index, occurrence=0):
+        seg = self.segment(name, occurrence)
+        if seg is None:
+            return b""
+        return get_field(seg, index, self.delimiters)
+
+    @property
+    def control_id(self):
+        """MSH-10 (Message Control ID)."""
+        return self.field(b"MSH", 10)
+
+    @property
+    def message_type(self):
+        """MSH-9 (Message Type), p.ej. b'ORU^R01'."""
+        return self.field(b"MSH", 9)
+
+    @property
+    def version(self):
+        """MSH-12 (Version ID), sólo el primer componente."""
+        return get_component(self.field(b"MSH", 12), 1, self.delimiters.component)
+
+
+def parse_ack(payload):
+    """Extrae (código MSA-1, MSA-2, MSA-3) de un ACK. Devuelve bytes vacíos si falta MSA."""
+    msg = LazyMessage(payload)
+    msa = msg.segment(b"MSA")
+    if msa is None:
+        return b"", b"", b""
+    delims = msg.delimiters
+    return get_field(msa, 1, delims), get_field(msa, 2, delims), get_field(msa, 3, delims)
+
+
+# Inicio de mensaje en ficheros sin framing: "MSH" al principio de una línea
+_MESSAGE_START_RE = re.compile(rb"(?:\A|(?<=[\r\n]))MSH")
+_VT = b"\x0b"
+_FS = b"\x1c"
+
+
+def open_mapped(path):
+    """Abre un fichero como mmap de sólo lectura (None si está vacío)."""
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+
+def is_mllp_framed(data):
+    """Indica si el contenido usa framing MLLP (VT ... FS CR), como el dead-letter de la cola."""
+    head = bytes(data[:64]).lstrip(b" \t\r\n")
+    return head[:1] == _VT
+
+
+def iter_message_spans(data, start=0, end=None, framed=None):
+    """Itera (inicio, fin) de los mensajes cuyo comienzo está en [start, end).
+
+    Funciona sobre bytes o mmap sin copiar el contenido, por lo que un fichero
+    grande puede repartirse en rangos entre varios procesos.
+    """
+    if end is None:
+        end = len(data)
+    if framed is None:
+        framed = is_mllp_framed(data)
+    if framed:
+        pos = data.find(_VT, start)
+        while 0 <= pos < end:
+            stop = data.find(_FS, pos + 1)
+            if stop < 0:
+                stop = len(data)
+            yield pos + 1, stop
+            pos = data.find(_VT, stop)
+        return
+    prev = None
+    for m in _MESSAGE_START_RE.finditer(data, start):
+        if prev is not None:
+            yield prev, m.start()
+        if m.start() >= end:
+            return
+        prev = m.start()
+    if prev is not None:
+        yield prev, len(data)
+
+
+def iter_messages(data, start=0, end=None, framed=None):
+    """Itera los mensajes (bytes sin terminadores finales) de un contenido completo."""
+    for msg_start, msg_end in iter_message_spans(data, start, end, framed):
+        yield data[msg_start:msg_end].rstrip(b"\r\n")
+
+
+def iter_message_views(data, start=0, end=None, framed=None):
+    """Como `iter_messages` pero sin copiar: cada mensaje es un memoryview sobre `data`.
+
+    La vista sólo es válida hasta pedir el siguiente mensaje; después se libera
+    para que el mmap pueda cerrarse.
+    """
+    with memoryview(data) as view:
+        for msg_start, msg_end in iter_message_spans(data, start, end, framed):
+            while msg_end > msg_start and data[msg_end - 1] in (0x0D, 0x0A):
+                msg_end -= 1
+            with view[msg_start:msg_end] as message:
+                yield message
+
@@ -0,0 +1,483 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Etapas de envío (lectura, transformación y envío MLLP) conectadas por `shm_ring`.
+
+Cada etapa es una función que se puede ejecutar en su propio proceso y recibe
+los nombres de los buffers de entrada y salida:
+
+    lector (mmap) -> ShmRing -> transformación -> ShmRing -> envío MLLP
+
+El lector copia cada mensaje del mmap al buffer sin pasar por bytes
+intermedios; la transformación y el envío leen memoryview sobre la memoria
+compartida y sólo copian cuando tienen que modificar el mensaje. El envío
+devuelve contadores agregados por una cola de `multiprocessing`.
+
+Uso:
+    python hl7_pipeline.py mensajes.hl7 --dest 127.0.0.1:2575 --rules reglas.json --window 16
+    python hl7_pipeline.py mezcla.hl7 --dest 127.0.0.1:2575 --charset utf-8
+    python hl7_pipeline.py mensajes.hl7 --dest 127.0.0.1:2575 --validate
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from ack_capture import AckCapture, ack_capture_from_args, add_ack_capture_arguments, spool_file
+from ack_tracker import classify, STATUS_ACCEPT
+from app_config import SETTINGS_FILE, load_profiles
+from hl7_charset import ENCODING_AUTO, codec_name, transcode
+from hl7_definitions import HL7DefinitionManager
+from hl7_parser import LazyMessage, iter_message_views, open_mapped, parse_ack
+from hl7_transform import Transformer, load_rules
+from hl7_validate import MessageValidator, format_issue
+from mllp import MLLPClient, MLLPFramingError, TLSConfig
+from rate_control import RateLimiter, add_rate_arguments, rate_limit_from_args
+from shm_ring import DEFAULT_CAPACITY, ShmRing
+
+REPORT_INTERVAL = 1.0
+# Fallos detallados (control_id, código, texto) que se conservan como máximo
+MAX_FAILURES = 1000
+# Bytes iniciales que se copian para leer MSH-10 sin copiar el mensaje entero
+MSH_PEEK = 1024
+
+
+def destination_from_profile(name, profile):
+    """Destino a partir de un perfil guardado por la interfaz."""
+    try:
+        port = int(profile.get("port", ""))
+    except ValueError:
+        raise ValueError(f"Profile {name!r} has no valid port")
+    try:
+        timeout = float(profile.get("timeout") or 10.0)
+    except ValueError:
+        timeout = 10.0
+    encoding = profile.get("encoding", "utf-8")
+    if encoding == ENCODING_AUTO:
+        # Los mensajes se envían tal cual; los valores de las reglas se escriben en UTF-8
+        encoding = "utf-8"
+    return {
+        "name": name,
+        "host": profile.get("ip", ""),
+        "port": port,
+        "timeout": timeout,
+        "encoding": encoding,
+        "expect_ack": profile.get("expect_ack", True),
+        "tls": profile.get("tls", {}),
+        "transforms": profile.get("transforms", []),
+        "rate_limit": profile.get("rate_limit", {}),
+        "definitions": profile.get("definitions", []),
+    }
+
+
+def parse_destination(text, timeout=10.0):
+    """Destino a partir de "host:puerto"."""
+    host, sep, port = text.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid destination (expected host:port): {text!r}")
+    return {"name": text, "host": host, "port": int(port), "timeout": timeout}
+
+
+def control_id_of(data):
+    """MSH-10 de un mensaje (bytes o memoryview) copiando sólo su comienzo."""
+    head = bytes(data[:MSH_PEEK])
+    if len(head) < len(data) and b"\r" not in head and b"\n" not in head:
+        # MSH más largo que el tramo copiado
+        head = bytes(data)
+    return LazyMessage(head).control_id
+
+
+def new_stats():
+    return {"messages": 0, "bytes": 0, "failed": 0, "acks": {}, "failures": [],
+            "batches": 0, "latency_sum": 0.0, "latency_max": 0.0, "acks_spooled": 0,
+            "acks_spool_dropped": 0}
+
+
+def merge_stats(total, delta):
+    for key in ("messages", "bytes", "failed", "batches", "latency_sum", "acks_spooled",
+                "acks_spool_dropped"):
+        total[key] += delta[key]
+    total["latency_max"] = max(total["latency_max"], delta["latency_max"])
+    for code, count in delta["acks"].items():
+        total["acks"][code] = total["acks"].get(code, 0) + count
+    room = MAX_FAILURES - len(total["failures"])
+    if room > 0:
+        total["failures"].extend(delta["failures"][:room])
+
+
+def _report_failure(stats, view, code, text):
+    stats["failed"] += 1
+    if len(stats["failures"]) < MAX_FAILURES:
+        stats["failures"].append((control_id_of(view).decode("latin-1"), code, text))
+
+
+def _put(out, data, stats):
+    """Copia un mensaje al buffer; si no cabe en él lo informa como fallido en lugar de abortar la etapa."""
+    if len(data) > out.max_record():
+        _report_failure(stats, data, "too large",
+                        f"{len(data)} bytes do not fit in the {out.capacity}-byte shared-memory ring")
+        return
+    out.put(data)
+
+
+def read_stage(paths, out_name, results=None):
+    """Etapa lectora: copia los mensajes de los ficheros (mmap) al buffer de salida.
+
+    Los mensajes que no caben en el buffer no se envían: se informan como
+    fallidos en `results`.
+    """
+    out = ShmRing(out_name)
+    stats = new_stats()
+    try:
+        for path in paths:
+            mm = open_mapped(path)
+            if mm is None:
+                continue
+            try:
+                for message in iter_message_views(mm):
+                    _put(out, message, stats)
+            finally:
+                mm.close()
+        if results is not None and stats["failed"]:
+            results.put(("reader", 0, stats, False))
+    finally:
+        # También si la etapa falla: las siguientes vacían el buffer y terminan en lugar de esperar
+        out.close_writer()
+        out.close()
+
+
+def transform_stage(in_name, out_name, rules, encoding="utf-8", charset=None, results=None,
+                    report_interval=REPORT_INTERVAL, definitions=None, overlays=()):
+    """Etapa de transformación: aplica las reglas y reenvía; sin reglas no copia a memoria propia.
+
+    Con `charset` cada mensaje se convierte antes a ese juego de caracteres
+    (detectando el de origen mensaje a mensaje). Con `definitions` (directorio
+    que contiene `reference`) cada mensaje se valida con `hl7_validate`, con
+    las definiciones de los directorios `overlays` superpuestas. Los
+    que no se pueden convertir o no son válidos no se reenvían: se informan
+    como fallidos en `results`.
+    """
+    source = ShmRing(in_name)
+    out = ShmRing(out_name)
+    transformer = Transformer(rules, charset or encoding)
+    validator = MessageValidator(HL7DefinitionManager(definitions, overlays)) if definitions else None
+    stats = new_stats()
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            view = source.read()
+            if view is None:
+                break
+            data = view
+            if charset:
+                result = transcode(view, charset)
+                data = result.data
+                if result.error is not None:
+                    data = None
+                    _report_failure(stats, view, "encoding", result.error)
+            if validator is not None and data is not None:
+                issues = validator.validate_message(data)
+                if issues:
+                    data = None
+                    text = "; ".join(format_issue(path, issue) for path, issue in issues[:3])
+                    if len(issues) > 3:
+                        text += f" (+{len(issues) - 3})"
+                    _report_failure(stats, view, "invalid", text)
+            if data is not None:
+                _put(out, transformer.apply(bytes(data)) if transformer else data, stats)
+            source.release()
+            if results is not None and stats["failed"] and time.monotonic() >= next_report:
+                results.put(("transform", 0, stats, False))
+                stats = new_stats()
+                next_report = time.monotonic() + report_interval
+        if results is not None and stats["failed"]:
+            results.put(("transform", 0, stats, False))
+    finally:
+        out.close_writer()
+        source.close()
+        out.close()
+
+
+class RingSender:
+    """Etapa de envío: consume un buffer, envía en ventanas y acumula contadores.
+
+    Los mensajes se leen como memoryview y sólo se copian si el destino tiene
+    transformaciones; los contadores se entregan a `results` cada
+    `report_interval` segundos como (nombre, shard, contadores, terminado).
+    Con "rate_limit" en el destino cada ventana espera al limitador; mientras
+    tanto el buffer de entrada se llena y frena a la etapa anterior. Con
+    "ack_capture" ({"dir", "sample_every"}) los ACK de error y los muestreados
+    se guardan completos en un fichero por destino y proceso.
+    """
+
+    def __init__(self, destination, shard, results, window):
+        self.name = destination["name"]
+        self.shard = shard
+        self.results = results
+        self.window = max(1, window)
+        self.expect_ack = destination.get("expect_ack", True)
+        tls = TLSConfig.from_dict(destination.get("tls", {}))
+        self.client = MLLPClient(destination["host"], destination["port"], destination.get("timeout", 10.0), tls)
+        self.transformer = Transformer(destination.get("transforms", []), destination.get("encoding", "utf-8"))
+        self.rate_limiter = RateLimiter.from_dict(destination.get("rate_limit"))
+        capture = destination.get("ack_capture")
+        self.capture = None
+        if capture and capture.get("dir"):
+            # Sólo se usa para guardar ACKs: el buffer de resúmenes puede ser mínimo
+            self.capture = AckCapture.from_dict(dict(capture, capacity=capture.get("capacity", 1)),
+                                                spool_file(capture["dir"], self.name, shard))
+        self.stats = new_stats()
+
+    def run(self, ring, report_interval):
+        transformer = self.transformer
+        next_report = time.monotonic() + report_interval
+        finished = False
+        while not finished:
+            batch = []
+            try:
+                while len(batch) < self.window:
+                    # Si ya hay mensajes no se espera a completar la ventana (y no se retiene el buffer)
+                    view = ring.read(timeout=0 if batch else report_interval)
+                    if view is None:
+                        finished = True
+                        break
+                    batch.append(transformer.apply(bytes(view)) if transformer else view)
+            except TimeoutError:
+                pass
+            if batch:
+                self.rate_limiter.acquire(sum(map(len, batch)), len(batch))
+                self._send_batch(batch)
+                ring.release()
+            now = time.monotonic()
+            if finished or now >= next_report:
+                self._report(finished)
+                next_report = now + report_interval
+
+    def _send_batch(self, batch):
+        """Envía los mensajes en pipeline y lee sus ACK en el mismo orden."""
+        control_ids = [control_id_of(m) for m in batch]
+        client = self.client
+        retried = False
+        while batch:
+            reused = client.connected
+            acks = []
+            start = time.perf_counter()
+            try:
+                client.send_many(batch)
+                if self.expect_ack:
+                    for _ in batch:
+                        acks.append(client.receive())
+            except (OSError, MLLPFramingError) as e:
+                client.close()
+                done = len(acks)
+                self._record(batch[:done], control_ids[:done], acks, time.perf_counter() - start)
+                batch, control_ids = batch[done:], control_ids[done:]
+                if reused and not done and not retried:
+                    # El destino pudo cerrar la conexión inactiva: una vez más con una nueva
+                    retried = True
+                    continue
+                self.rate_limiter.observe(time.perf_counter() - start, ok=False)
+                self._fail(control_ids, str(e) or type(e).__name__)
+                return
+            self._record(batch, control_ids, acks, time.perf_counter() - start)
+            return
+
+    def _record(self, batch, control_ids, acks, elapsed):
+        if not batch:
+            return
+        stats = self.stats
+        stats["messages"] += len(batch)
+        stats["bytes"] += sum(map(len, batch))
+        stats["batches"] += 1
+        stats["latency_sum"] += elapsed
+        stats["latency_max"] = max(stats["latency_max"], elapsed)
+        self.rate_limiter.observe(elapsed, count=len(batch))
+        capture = self.capture
+        if capture is not None:
+            spooled, dropped = capture.spooled, capture.spool_dropped
+            for control_id, ack in zip(control_ids, acks):
+                capture.record(control_id, ack, elapsed)
+            stats["acks_spooled"] += capture.spooled - spooled
+            stats["acks_spool_dropped"] += capture.spool_dropped - dropped
+        for control_id, ack in zip(control_ids, acks):
+            code, ack_id, text = parse_ack(ack)
+            key = code.decode("ascii", errors="replace") or "?"
+            stats["acks"][key] = stats["acks"].get(key, 0) + 1
+            if classify(code) != STATUS_ACCEPT or ack_id != control_id:
+                if ack_id != control_id:
+                    text = b"MSA-2 mismatch: " + ack_id
+                stats["failed"] += 1
+                self._failure(control_id, key, text.decode("latin-1"))
+
+    def _fail(self, control_ids, reason):
+        self.stats["failed"] += len(control_ids)
+        for control_id in control_ids:
+            self._failure(control_id, "error", reason)
+
+    def _failure(self, control_id, code, text):
+        failures = self.stats["failures"]
+        if len(failures) < MAX_FAILURES:
+            failures.append((control_id.decode("latin-1"), code, text))
+
+    def _report(self, finished):
+        self.results.put((self.name, self.shard, self.stats, finished))
+        self.stats = new_stats()
+
+    def close(self):
+        self.client.close()
+        if self.capture is not None:
+            self.capture.close()
+
+
+def send_stage(in_name, destination, shard, results, window=1, report_interval=REPORT_INTERVAL):
+    """Etapa de envío MLLP (punto de entrada de su proceso)."""
+    ring = ShmRing(in_name)
+    sender = RingSender(destination, shard, results, window)
+    try:
+        sender.run(ring, report_interval)
+    finally:
+        sender.close()
+        ring.close()
+
+
+def run_pipeline(paths, destination, rules=(), window=1, ring_capacity=DEFAULT_CAPACITY,
+                 report_interval=REPORT_INTERVAL, on_progress=None, charset=None, definitions=None):
+    """Ejecuta lector, transformación y envío en tres procesos y devuelve los contadores totales.
+
+    Con `charset` los mensajes se convierten a ese juego de caracteres antes de las reglas; con
+    `definitions` (directorio que contiene `reference`) los mensajes no válidos no se envían. Los
+    overlays de definiciones son los del destino ("definitions").
+    """
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    # Las reglas se aplican en su propia etapa, no en la de envío
+    destination = dict(destination, transforms=[])
+    rings = []
+    processes = []
+    totals = new_stats()
+    started = time.monotonic()
+    try:
+        for _ in range(2):
+            rings.append(ShmRing(capacity=ring_capacity, create=True))
+        stages = [
+            ("reader", read_stage, (list(paths), rings[0].name, results)),
+            ("transform", transform_stage, (rings[0].name, rings[1].name, list(rules),
+                                            destination.get("encoding", "utf-8"), charset, results,
+                                            report_interval, definitions,
+                                            tuple(destination.get("definitions", ())))),
+            ("sender", send_stage, (rings[1].name, destination, 0, results, window, report_interval)),
+        ]
+        for name, target, args in stages:
+            process = context.Process(target=target, args=args, name=f"hl7-pipeline-{name}", daemon=True)
+            process.start()
+            processes.append(process)
+        finished = False
+        crashed = []
+        while not finished:
+            # Si muere cualquier etapa se detiene todo (las demás podrían quedarse esperándola)
+            crashed = [process for process in processes if process.exitcode]
+            if crashed:
+                for process in crashed:
+                    totals["failures"].append(("", "error", f"{process.name} exited with code {process.exitcode}"))
+                break
+            try:
+                _, _, stats, finished = results.get(timeout=report_interval)
+            except queue.Empty:
+                if not processes[-1].is_alive():
+                    break
+                continue
+            merge_stats(totals, stats)
+            if on_progress is not None:
+                on_progress(totals, time.monotonic() - started)
+        if not crashed:
+            for process in processes:
+                process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for ring in rings:
+            ring.close()
+            ring.unlink()
+    totals["elapsed"] = time.monotonic() - started
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send HL7 files through reader, transform and sender processes")
+    parser.add_argument("files", nargs="+")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--profile", help="saved connection profile (its transforms are applied)")
+    target.add_argument("--dest", help="destination host:port")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file with the profiles")
+    parser.add_argument("--rules", help="JSON file with transform rules (instead of the profile ones)")
+    parser.add_argument("--window", type=int, default=1, help="messages sent before waiting for their ACKs")
+    parser.add_argument("--timeout", type=float, default=10.0, help="timeout for --dest")
+    parser.add_argument("--charset", help="convert every message to this charset (source detected per message)")
+    parser.add_argument("--validate", action="store_true",
+                        help="validate every message against the reference definitions and skip invalid ones")
+    parser.add_argument("--definitions", action="append", metavar="DIR",
+                        help="overlay definition directory for --validate (default: the profile ones)")
+    parser.add_argument("--ring-mb", type=int, default=DEFAULT_CAPACITY // (1024 * 1024),
+                        help="shared-memory buffer between stages (must fit the largest message)")
+    add_rate_arguments(parser)
+    add_ack_capture_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.profile:
+            profiles = load_profiles(args.settings)
+            if args.profile not in profiles:
+                parser.error(f"unknown profile: {args.profile}")
+            destination = destination_from_profile(args.profile, profiles[args.profile])
+        else:
+            destination = parse_destination(args.dest, args.timeout)
+        rules = load_rules(args.rules) if args.rules else destination.get("transforms", [])
+        rate_limit = rate_limit_from_args(args)
+        if rate_limit is not None:
+            destination["rate_limit"] = rate_limit
+        # Validar la configuración antes de arrancar los procesos
+        RateLimiter.from_dict(destination.get("rate_limit"))
+        charset = codec_name(args.charset) if args.charset else None
+        if args.definitions:
+            destination["definitions"] = args.definitions
+        ack_capture = ack_capture_from_args(args)
+        if ack_capture is not None:
+            destination["ack_capture"] = ack_capture
+    except (OSError, ValueError, LookupError) as e:
+        parser.error(str(e))
+
+    definitions = os.path.dirname(os.path.abspath(__file__)) if args.validate else None
+    totals = run_pipeline(args.files, destination, rules, args.window, args.ring_mb * 1024 * 1024,
+                          charset=charset, definitions=definitions)
+    elapsed = totals["elapsed"]
+    rate = totals["messages"] / elapsed if elapsed else 0.0
+    print(f"{totals['messages']} sent, {totals['failed']} failed, ACK {totals['acks']} in {elapsed:.2f} s "
+          f"({rate:.0f}/s)", file=sys.stderr)
+    if totals["acks_spooled"]:
+        print(f"{totals['acks_spooled']} full ACKs saved in {args.ack_spool}", file=sys.stderr)
+    if totals["acks_spool_dropped"]:
+        print(f"{totals['acks_spool_dropped']} full ACKs not saved (--ack-spool-mb limit reached)", file=sys.stderr)
+    for control_id, code, text in totals["failures"][:10]:
+        print(f"  {control_id or '-'}: {code} {text}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
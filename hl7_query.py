@@ -0,0 +1,256 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Consultas por rutas de campo sobre ficheros HL7 grandes.
+
+Rutas soportadas (los índices son 1-based como en HL7):
+    PID-3          campo completo de la primera ocurrencia del segmento
+    PID-3.1        componente (de la primera repetición)
+    PID-3(2).1     repetición concreta; (*) para todas
+    OBX[*]-5       todas las ocurrencias del segmento; OBX[2]-5 la segunda
+    PID-5.1.1      subcomponente
+
+Condiciones: RUTA=valor, RUTA!=valor, RUTA^=prefijo, RUTA~=regex. Con [*] o (*)
+basta con que cumpla una de las ocurrencias.
+
+Uso:
+    python hl7_query.py -s MSH-4 -s MSH-10 -w "MSH-9^=ORU^R01" -w "OBX[*]-11=F" -w "MSH-7^=20261018" datos/*.hl7
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from hl7_parser import LazyMessage, get_field, iter_message_spans, is_mllp_framed, open_mapped
+
+ALL = -1
+
+_PATH_RE = re.compile(
+    r"^(?P<seg>[A-Z0-9]{3})(?:\[(?P<occ>\*|\d+)\])?"
+    r"[-.](?P<field>\d+)(?:\((?P<rep>\*|\d+)\))?"
+    r"(?:\.(?P<comp>\d+))?(?:\.(?P<sub>\d+))?$")
+
+_CONDITION_RE = re.compile(r"^(?P<path>.+?)(?P<op>!=|\^=|~=|=)(?P<value>.*)$")
+
+# Tamaño de los rangos en que se reparte cada fichero entre los procesos
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class FieldPath:
+    """Ruta de campo compilada a un extractor sobre LazyMessage."""
+
+    __slots__ = ("text", "segment", "occurrence", "field", "repetition", "component", "subcomponent")
+
+    def __init__(self, text):
+        m = _PATH_RE.match(text.strip())
+        if m is None:
+            raise ValueError(f"Invalid HL7 path: {text!r}")
+        self.text = text.strip()
+        self.segment = m.group("seg").encode("ascii")
+        self.occurrence = self._index(m.group("occ"), 1)
+        self.field = int(m.group("field"))
+        self.repetition = self._index(m.group("rep"), None)
+        self.component = int(m.group("comp")) if m.group("comp") else None
+        self.subcomponent = int(m.group("sub")) if m.group("sub") else None
+        if self.component is not None and self.repetition is None:
+            # Un componente se refiere por defecto a la primera repetición
+            self.repetition = 1
+
+    @staticmethod
+    def _index(value, default):
+        if value is None:
+            return default
+        return ALL if value == "*" else int(value)
+
+    def extract(self, msg):
+        """Devuelve la lista de valores (bytes) que selecciona la ruta en el mensaje."""
+        data = msg.data
+        delims = msg.delimiters
+        wanted = self.segment
+        occurrence = self.occurrence
+        values = []
+        seen = 0
+        # Se buscan sólo los segmentos pedidos: los demás no se delimitan ni se dividen
+        for start, end in msg.find_segments(wanted):
+            seen += 1
+            if occurrence != ALL and seen != occurrence:
+                continue
+            self._extract_field(get_field(data[start:end], self.field, delims), delims, values)
+            if occurrence != ALL:
+                break
+        return values
+
+    def _extract_field(self, value, delims, values):
+        if self.repetition is None:
+            values.append(value)
+            return
+        reps = value.split(delims.repetition)
+        if self.repetition != ALL:
+            reps = reps[self.repetition - 1:self.repetition]
+        for rep in reps:
+            if self.component is not None:
+                rep = _nth(rep, delims.component, self.component)
+                if self.subcomponent is not None:
+                    rep = _nth(rep, delims.subcomponent, self.subcomponent)
+            values.append(rep)
+
+
+def _nth(value, separator, index):
+    parts = value.split(separator)
+    return parts[index - 1] if index <= len(parts) else b""
+
+
+class Condition:
+    """Filtro `RUTA op valor` evaluado sobre los valores extraídos."""
+
+    def __init__(self, text, encoding="utf-8"):
+        m = _CONDITION_RE.match(text)
+        if m is None:
+            raise ValueError(f"Invalid condition: {text!r}")
+        self.path = FieldPath(m.group("path"))
+        self.op = m.group("op")
+        value = m.group("value").encode(encoding)
+        if self.op == "~=":
+            self.test = re.compile(value).search
+        elif self.op == "^=":
+            self.test = lambda v: v.startswith(value)
+        elif self.op == "=":
+            self.test = lambda v: v == value
+        else:
+            self.test = None
+            self.value = value
+
+    def matches(self, msg):
+        values = self.path.extract(msg)
+        if self.test is None:
+            return all(v != self.value for v in values)
+        test = self.test
+        return any(test(v) for v in values)
+
+
+class Query:
+    """Conjunto de rutas seleccionadas y condiciones (AND)."""
+
+    def __init__(self, select, where=(), encoding="utf-8"):
+        self.select_text = list(select)
+        self.where_text = list(where)
+        self.encoding = encoding
+        self.select = [FieldPath(p) for p in select]
+        self.where = [Condition(c, encoding) for c in where]
+
+    def run(self, messages):
+        """Itera las filas (lista de listas de bytes) de los mensajes que cumplen las condiciones."""
+        select, where = self.select, self.where
+        for data in messages:
+            msg = LazyMessage(data)
+            if all(cond.matches(msg) for cond in where):
+                yield [path.extract(msg) for path in select]
+
+
+def _query_range(args):
+    """Trabajo de un proceso: ejecuta la consulta sobre un rango de un fichero."""
+    select, where, encoding, path, start, end = args
+    query = Query(select, where, encoding)
+    mm = open_mapped(path)
+    if mm is None:
+        return path, []
+    rows = []
+    try:
+        framed = is_mllp_framed(mm)
+        spans = iter_message_spans(mm, start, end, framed)
+        messages = (mm[s:e].rstrip(b"\r\n") for s, e in spans)
+        for row in query.run(messages):
+            rows.append([[v.decode(encoding, errors="replace") for v in values] for values in row])
+    finally:
+        mm.close()
+    return path, rows
+
+
+def plan_ranges(paths, chunk_size=CHUNK_SIZE):
+    """Divide los ficheros en rangos de bytes independientes."""
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            yield path, start, min(start + chunk_size, size)
+
+
+def run_query(query, paths, workers=None, chunk_size=CHUNK_SIZE):
+    """Ejecuta la consulta en paralelo e itera (fichero, fila) a medida que terminan los rangos."""
+    tasks = [(query.select_text, query.where_text, query.encoding, path, start, end)
+             for path, start, end in plan_ranges(paths, chunk_size)]
+    if workers == 1 or len(tasks) == 1:
+        results = map(_query_range, tasks)
+        for path, rows in results:
+            for row in rows:
+                yield path, row
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, rows in pool.map(_query_range, tasks):
+            for row in rows:
+                yield path, row
+
+
+def write_results(results, select, out, fmt="csv", with_file=False):
+    """Escribe las filas en CSV (repeticiones unidas con ~) o JSONL a medida que llegan."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow((["file"] if with_file else []) + list(select))
+        for path, row in results:
+            writer.writerow(([path] if with_file else []) + ["~".join(values) for values in row])
+            count += 1
+    else:
+        for path, row in results:
+            record = {"file": path} if with_file else {}
+            for name, values in zip(select, row):
+                record[name] = values if len(values) != 1 else values[0]
+            out.write(json.dumps(record, ensure_ascii=False))
+            out.write("\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query HL7 files by field path")
+    parser.add_argument("files", nargs="+", help="HL7 files (plain or MLLP framed)")
+    parser.add_argument("-s", "--select", action="append", required=True, help="field path to output")
+    parser.add_argument("-w", "--where", action="append", default=[], help="condition PATH=VALUE (also !=, ^=, ~=)")
+    parser.add_argument("-f", "--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--with-file", action="store_true", help="add the source file as first column")
+    args = parser.parse_args(argv)
+
+    query = Query(args.select, args.where, args.encoding)
+    results = run_query(query, args.files, args.workers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            count = write_results(results, args.select, out, args.format, args.with_file)
+    else:
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+        count = write_results(results, args.select, out, args.format, args.with_file)
+        out.flush()
+    print(f"{count} matching messages", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,16 +18,37 @@ import sys
 import socket
 import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import xml.etree.ElementTree as ET
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QLineEdit, QPushButton, 
                              QTextEdit, QCheckBox, QGroupBox, QMessageBox, QComboBox,
                              QFileDialog, QInputDialog, QSplitter, QTreeWidget, QTreeWidgetItem,
-                             QHeaderView, QAbstractItemView)
+                             QHeaderView, QAbstractItemView, QTableWidget, QTableWidgetItem, QTableView)
 from PyQt6.QtGui import QFont, QTextCharFormat, QSyntaxHighlighter, QColor, QClipboard, QAction, QIcon, QKeySequence
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QObject, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex
 import re # Para expresiones regulares en el resaltador de sintaxis
+from app_config import SETTINGS_FILE
+from mllp import ConnectionPool, MLLPClient, MLLPFramingError, TLSConfig
+from hl7_parser import LazyMessage, parse_ack
+from hl7_codec import HL7EncodingError, encode_text
+from hl7_charset import ENCODING_AUTO, declared_charset, decode_message, detect_charset
+from hl7_transform import Transformer
+from hl7_definitions import HL7DefinitionManager, nest_segments
+from hl7_diff import KIND_ADDED, KIND_CHANGED, KIND_REMOVED, MessageDiffer
+from hl7_validate import MessageValidator
+from hl7_generator import MessageGenerator
+from message_index import fts5_available
+from message_store import MessageStore, STATUS_BY_LABEL, STATUS_ERROR, STATUS_LABELS, STATUS_QUEUED, STATUS_SENT
+from ack_tracker import classify, STATUS_UNKNOWN
+from ack_capture import AckCapture
+from mllp_receiver import MLLPReceiver, MessageJournal
+from rate_control import RateLimiter
+import profiling
+from profiling import traced
+from outbound_queue import (ACK_SPOOL_NAME, OutboundQueue, QueueDrainer, RetryPolicy, save_destination,
+                            load_destination, spool_dir_for)
 
 def get_resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -41,16 +62,44 @@ def get_resource_path(relative_path):
 
 VERSION = "1.1"
 
-def get_app_config_path(app_name):
-    """Devuelve la ruta estándar para la configuración de la aplicación."""
-    if sys.platform == 'darwin':  # macOS
-        return os.path.join(os.path.expanduser('~/Library/Application Support'), app_name, 'hl7_sender_settings.json')
-    elif sys.platform == 'win32':  # Windows
-        return os.path.join(os.environ['APPDATA'], app_name, 'hl7_sender_settings.json')
-    else:  # Linux y otros
-        return os.path.join(os.path.expanduser('~/.config'), app_name, 'hl7_sender_settings.json')
+# Colas store-and-forward persistentes (una por destino host:puerto)
+SPOOL_DIR = os.path.join(os.path.dirname(SETTINGS_FILE), 'spool')
 
-SETTINGS_FILE = get_app_config_path('HL7Sender')
+# Diario por defecto del receptor MLLP
+RECEIVER_JOURNAL = os.path.join(os.path.dirname(SETTINGS_FILE), 'received.hl7')
+
+# Espacio de trabajo multi-mensaje (cuerpos en disco)
+WORKSPACE_DIR = os.path.join(os.path.dirname(SETTINGS_FILE), 'workspace')
+
+# Espera tras la última pulsación antes de filtrar el espacio de trabajo (ms)
+WORKSPACE_FILTER_DELAY_MS = 250
+
+# Mensajes con hasta este número de segmentos se abren en el detalle con los grupos desplegados
+DETAIL_EXPAND_LIMIT = 200
+
+# Longitud máxima del resumen (primer segmento) de un grupo en el detalle
+DETAIL_GROUP_PREVIEW = 200
+
+# Intervalo de refresco de la columna de estado del espacio de trabajo (ms)
+WORKSPACE_REFRESH_MS = 500
+
+# Tamaño máximo del mensaje del editor que se guarda en la configuración (caracteres);
+# los mensajes mayores se conservan en el espacio de trabajo, no en el JSON
+LAST_MESSAGE_MAX_CHARS = 256 * 1024
+
+# Intervalo de refresco de las estadísticas del receptor (ms)
+RECEIVER_REFRESH_MS = 500
+
+# Intervalo de refresco del resumen de ACKs de las colas (ms)
+ACK_SUMMARY_REFRESH_MS = 500
+# Errores recientes que se muestran en el resumen de ACKs
+ACK_SUMMARY_ERRORS = 10
+
+# Intervalo de refresco de la tabla de perfilado (ms)
+PROFILER_REFRESH_MS = 1000
+
+# Espera tras la última pulsación antes de validar el mensaje del editor (ms)
+VALIDATION_DELAY_MS = 300
 
 TRANSLATIONS = {
     "es": {
@@ -125,9 +174,87 @@ TRANSLATIONS = {
         "ack_timeout": "Error: Tiempo de espera agotado. Verifique que el servidor esté escuchando y que no haya un firewall bloqueando la conexión.",
         "ack_refused": "Error: Conexión rechazada. Verifique que la IP y el puerto son correctos y que el servidor está en ejecución.",
         "ack_raw": "Respuesta Raw (Invalid MLLP):\n{}",
-        "ack_decoded": "ACK Recibido (Error de decodificación con {}):\n{}\n\n{}",
         "menu_zoom_in": "Acercar",
-        "menu_zoom_out": "Alejar"
+        "menu_zoom_out": "Alejar",
+        "use_queue": "Cola persistente",
+        "use_queue_tooltip": "Guarda el mensaje en una cola en disco y lo envía en segundo plano con reintentos",
+        "use_tls": "TLS",
+        "use_tls_tooltip": "MLLP sobre TLS (certificados y verificación en la clave \"tls\" del perfil)",
+        "status_queued": "Mensaje encolado para {}:{} (pendientes: {})",
+        "status_queue_summary": "Colas: {:,} respuestas, {:,} con error. Pendientes: {}",
+        "ack_summary_queue": "Cola {}: {:,} respuestas ({}) | latencia media {:.1f} ms, máx. {:.1f} ms | pendientes: {}",
+        "ack_summary_spooled": "  ACK completos guardados (errores y muestras): {:,} en {}",
+        "ack_summary_spool_full": "  Fichero de ACK lleno (max_spool_mb): {:,} ACK sin guardar",
+        "ack_summary_errors": "  Últimos errores:",
+        "status_queue_retry": "Cola {}:{}: reintentando mensaje #{} ({}). Pendientes: {}",
+        "status_queue_dead": "Cola {}:{}: mensaje #{} movido a dead-letter ({})",
+        "err_queue": "No se pudo encolar el mensaje: {}",
+        "err_transform": "Las reglas de transformación del perfil no son válidas:\n{}",
+        "menu_receiver": "&Receptor MLLP...",
+        "receiver_title": "Receptor MLLP",
+        "receiver_ports": "Puertos:",
+        "receiver_ports_tooltip": "Puertos de escucha separados por comas",
+        "receiver_journal": "Diario:",
+        "receiver_send_ack": "Responder ACK",
+        "receiver_to_workspace": "Añadir al espacio de trabajo",
+        "receiver_start": "Iniciar",
+        "receiver_stop": "Detener",
+        "receiver_stats": "Mensajes: {} ({:.0f}/s) | Conexiones: {} activas, {} total | Errores de framing: {} | AA: {} AE: {} AR: {}",
+        "receiver_last": "Último mensaje ({}):",
+        "receiver_to_editor": "Copiar al Editor",
+        "receiver_running": "Receptor MLLP escuchando en {}",
+        "err_receiver_ports": "Los puertos deben ser números entre 1 y 65535 separados por comas.",
+        "err_receiver_start": "No se pudo iniciar el receptor:\n{}",
+        "warn_ack_mismatch": "ACK no correlacionado: MSA-2 '{}' no coincide con MSH-10 '{}'",
+        "warn_ack_unknown": "Código de ACK desconocido en MSA-1: '{}'",
+        "menu_profiler": "&Perfilado...",
+        "profiler_title": "Perfilado por Fases",
+        "profiler_enable": "Activar perfilado",
+        "profiler_reset": "Reiniciar",
+        "profiler_export": "Exportar Flame Graph...",
+        "profiler_export_title": "Exportar perfil (folded stacks)",
+        "profiler_headers": "Fase|Llamadas|Total (ms)|Propio (ms)|Media (µs)|Máx (µs)",
+        "profiler_exported": "Perfil exportado a {} ({} pilas)",
+        "profiler_export_err": "No se pudo exportar el perfil:\n{}",
+        "menu_workspace": "&Espacio de Trabajo...",
+        "workspace_title": "Espacio de Trabajo",
+        "workspace_filter": "Buscar: 12345, GARCIA, PID-3:12345, MSH-9:ORU* (campos clave y texto completo)",
+        "workspace_fulltext": "Texto completo",
+        "workspace_fulltext_tooltip": "Indexa también el texto de los mensajes (más lento al cargar y más espacio en disco)",
+        "workspace_headers": "Fecha (MSH-7)|Tipo (MSH-9)|Control ID (MSH-10)|Paciente (PID-3)|Tamaño|ACK",
+        "workspace_load": "Cargar Ficheros...",
+        "workspace_generate": "Generar...",
+        "workspace_generate_type": "Tipo de mensaje (MSH-9):",
+        "workspace_generate_count": "Número de mensajes:",
+        "workspace_add": "Añadir del Editor",
+        "workspace_clear": "Vaciar",
+        "workspace_open": "Abrir en el Editor",
+        "workspace_send": "Enviar Selección",
+        "workspace_count": "{} mensajes ({} mostrados)",
+        "workspace_loaded": "{} mensajes añadidos desde {}",
+        "workspace_confirm_clear": "¿Eliminar los {} mensajes del espacio de trabajo?",
+        "workspace_queued": "{} mensajes encolados para {}:{} (pendientes: {})",
+        "err_workspace": "Error en el espacio de trabajo:\n{}",
+        "menu_diff": "&Comparar Mensajes...",
+        "diff_title": "Comparar Mensajes",
+        "diff_left": "Izquierda (referencia):",
+        "diff_right": "Derecha:",
+        "diff_from_editor": "Desde el Editor",
+        "diff_swap": "Intercambiar",
+        "diff_run": "Comparar",
+        "diff_ignore": "Ignorar: MSH-7 MSH-10 ...",
+        "diff_headers": "Tipo|Ruta|Descripción|Izquierda|Derecha",
+        "diff_kinds": "Cambiado|Añadido|Eliminado",
+        "diff_result": "{} diferencias",
+        "diff_equal": "Los mensajes son iguales",
+        "err_diff": "No se pudo comparar:\n{}",
+        "menu_live_validation": "&Validación en Vivo",
+        "val_unknown_segment": "{}: segmento desconocido",
+        "val_unexpected_segment": "{}: segmento fuera de la estructura de {}",
+        "val_too_many_fields": "{}: más campos de los definidos ({})",
+        "val_required_missing": "{}: campo obligatorio vacío",
+        "val_bad_format": "{}: formato {} no válido",
+        "status_validation_err": "Error al validar: {}"
     },
     "en": {
         "window_title": f"HL7 Sender v{VERSION}",
@@ -201,155 +328,115 @@ TRANSLATIONS = {
         "ack_timeout": "Error: Timed out. Check if server is listening and no firewall is blocking.",
         "ack_refused": "Error: Connection refused. Check IP and Port are correct and server is running.",
         "ack_raw": "Raw Response (Invalid MLLP):\n{}",
-        "ack_decoded": "ACK Received (Decoding error with {}):\n{}\n\n{}",
         "menu_zoom_in": "Zoom In",
-        "menu_zoom_out": "Zoom Out"
+        "menu_zoom_out": "Zoom Out",
+        "use_queue": "Persistent queue",
+        "use_queue_tooltip": "Stores the message in an on-disk queue and sends it in the background with retries",
+        "use_tls": "TLS",
+        "use_tls_tooltip": "MLLP over TLS (certificates and verification in the profile \"tls\" key)",
+        "status_queued": "Message queued for {}:{} (pending: {})",
+        "status_queue_summary": "Queues: {:,} responses, {:,} with errors. Pending: {}",
+        "ack_summary_queue": "Queue {}: {:,} responses ({}) | average latency {:.1f} ms, max {:.1f} ms | pending: {}",
+        "ack_summary_spooled": "  Full ACKs saved (errors and samples): {:,} in {}",
+        "ack_summary_spool_full": "  ACK spool full (max_spool_mb): {:,} ACKs not saved",
+        "ack_summary_errors": "  Latest errors:",
+        "status_queue_retry": "Queue {}:{}: retrying message #{} ({}). Pending: {}",
+        "status_queue_dead": "Queue {}:{}: message #{} moved to dead-letter ({})",
+        "err_queue": "Could not queue the message: {}",
+        "err_transform": "The profile transform rules are not valid:\n{}",
+        "menu_receiver": "MLLP &Receiver...",
+        "receiver_title": "MLLP Receiver",
+        "receiver_ports": "Ports:",
+        "receiver_ports_tooltip": "Comma-separated listening ports",
+        "receiver_journal": "Journal:",
+        "receiver_send_ack": "Reply with ACK",
+        "receiver_to_workspace": "Add to workspace",
+        "receiver_start": "Start",
+        "receiver_stop": "Stop",
+        "receiver_stats": "Messages: {} ({:.0f}/s) | Connections: {} active, {} total | Framing errors: {} | AA: {} AE: {} AR: {}",
+        "receiver_last": "Last message ({}):",
+        "receiver_to_editor": "Copy to Editor",
+        "receiver_running": "MLLP receiver listening on {}",
+        "err_receiver_ports": "Ports must be comma-separated numbers between 1 and 65535.",
+        "err_receiver_start": "Could not start the receiver:\n{}",
+        "warn_ack_mismatch": "Uncorrelated ACK: MSA-2 '{}' does not match MSH-10 '{}'",
+        "warn_ack_unknown": "Unknown ACK code in MSA-1: '{}'",
+        "menu_profiler": "&Profiling...",
+        "profiler_title": "Phase Profiling",
+        "profiler_enable": "Enable profiling",
+        "profiler_reset": "Reset",
+        "profiler_export": "Export Flame Graph...",
+        "profiler_export_title": "Export profile (folded stacks)",
+        "profiler_headers": "Phase|Calls|Total (ms)|Self (ms)|Mean (µs)|Max (µs)",
+        "profiler_exported": "Profile exported to {} ({} stacks)",
+        "profiler_export_err": "Could not export the profile:\n{}",
+        "menu_workspace": "&Workspace...",
+        "workspace_title": "Workspace",
+        "workspace_filter": "Search: 12345, GARCIA, PID-3:12345, MSH-9:ORU* (key fields and full text)",
+        "workspace_fulltext": "Full text",
+        "workspace_fulltext_tooltip": "Also index the message text (slower loading and more disk space)",
+        "workspace_headers": "Date (MSH-7)|Type (MSH-9)|Control ID (MSH-10)|Patient (PID-3)|Size|ACK",
+        "workspace_load": "Load Files...",
+        "workspace_generate": "Generate...",
+        "workspace_generate_type": "Message type (MSH-9):",
+        "workspace_generate_count": "Number of messages:",
+        "workspace_add": "Add from Editor",
+        "workspace_clear": "Clear",
+        "workspace_open": "Open in Editor",
+        "workspace_send": "Send Selection",
+        "workspace_count": "{} messages ({} shown)",
+        "workspace_loaded": "{} messages added from {}",
+        "workspace_confirm_clear": "Remove the {} messages from the workspace?",
+        "workspace_queued": "{} messages queued for {}:{} (pending: {})",
+        "err_workspace": "Workspace error:\n{}",
+        "menu_diff": "&Compare Messages...",
+        "diff_title": "Compare Messages",
+        "diff_left": "Left (reference):",
+        "diff_right": "Right:",
+        "diff_from_editor": "From Editor",
+        "diff_swap": "Swap",
+        "diff_run": "Compare",
+        "diff_ignore": "Ignore: MSH-7 MSH-10 ...",
+        "diff_headers": "Kind|Path|Description|Left|Right",
+        "diff_kinds": "Changed|Added|Removed",
+        "diff_result": "{} differences",
+        "diff_equal": "The messages are identical",
+        "err_diff": "Could not compare:\n{}",
+        "menu_live_validation": "Live &Validation",
+        "val_unknown_segment": "{}: unknown segment",
+        "val_unexpected_segment": "{}: segment not expected in the {} structure",
+        "val_too_many_fields": "{}: more fields than defined ({})",
+        "val_required_missing": "{}: required field is empty",
+        "val_bad_format": "{}: invalid {} format",
+        "status_validation_err": "Validation error: {}"
     }
 }
 
-class HL7DefinitionManager:
-    """Clase para manejar las definiciones XML de HL7."""
-    def __init__(self, base_path):
-        self.base_path = base_path
-        self.definitions_cache = {}
-
-    def get_version_path(self, version):
-        """Devuelve la ruta al directorio de definiciones para una versión específica."""
-        # Mapeo simple de versiones a directorios si es necesario, o uso directo
-        return os.path.join(self.base_path, "reference", version)
-
-    def is_version_available(self, version):
-        """Verifica si existen definiciones para la versión dada."""
-        path = self.get_version_path(version)
-        return os.path.isdir(path)
-
-    def load_segment_definition(self, version, segment_name):
-        """Carga la definición de un segmento desde el archivo XML."""
-        cache_key = f"{version}_{segment_name}"
-        if cache_key in self.definitions_cache:
-            return self.definitions_cache[cache_key]
-
-        version_path = self.get_version_path(version)
-        # Intentar cargar segment{Name}.xml
-        file_path = os.path.join(version_path, f"segment{segment_name}.xml")
-        
-        if not os.path.exists(file_path):
-            # Fallback o intentar otro nombre si es necesario
-            return None
-
-        try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-            self.definitions_cache[cache_key] = root
-            return root
-        except Exception as e:
-            print(f"Error loading segment definition {segment_name} for version {version}: {e}")
-            return None
-
-    def load_datatype_definition(self, version, datatype_name):
-        """Carga la definición de un tipo de dato compuesto."""
-        if not datatype_name:
-            return None
-            
-        cache_key = f"{version}_dt_{datatype_name}"
-        if cache_key in self.definitions_cache:
-            return self.definitions_cache[cache_key]
+# Clase para el resaltado de sintaxis HL7
+# Candidatos a identificador de segmento no precedidos por una letra (no encontrar 'LOC' en 'LOCAL');
+# se confirman contra el vocabulario de `reference` con is_segment_id
+SEGMENT_ID_PATTERN = re.compile(r"(?<![A-Za-z])([A-Z][A-Z0-9]{2})\b")
+SEGMENT_START_PATTERN = re.compile(r"(?<![A-Za-z])([A-Z][A-Z0-9]{2})\|")
 
-        version_path = self.get_version_path(version)
-        # Intentar cargar composite{Name}.xml
-        # A veces los tipos de datos tienen nombres como CE, CX, etc.
-        file_path = os.path.join(version_path, f"composite{datatype_name}.xml")
-        
-        if not os.path.exists(file_path):
-             return None
 
-        try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-            self.definitions_cache[cache_key] = root
-            return root
-        except Exception:
-            return None
+def is_segment_id(name, segments):
+    """Indica si `name` es un segmento del vocabulario o un Z-segment (personalizado)."""
+    return name in segments or name[0] == "Z"
 
-    def get_field_description(self, version, segment, field_index, definitions=None):
-        """Obtiene la descripción de un campo dado el segmento y el índice (1-based)."""
-        if definitions is None:
-            definitions = self.load_segment_definition(version, segment)
-        
-        if definitions is None:
-            return None
 
-        # Navegar el XML: elements -> field
-        # Nota: Los archivos XML de definición que hemos visto tienen una estructura específica.
-        # <elements>
-        #   <field> <name>PID.1</name> ... </field>
-        # </elements>
-        # Sin embargo, el índice de los fields en el XML suele corresponder al orden.
-        
-        try:
-            elements = definitions.find("elements")
-            if elements is not None:
-                fields = elements.findall("field")
-                # field_index es 1-based.
-                # Ajuste: PID.1 es el primer campo en la lista para PID?
-                # En muchos estándares HL7, MSH es especial.
-                if 0 <= field_index - 1 < len(fields):
-                    field_node = fields[field_index - 1]
-                    description = field_node.find("description").text
-                    datatype = field_node.find("datatype").text
-                    return description, datatype
-        except Exception:
-            pass
-        return None, None
-
-    def get_component_description(self, version, datatype, component_index):
-        """Obtiene la descripción de un componente de un tipo de dato compuesto."""
-        definitions = self.load_datatype_definition(version, datatype)
-        if definitions is None:
-            return None, None
-            
-        try:
-            elements = definitions.find("elements")
-            if elements is not None:
-                fields = elements.findall("field")
-                if 0 <= component_index - 1 < len(fields):
-                    field_node = fields[component_index - 1]
-                    description = field_node.find("description").text
-                    datatype = field_node.find("datatype").text # Puede ser subcomponente
-                    return description, datatype
-        except Exception:
-            pass
-        return None, None
-
-
-# Clase para el resaltado de sintaxis HL7
 class Hl7Highlighter(QSyntaxHighlighter):
-    HL7_SEGMENTS = [
-        "MSH", "PID", "PV1", "ORC", "OBR", "DG1", "OBX", "SAC", # Ejemplos del usuario
-        "EVN", "ADD", "AIG", "AIS", "AIL", "AL1", "APT", "ARQ", "AUT", "BHS",
-        "BTS", "BLG", "CDM", "CER", "CM0", "CM1", "CM2", "CNS", "CSP", #"CON", 
-        "CSR", "CSS", "CTD", "CTI", "DB1", "DDI", "DFT", "DG1", "DRG", "DSC",
-        "DSP", "EHC", "EQL", "EQP", "EQT", "FAC", "FHS", "FT1", "GOL", "GP1",
-        "GP2", "GT1", "Hxx", "IAM", "IAR", "IIM", "ILT", "IN1", "IN2", "IN3",
-        "INV", "ISD", "LAN", "LCC", "LDP", "LRL", "MFA", "MFE", "MFI", #"LOC",
-        "MRG", "MTN", "NAA", "NBS", "NDS", "NK1", "NPU", "NSC", "NST", "NTE",
-        "OM1", "OM2", "OM3", "OM4", "OM5", "OM6", "OM7", "ORG", "PR1", "PRA",
-        "PRB", "PRC", "PRD", "PSG", "PSH", "PTH", "PV2", "QCN", "QID", "RCP",
-        "RDF", "RDT", "REL", "RF1", "RGS", "RMI", "ROL", "RQ1", "RQD", "RXA",
-        "RXC", "RXD", "RXE", "RXG", "RXO", "RXR", "RXV", "SCH", "SPM", "STF",
-        "TCC", "TCD", "TQ1", "TQ2", "TXA", "UB1", "UB2", "UR1", "VAR", "VMD",
-        "VP1", "VTQ", "Zxx", "MSA" # Segmentos "Z" pueden ser personalizados, pero este es un placeholder
-    ]
-
-    def __init__(self, document, dark_mode=False):
+    def __init__(self, document, dark_mode=False, segments=frozenset()):
         super().__init__(document)
         self.dark_mode = dark_mode
+        # Vocabulario de segmentos (HL7DefinitionManager.get_all_segments)
+        self.segments = segments
+        # Problemas de validación: número de bloque -> (texto validado, tupla de Issue)
+        self.issues = {}
+        self.issue_format = QTextCharFormat()
+        self.issue_format.setUnderlineStyle(QTextCharFormat.UnderlineStyle.WaveUnderline)
+        self.issue_format.setUnderlineColor(QColor(220, 50, 47))
         self.update_colors()
 
-        # Expresión regular para encontrar nombres de segmento que no están precedidos por una letra
-        segments_pattern = '|'.join(self.HL7_SEGMENTS)
-        self.segment_pattern = re.compile(r"(?<![A-Za-z])(%s)\b" % segments_pattern)
-        
         # Expresión regular para números
         self.number_pattern = re.compile(r'\b\d+\b')
         
@@ -393,6 +480,7 @@ class Hl7Highlighter(QSyntaxHighlighter):
         self.update_colors()
         self.rehighlight()
 
+    @traced("highlightBlock")
     def highlightBlock(self, text):
         # Primero, aplicar formato a los separadores
         for match in self.separator_pattern.finditer(text):
@@ -403,8 +491,30 @@ class Hl7Highlighter(QSyntaxHighlighter):
             self.setFormat(match.start(), match.end() - match.start(), self.number_format)
         
         # Finalmente, aplicar formato a los segmentos (para que tengan prioridad)
-        for match in self.segment_pattern.finditer(text):
-            self.setFormat(match.start(1), match.end(1) - match.start(1), self.segment_format)
+        segments = self.segments
+        for match in SEGMENT_ID_PATTERN.finditer(text):
+            if is_segment_id(match.group(1), segments):
+                self.setFormat(match.start(1), 3, self.segment_format)
+
+        # Subrayar los problemas de validación si siguen correspondiendo al texto del bloque
+        entry = self.issues.get(self.currentBlock().blockNumber())
+        if entry is not None and entry[0] == text:
+            for issue in entry[1]:
+                for pos in range(issue.start, min(issue.end, len(text))):
+                    char_format = self.format(pos)
+                    char_format.merge(self.issue_format)
+                    self.setFormat(pos, 1, char_format)
+
+    def set_issues(self, issues):
+        """Sustituye los problemas de validación y repinta sólo los bloques que cambian."""
+        old = self.issues
+        self.issues = issues
+        document = self.document()
+        for number in set(old) | set(issues):
+            if old.get(number) != issues.get(number):
+                block = document.findBlockByNumber(number)
+                if block.isValid():
+                    self.rehighlightBlock(block)
 
 class MessageDetailWindow(QMainWindow):
     def __init__(self, message_text, definition_manager, dark_mode=False, parent=None):
@@ -444,6 +554,8 @@ class MessageDetailWindow(QMainWindow):
         self.tree.setColumnWidth(1, 250) # Descripción
         self.tree.setColumnWidth(2, 100) # Tipo
         self.tree.setColumnWidth(3, 250) # Valor
+        # Los campos de los segmentos y el contenido de los grupos se crean al desplegarlos
+        self.tree.itemExpanded.connect(self.on_item_expanded)
         
         layout.addWidget(self.tree)
 
@@ -481,6 +593,7 @@ class MessageDetailWindow(QMainWindow):
             self.info_label.setStyleSheet("color: black; background-color: transparent; font-weight: bold;") 
             self.info_label.setStyleSheet("")
 
+    @traced("parse_message")
     def parse_message(self):
         self.tree.clear()
         if not self.message_text:
@@ -513,8 +626,8 @@ class MessageDetailWindow(QMainWindow):
                 pass # Usar defaults
 
         # Normalizar saltos de línea y dividir segmentos
-        segments = self.message_text.strip().split('\n')
-        segments = [s.strip() for s in segments if s.strip()]
+        segments = [s.strip() for s in re.split(r"[\r\n]+", self.message_text)]
+        segments = [s for s in segments if s]
         
         # Intentar detectar versión
         version = "2.3" # Default
@@ -528,100 +641,165 @@ class MessageDetailWindow(QMainWindow):
                 if len(fields) >= 9:
                     msg_type = fields[8] # MSH-9
                 break
-        
-        self.info_label.setText(f"Versión HL7 detectada: {version} | Tipo de mensaje: {msg_type}")
+
+        # Agrupar los segmentos según la gramática del mensaje (messageXXX.xml); sin ella, lista plana
+        names = [seg.split(field_sep, 1)[0] for seg in segments]
+        structure = self.def_manager.get_message_structure(version, msg_type) if msg_type else None
+        if structure:
+            nodes, unexpected = nest_segments(structure, names)
+        else:
+            nodes, unexpected = list(range(len(segments))), []
+
+        info = f"Versión HL7 detectada: {version} | Tipo de mensaje: {msg_type}"
+        if unexpected:
+            info += f" | Segmentos fuera de la estructura: {len(unexpected)}"
+        self.info_label.setText(info)
         self.apply_theme() 
-        
-        for seg in segments:
-            if not seg: continue
-            
-            fields = seg.split(field_sep)
-            seg_name = fields[0]
-            
-            # Cargar definición del segmento
-            seg_def = self.def_manager.load_segment_definition(version, seg_name)
+
+        # Los campos de cada segmento y el contenido de cada grupo se crean al desplegarlos
+        self.segments = segments
+        self.delimiters = (field_sep, comp_sep, rep_sep, sub_sep)
+        self.version = version
+        self.unexpected = frozenset(unexpected)
+        self.segment_descriptions = {}
+        # Los elementos guardan un entero: el índice del segmento o -(n + 1) para el grupo self.groups[n]
+        self.groups = []
+        self.add_nodes(self.tree.invisibleRootItem(), nodes)
+        if len(segments) <= DETAIL_EXPAND_LIMIT:
+            self.expand_groups(self.tree.invisibleRootItem())
+
+    def add_nodes(self, parent_item, nodes):
+        """Crea los elementos de un nivel del árbol: segmentos (índices) y grupos (GroupInstance)."""
+        for node in nodes:
+            item = QTreeWidgetItem(parent_item)
+            if isinstance(node, int):
+                seg = self.segments[node]
+                seg_name = seg.split(self.delimiters[0], 1)[0]
+                item.setText(0, seg_name)
+                item.setText(1, self.segment_description(seg_name))
+                item.setText(3, seg) # Mostrar segmento completo en columna valor
+                if node in self.unexpected:
+                    item.setToolTip(0, "Segmento no esperado en la estructura del mensaje")
+                    item.setForeground(0, QColor(200, 80, 80))
+                if self.delimiters[0] in seg:
+                    item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+            else:
+                item.setText(0, f"[{node.name}] ({node.repetition + 1})")
+                item.setText(1, "Grupo")
+                item.setText(3, self.segments[self.first_segment(node)][:DETAIL_GROUP_PREVIEW])
+                item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+                self.groups.append(node)
+                node = -len(self.groups)
+            item.setData(0, Qt.ItemDataRole.UserRole, node)
+
+    def first_segment(self, group):
+        node = group
+        while not isinstance(node, int):
+            node = node.children[0]
+        return node
+
+    def segment_description(self, seg_name):
+        try:
+            return self.segment_descriptions[seg_name]
+        except KeyError:
+            pass
+        seg_desc = ""
+        seg_def = self.def_manager.load_segment_definition(self.version, seg_name)
+        if seg_def is not None:
+            seg_desc = seg_def.findtext("description", "")
+        self.segment_descriptions[seg_name] = seg_desc
+        return seg_desc
+
+    def expand_groups(self, parent_item):
+        for i in range(parent_item.childCount()):
+            item = parent_item.child(i)
+            if item.data(0, Qt.ItemDataRole.UserRole) < 0:
+                # Desplegar el grupo crea sus elementos (on_item_expanded)
+                item.setExpanded(True)
+                self.expand_groups(item)
+
+    def on_item_expanded(self, item):
+        if item.childCount():
+            return
+        node = item.data(0, Qt.ItemDataRole.UserRole)
+        if node is None:
+            return
+        if node >= 0:
+            self.populate_segment(item, self.segments[node])
+        else:
+            self.add_nodes(item, self.groups[-node - 1].children)
+
+    @traced("populate_segment")
+    def populate_segment(self, seg_item, seg):
+        """Añade al elemento de un segmento sus campos, repeticiones y componentes."""
+        field_sep, comp_sep, rep_sep, sub_sep = self.delimiters
+        version = self.version
+        fields = seg.split(field_sep)
+        seg_name = fields[0]
+        seg_def = self.def_manager.load_segment_definition(version, seg_name)
+
+        # Iterar campos
+        # Nota: MSH tiene un manejo especial de índices
+        # MSH-1 es el separador (|)
+        # MSH-2 son los encoding chars (^~\&)
+        # Si hago split('|'):
+        # "MSH|^~\&|SendingApp|..."
+        # [0] = MSH
+        # [1] = ^~\& (MSH-2)
+        # [2] = SendingApp (MSH-3)
+        # Entonces index i en fields corresponde a MSH-(i+1)
+        
+        start_index = 1
+        if seg_name == "MSH":
+            # MSH.1
+            msh1 = QTreeWidgetItem(seg_item)
+            msh1.setText(0, f"{seg_name}.1")
+            msh1.setText(1, "Field Separator")
+            msh1.setText(2, "ST")
+            msh1.setText(3, field_sep)
             
-            # Crear item raíz para el segmento
-            seg_desc = ""
-            if seg_def:
-                try:
-                    seg_desc = seg_def.find("description").text
-                except: pass
+            # MSH.2 (fields[1] en el split array es MSH.2)
+            if len(fields) > 1:
+                 msh2 = QTreeWidgetItem(seg_item)
+                 msh2.setText(0, f"{seg_name}.2")
+                 msh2.setText(1, "Encoding Characters")
+                 msh2.setText(2, "ST")
+                 msh2.setText(3, fields[1])
             
-            seg_item = QTreeWidgetItem(self.tree)
-            seg_item.setText(0, seg_name)
-            seg_item.setText(1, seg_desc)
-            seg_item.setText(3, seg) # Mostrar segmento completo en columna valor
+            start_index = 2 # Comenzar loop desde fields[2] que es MSH.3
+        
+        for i in range(start_index, len(fields)):
+            field_val = fields[i]
+            if not field_val: continue
             
-            # Iterar campos
-            # Nota: MSH tiene un manejo especial de índices
-            # MSH-1 es el separador (|)
-            # MSH-2 son los encoding chars (^~\&)
-            # MSH-3 es el primer campo real de datos después de encoding chars
-            # Sin embargo, el split('|') nos da:
-            # [0]=MSH, [1]=^~\&, [2]=SendingApp...
-            # Entonces fields[1] corresponde a MSH-3? No.
-            # fields[0] = "MSH"
-            # fields[1] = "|...|" (contenido entre pipes) -> MSH-3 (Sending App)
-            # ESPERA: MSH-1 es el pipe mismo. MSH-2 son los encoding chars.
-            # Si hago split('|'):
-            # "MSH|^~\&|SendingApp|..."
-            # [0] = MSH
-            # [1] = ^~\& (MSH-2)
-            # [2] = SendingApp (MSH-3)
-            # Entonces index i en fields corresponde a MSH-(i+1)
+            # Calcular índice HL7 real
+            # Para MSH: fields[2] (Sending App) es MSH.3 -> idx = i + 1
+            # Para otros (ej PID): fields[1] (Set ID) es PID.1 -> idx = i
+            hl7_idx = i + 1 if seg_name == "MSH" else i
             
-            start_index = 1
-            if seg_name == "MSH":
-                # Agregar manualmente MSH.1 y MSH.2 si se desea, o ajustar looping
-                # MSH.1
-                msh1 = QTreeWidgetItem(seg_item)
-                msh1.setText(0, f"{seg_name}.1")
-                msh1.setText(1, "Field Separator")
-                msh1.setText(2, "ST")
-                msh1.setText(3, field_sep)
-                
-                # MSH.2 (fields[1] en el split array es MSH.2)
-                if len(fields) > 1:
-                     msh2 = QTreeWidgetItem(seg_item)
-                     msh2.setText(0, f"{seg_name}.2")
-                     msh2.setText(1, "Encoding Characters")
-                     msh2.setText(2, "ST")
-                     msh2.setText(3, fields[1])
-                
-                start_index = 2 # Comenzar loop desde fields[2] que es MSH.3
+            desc, dt_type = self.def_manager.get_field_description(version, seg_name, hl7_idx, seg_def)
+            if not desc: desc = "Unknown"
+            if not dt_type: dt_type = ""
+
+            # Manejar repeticiones
+            repetitions = field_val.split(rep_sep)
             
-            for i in range(start_index, len(fields)):
-                field_val = fields[i]
-                if not field_val: continue
+            for rep_idx, rep_val in enumerate(repetitions):
+                display_idx = f"{seg_name}.{hl7_idx}"
+                if len(repetitions) > 1:
+                    display_idx += f"({rep_idx+1})"
+
+                field_item = QTreeWidgetItem(seg_item)
+                field_item.setText(0, display_idx)
+                field_item.setText(1, desc)
+                field_item.setText(2, dt_type)
+                field_item.setText(3, rep_val)
                 
-                # Calcular índice HL7 real
-                # Para MSH: fields[2] (Sending App) es MSH.3 -> idx = i + 1
-                # Para otros (ej PID): fields[1] (Set ID) es PID.1 -> idx = i
-                hl7_idx = i + 1 if seg_name == "MSH" else i
-                
-                # Manejar repeticiones
-                repetitions = field_val.split(rep_sep)
-                
-                for rep_idx, rep_val in enumerate(repetitions):
-                    display_idx = f"{seg_name}.{hl7_idx}"
-                    if len(repetitions) > 1:
-                        display_idx += f"({rep_idx+1})"
-                    
-                    desc, dt_type = self.def_manager.get_field_description(version, seg_name, hl7_idx)
-                    if not desc: desc = "Unknown"
-                    if not dt_type: dt_type = ""
-
-                    field_item = QTreeWidgetItem(seg_item)
-                    field_item.setText(0, display_idx)
-                    field_item.setText(1, desc)
-                    field_item.setText(2, dt_type)
-                    field_item.setText(3, rep_val)
-                    
-                    # Descomponer componentes si existen
-                    if comp_sep in rep_val:
-                        self.decompose_components(version, dt_type, rep_val, field_item, comp_sep, sub_sep, prefix=display_idx)
+                # Descomponer componentes si existen
+                if comp_sep in rep_val:
+                    self.decompose_components(version, dt_type, rep_val, field_item, comp_sep, sub_sep, prefix=display_idx)
 
+    @traced("decompose_components")
     def decompose_components(self, version, datatype, value, parent_item, comp_sep, sub_sep, prefix=""):
         components = value.split(comp_sep)
         for j, comp_val in enumerate(components):
@@ -660,6 +838,654 @@ class MessageDetailWindow(QMainWindow):
                     s_item.setText(3, sub_val)
 
 
+class ReceiverWindow(QMainWindow):
+    """Ventana del receptor MLLP: configuración, estadísticas en vivo y último mensaje recibido.
+
+    El receptor pertenece a la ventana principal y sigue activo aunque esta
+    ventana se cierre; las estadísticas se leen con un QTimer en lugar de
+    emitir una señal por cada mensaje.
+    """
+
+    def __init__(self, app_window):
+        super().__init__(app_window)
+        self.app_window = app_window
+        self.setGeometry(150, 150, 760, 480)
+        self.last_count = 0
+        self.last_shown = None
+
+        central = QWidget()
+        self.setCentralWidget(central)
+        layout = QVBoxLayout(central)
+
+        config_layout = QHBoxLayout()
+        self.ports_label = QLabel()
+        config_layout.addWidget(self.ports_label)
+        self.ports_entry = QLineEdit()
+        self.ports_entry.setMaximumWidth(140)
+        config_layout.addWidget(self.ports_entry)
+        self.journal_label = QLabel()
+        config_layout.addWidget(self.journal_label)
+        self.journal_entry = QLineEdit()
+        config_layout.addWidget(self.journal_entry)
+        self.ack_check = QCheckBox()
+        config_layout.addWidget(self.ack_check)
+        self.workspace_check = QCheckBox()
+        config_layout.addWidget(self.workspace_check)
+        self.start_button = QPushButton()
+        self.start_button.clicked.connect(self.toggle_receiver)
+        config_layout.addWidget(self.start_button)
+        layout.addLayout(config_layout)
+
+        self.stats_label = QLabel()
+        layout.addWidget(self.stats_label)
+        self.last_label = QLabel()
+        layout.addWidget(self.last_label)
+        self.last_text = QTextEdit()
+        self.last_text.setReadOnly(True)
+        self.last_text.setFont(QFont("Courier New", 10))
+        self.highlighter = Hl7Highlighter(self.last_text.document(), app_window.dark_mode,
+                                          app_window.hl7_def_manager.get_all_segments())
+        layout.addWidget(self.last_text)
+        self.to_editor_button = QPushButton()
+        self.to_editor_button.clicked.connect(self.copy_to_editor)
+        layout.addWidget(self.to_editor_button, alignment=Qt.AlignmentFlag.AlignRight)
+
+        config = app_window._read_settings().get("receiver", {})
+        self.ports_entry.setText(config.get("ports", "2575"))
+        self.journal_entry.setText(config.get("journal", RECEIVER_JOURNAL))
+        self.ack_check.setChecked(config.get("send_ack", True))
+        self.workspace_check.setChecked(config.get("to_workspace", False))
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(RECEIVER_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.retranslate_ui()
+        self.refresh()
+
+    def tr(self, key):
+        return self.app_window.tr(key)
+
+    def retranslate_ui(self):
+        self.setWindowTitle(self.tr("receiver_title"))
+        self.ports_label.setText(self.tr("receiver_ports"))
+        self.ports_entry.setToolTip(self.tr("receiver_ports_tooltip"))
+        self.journal_label.setText(self.tr("receiver_journal"))
+        self.ack_check.setText(self.tr("receiver_send_ack"))
+        self.workspace_check.setText(self.tr("receiver_to_workspace"))
+        self.to_editor_button.setText(self.tr("receiver_to_editor"))
+        self.update_controls()
+
+    def update_controls(self):
+        running = self.app_window.receiver is not None
+        self.start_button.setText(self.tr("receiver_stop") if running else self.tr("receiver_start"))
+        for widget in (self.ports_entry, self.journal_entry, self.ack_check, self.workspace_check):
+            widget.setEnabled(not running)
+
+    def toggle_receiver(self):
+        if self.app_window.receiver is not None:
+            self.app_window.stop_receiver()
+            self.update_controls()
+            return
+        try:
+            ports = [int(p) for p in self.ports_entry.text().replace(" ", "").split(",") if p]
+        except ValueError:
+            ports = []
+        if not ports or not all(0 < port < 65536 for port in ports):
+            QMessageBox.critical(self, self.tr("err_input_title"), self.tr("err_receiver_ports"))
+            return
+        config = {"ports": self.ports_entry.text(), "journal": self.journal_entry.text().strip(),
+                  "send_ack": self.ack_check.isChecked(), "to_workspace": self.workspace_check.isChecked()}
+        try:
+            self.app_window.start_receiver(ports, config["journal"], config["send_ack"], config["to_workspace"])
+        except OSError as e:
+            QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_receiver_start").format(e))
+            return
+        settings = self.app_window._read_settings()
+        settings["receiver"] = config
+        self.app_window._write_settings(settings)
+        self.last_count = 0
+        self.update_controls()
+
+    def refresh(self):
+        receiver = self.app_window.receiver
+        if receiver is None:
+            return
+        stats = receiver.stats
+        messages = stats.messages
+        rate = (messages - self.last_count) * 1000 / RECEIVER_REFRESH_MS
+        self.last_count = messages
+        acks = stats.acks
+        self.stats_label.setText(self.tr("receiver_stats").format(
+            messages, rate, stats.connections_active, stats.connections_total, stats.framing_errors,
+            acks.get(b"AA", 0), acks.get(b"AE", 0), acks.get(b"AR", 0)))
+        last = stats.last_message
+        # Sólo se redibuja el último mensaje si ha cambiado desde el refresco anterior
+        if last is not self.last_shown:
+            self.last_shown = last
+            self.last_label.setText(self.tr("receiver_last").format(stats.last_peer))
+            text = self.app_window.decode_bytes(last)
+            self.last_text.setPlainText(text.replace("\r", "\n"))
+
+    def copy_to_editor(self):
+        text = self.last_text.toPlainText()
+        if text:
+            self.app_window.msg_text.setPlainText(text)
+
+    def set_dark_mode(self, dark_mode):
+        self.highlighter.set_dark_mode(dark_mode)
+
+
+class WorkspaceModel(QAbstractTableModel):
+    """Modelo virtual sobre un `MessageStore`: sólo se leen los resúmenes de las filas que se pintan.
+
+    `rows` es None (todos los mensajes) o la lista de índices que pasan el filtro.
+    Sin filtro, `count` es el número de mensajes que conoce la vista: los que se
+    añaden al almacén se notifican después con `messages_appended`.
+    """
+
+    COLUMN_SIZE = 4
+    COLUMN_STATUS = 5
+
+    def __init__(self, store, headers, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.headers = headers
+        self.rows = None
+        self.count = len(store)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.count if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def message_index(self, row):
+        return row if self.rows is None else self.rows[row]
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            i = self.message_index(index.row())
+            if column == self.COLUMN_SIZE:
+                return str(self.store.size(i))
+            if column == self.COLUMN_STATUS:
+                return STATUS_LABELS[self.store.status(i)]
+            return self.store.summary(i)[column]
+        if role == Qt.ItemDataRole.TextAlignmentRole and column == self.COLUMN_SIZE:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def set_headers(self, headers):
+        self.headers = headers
+        self.headerDataChanged.emit(Qt.Orientation.Horizontal, 0, len(headers) - 1)
+
+    def set_rows(self, rows):
+        """Aplica un filtro (lista de índices) o lo quita (None)."""
+        self.beginResetModel()
+        self.rows = rows
+        self.count = len(self.store)
+        self.endResetModel()
+
+    def messages_appended(self):
+        """Añade al final las filas de los mensajes nuevos sin reiniciar la vista (conserva la selección)."""
+        total = len(self.store)
+        if self.rows is None and total > self.count:
+            self.beginInsertRows(QModelIndex(), self.count, total - 1)
+            self.count = total
+            self.endInsertRows()
+
+    def statuses_changed(self):
+        # La vista sólo vuelve a pedir las celdas visibles de la columna
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, self.COLUMN_STATUS),
+                                  self.index(self.rowCount() - 1, self.COLUMN_STATUS))
+
+
+class WorkspaceWindow(QMainWindow):
+    """Espacio de trabajo con muchos mensajes: carga por lotes, generación, filtro y envío de la selección.
+
+    Los cuerpos están en disco (`message_store`) y la tabla es virtual, así
+    que abrir, filtrar y seleccionar no depende del número de mensajes.
+    """
+
+    def __init__(self, app_window):
+        super().__init__(app_window)
+        self.app_window = app_window
+        self.store = app_window.get_workspace()
+        self.setGeometry(130, 130, 900, 560)
+
+        central = QWidget()
+        self.setCentralWidget(central)
+        layout = QVBoxLayout(central)
+
+        controls = QHBoxLayout()
+        self.filter_entry = QLineEdit()
+        self.filter_entry.setClearButtonEnabled(True)
+        self.filter_entry.textChanged.connect(lambda: self.filter_timer.start())
+        controls.addWidget(self.filter_entry)
+        self.load_button = QPushButton()
+        self.load_button.clicked.connect(self.load_files)
+        controls.addWidget(self.load_button)
+        self.generate_button = QPushButton()
+        self.generate_button.clicked.connect(self.generate_messages)
+        controls.addWidget(self.generate_button)
+        self.add_button = QPushButton()
+        self.add_button.clicked.connect(self.add_from_editor)
+        controls.addWidget(self.add_button)
+        self.clear_button = QPushButton()
+        self.clear_button.clicked.connect(self.clear_workspace)
+        controls.addWidget(self.clear_button)
+        self.fulltext_check = QCheckBox()
+        self.fulltext_check.setChecked(self.store.index is not None and self.store.index.fulltext)
+        self.fulltext_check.setEnabled(self.store.index is not None and fts5_available())
+        self.fulltext_check.toggled.connect(self.toggle_fulltext)
+        controls.addWidget(self.fulltext_check)
+        layout.addLayout(controls)
+
+        self.model = WorkspaceModel(self.store, self.tr("workspace_headers").split("|"), self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setWordWrap(False)
+        # Altura de fila fija: la vista no mide cada fila para calcular el scroll
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(self.table.fontMetrics().height() + 6)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        for column, width in enumerate((130, 90, 160, 220, 70)):
+            self.table.setColumnWidth(column, width)
+        self.table.doubleClicked.connect(lambda: self.open_in_editor())
+        layout.addWidget(self.table)
+
+        bottom = QHBoxLayout()
+        self.count_label = QLabel()
+        bottom.addWidget(self.count_label)
+        bottom.addStretch()
+        self.open_button = QPushButton()
+        self.open_button.clicked.connect(self.open_in_editor)
+        bottom.addWidget(self.open_button)
+        self.send_button = QPushButton()
+        self.send_button.clicked.connect(self.send_selected)
+        bottom.addWidget(self.send_button)
+        layout.addLayout(bottom)
+
+        # El filtro se aplica cuando se deja de escribir
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(WORKSPACE_FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        # Los ACK pueden llegar a cientos por segundo: la columna de estado se repinta por temporizador
+        self.statuses_dirty = False
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(WORKSPACE_REFRESH_MS)
+        self.status_timer.timeout.connect(self.refresh_statuses)
+        self.status_timer.start()
+        self.retranslate_ui()
+
+    def tr(self, key):
+        return self.app_window.tr(key)
+
+    def retranslate_ui(self):
+        self.setWindowTitle(self.tr("workspace_title"))
+        self.filter_entry.setPlaceholderText(self.tr("workspace_filter"))
+        self.load_button.setText(self.tr("workspace_load"))
+        self.generate_button.setText(self.tr("workspace_generate"))
+        self.add_button.setText(self.tr("workspace_add"))
+        self.clear_button.setText(self.tr("workspace_clear"))
+        self.fulltext_check.setText(self.tr("workspace_fulltext"))
+        self.fulltext_check.setToolTip(self.tr("workspace_fulltext_tooltip"))
+        self.open_button.setText(self.tr("workspace_open"))
+        self.send_button.setText(self.tr("workspace_send"))
+        self.model.set_headers(self.tr("workspace_headers").split("|"))
+        self.update_count()
+
+    def update_count(self):
+        self.count_label.setText(self.tr("workspace_count").format(len(self.store), self.model.rowCount()))
+
+    def apply_filter(self):
+        text = self.filter_entry.text().strip()
+        self.model.set_rows(self.store.search(text) if text else None)
+        self.update_count()
+
+    def messages_added(self):
+        if self.filter_entry.text().strip():
+            self.apply_filter()
+        else:
+            self.model.messages_appended()
+            self.update_count()
+
+    def toggle_fulltext(self, checked):
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            self.store.index.set_fulltext(checked)
+            # Al activarlo se indexan sólo los textos de los mensajes ya cargados
+            self.store.index.catch_up(self.store)
+        finally:
+            QApplication.restoreOverrideCursor()
+        settings = self.app_window._read_settings()
+        settings.setdefault("state", {})["workspace_fulltext"] = checked
+        self.app_window._write_settings(settings)
+        if self.filter_entry.text().strip():
+            self.apply_filter()
+
+    def refresh_statuses(self):
+        if self.statuses_dirty:
+            self.statuses_dirty = False
+            self.model.statuses_changed()
+
+    def selected_indices(self):
+        rows = sorted(index.row() for index in self.table.selectionModel().selectedRows())
+        return [self.model.message_index(row) for row in rows]
+
+    def load_files(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, self.tr("file_dialog_title"), "",
+                                                "HL7 (*.hl7 *.txt *.mllp);;Todos los Archivos (*)")
+        if not paths:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            for path in paths:
+                count = self.store.load_file(path)
+                self.app_window.set_status(self.tr("workspace_loaded").format(count, os.path.basename(path)), 5000)
+        except OSError as e:
+            QMessageBox.critical(self, self.tr("file_err_title"), self.tr("err_workspace").format(e))
+        finally:
+            QApplication.restoreOverrideCursor()
+            self.messages_added()
+
+    def generate_messages(self):
+        message_type, ok = QInputDialog.getText(self, self.tr("workspace_generate"),
+                                                self.tr("workspace_generate_type"), text="ADT^A01")
+        if not ok or not message_type.strip():
+            return
+        count, ok = QInputDialog.getInt(self, self.tr("workspace_generate"), self.tr("workspace_generate_count"),
+                                        1000, 1, 1000000)
+        if not ok:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            generator = MessageGenerator(self.app_window.hl7_def_manager, message_type.strip())
+            self.store.append_many(generator.generate(count))
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_workspace").format(e))
+        finally:
+            QApplication.restoreOverrideCursor()
+            self.messages_added()
+
+    def add_from_editor(self):
+        message = self.app_window.msg_text.toPlainText().strip()
+        if not message:
+            QMessageBox.warning(self, self.tr("err_msg_empty_title"), self.tr("err_msg_empty"))
+            return
+        encoding = self.app_window.text_encoding(message)
+        try:
+            self.store.append(encode_text(message, encoding))
+        except (LookupError, HL7EncodingError) as e:
+            QMessageBox.critical(self, self.tr("err_encoding_title"), self.tr("err_encoding_fail").format(encoding, e))
+            return
+        self.messages_added()
+
+    def open_in_editor(self):
+        indices = self.selected_indices()
+        if not indices:
+            return
+        text = self.app_window.decode_bytes(self.store.get(indices[0]))
+        self.app_window.msg_text.setPlainText(text.replace("\r", "\n"))
+        self.app_window.raise_()
+
+    def send_selected(self):
+        indices = self.selected_indices()
+        if indices:
+            self.app_window.send_workspace_messages(indices)
+
+    def clear_workspace(self):
+        if not len(self.store):
+            return
+        reply = QMessageBox.question(self, self.tr("workspace_clear"),
+                                     self.tr("workspace_confirm_clear").format(len(self.store)))
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        self.app_window.workspace_pending.clear()
+        self.store.clear()
+        self.apply_filter()
+
+
+class ProfilerWindow(QMainWindow):
+    """Activa el perfilado por fases (módulo `profiling`) y muestra el resumen por fase.
+
+    La tabla se refresca con un QTimer sólo mientras la ventana está visible y
+    el perfil completo se puede exportar en formato folded stacks para generar
+    un flame graph.
+    """
+
+    def __init__(self, app_window):
+        super().__init__(app_window)
+        self.app_window = app_window
+        self.setGeometry(170, 170, 720, 420)
+
+        central = QWidget()
+        self.setCentralWidget(central)
+        layout = QVBoxLayout(central)
+
+        controls = QHBoxLayout()
+        self.enable_check = QCheckBox()
+        self.enable_check.setChecked(profiling.is_enabled())
+        self.enable_check.toggled.connect(self.toggle_profiling)
+        controls.addWidget(self.enable_check)
+        controls.addStretch()
+        self.reset_button = QPushButton()
+        self.reset_button.clicked.connect(self.reset)
+        controls.addWidget(self.reset_button)
+        self.export_button = QPushButton()
+        self.export_button.clicked.connect(self.export_folded)
+        controls.addWidget(self.export_button)
+        layout.addLayout(controls)
+
+        self.table = QTableWidget(0, 6)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(PROFILER_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.retranslate_ui()
+        self.refresh()
+
+    def tr(self, key):
+        return self.app_window.tr(key)
+
+    def retranslate_ui(self):
+        self.setWindowTitle(self.tr("profiler_title"))
+        self.enable_check.setText(self.tr("profiler_enable"))
+        self.reset_button.setText(self.tr("profiler_reset"))
+        self.export_button.setText(self.tr("profiler_export"))
+        self.table.setHorizontalHeaderLabels(self.tr("profiler_headers").split("|"))
+
+    def toggle_profiling(self, checked):
+        if checked:
+            profiling.enable()
+        else:
+            profiling.disable()
+        self.refresh()
+
+    def reset(self):
+        profiling.reset()
+        self.refresh()
+
+    def refresh(self):
+        rows = profiling.summary()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            values = (row["phase"], str(row["calls"]), f"{row['total_ns'] / 1e6:.1f}",
+                      f"{row['self_ns'] / 1e6:.1f}", f"{row['total_ns'] / row['calls'] / 1e3:.1f}",
+                      f"{row['max_ns'] / 1e3:.0f}")
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(i, column, item)
+
+    def export_folded(self):
+        path, _ = QFileDialog.getSaveFileName(self, self.tr("profiler_export_title"), "hl7_profile.folded",
+                                              "Folded stacks (*.folded *.txt);;All Files (*)")
+        if not path:
+            return
+        try:
+            count = profiling.write_folded(path)
+        except OSError as e:
+            QMessageBox.critical(self, self.tr("warn_title"), self.tr("profiler_export_err").format(e))
+            return
+        self.app_window.set_status(self.tr("profiler_exported").format(path, count), 5000)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+
+class DiffWindow(QMainWindow):
+    """Comparación estructural de dos mensajes (módulo `hl7_diff`).
+
+    La columna izquierda es la referencia; las diferencias se listan por
+    segmento con la ruta y la descripción del campo o componente.
+    """
+
+    KINDS = (KIND_CHANGED, KIND_ADDED, KIND_REMOVED)
+
+    def __init__(self, app_window):
+        super().__init__(app_window)
+        self.app_window = app_window
+        self.setGeometry(140, 140, 1000, 700)
+
+        central = QWidget()
+        self.setCentralWidget(central)
+        layout = QVBoxLayout(central)
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        layout.addWidget(splitter)
+
+        editors = QWidget()
+        editors_layout = QHBoxLayout(editors)
+        editors_layout.setContentsMargins(0, 0, 0, 0)
+        self.left_label = QLabel()
+        self.right_label = QLabel()
+        self.left_text = QTextEdit()
+        self.right_text = QTextEdit()
+        for label, text in ((self.left_label, self.left_text), (self.right_label, self.right_text)):
+            text.setAcceptRichText(False)
+            text.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+            text.setFont(QFont("Courier New", 10))
+            column = QVBoxLayout()
+            column.addWidget(label)
+            column.addWidget(text)
+            editors_layout.addLayout(column)
+        splitter.addWidget(editors)
+
+        results = QWidget()
+        results_layout = QVBoxLayout(results)
+        results_layout.setContentsMargins(0, 0, 0, 0)
+        controls = QHBoxLayout()
+        self.from_editor_button = QPushButton()
+        self.from_editor_button.clicked.connect(self.load_from_editor)
+        controls.addWidget(self.from_editor_button)
+        self.swap_button = QPushButton()
+        self.swap_button.clicked.connect(self.swap)
+        controls.addWidget(self.swap_button)
+        self.ignore_edit = QLineEdit()
+        controls.addWidget(self.ignore_edit, 1)
+        self.run_button = QPushButton()
+        self.run_button.clicked.connect(self.run_diff)
+        controls.addWidget(self.run_button)
+        results_layout.addLayout(controls)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
+        results_layout.addWidget(self.table)
+        self.summary_label = QLabel()
+        results_layout.addWidget(self.summary_label)
+        splitter.addWidget(results)
+
+        self.retranslate_ui()
+        self.load_from_editor()
+
+    def tr(self, key):
+        return self.app_window.tr(key)
+
+    def retranslate_ui(self):
+        self.setWindowTitle(self.tr("diff_title"))
+        self.left_label.setText(self.tr("diff_left"))
+        self.right_label.setText(self.tr("diff_right"))
+        self.from_editor_button.setText(self.tr("diff_from_editor"))
+        self.swap_button.setText(self.tr("diff_swap"))
+        self.run_button.setText(self.tr("diff_run"))
+        self.ignore_edit.setPlaceholderText(self.tr("diff_ignore"))
+        self.table.setHorizontalHeaderLabels(self.tr("diff_headers").split("|"))
+
+    def load_from_editor(self):
+        self.left_text.setPlainText(self.app_window.msg_text.toPlainText())
+
+    def swap(self):
+        left = self.left_text.toPlainText()
+        self.left_text.setPlainText(self.right_text.toPlainText())
+        self.right_text.setPlainText(left)
+
+    def run_diff(self):
+        left_text = self.left_text.toPlainText().strip()
+        right_text = self.right_text.toPlainText().strip()
+        encoding = self.app_window.text_encoding(left_text)
+        try:
+            left = encode_text(left_text, encoding)
+            right = encode_text(right_text, self.app_window.text_encoding(right_text))
+            differ = MessageDiffer(self.app_window.hl7_def_manager, ignore=self.ignore_edit.text().split(),
+                                   encoding=encoding)
+            differences = differ.diff(left, right)
+        except ValueError as e:
+            QMessageBox.warning(self, self.tr("warn_title"), self.tr("err_diff").format(e))
+            return
+        kinds = dict(zip(self.KINDS, self.tr("diff_kinds").split("|")))
+        colors = {KIND_ADDED: QColor("#2e7d32"), KIND_REMOVED: QColor("#c62828")}
+        self.table.setRowCount(len(differences))
+        for row, difference in enumerate(differences):
+            values = (kinds[difference.kind], difference.path, difference.description,
+                      difference.left or "", difference.right or "")
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if difference.kind in colors:
+                    item.setForeground(colors[difference.kind])
+                self.table.setItem(row, column, item)
+        self.table.resizeColumnToContents(1)
+        self.summary_label.setText(self.tr("diff_result").format(len(differences)) if differences
+                                   else self.tr("diff_equal"))
+
+
+class QueueEventBridge(QObject):
+    """Reenvía al hilo de la GUI los eventos emitidos por los hilos de las colas."""
+    event = pyqtSignal(str, str, int, str)
+
+
+class ValidationBridge(QObject):
+    """Reenvía al hilo de la GUI el resultado de una validación en segundo plano."""
+    finished = pyqtSignal(int, object, object)
+
+
 class HL7SenderApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -703,11 +1529,37 @@ class HL7SenderApp(QMainWindow):
         settings = self._read_settings()
         self.dark_mode = settings.get("state", {}).get("dark_mode", False)
         
+        # Inicializar Definition Manager (su índice da el vocabulario de segmentos a los resaltadores)
+        # Usar get_resource_path con cadena vacía o '.' para obtener el base_path correcto
+        base_path = get_resource_path(".")
+        # Con los overlays de definiciones (Z-segments...) del perfil seleccionado
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        self.hl7_def_manager = HL7DefinitionManager(base_path, profile.get("definitions", []))
+        segments = self.hl7_def_manager.get_all_segments()
+
         # Instanciar el resaltador de sintaxis para el editor de mensajes
-        self.hl7_highlighter = Hl7Highlighter(self.msg_text.document(), self.dark_mode)
+        self.hl7_highlighter = Hl7Highlighter(self.msg_text.document(), self.dark_mode, segments)
         
         # Instanciar el resaltador de sintaxis para la respuesta ACK
-        self.hl7_response_highlighter = Hl7Highlighter(self.resp_text.document(), self.dark_mode)
+        self.hl7_response_highlighter = Hl7Highlighter(self.resp_text.document(), self.dark_mode, segments)
+
+        # Validación en vivo: al dejar de escribir se valida el mensaje en un hilo de trabajo. El
+        # validador guarda en caché cada segmento, así que sólo se comprueban las líneas editadas. Tiene su
+        # propio gestor de definiciones: el de la interfaz no se puede usar a la vez desde otro hilo
+        self.live_validation = settings.get("state", {}).get("live_validation", True)
+        self.live_validation_action.setChecked(self.live_validation)
+        self.validator = MessageValidator(HL7DefinitionManager(base_path, self.hl7_def_manager.overlays))
+        self.validation_executor = ThreadPoolExecutor(max_workers=1)
+        self.validation_generation = 0
+        self.validation_bridge = ValidationBridge()
+        self.validation_bridge.finished.connect(self.on_validation_finished)
+        self.validation_timer = QTimer(self)
+        self.validation_timer.setSingleShot(True)
+        self.validation_timer.setInterval(VALIDATION_DELAY_MS)
+        self.validation_timer.timeout.connect(self.start_validation)
+        self.msg_text.textChanged.connect(self.schedule_validation)
+        self.msg_text.cursorPositionChanged.connect(self.show_cursor_issues)
+        self.schedule_validation()
         
         # Aplicar el tema inicial
         self.apply_theme()
@@ -718,13 +1570,29 @@ class HL7SenderApp(QMainWindow):
         # Restaurar geometría de la ventana
         self.restore_window_geometry()
         
-        # Inicializar Definition Manager
-        # Asumiendo que 'reference' está en el mismo directorio que el script
-        
-        # Inicializar Definition Manager
-        # Usar get_resource_path con cadena vacía o '.' para obtener el base_path correcto
-        base_path = get_resource_path(".")
-        self.hl7_def_manager = HL7DefinitionManager(base_path)
+        # Colas store-and-forward: spool_dir -> (OutboundQueue, QueueDrainer)
+        self.queues = {}
+        # Resumen compacto de ACKs por cola: spool_dir -> (host:puerto, AckCapture)
+        self.ack_captures = {}
+        self.ack_summary_dirty = False
+        self.ack_summary_timer = QTimer(self)
+        self.ack_summary_timer.setInterval(ACK_SUMMARY_REFRESH_MS)
+        self.ack_summary_timer.timeout.connect(self.refresh_ack_summary)
+        self._transformer_cache = (None, None)
+        self.receiver = None
+        self.receiver_journal = None
+        # Espacio de trabajo (se abre al usarlo) y (destino, seq de la cola) -> índice del mensaje
+        self.workspace = None
+        self.workspace_pending = {}
+        # Mensajes recibidos pendientes de pasar al espacio de trabajo (los añade el hilo del receptor)
+        self.received_messages = deque()
+        self.received_timer = QTimer(self)
+        self.received_timer.setInterval(RECEIVER_REFRESH_MS)
+        self.received_timer.timeout.connect(self.drain_received)
+        self.connection_pool = ConnectionPool()
+        self.queue_bridge = QueueEventBridge()
+        self.queue_bridge.event.connect(self.on_queue_event)
+        self.resume_queues()
 
     def create_menus(self):
         menubar = self.menuBar()
@@ -736,6 +1604,11 @@ class HL7SenderApp(QMainWindow):
         self.load_action.setShortcut("Ctrl+O")
         self.load_action.triggered.connect(self.load_message_from_file)
         self.file_menu.addAction(self.load_action)
+
+        self.workspace_action = QAction(self.tr("menu_workspace"), self)
+        self.workspace_action.setShortcut("Ctrl+Shift+W")
+        self.workspace_action.triggered.connect(self.show_workspace_window)
+        self.file_menu.addAction(self.workspace_action)
         
         self.file_menu.addSeparator()
         
@@ -754,8 +1627,13 @@ class HL7SenderApp(QMainWindow):
         
         self.format_action = QAction(self.tr("menu_format"), self)
         self.format_action.setShortcut("Ctrl+F")
-        self.format_action.triggered.connect(self.format_message_for_display)
+        # Con lambda: la señal pasa `checked` y la firma del método decorado con @traced no lo admite
+        self.format_action.triggered.connect(lambda: self.format_message_for_display())
         self.message_menu.addAction(self.format_action)
+
+        self.diff_action = QAction(self.tr("menu_diff"), self)
+        self.diff_action.triggered.connect(self.show_diff_window)
+        self.message_menu.addAction(self.diff_action)
         
         # Menú Conexión
         self.connection_menu = menubar.addMenu(self.tr("menu_conn"))
@@ -769,6 +1647,13 @@ class HL7SenderApp(QMainWindow):
         self.send_action.setShortcut("Ctrl+Return")
         self.send_action.triggered.connect(self.send_message)
         self.connection_menu.addAction(self.send_action)
+
+        self.connection_menu.addSeparator()
+
+        self.receiver_action = QAction(self.tr("menu_receiver"), self)
+        self.receiver_action.setShortcut("Ctrl+R")
+        self.receiver_action.triggered.connect(self.show_receiver_window)
+        self.connection_menu.addAction(self.receiver_action)
         
         # Menú Perfiles
         self.profiles_menu = menubar.addMenu(self.tr("menu_profiles"))
@@ -803,6 +1688,17 @@ class HL7SenderApp(QMainWindow):
         self.zoom_out_action.setShortcut(QKeySequence.StandardKey.ZoomOut)
         self.zoom_out_action.triggered.connect(self.zoom_out)
         self.view_menu.addAction(self.zoom_out_action)
+
+        self.view_menu.addSeparator()
+
+        self.profiler_action = QAction(self.tr("menu_profiler"), self)
+        self.profiler_action.triggered.connect(self.show_profiler_window)
+        self.view_menu.addAction(self.profiler_action)
+
+        self.live_validation_action = QAction(self.tr("menu_live_validation"), self)
+        self.live_validation_action.setCheckable(True)
+        self.live_validation_action.triggered.connect(self.toggle_live_validation)
+        self.view_menu.addAction(self.live_validation_action)
         
         # Menú Idioma
         self.lang_menu = self.view_menu.addMenu("&Idioma")
@@ -852,13 +1748,22 @@ class HL7SenderApp(QMainWindow):
         self.encoding_label = QLabel(self.tr("encoding"))
         config_layout.addWidget(self.encoding_label)
         self.encoding_combo = QComboBox()
-        self.encoding_combo.addItems(["utf-8", "iso-8859-1", "cp1252", "ascii"])
+        self.encoding_combo.addItems(["utf-8", "iso-8859-1", "cp1252", "ascii", ENCODING_AUTO])
         config_layout.addWidget(self.encoding_combo)
 
         # Expect ACK
         self.expect_ack_check = QCheckBox(self.tr("expect_ack"))
         config_layout.addWidget(self.expect_ack_check)
 
+        # Store-and-forward
+        self.queue_check = QCheckBox(self.tr("use_queue"))
+        self.queue_check.setToolTip(self.tr("use_queue_tooltip"))
+        config_layout.addWidget(self.queue_check)
+
+        self.tls_check = QCheckBox(self.tr("use_tls"))
+        self.tls_check.setToolTip(self.tr("use_tls_tooltip"))
+        config_layout.addWidget(self.tls_check)
+
         self.config_group.setLayout(config_layout)
         self.layout.addWidget(self.config_group)
 
@@ -926,7 +1831,7 @@ class HL7SenderApp(QMainWindow):
         btn_layout.addWidget(self.paste_clipboard_btn)
         
         self.format_msg_btn = QPushButton(self.tr("format_btn"))
-        self.format_msg_btn.clicked.connect(self.format_message_for_display)
+        self.format_msg_btn.clicked.connect(lambda: self.format_message_for_display())
         btn_layout.addWidget(self.format_msg_btn)
 
         self.detail_btn = QPushButton("Detalle del Mensaje")
@@ -948,6 +1853,22 @@ class HL7SenderApp(QMainWindow):
         """Muestra un mensaje en la barra de estado."""
         self.statusBar().showMessage(message, timeout)
 
+    def text_encoding(self, text):
+        """Codificación con la que se envía un texto del editor.
+
+        En automático es la que declara MSH-18 o UTF-8 si no declara ninguna.
+        """
+        encoding = self.encoding_combo.currentText()
+        if encoding != ENCODING_AUTO:
+            return encoding
+        head = text[:1024].replace("\n", "\r").encode("latin-1", errors="replace")
+        return declared_charset(head) or "utf-8"
+
+    def decode_bytes(self, data):
+        """Texto de un mensaje recibido o leído de disco con su juego de caracteres detectado."""
+        encoding = self.encoding_combo.currentText()
+        return decode_message(data, None if encoding == ENCODING_AUTO else encoding)
+
     def set_response_text(self, message):
         """Muestra un mensaje en el área de texto de respuesta."""
         self.resp_text.setPlainText(message)
@@ -957,10 +1878,10 @@ class HL7SenderApp(QMainWindow):
         file_path, _ = QFileDialog.getOpenFileName(self, self.tr("file_dialog_title"), "", "Archivos de Texto (*.txt *.hl7);;Todos los Archivos (*)")
         if file_path:
             try:
-                # Usar la codificación seleccionada en la UI para leer el archivo
+                # Juego de caracteres detectado (BOM, MSH-18 o heurística; la selección de la UI como preferencia)
                 encoding = self.encoding_combo.currentText()
-                with open(file_path, 'r', encoding=encoding) as f:
-                    message = f.read()
+                with open(file_path, 'rb') as f:
+                    message = self.decode_bytes(f.read())
                 self.msg_text.setPlainText(message)
                 self.set_status(self.tr("status_file_loaded").format(os.path.basename(file_path)), timeout=5000)
             except Exception as e:
@@ -982,6 +1903,7 @@ class HL7SenderApp(QMainWindow):
             self.resp_text.clear() # Limpiar respuesta al limpiar
             self.set_status(self.tr("status_msg_empty"), timeout=3000)
 
+    @traced("format_message_for_display")
     def format_message_for_display(self):
         """Formatea un mensaje HL7 de una sola línea, separando los segmentos para una mejor legibilidad."""
         self.resp_text.clear() # Limpiar respuesta al formatear
@@ -991,13 +1913,10 @@ class HL7SenderApp(QMainWindow):
         temp_sep = "|||TEMP_SEP|||"
         text = current_message.replace('\r', temp_sep).replace('\n', temp_sep)
 
-        # 2. Insertar el separador temporal antes de cada ID de segmento HL7.
-        segments_pattern = '|'.join(Hl7Highlighter.HL7_SEGMENTS)
-        # Se usa un lookbehind negativo `(?<![A-Za-z])` para asegurar que el segmento
-        # no es parte de una palabra más larga (ej. no encontrar 'LOC' en 'LOCAL').
-        regex = re.compile(r"(?<![A-Za-z])(%s\|)" % segments_pattern)
-        
-        text_with_seps = regex.sub(lambda m: temp_sep + m.group(1), text)
+        # 2. Insertar el separador temporal antes de cada ID de segmento HL7 conocido.
+        segments = self.hl7_def_manager.get_all_segments()
+        text_with_seps = SEGMENT_START_PATTERN.sub(
+            lambda m: temp_sep + m.group(0) if is_segment_id(m.group(1), segments) else m.group(0), text)
 
         # 3. Dividir el texto por el separador, limpiar y unir con saltos de línea.
         parts = [part.strip() for part in text_with_seps.split(temp_sep) if part.strip()]
@@ -1067,6 +1986,8 @@ class HL7SenderApp(QMainWindow):
             self.timeout_entry.setText("10")
             self.encoding_combo.setCurrentText("utf-8")
             self.expect_ack_check.setChecked(True)
+            self.queue_check.setChecked(False)
+            self.tls_check.setChecked(False)
 
         self.msg_text.setText(settings.get("state", {}).get("last_message", ""))
         
@@ -1111,6 +2032,9 @@ class HL7SenderApp(QMainWindow):
         # print(f"DEBUG: Check Path: '{path}'")
         # print(f"DEBUG: Exists? {os.path.isdir(path)}")
         
+        # Recoger los cambios en los overlays de definiciones del perfil
+        if self.hl7_def_manager.refresh():
+            self.update_segment_vocabulary()
         if not self.hl7_def_manager.is_version_available(version):
             QMessageBox.warning(self, "Definiciones Faltantes", 
                 f"No se pueden cargar los detalles: No se encontraron definiciones para la versión HL7 {version}.\n"
@@ -1135,6 +2059,9 @@ class HL7SenderApp(QMainWindow):
              except RuntimeError:
                  pass # El objeto C++ ya fue eliminado
 
+        if getattr(self, "receiver_window", None) is not None:
+            self.receiver_window.set_dark_mode(self.dark_mode)
+
         # Guardar la preferencia
         settings = self._read_settings()
         if "state" not in settings:
@@ -1210,6 +2137,10 @@ class HL7SenderApp(QMainWindow):
         
         # Checkbox y Tooltips
         self.expect_ack_check.setText(self.tr("expect_ack"))
+        self.queue_check.setText(self.tr("use_queue"))
+        self.queue_check.setToolTip(self.tr("use_queue_tooltip"))
+        self.tls_check.setText(self.tr("use_tls"))
+        self.tls_check.setToolTip(self.tr("use_tls_tooltip"))
         self.profiles_combo.setToolTip(self.tr("profile_tooltip"))
         
         # Botones
@@ -1237,15 +2168,24 @@ class HL7SenderApp(QMainWindow):
         
         self.file_menu.setTitle(self.tr("menu_file"))
         self.load_action.setText(self.tr("menu_load"))
+        self.workspace_action.setText(self.tr("menu_workspace"))
+        if getattr(self, "workspace_window", None) is not None:
+            self.workspace_window.retranslate_ui()
         self.exit_action.setText(self.tr("menu_exit"))
         
         self.message_menu.setTitle(self.tr("menu_msg"))
         self.paste_action.setText(self.tr("menu_paste"))
         self.format_action.setText(self.tr("menu_format"))
+        self.diff_action.setText(self.tr("menu_diff"))
+        if getattr(self, "diff_window", None) is not None:
+            self.diff_window.retranslate_ui()
         
         self.connection_menu.setTitle(self.tr("menu_conn"))
         self.test_action.setText(self.tr("menu_test"))
         self.send_action.setText(self.tr("menu_send"))
+        self.receiver_action.setText(self.tr("menu_receiver"))
+        if getattr(self, "receiver_window", None) is not None:
+            self.receiver_window.retranslate_ui()
         
         self.profiles_menu.setTitle(self.tr("menu_profiles"))
         self.save_profile_action.setText(self.tr("menu_save_profile"))
@@ -1255,6 +2195,10 @@ class HL7SenderApp(QMainWindow):
         self.dark_mode_action.setText(self.tr("menu_dark_mode"))
         self.zoom_in_action.setText(self.tr("menu_zoom_in"))
         self.zoom_out_action.setText(self.tr("menu_zoom_out"))
+        self.profiler_action.setText(self.tr("menu_profiler"))
+        self.live_validation_action.setText(self.tr("menu_live_validation"))
+        if getattr(self, "profiler_window", None) is not None:
+            self.profiler_window.retranslate_ui()
         self.lang_menu.setTitle(self.tr("menu_lang"))
 
     def _populate_profiles_combo(self):
@@ -1279,6 +2223,9 @@ class HL7SenderApp(QMainWindow):
             self.timeout_entry.setText(profile.get("timeout", ""))
             self.encoding_combo.setCurrentText(profile.get("encoding", "utf-8"))
             self.expect_ack_check.setChecked(profile.get("expect_ack", True))
+            self.queue_check.setChecked(profile.get("use_queue", False))
+            self.tls_check.setChecked(profile.get("tls", {}).get("enabled", False))
+            self.apply_definition_overlays(profile)
             self.set_status(self.tr("status_loaded").format(profile_name), 5000)
 
     def save_profile(self):
@@ -1289,13 +2236,22 @@ class HL7SenderApp(QMainWindow):
             if "profiles" not in settings:
                 settings["profiles"] = {}
 
-            settings["profiles"][profile_name] = {
+            new_profile = {
                 "ip": self.ip_entry.text(),
                 "port": self.port_entry.text(),
                 "timeout": self.timeout_entry.text(),
                 "encoding": self.encoding_combo.currentText(),
                 "expect_ack": self.expect_ack_check.isChecked(),
+                "use_queue": self.queue_check.isChecked(),
             }
+            # Conservar la política de reintentos, las transformaciones, el límite de ritmo, los overlays
+            # de definiciones, la captura de ACKs y los certificados TLS (sólo editables en el JSON)
+            old_profile = settings["profiles"].get(profile_name, {})
+            for key in ("retry_policy", "transforms", "rate_limit", "definitions", "ack_capture"):
+                if key in old_profile:
+                    new_profile[key] = old_profile[key]
+            new_profile["tls"] = dict(old_profile.get("tls", {}), enabled=self.tls_check.isChecked())
+            settings["profiles"][profile_name] = new_profile
             
             self._write_settings(settings)
             self._populate_profiles_combo()
@@ -1350,6 +2306,8 @@ class HL7SenderApp(QMainWindow):
                         self.timeout_entry.clear()
                         self.encoding_combo.setCurrentIndex(0)
                         self.expect_ack_check.setChecked(True)
+                        self.queue_check.setChecked(False)
+                        self.tls_check.setChecked(False)
                         self.set_status(self.tr("status_all_deleted"), 5000)
                 else:
                     QMessageBox.critical(self, self.tr("critical_error_title"), self.tr("err_delete_profile_file").format(profile_name))
@@ -1364,7 +2322,9 @@ class HL7SenderApp(QMainWindow):
             settings["state"] = {}
         
         settings["state"]["last_profile"] = self.profiles_combo.currentText()
-        settings["state"]["last_message"] = self.msg_text.toPlainText()
+        message = self.msg_text.toPlainText()
+        # Un lote grande no debe acabar en el JSON de configuración
+        settings["state"]["last_message"] = message if len(message) <= LAST_MESSAGE_MAX_CHARS else ""
         settings["state"]["splitter_sizes"] = self.text_splitter.sizes()
         
         # Guardar geometría de la ventana
@@ -1378,10 +2338,400 @@ class HL7SenderApp(QMainWindow):
         
         self._write_settings(settings)
 
+    def schedule_validation(self):
+        if self.live_validation:
+            self.validation_timer.start()
+
+    def start_validation(self):
+        """Valida en el hilo de trabajo una copia de las líneas del editor."""
+        # Un overlay modificado invalida sólo sus definiciones (y los resultados del validador)
+        if self.hl7_def_manager.refresh():
+            self.update_segment_vocabulary()
+        self.validation_generation += 1
+        generation = self.validation_generation
+        lines = self.msg_text.toPlainText().split("\n")
+        future = self.validation_executor.submit(self._validate_lines, self.hl7_def_manager.overlays, lines)
+        future.add_done_callback(lambda f: self.validation_bridge.finished.emit(generation, lines, f))
+
+    def _validate_lines(self, overlays, lines):
+        """Se ejecuta en el hilo de validación: aplica allí los overlays actuales y valida las líneas."""
+        def_manager = self.validator.def_manager
+        if not def_manager.set_overlays(overlays):
+            def_manager.refresh()
+        return self.validator.validate_lines(lines)
+
+    def on_validation_finished(self, generation, lines, future):
+        # Un resultado de un texto que ya se ha vuelto a editar se descarta
+        if generation != self.validation_generation or not self.live_validation:
+            return
+        try:
+            results = future.result()
+        except Exception as e:
+            self.set_status(self.tr("status_validation_err").format(e), 5000)
+            return
+        self.hl7_highlighter.set_issues({number: (lines[number], issues) for number, issues in results.items()})
+        self.show_cursor_issues()
+
+    def apply_definition_overlays(self, profile):
+        """Aplica los overlays de definiciones ("definitions") de un perfil."""
+        # load_profile se llama también al arrancar, antes de crear el gestor de definiciones
+        if getattr(self, "hl7_def_manager", None) is None:
+            return
+        if self.hl7_def_manager.set_overlays(profile.get("definitions", [])):
+            self.update_segment_vocabulary()
+            self.schedule_validation()
+
+    def update_segment_vocabulary(self):
+        """Pasa a los resaltadores el vocabulario de segmentos tras un cambio en los overlays."""
+        segments = self.hl7_def_manager.get_all_segments()
+        highlighters = [self.hl7_highlighter, self.hl7_response_highlighter]
+        if getattr(self, "receiver_window", None) is not None:
+            highlighters.append(self.receiver_window.highlighter)
+        for highlighter in highlighters:
+            if highlighter.segments != segments:
+                highlighter.segments = segments
+                highlighter.rehighlight()
+
+    def describe_issue(self, issue):
+        return self.tr("val_" + issue.code).format(issue.location, issue.detail)
+
+    def show_cursor_issues(self):
+        """Muestra en la barra de estado el problema de validación bajo el cursor."""
+        cursor = self.msg_text.textCursor()
+        block = cursor.block()
+        entry = self.hl7_highlighter.issues.get(block.blockNumber())
+        if entry is None or entry[0] != block.text():
+            return
+        pos = cursor.positionInBlock()
+        issues = [issue for issue in entry[1] if issue.start <= pos <= issue.end]
+        if issues:
+            self.set_status(" · ".join(self.describe_issue(issue) for issue in issues), 5000)
+
+    def toggle_live_validation(self):
+        self.live_validation = self.live_validation_action.isChecked()
+        if self.live_validation:
+            self.start_validation()
+        else:
+            self.validation_timer.stop()
+            self.hl7_highlighter.set_issues({})
+        settings = self._read_settings()
+        settings.setdefault("state", {})["live_validation"] = self.live_validation
+        self._write_settings(settings)
+
     def closeEvent(self, event):
         self.save_state()
+        self.validation_executor.shutdown(wait=False, cancel_futures=True)
+        self.stop_queues()
+        self.stop_receiver()
+        self.connection_pool.close_all()
+        if self.workspace is not None:
+            self.workspace.close()
         super().closeEvent(event)
 
+    def show_receiver_window(self):
+        if getattr(self, "receiver_window", None) is None:
+            self.receiver_window = ReceiverWindow(self)
+        self.receiver_window.show()
+        self.receiver_window.raise_()
+
+    def get_workspace(self):
+        if self.workspace is None:
+            fulltext = self._read_settings().get("state", {}).get("workspace_fulltext", False)
+            self.workspace = MessageStore(WORKSPACE_DIR, indexed=True, fulltext=fulltext and fts5_available())
+        return self.workspace
+
+    def drain_received(self):
+        """Pasa al espacio de trabajo (e índice) los mensajes recibidos desde el último refresco."""
+        if not self.received_messages:
+            return
+        batch = []
+        while self.received_messages:
+            batch.append(self.received_messages.popleft())
+        try:
+            self.get_workspace().append_many(batch)
+        except OSError as e:
+            self.set_status(self.tr("err_workspace").format(e), 5000)
+            return
+        if getattr(self, "workspace_window", None) is not None:
+            self.workspace_window.messages_added()
+
+    def show_workspace_window(self):
+        if getattr(self, "workspace_window", None) is None:
+            try:
+                self.workspace_window = WorkspaceWindow(self)
+            except OSError as e:
+                QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_workspace").format(e))
+                return
+        self.workspace_window.show()
+        self.workspace_window.raise_()
+
+    def send_workspace_messages(self, indices):
+        """Encola mensajes del espacio de trabajo hacia el destino actual (envío en segundo plano)."""
+        ip = self.ip_entry.text()
+        try:
+            port = int(self.port_entry.text())
+            timeout = float(self.timeout_entry.text())
+        except ValueError:
+            QMessageBox.critical(self, self.tr("err_input_title"), self.tr("err_port_timeout_num"))
+            return
+        encoding = self.encoding_combo.currentText()
+        store = self.get_workspace()
+        transformers = {}
+
+        def transform(data):
+            # En automático las reglas escriben sus valores en el juego de caracteres de cada mensaje
+            codec = detect_charset(data).codec if encoding == ENCODING_AUTO else encoding
+            transformer = transformers.get(codec)
+            if transformer is None:
+                transformer = transformers[codec] = self._current_transformer(codec)
+            return transformer.apply(data)
+
+        try:
+            queue = self.get_queue(ip, port, timeout, self.expect_ack_check.isChecked(),
+                                   self._current_retry_policy(), self._current_tls(), self._current_rate_limit(),
+                                   self._current_ack_capture())
+            label = f"{ip}:{port}"
+            for start in range(0, len(indices), 1024):
+                batch = indices[start:start + 1024]
+                seqs = queue.enqueue_many([transform(store.get(i)) for i in batch])
+                for seq, index in zip(seqs, batch):
+                    self.workspace_pending[(label, seq)] = index
+                store.set_status_many(batch, STATUS_QUEUED)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_queue").format(e))
+            return
+        finally:
+            if getattr(self, "workspace_window", None) is not None:
+                self.workspace_window.statuses_dirty = True
+        self.set_status(self.tr("workspace_queued").format(len(indices), ip, port, len(queue)), 5000)
+
+    def _update_workspace_status(self, kind, label, seq, detail):
+        """Refleja en el espacio de trabajo el resultado de un mensaje encolado desde él."""
+        key = (label, seq)
+        index = self.workspace_pending.get(key)
+        if index is None:
+            return
+        if kind == "sent":
+            status = STATUS_BY_LABEL.get(detail, STATUS_SENT)
+        else:
+            # detail es "resultado: texto" (AE, AR, timeout o refused)
+            status = STATUS_BY_LABEL.get(detail.split(":", 1)[0].upper(), STATUS_ERROR)
+        if kind != "retry":
+            del self.workspace_pending[key]
+        if index < len(self.workspace):
+            self.workspace.set_status(index, status)
+            if getattr(self, "workspace_window", None) is not None:
+                self.workspace_window.statuses_dirty = True
+
+    def show_diff_window(self):
+        if getattr(self, "diff_window", None) is None:
+            self.diff_window = DiffWindow(self)
+        self.diff_window.show()
+        self.diff_window.raise_()
+
+    def show_profiler_window(self):
+        if getattr(self, "profiler_window", None) is None:
+            self.profiler_window = ProfilerWindow(self)
+        self.profiler_window.show()
+        self.profiler_window.raise_()
+
+    def start_receiver(self, ports, journal_path, send_ack, to_workspace=False):
+        """Arranca el receptor MLLP en su propio hilo (lanza OSError si un puerto está ocupado)."""
+        journal = MessageJournal(journal_path) if journal_path else None
+        # deque.append es seguro entre hilos y devuelve None: el ACK sigue siendo AA
+        handler = self.received_messages.append if to_workspace else None
+        receiver = MLLPReceiver("0.0.0.0", ports, journal, send_ack, handler)
+        try:
+            receiver.start()
+        except Exception:
+            if journal is not None:
+                journal.close()
+            raise
+        self.receiver = receiver
+        self.receiver_journal = journal
+        if to_workspace:
+            self.received_timer.start()
+        self.set_status(self.tr("receiver_running").format(", ".join(map(str, ports))), 5000)
+
+    def stop_receiver(self):
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
+        if self.received_timer.isActive():
+            self.received_timer.stop()
+            self.drain_received()
+        if self.receiver_journal is not None:
+            self.receiver_journal.close()
+            self.receiver_journal = None
+
+    def _current_retry_policy(self):
+        settings = self._read_settings()
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        return profile.get("retry_policy", {})
+
+    def _current_rate_limit(self):
+        settings = self._read_settings()
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        return profile.get("rate_limit", {})
+
+    def _current_ack_capture(self):
+        settings = self._read_settings()
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        return profile.get("ack_capture", {})
+
+    def _current_tls(self):
+        """Configuración TLS del perfil actual, activada o no según la casilla TLS."""
+        settings = self._read_settings()
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        return TLSConfig.from_dict(dict(profile.get("tls", {}), enabled=self.tls_check.isChecked()))
+
+    def _current_transformer(self, encoding):
+        """Transformer compilado con las reglas del perfil actual (se recompila sólo si cambian)."""
+        settings = self._read_settings()
+        profile = settings.get("profiles", {}).get(self.profiles_combo.currentText(), {})
+        key = json.dumps([profile.get("transforms", []), encoding], sort_keys=True)
+        cached_key, transformer = self._transformer_cache
+        if cached_key != key:
+            transformer = Transformer(profile.get("transforms", []), encoding)
+            self._transformer_cache = (key, transformer)
+        return transformer
+
+    def get_queue(self, ip, port, timeout, expect_ack, retry_policy=None, tls=None, rate_limit=None,
+                  ack_capture=None):
+        """Devuelve la cola del destino, creándola y arrancando su hilo si no existe."""
+        spool_dir = spool_dir_for(SPOOL_DIR, ip, port)
+        tls = tls or TLSConfig()
+        destination = {"ip": ip, "port": port, "timeout": timeout, "expect_ack": expect_ack,
+                       "retry_policy": retry_policy or {}, "tls": tls.to_dict(),
+                       "rate_limit": RateLimiter.from_dict(rate_limit).to_dict(), "ack_capture": ack_capture or {}}
+        entry = self.queues.get(spool_dir)
+        if entry is not None:
+            queue, drainer = entry
+            capture_entry = self.ack_captures.get(spool_dir)
+            if (drainer.timeout, drainer.expect_ack) == (timeout, expect_ack) and \
+                    drainer.policy.to_dict() == RetryPolicy.from_dict(destination["retry_policy"]).to_dict() and \
+                    (drainer.tls or TLSConfig()).to_dict() == destination["tls"] and \
+                    drainer.rate_limiter.to_dict() == destination["rate_limit"] and \
+                    capture_entry is not None and capture_entry[2] == destination["ack_capture"]:
+                return queue
+            # La configuración cambió: reiniciar el hilo con los nuevos parámetros
+            drainer.stop()
+            drainer.join()
+        else:
+            queue = OutboundQueue(spool_dir)
+        save_destination(spool_dir, destination)
+        self._start_drainer(spool_dir, queue, destination)
+        return queue
+
+    def _start_drainer(self, spool_dir, queue, destination):
+        ip, port = destination["ip"], destination["port"]
+        label = f"{ip}:{port}"
+        # La captura se conserva al reiniciar el hilo para no perder los contadores acumulados, salvo que
+        # cambie su configuración (el hilo anterior ya está parado)
+        config = destination.get("ack_capture") or {}
+        entry = self.ack_captures.get(spool_dir)
+        if entry is None or entry[2] != config:
+            capture = AckCapture.from_dict(config, os.path.join(spool_dir, ACK_SPOOL_NAME))
+            if entry is not None:
+                entry[1].close()
+            self.ack_captures[spool_dir] = (label, capture, config)
+        else:
+            capture = entry[1]
+        drainer = QueueDrainer(
+            queue, ip, port, destination.get("timeout", 10.0), destination.get("expect_ack", True),
+            RetryPolicy.from_dict(destination.get("retry_policy")),
+            on_event=lambda kind, seq, detail: self.queue_bridge.event.emit(kind, label, seq, detail),
+            tls=TLSConfig.from_dict(destination.get("tls")),
+            rate_limiter=RateLimiter.from_dict(destination.get("rate_limit")), capture=capture)
+        drainer.start()
+        self.queues[spool_dir] = (queue, drainer)
+
+    def resume_queues(self):
+        """Reanuda al arrancar las colas que quedaron con mensajes pendientes."""
+        if not os.path.isdir(SPOOL_DIR):
+            return
+        for name in os.listdir(SPOOL_DIR):
+            spool_dir = os.path.join(SPOOL_DIR, name)
+            destination = load_destination(spool_dir)
+            if destination is None:
+                continue
+            try:
+                queue = OutboundQueue(spool_dir)
+            except OSError as e:
+                self.set_status(self.tr("err_queue").format(e), 5000)
+                continue
+            if not len(queue):
+                queue.close()
+                continue
+            try:
+                self._start_drainer(spool_dir, queue, destination)
+            except (OSError, ValueError) as e:
+                queue.close()
+                self.set_status(self.tr("err_queue").format(e), 5000)
+
+    def stop_queues(self):
+        for queue, drainer in self.queues.values():
+            drainer.stop()
+        for queue, drainer in self.queues.values():
+            drainer.join(timeout=2.0)
+            queue.close()
+        self.queues.clear()
+        for _, capture, _ in self.ack_captures.values():
+            capture.close()
+        self.ack_captures.clear()
+
+    def on_queue_event(self, kind, label, seq, detail):
+        if self.workspace_pending:
+            self._update_workspace_status(kind, label, seq, detail)
+        host, _, port = label.rpartition(":")
+        # Los ACK no se muestran uno a uno: el resumen agregado se refresca con un temporizador
+        self.ack_summary_dirty = True
+        if not self.ack_summary_timer.isActive():
+            self.ack_summary_timer.start()
+        if kind == "sent":
+            return
+        pending = sum(len(queue) for queue, _ in self.queues.values())
+        if kind == "retry":
+            self.set_status(self.tr("status_queue_retry").format(host, port, seq, detail, pending))
+        elif kind == "dead_letter":
+            self.set_status(self.tr("status_queue_dead").format(host, port, seq, detail))
+
+    def refresh_ack_summary(self):
+        """Muestra en la respuesta los contadores de ACK de las colas (tamaño fijo, no un texto por ACK)."""
+        if not self.ack_summary_dirty:
+            self.ack_summary_timer.stop()
+            return
+        self.ack_summary_dirty = False
+        pending = sum(len(queue) for queue, _ in self.queues.values())
+        lines = []
+        total = failed = 0
+        for spool_dir, (label, capture, _) in self.ack_captures.items():
+            snapshot = capture.snapshot()
+            if not snapshot["count"]:
+                continue
+            total += snapshot["count"]
+            failed += snapshot["failed"]
+            entry = self.queues.get(spool_dir)
+            counts = ", ".join(f"{code} {count:,}" for code, count in sorted(snapshot["counts"].items()))
+            lines.append(self.tr("ack_summary_queue").format(
+                label, snapshot["count"], counts, snapshot["latency_avg"] * 1000, snapshot["latency_max"] * 1000,
+                len(entry[0]) if entry is not None else 0))
+            if snapshot["spooled"]:
+                lines.append(self.tr("ack_summary_spooled").format(snapshot["spooled"], snapshot["spool_path"]))
+            if snapshot["spool_dropped"]:
+                lines.append(self.tr("ack_summary_spool_full").format(snapshot["spool_dropped"]))
+            errors = capture.recent(ACK_SUMMARY_ERRORS, failed_only=True)
+            if errors:
+                lines.append(self.tr("ack_summary_errors"))
+                for row in errors:
+                    lines.append(f"  {row.control_id.decode('latin-1') or '-'}  {row.code}  "
+                                 f"{row.latency * 1000:.1f} ms  {row.error.decode('latin-1')}")
+            lines.append("")
+        if not lines:
+            return
+        self.set_response_text("\n".join(lines).rstrip())
+        self.set_status(self.tr("status_queue_summary").format(total, failed, pending), 5000)
+
     def test_connection(self):
         ip = self.ip_entry.text()
         try:
@@ -1394,9 +2744,9 @@ class HL7SenderApp(QMainWindow):
         self.resp_text.clear() # Limpiar respuesta al probar conexión
         self.set_status(self.tr("status_conn_test").format(ip, port), timeout=0)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(timeout)
-                s.connect((ip, port))
+            # Con TLS la prueba incluye el handshake y la verificación del certificado
+            with MLLPClient(ip, port, timeout, self._current_tls()):
+                pass
             self.set_status(self.tr("status_conn_ok").format(ip, port), timeout=5000)
         except socket.timeout:
             self.set_status(self.tr("status_conn_timeout").format(ip, port), timeout=5000)
@@ -1405,6 +2755,16 @@ class HL7SenderApp(QMainWindow):
         except Exception as e:
             self.set_status(self.tr("status_conn_error").format(ip, port, e), timeout=5000)
 
+    def _check_ack_correlation(self, payload, response):
+        """Comprueba que el ACK (MSA-2) corresponde al mensaje enviado (MSH-10)."""
+        code, ack_control_id, _ = parse_ack(response)
+        control_id = LazyMessage(payload).control_id
+        if control_id and ack_control_id != control_id:
+            return self.tr("warn_ack_mismatch").format(ack_control_id.decode("latin-1"), control_id.decode("latin-1"))
+        if classify(code) == STATUS_UNKNOWN:
+            return self.tr("warn_ack_unknown").format(code.decode("latin-1"))
+        return ""
+
     def send_message(self):
         
         ip = self.ip_entry.text()
@@ -1420,60 +2780,78 @@ class HL7SenderApp(QMainWindow):
             QMessageBox.warning(self, self.tr("err_msg_empty_title"), self.tr("err_msg_empty"))
             return
 
-        # Normalizar separadores de segmento a CR (\r) para compatibilidad con sistemas estrictos.
-        message = message.replace('\r\n', '\r').replace('\n', '\r')
-
-        encoding = self.encoding_combo.currentText()
+        encoding = self.text_encoding(message)
         self.set_response_text("")  # Limpiar respuesta anterior
         self.set_status("")         # Limpiar barra de estado anterior
 
-        # MLLP Wrapping
-        VT = b'\x0b'
-        FS = b'\x1c'
-        CR = b'\x0d'
-        
         try:
-            wrapped_msg = VT + message.encode(encoding, errors='replace') + FS + CR
+            # Normaliza los separadores de segmento a CR (\r) y codifica sin sustituir caracteres
+            payload = encode_text(message, encoding)
         except LookupError:
              QMessageBox.critical(self, self.tr("err_encoding_title"), self.tr("err_encoding_invalid").format(encoding))
              return
-        except UnicodeEncodeError as e:
+        except HL7EncodingError as e:
              QMessageBox.critical(self, self.tr("err_encoding_title"), self.tr("err_encoding_fail").format(encoding, e))
              return
 
+        # Reglas de transformación del perfil (MSH-5/6, MSH-10, anonimización...)
+        try:
+            payload = self._current_transformer(encoding).apply(payload)
+        except ValueError as e:
+            QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_transform").format(e))
+            return
+
+        try:
+            tls = self._current_tls()
+        except ValueError as e:
+            QMessageBox.critical(self, self.tr("warn_title"), str(e))
+            return
+
+        # Store-and-forward: el mensaje se persiste y se envía en segundo plano
+        if self.queue_check.isChecked():
+            try:
+                queue = self.get_queue(ip, port, timeout, self.expect_ack_check.isChecked(),
+                                       self._current_retry_policy(), tls, self._current_rate_limit(),
+                                       self._current_ack_capture())
+                queue.enqueue(payload)
+            except (OSError, ValueError) as e:
+                QMessageBox.critical(self, self.tr("warn_title"), self.tr("err_queue").format(e))
+                return
+            self.set_status(self.tr("status_queued").format(ip, port, len(queue)))
+            return
+
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(timeout)
-                # self.set_status(f"Enviando a {ip}:{port}...", timeout=0) # Removed this line as per user request
-                s.connect((ip, port))
+            # Conexión del pool: el handshake TCP/TLS se reutiliza entre envíos al mismo destino
+            expect_ack = self.expect_ack_check.isChecked()
+            sent_time = datetime.now()
+            try:
+                response = self.connection_pool.exchange(ip, port, payload, timeout, tls, expect_ack)
+            except MLLPFramingError as e:
+                response = None
+                raw_response = e.raw
+            if expect_ack:
+                received_time = datetime.now()
+                response_time_ms = (received_time - sent_time).total_seconds() * 1000
                 
-                sent_time = datetime.now()
-                s.sendall(wrapped_msg)
+                status_msg = (
+                    f"Envío: {sent_time.strftime('%H:%M:%S.%f')[:-3]} | "
+                    f"Recibido: {received_time.strftime('%H:%M:%S.%f')[:-3]} | "
+                    f"Tiempo: {response_time_ms:.2f} ms"
+                )
+                self.set_status(status_msg)
                 
-                if self.expect_ack_check.isChecked():
-                    response = s.recv(4096)
-                    received_time = datetime.now()
-                    response_time_ms = (received_time - sent_time).total_seconds() * 1000
-                    
-                    status_msg = (
-                        f"Envío: {sent_time.strftime('%H:%M:%S.%f')[:-3]} | "
-                        f"Recibido: {received_time.strftime('%H:%M:%S.%f')[:-3]} | "
-                        f"Tiempo: {response_time_ms:.2f} ms"
-                    )
-                    self.set_status(status_msg)
-                    
-                    # MLLP Unwrapping
-                    if response.startswith(VT) and response.endswith(FS + CR):
-                        try:
-                            ack_msg = response[1:-2].decode(encoding)
-                            self.set_response_text(ack_msg)
-                        except UnicodeDecodeError as e:
-                            self.set_response_text(self.tr("ack_decoded").format(encoding, response[1:-2], e))
-                    else:
-                        self.set_response_text(self.tr("ack_raw").format(response))
+                # MLLPClient ya devuelve el ACK sin framing
+                if response is not None:
+                    ack_warning = self._check_ack_correlation(payload, response)
+                    if ack_warning:
+                        self.set_status(f"{status_msg} | {ack_warning}")
+                    # El ACK puede venir en otro juego de caracteres (MSH-18 del receptor)
+                    self.set_response_text(self.decode_bytes(response))
                 else:
-                    self.set_status(self.tr("status_msg_sent").format(ip, port, sent_time.strftime('%H:%M:%S.%f')[:-3]))
-                    
+                    self.set_response_text(self.tr("ack_raw").format(raw_response))
+            else:
+                self.set_status(self.tr("status_msg_sent").format(ip, port, sent_time.strftime('%H:%M:%S.%f')[:-3]))
+
         except socket.timeout:
             self.set_status(self.tr("err_timeout"))
             self.set_response_text(self.tr("ack_timeout"))
@@ -0,0 +1,292 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Envío masivo sin interfaz repartido entre varios procesos.
+
+Cada destino (perfil guardado o host:puerto) recibe el flujo completo de
+mensajes y lo reparte entre `workers` procesos propios. Con una clave de orden
+(ruta HL7, p.ej. PID-3.1) los mensajes con la misma clave van siempre al mismo
+proceso y conservan su orden relativo; sin clave se reparten por turnos.
+
+El proceso padre lee los ficheros con mmap y copia cada mensaje al buffer
+circular en memoria compartida (`shm_ring`) del proceso que le toca, sin pickle.
+Cada proceso ejecuta la etapa de envío de `hl7_pipeline`: aplica las
+transformaciones del perfil, envía por MLLP (con TLS si el perfil lo indica) y
+devuelve periódicamente contadores agregados por una cola, no un resultado por
+mensaje.
+
+Uso:
+    python hl7_shard_send.py mensajes.hl7 --profile LAB --profile RIS -j 4 --key PID-3.1
+    python hl7_shard_send.py mensajes.hl7 --dest 10.0.0.5:2575 --dest 10.0.0.6:2575 --window 32
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import zlib
+
+from ack_capture import ack_capture_from_args, add_ack_capture_arguments
+from app_config import SETTINGS_FILE, load_profiles
+from hl7_parser import LazyMessage, iter_message_views, open_mapped
+from hl7_pipeline import (REPORT_INTERVAL, destination_from_profile, merge_stats, new_stats, parse_destination,
+                          send_stage)
+from hl7_query import FieldPath
+from rate_control import RateLimiter, add_rate_arguments, rate_limit_from_args, split_rate_limit
+from shm_ring import DEFAULT_CAPACITY, ShmRing
+
+PUT_TIMEOUT = 0.5
+
+
+class ShardedSender:
+    """Reparte mensajes entre procesos de envío (`workers` por destino) y agrega sus resultados.
+
+    `on_progress(summary)` se llama desde el proceso padre cada vez que llegan
+    contadores nuevos de los procesos.
+    """
+
+    def __init__(self, destinations, workers=1, key=None, window=1, ring_capacity=DEFAULT_CAPACITY,
+                 report_interval=REPORT_INTERVAL, on_progress=None):
+        if not destinations:
+            raise ValueError("At least one destination is required")
+        self.destinations = list(destinations)
+        self.workers = max(1, workers)
+        self.key = FieldPath(key) if key else None
+        self.window = window
+        self.ring_capacity = ring_capacity
+        self.report_interval = report_interval
+        self.on_progress = on_progress
+        self.rings = []
+        self.processes = []
+        self.results = None
+        self.totals = {d["name"]: new_stats() for d in self.destinations}
+        self.submitted = 0
+        self.started = None
+        self._turn = 0
+
+    def start(self):
+        context = multiprocessing.get_context()
+        self.results = context.Queue()
+        self.started = time.monotonic()
+        try:
+            for destination in self.destinations:
+                # El límite de ritmo del destino se reparte entre sus procesos
+                worker_destination = dict(
+                    destination, rate_limit=split_rate_limit(destination.get("rate_limit"), self.workers))
+                for shard in range(self.workers):
+                    ring = ShmRing(capacity=self.ring_capacity, create=True)
+                    self.rings.append(ring)
+                    process = context.Process(
+                        target=send_stage, name=f"hl7-shard-{destination['name']}-{shard}", daemon=True,
+                        args=(ring.name, worker_destination, shard, self.results, self.window,
+                              self.report_interval))
+                    process.start()
+                    self.processes.append(process)
+        except BaseException:
+            self.abort()
+            raise
+        return self
+
+    def shard_of(self, data):
+        """Proceso (0..workers-1) que envía este mensaje en cada destino."""
+        if self.workers == 1:
+            return 0
+        if self.key is None:
+            self._turn = (self._turn + 1) % self.workers
+            return self._turn
+        values = self.key.extract(LazyMessage(bytes(data)))
+        return zlib.crc32(b"\x00".join(values)) % self.workers
+
+    def submit(self, data):
+        """Copia un mensaje (bytes o memoryview) al buffer de su proceso en cada destino."""
+        shard = self.shard_of(data)
+        for index in range(shard, len(self.rings), self.workers):
+            ring = self.rings[index]
+            while True:
+                try:
+                    ring.put(data, timeout=PUT_TIMEOUT)
+                    break
+                except TimeoutError:
+                    # Buffer lleno: el destino va más lento; aprovechar para recoger resultados
+                    self.poll()
+                    if not self.processes[index].is_alive():
+                        raise RuntimeError(f"Send worker {self.processes[index].name} exited unexpectedly")
+        self.submitted += 1
+        if not self.submitted % 1024:
+            self.poll()
+
+    def send_files(self, paths):
+        for path in paths:
+            mm = open_mapped(path)
+            if mm is None:
+                continue
+            try:
+                for message in iter_message_views(mm):
+                    self.submit(message)
+            finally:
+                mm.close()
+        return self.submitted
+
+    def poll(self, timeout=0):
+        """Agrega los contadores recibidos; devuelve cuántos procesos han terminado en esta llamada."""
+        finished = 0
+        changed = False
+        while True:
+            try:
+                name, _, stats, done = self.results.get(timeout=timeout)
+            except queue.Empty:
+                break
+            timeout = 0
+            merge_stats(self.totals[name], stats)
+            finished += done
+            changed = True
+        if changed and self.on_progress is not None:
+            self.on_progress(self.summary())
+        return finished
+
+    def finish(self):
+        """Cierra los buffers, espera a que los procesos vacíen su cola de envío y devuelve el resumen."""
+        for ring in self.rings:
+            ring.close_writer()
+        pending = len(self.processes)
+        while pending > 0:
+            pending -= self.poll(timeout=self.report_interval)
+            if pending > 0 and not any(p.is_alive() for p in self.processes):
+                # Algún proceso murió sin enviar su último informe
+                pending -= self.poll()
+                break
+        for process in self.processes:
+            process.join()
+        self._release()
+        return self.summary()
+
+    def abort(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join()
+        self._release()
+
+    def _release(self):
+        for ring in self.rings:
+            ring.close()
+            ring.unlink()
+        self.rings = []
+        self.processes = []
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        destinations = {}
+        for name, stats in self.totals.items():
+            entry = {k: v for k, v in stats.items() if k != "failures"}
+            entry["rate"] = stats["messages"] / elapsed if elapsed else 0.0
+            entry["latency_avg"] = stats["latency_sum"] / stats["batches"] if stats["batches"] else 0.0
+            entry["failures"] = list(stats["failures"])
+            destinations[name] = entry
+        total = sum(s["messages"] for s in self.totals.values())
+        return {"elapsed": elapsed, "submitted": self.submitted, "messages": total,
+                "rate": total / elapsed if elapsed else 0.0, "destinations": destinations}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send HL7 files through several worker processes")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--profile", action="append", default=[], help="saved connection profile (repeatable)")
+    parser.add_argument("--dest", action="append", default=[], help="destination host:port (repeatable)")
+    parser.add_argument("--settings", default=SETTINGS_FILE, help="settings file with the profiles")
+    parser.add_argument("-j", "--workers", type=int, help="processes per destination (default: CPUs / destinations)")
+    parser.add_argument("--key", help="ordering key path, e.g. PID-3.1: same key, same process, same order")
+    parser.add_argument("--window", type=int, default=1, help="messages sent before waiting for their ACKs")
+    parser.add_argument("--timeout", type=float, default=10.0, help="timeout for --dest destinations")
+    parser.add_argument("--ring-mb", type=int, default=DEFAULT_CAPACITY // (1024 * 1024),
+                        help="shared-memory buffer per process (must fit the largest message)")
+    parser.add_argument("--report", help="write the final summary as JSON to this file")
+    add_rate_arguments(parser)
+    add_ack_capture_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        profiles = load_profiles(args.settings) if args.profile else {}
+        destinations = []
+        for name in args.profile:
+            if name not in profiles:
+                parser.error(f"unknown profile: {name}")
+            destinations.append(destination_from_profile(name, profiles[name]))
+        destinations += [parse_destination(d, args.timeout) for d in args.dest]
+        rate_limit = rate_limit_from_args(args)
+        ack_capture = ack_capture_from_args(args)
+        for destination in destinations:
+            if rate_limit is not None:
+                destination["rate_limit"] = rate_limit
+            if ack_capture is not None:
+                destination["ack_capture"] = ack_capture
+            # Validar la configuración antes de arrancar los procesos
+            RateLimiter.from_dict(destination.get("rate_limit"))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not destinations:
+        parser.error("at least one --profile or --dest is required")
+    workers = args.workers or max(1, (os.cpu_count() or 1) // len(destinations))
+
+    last = [0.0]
+
+    def progress(summary):
+        now = time.monotonic()
+        if now - last[0] >= 5.0:
+            last[0] = now
+            print(f"{summary['messages']} sent ({summary['rate']:.0f}/s)", file=sys.stderr)
+
+    sender = ShardedSender(destinations, workers, args.key, args.window, args.ring_mb * 1024 * 1024,
+                           on_progress=progress)
+    with sender:
+        try:
+            sender.send_files(args.files)
+        except KeyboardInterrupt:
+            print("Interrupted: waiting for messages already queued", file=sys.stderr)
+    summary = sender.summary()
+
+    print(f"{summary['submitted']} messages read, {summary['messages']} sends in {summary['elapsed']:.2f} s "
+          f"({summary['rate']:.0f}/s) with {workers} process(es) per destination", file=sys.stderr)
+    for name, entry in summary["destinations"].items():
+        print(f"  {name}: {entry['messages']} sent, {entry['failed']} failed, ACK {entry['acks']}, "
+              f"{entry['rate']:.0f}/s, avg batch latency {entry['latency_avg'] * 1000:.1f} ms", file=sys.stderr)
+        if entry["acks_spooled"]:
+            print(f"    {entry['acks_spooled']} full ACKs saved in {args.ack_spool}", file=sys.stderr)
+        if entry["acks_spool_dropped"]:
+            print(f"    {entry['acks_spool_dropped']} full ACKs not saved (--ack-spool-mb limit reached)",
+                  file=sys.stderr)
+        for control_id, code, text in entry["failures"][:10]:
+            print(f"    {control_id or '-'}: {code} {text}", file=sys.stderr)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
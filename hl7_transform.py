@@ -0,0 +1,292 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Transformaciones de mensajes por reglas sobre rutas de campo.
+
+Las reglas se definen como una lista de diccionarios (p.ej. en el perfil,
+clave "transforms"):
+
+    [{"path": "MSH-6", "op": "set", "value": "TEST"},
+     {"path": "MSH-10", "op": "control_id", "prefix": "T"},
+     {"path": "PID-3(*).1", "op": "hash", "key": "secreto", "length": 16},
+     {"path": "OBR[*]-4.1", "op": "map", "table": {"GLU": "GLUC"}},
+     {"path": "PID-19", "op": "clear"}]
+
+Las rutas usan la sintaxis de `hl7_query` ([*] para todas las ocurrencias del
+segmento y (*) para todas las repeticiones). Cada regla se compila una vez; al
+aplicarla sólo se localizan los offsets del campo afectado y se sustituyen esos
+bytes, sin dividir ni volver a serializar el resto del mensaje.
+"""
+
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import secrets
+import sys
+import time
+
+from hl7_codec import escape
+from hl7_parser import LazyMessage, detect_delimiters, iter_messages, open_mapped
+from hl7_query import ALL, FieldPath
+
+OPERATIONS = ("set", "clear", "hash", "map", "control_id")
+# Caracteres de la marca que distingue los MSH-10 de cada regla control_id (36 ** 8 valores)
+CONTROL_ID_TAG_LENGTH = 8
+_BASE36 = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _instance_tag():
+    """Marca aleatoria de longitud fija en base 36 (sin caracteres que haya que escapar)."""
+    value = secrets.randbelow(36 ** CONTROL_ID_TAG_LENGTH)
+    tag = bytearray()
+    for _ in range(CONTROL_ID_TAG_LENGTH):
+        value, digit = divmod(value, 36)
+        tag.append(_BASE36[digit])
+    return bytes(tag)
+
+
+def _nth_spans(data, start, end, sep, n):
+    """Spans (inicio, fin, relleno) del elemento `n` (1-based o ALL) en data[start:end].
+
+    Si el elemento no existe se devuelve una posición vacía al final con el
+    número de separadores que hay que añadir para crearlo.
+    """
+    if n == ALL:
+        spans = []
+        pos = start
+        while True:
+            nxt = data.find(sep, pos, end)
+            if nxt < 0:
+                spans.append((pos, end, 0))
+                return spans
+            spans.append((pos, nxt, 0))
+            pos = nxt + 1
+    pos = start
+    for i in range(n - 1):
+        nxt = data.find(sep, pos, end)
+        if nxt < 0:
+            return [(end, end, n - 1 - i)]
+        pos = nxt + 1
+    nxt = data.find(sep, pos, end)
+    return [(pos, end if nxt < 0 else nxt, 0)]
+
+
+class Rule:
+    """Regla compilada: ruta de campo + función que calcula el nuevo valor (bytes)."""
+
+    def __init__(self, spec, encoding="utf-8"):
+        try:
+            self.path = FieldPath(spec["path"])
+            self.op = spec.get("op", "set")
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError(f"Invalid transform rule: {spec!r}")
+        if self.op not in OPERATIONS:
+            raise ValueError(f"Unknown transform operation: {self.op!r}")
+        if self.path.segment == b"MSH" and self.path.field <= 2:
+            raise ValueError("MSH-1 and MSH-2 cannot be transformed")
+        self.spec = spec
+        self.encoding = encoding
+        self.creates = self.op in ("set", "control_id")
+        self.compute = getattr(self, "_compile_" + self.op)(spec)
+
+    def _escaped(self, value, delimiters):
+        return escape(value, delimiters).encode(self.encoding)
+
+    def _compile_set(self, spec):
+        value = str(spec.get("value", ""))
+        cache = {}
+
+        def compute(old, delimiters):
+            new = cache.get(delimiters)
+            if new is None:
+                new = cache[delimiters] = self._escaped(value, delimiters)
+            return new
+        return compute
+
+    def _compile_clear(self, spec):
+        return lambda old, delimiters: b""
+
+    def _compile_hash(self, spec):
+        key = str(spec.get("key", "")).encode("utf-8")
+        length = int(spec.get("length", 16))
+        prefix = str(spec.get("prefix", "")).encode(self.encoding)
+        digest = hashlib.sha256
+
+        def compute(old, delimiters):
+            if not old:
+                return old
+            # HMAC en hexadecimal: determinista y sin caracteres que haya que escapar
+            return prefix + hmac.new(key, old, digest).hexdigest()[:length].upper().encode("ascii")
+        return compute
+
+    def _compile_map(self, spec):
+        table = spec.get("table")
+        if not isinstance(table, dict):
+            raise ValueError(f"Transform 'map' requires a table: {spec!r}")
+        default = spec.get("default")
+        by_delimiters = {}
+
+        def compute(old, delimiters):
+            mapping = by_delimiters.get(delimiters)
+            if mapping is None:
+                mapping = by_delimiters[delimiters] = {
+                    self._escaped(str(k), delimiters): self._escaped(str(v), delimiters) for k, v in table.items()}
+            new = mapping.get(old)
+            if new is None:
+                return old if default is None else self._escaped(str(default), delimiters)
+            return new
+        return compute
+
+    def _compile_control_id(self, spec):
+        # Cada regla lleva su propia marca aleatoria: varios transformadores a la vez (procesos de envío,
+        # juegos de caracteres, reinicios) no pueden repetir MSH-10 aunque sus contadores coincidan
+        prefix = str(spec.get("prefix", "")).encode(self.encoding) + _instance_tag()
+        counter = itertools.count(1)
+        return lambda old, delimiters: prefix + str(next(counter)).encode("ascii")
+
+    def spans(self, msg):
+        """Spans (inicio, fin, relleno) que selecciona la ruta en el mensaje."""
+        data = msg.data
+        delims = msg.delimiters
+        path = self.path
+        sep = delims.field
+        is_msh = path.segment == b"MSH"
+        # En MSH el primer elemento tras el nombre es MSH-2
+        field = path.field - 1 if is_msh else path.field
+        result = []
+        seen = 0
+        for seg_start, seg_end in msg.find_segments(path.segment):
+            seen += 1
+            if path.occurrence != ALL and seen != path.occurrence:
+                continue
+            if seg_start + 3 < seg_end:
+                spans = _nth_spans(data, seg_start + 4, seg_end, sep, field)
+            else:
+                spans = [(seg_end, seg_end, field)]
+            pads = [sep * pad for _, _, pad in spans]
+            for level_sep, n in ((delims.repetition, path.repetition), (delims.component, path.component),
+                                 (delims.subcomponent, path.subcomponent)):
+                if n is None:
+                    break
+                nested, nested_pads = [], []
+                for (start, end, _), pad in zip(spans, pads):
+                    if pad:
+                        # El elemento no existe: sólo se acumula el relleno
+                        nested.append((start, end, 0))
+                        nested_pads.append(pad + level_sep * (max(n, 1) - 1))
+                    else:
+                        for span in _nth_spans(data, start, end, level_sep, n):
+                            nested.append(span)
+                            nested_pads.append(level_sep * span[2])
+                spans, pads = nested, nested_pads
+            result.extend((start, end, pad) for (start, end, _), pad in zip(spans, pads))
+            if path.occurrence != ALL:
+                break
+        return result
+
+    def apply(self, msg):
+        """Devuelve los bytes transformados, o los originales si la regla no cambia nada."""
+        data = msg.data
+        pieces = []
+        pos = 0
+        changed = False
+        compute = self.compute
+        delims = msg.delimiters
+        for start, end, pad in self.spans(msg):
+            old = data[start:end]
+            if pad and not self.creates:
+                continue
+            new = compute(old, delims)
+            if new == old and not pad:
+                continue
+            pieces.append(data[pos:start])
+            pieces.append(pad)
+            pieces.append(new)
+            pos = end
+            changed = True
+        if not changed:
+            return data
+        pieces.append(data[pos:])
+        return b"".join(pieces)
+
+
+class Transformer:
+    """Lista de reglas compiladas que se aplican en orden a cada mensaje."""
+
+    def __init__(self, rules=(), encoding="utf-8"):
+        self.rules = [Rule(spec, encoding) for spec in rules]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def apply(self, data):
+        """Aplica las reglas a un mensaje (bytes) y devuelve el resultado."""
+        if not self.rules:
+            return data
+        delimiters = detect_delimiters(data)
+        msg = LazyMessage(data, delimiters)
+        for rule in self.rules:
+            new = rule.apply(msg)
+            if new is not msg.data:
+                msg = LazyMessage(new, delimiters)
+        return msg.data
+
+    def apply_many(self, messages):
+        apply = self.apply
+        for data in messages:
+            yield apply(data)
+
+
+def load_rules(path):
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    # Se admite tanto la lista de reglas como un perfil completo
+    return rules.get("transforms", []) if isinstance(rules, dict) else rules
+
+
+def main(argv=None):
+    from hl7_generator import write_messages
+
+    parser = argparse.ArgumentParser(description="Apply transform rules to HL7 files")
+    parser.add_argument("rules", help="JSON file with the list of rules (or a profile with 'transforms')")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--framing", choices=["mllp", "none"], default="mllp")
+    parser.add_argument("--encoding", default="utf-8")
+    args = parser.parse_args(argv)
+
+    transformer = Transformer(load_rules(args.rules), args.encoding)
+
+    def messages():
+        for path in args.files:
+            mm = open_mapped(path)
+            if mm is None:
+                continue
+            try:
+                yield from transformer.apply_many(iter_messages(mm))
+            finally:
+                mm.close()
+
+    start = time.perf_counter()
+    count = write_messages(messages(), args.output, args.framing)
+    elapsed = time.perf_counter() - start
+    print(f"{count} messages transformed in {elapsed:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
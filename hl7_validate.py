@@ -0,0 +1,394 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Validación incremental de mensajes HL7 contra las definiciones de `reference`.
+
+Pensada para el editor: el mensaje se valida por líneas (segmentos) y el
+resultado de cada segmento se guarda en caché por su texto, de modo que al
+volver a validar tras una edición sólo se comprueban los segmentos que han
+cambiado. La posición de cada segmento en la gramática del mensaje
+(`match_structure`) se recalcula sólo si cambia la secuencia de nombres.
+
+Comprobaciones por segmento: segmento desconocido, más campos de los
+definidos, campos obligatorios vacíos y formato de los valores según su tipo
+de dato, con los validadores compilados de `hl7_datatypes` (p.ej. PID-7.1 no
+es un DTM). Las posiciones de los problemas son desplazamientos dentro del
+texto del segmento.
+
+También valida ficheros completos (planos o con framing MLLP) repartiendo los
+mensajes por lotes entre procesos:
+
+    python hl7_validate.py mensajes.hl7 -j 4 -f jsonl -o problemas.jsonl
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from hl7_datatypes import DatatypeValidators
+from hl7_definitions import HL7DefinitionManager, match_structure, structure_segment_names
+from hl7_parser import detect_delimiters, get_field, iter_message_spans, is_mllp_framed, open_mapped
+
+# Versión supuesta si el MSH no indica una disponible
+DEFAULT_VERSION = "2.5"
+
+# Segmentos validados que se guardan en caché (se vacía al llenarse)
+CACHE_LIMIT = 20000
+
+# Mensajes por lote en la validación de ficheros
+BATCH_SIZE = 256
+
+_LINE_BREAK = re.compile("\r\n|\r|\n")
+
+ISSUE_UNKNOWN_SEGMENT = "unknown_segment"
+ISSUE_UNEXPECTED_SEGMENT = "unexpected_segment"
+ISSUE_TOO_MANY_FIELDS = "too_many_fields"
+ISSUE_REQUIRED_MISSING = "required_missing"
+ISSUE_BAD_FORMAT = "bad_format"
+
+# Problema en un segmento: [start, end) en el texto del segmento, código, ubicación (p.ej. PID-7.1
+# o PID-3(2).4.1 si el campo se repite) y detalle (tipo de dato o número de campos definidos)
+Issue = namedtuple("Issue", "start end code location detail")
+
+# Separadores de un mensaje como str
+Delimiters = namedtuple("Delimiters", "field component repetition escape subcomponent")
+DEFAULT_DELIMITERS = Delimiters("|", "^", "~", "\\", "&")
+
+def message_delimiters(msh):
+    """Separadores declarados en una línea MSH (str)."""
+    if not msh.startswith("MSH") or len(msh) < 8:
+        return DEFAULT_DELIMITERS
+    field = msh[3]
+    encoding = msh[4:].split(field, 1)[0]
+    values = list(DEFAULT_DELIMITERS[1:])
+    # Orden en MSH-2: componente, repetición, escape, subcomponente
+    for i, char in enumerate(encoding[:4]):
+        values[i] = char
+    return Delimiters(field, *values)
+
+
+def _split_spans(text, separator, base=0):
+    """Pares (valor, desplazamiento) de `text` dividido por `separator`."""
+    spans = []
+    pos = 0
+    for value in text.split(separator):
+        spans.append((value, base + pos))
+        pos += len(value) + 1
+    return spans
+
+
+class MessageValidator:
+    """Valida segmentos y mensajes; es seguro usar una instancia desde un único hilo de trabajo."""
+
+    def __init__(self, def_manager, cache_limit=CACHE_LIMIT):
+        self.def_manager = def_manager
+        self.datatypes = DatatypeValidators(def_manager)
+        self.cache_limit = cache_limit
+        self._cache = {}
+        self._field_validators = {}
+        self._generation = def_manager.generation
+        self._structure_key = None
+        self._structure_result = None
+
+    def _check_generation(self):
+        # Si cambian las definiciones (overlays) los resultados guardados dejan de valer
+        if self._generation != self.def_manager.generation:
+            self._cache.clear()
+            self._field_validators.clear()
+            self._structure_key = None
+            self._generation = self.def_manager.generation
+
+    def check_segment(self, text, version, delimiters=DEFAULT_DELIMITERS):
+        """Tupla de Issue de un segmento (en caché por su texto, la versión y los separadores)."""
+        self._check_generation()
+        key = (text, version, delimiters)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        issues = tuple(self._check_segment(text, version, delimiters))
+        if len(self._cache) >= self.cache_limit:
+            self._cache.clear()
+        self._cache[key] = issues
+        return issues
+
+    def _check_segment(self, text, version, delimiters):
+        fields = _split_spans(text, delimiters.field)
+        name = fields[0][0]
+        definition = self.def_manager.get_segment_fields(version, name)
+        if definition is None:
+            vocabulary = self.def_manager.get_segment_vocabulary(version)
+            if vocabulary and name not in vocabulary and not name.startswith("Z"):
+                yield Issue(0, len(name), ISSUE_UNKNOWN_SEGMENT, name, "")
+            return
+        validators = self.field_validators(version, name, definition)
+        separators = (delimiters.component, delimiters.subcomponent)
+        # En MSH el propio separador es MSH-1: los campos quedan desplazados una posición
+        shift = 1 if name == "MSH" else 0
+        count = len(definition)
+        present = len(fields) - 1 + shift
+        for i in range(1, len(fields)):
+            number = i + shift
+            value, start = fields[i]
+            if number > count:
+                if any(v for v, _ in fields[i:]):
+                    yield Issue(start, len(text), ISSUE_TOO_MANY_FIELDS, f"{name}-{number}", count)
+                break
+            validator = validators[number - 1]
+            if not value or validator is None or (shift and number == 2):
+                continue
+            repetitions = _split_spans(value, delimiters.repetition, start)
+            for r, (repetition, rep_start) in enumerate(repetitions, 1):
+                if not repetition:
+                    continue
+                violations = validator(repetition, separators, 0)
+                if violations:
+                    location = f"{name}-{number}({r})" if len(repetitions) > 1 else f"{name}-{number}"
+                    for violation in violations:
+                        yield Issue(rep_start + violation.start, rep_start + violation.end, ISSUE_BAD_FORMAT,
+                                    location + violation.path, violation.datatype)
+        for number in range(1 + 2 * shift, count + 1):
+            if not definition[number - 1].min_occurs:
+                continue
+            if number <= present:
+                value, start = fields[number - shift]
+                if value:
+                    continue
+                # Campo vacío: se marca el separador que lo precede
+                yield Issue(start - 1, start, ISSUE_REQUIRED_MISSING, f"{name}-{number}", "")
+            else:
+                yield Issue(max(len(text) - 1, 0), len(text), ISSUE_REQUIRED_MISSING, f"{name}-{number}", "")
+
+    def field_validators(self, version, name, definition):
+        """Validadores (hl7_datatypes) de los campos de un segmento, en caché por versión."""
+        key = (version, name)
+        validators = self._field_validators.get(key)
+        if validators is None:
+            validators = [self.datatypes.get(version, field.datatype) for field in definition]
+            self._field_validators[key] = validators
+        return validators
+
+    def _unexpected(self, version, message_type, names):
+        """Índices de los segmentos conocidos que no encajan en la gramática del mensaje.
+
+        Los Z-segments sólo se señalan si la gramática (p.ej. la de un overlay) los incluye.
+        """
+        key = (version, message_type, tuple(names))
+        if key == self._structure_key:
+            return self._structure_result
+        structure = self.def_manager.get_message_structure(version, message_type) if message_type else None
+        result = ()
+        if structure:
+            vocabulary = self.def_manager.get_segment_vocabulary(version)
+            expected = structure_segment_names(structure)
+            result = tuple(i for i, address in enumerate(match_structure(structure, names))
+                           if address is None and (names[i] in expected or
+                                                   (names[i] in vocabulary and not names[i].startswith("Z"))))
+        self._structure_key, self._structure_result = key, result
+        return result
+
+    def validate_lines(self, lines):
+        """Valida un mensaje dado como lista de líneas; devuelve {número de línea: tupla de Issue}."""
+        msh = next((line for line in lines if line.startswith("MSH")), "")
+        delimiters = message_delimiters(msh)
+        msh_fields = msh.split(delimiters.field)
+        version = msh_fields[11].split(delimiters.component, 1)[0] if len(msh_fields) > 11 else ""
+        if not version or not self.def_manager.is_version_available(version):
+            version = DEFAULT_VERSION
+        message_type = msh_fields[8] if len(msh_fields) > 8 else ""
+
+        results = {}
+        numbers = []
+        names = []
+        for number, line in enumerate(lines):
+            # Sin quitar los espacios iniciales: las posiciones son las de la línea del editor
+            line = line.rstrip()
+            if not line:
+                continue
+            issues = self.check_segment(line, version, delimiters)
+            if issues:
+                results[number] = issues
+            numbers.append(number)
+            names.append(line.split(delimiters.field, 1)[0])
+        for i in self._unexpected(version, message_type, names):
+            number = numbers[i]
+            issue = Issue(0, len(names[i]), ISSUE_UNEXPECTED_SEGMENT, names[i], message_type)
+            results[number] = (issue,) + results.get(number, ())
+        return results
+
+    def validate_message(self, data, encoding="latin-1"):
+        """Problemas de un mensaje (bytes o str) como lista de (ruta, Issue), p.ej. ('OBX[3]-5', ...).
+
+        La ruta incluye la ocurrencia del segmento cuando no es la primera.
+        """
+        text = data if isinstance(data, str) else bytes(data).decode(encoding, errors="replace")
+        lines = _LINE_BREAK.split(text)
+        results = self.validate_lines(lines)
+        if not results:
+            return []
+        field = message_delimiters(next((line for line in lines if line.startswith("MSH")), "")).field
+        found = []
+        seen = {}
+        for number, line in enumerate(lines):
+            name = line.split(field, 1)[0]
+            if not name.strip():
+                continue
+            occurrence = seen[name] = seen.get(name, 0) + 1
+            for issue in results.get(number, ()):
+                path = issue.location
+                if occurrence > 1:
+                    path = f"{name}[{occurrence}]{path[len(name):]}"
+                found.append((path, issue))
+        return found
+
+
+def format_issue(path, issue):
+    """Texto de una línea para un problema de validate_message."""
+    detail = f" ({issue.detail})" if issue.detail != "" else ""
+    return f"{path}: {issue.code}{detail}"
+
+
+_WORKER = {}
+
+
+def _worker_validator(base_path, overlays):
+    """Un MessageValidator por proceso: los validadores compilados se reutilizan entre lotes."""
+    cache_key = (base_path, overlays)
+    validator = _WORKER.get(cache_key)
+    if validator is None:
+        _WORKER.clear()
+        validator = _WORKER[cache_key] = MessageValidator(HL7DefinitionManager(base_path, overlays))
+    return validator
+
+
+def _validate_batch(args):
+    """Trabajo de un proceso: valida un lote de mensajes y devuelve sólo los que tienen problemas."""
+    base_path, overlays, encoding, first, messages = args
+    validator = _worker_validator(base_path, overlays)
+    results = []
+    for number, data in enumerate(messages, first):
+        issues = validator.validate_message(data, encoding)
+        if issues:
+            msh = data.split(b"\r", 1)[0].split(b"\n", 1)[0]
+            control_id = get_field(msh, 10, detect_delimiters(msh))
+            results.append((number, control_id.decode(encoding, errors="replace"), issues))
+    return results
+
+
+def validate_file(path, encoding="latin-1", workers=None, batch_size=BATCH_SIZE, base_path=None, stats=None,
+                  overlays=()):
+    """Valida los mensajes de un fichero (con las definiciones de `reference` y los `overlays`).
+
+    Itera (número de mensaje 1-based, MSH-10, lista de (ruta, Issue)) de los
+    mensajes con problemas, en orden. Si se pasa `stats` (dict) se acumulan en
+    él los mensajes validados ("messages") y los que tienen problemas ("invalid").
+    """
+    base_path = base_path or os.path.dirname(os.path.abspath(__file__))
+    overlays = tuple(overlays)
+    workers = workers or os.cpu_count() or 1
+    stats = {} if stats is None else stats
+    stats.setdefault("messages", 0)
+    stats.setdefault("invalid", 0)
+    mm = open_mapped(path)
+    if mm is None:
+        return
+
+    def batches():
+        batch = []
+        first = 1
+        for start, end in iter_message_spans(mm, framed=is_mllp_framed(mm)):
+            batch.append(mm[start:end].rstrip(b"\r\n"))
+            if len(batch) >= batch_size:
+                yield (base_path, overlays, encoding, first, batch)
+                first += len(batch)
+                batch = []
+        if batch:
+            yield (base_path, overlays, encoding, first, batch)
+
+    def count(task, results):
+        stats["messages"] += len(task[4])
+        stats["invalid"] += len(results)
+        return results
+
+    try:
+        if workers == 1:
+            for task in batches():
+                yield from count(task, _validate_batch(task))
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Como mucho dos lotes en vuelo por proceso: la lectura no se adelanta a la validación
+            pending = deque()
+            for task in batches():
+                pending.append((task, pool.submit(_validate_batch, task)))
+                if len(pending) >= workers * 2:
+                    done_task, future = pending.popleft()
+                    yield from count(done_task, future.result())
+            while pending:
+                done_task, future = pending.popleft()
+                yield from count(done_task, future.result())
+    finally:
+        mm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate HL7 messages against the reference definitions")
+    parser.add_argument("file", help="file of messages (plain or MLLP framed)")
+    parser.add_argument("-f", "--format", choices=["text", "jsonl"], default="text")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes")
+    parser.add_argument("--encoding", default="latin-1")
+    parser.add_argument("--definitions", action="append", default=[], metavar="DIR",
+                        help="overlay directory with custom segment/composite/message definitions (repeatable)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = {}
+    results = validate_file(args.file, args.encoding, args.workers, stats=stats, overlays=args.definitions)
+    if args.output:
+        out = open(args.output, "w", encoding="utf-8", newline="")
+    else:
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+    try:
+        for number, control_id, issues in results:
+            if args.format == "jsonl":
+                record = {"message": number, "control_id": control_id,
+                          "issues": [{"path": path, "code": issue.code, "detail": issue.detail}
+                                     for path, issue in issues]}
+                out.write(json.dumps(record, ensure_ascii=False))
+                out.write("\n")
+            else:
+                out.write(f"#{number} {control_id}\n")
+                for path, issue in issues:
+                    out.write(f"  {format_issue(path, issue)}\n")
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{stats['messages']} messages validated, {stats['invalid']} with issues in {elapsed:.2f} s",
+          file=sys.stderr)
+    sys.exit(1 if stats["invalid"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Índice invertido en disco (SQLite) sobre los mensajes del espacio de trabajo.
+
+Por cada mensaje se indexan los campos clave (INDEXED_FIELDS) con todas sus
+ocurrencias y repeticiones. De los identificadores (PID-3, OBR-2/3, ORC-2) se
+indexa además el primer componente (CX.1, EI.1), así que "PID-3:12345" encuentra
+exactamente PID-3 = 12345^^^HOSP^MR; de los nombres (PID-5) se indexa cada
+componente para encontrar también el nombre de pila. La tabla `terms` es una única tabla
+WITHOUT ROWID ordenada por (valor, campo, mensaje), así que cada consulta es
+el recorrido de un rango de B-tree: milisegundos aunque haya millones de
+mensajes.
+
+Opcionalmente se mantiene también un índice de texto completo FTS5 sin
+contenido (los cuerpos ya están en `message_store`).
+
+El índice se actualiza al añadir mensajes; `catch_up` indexa sólo los que
+falten (p.ej. tras activar el texto completo o un cierre inesperado), nunca
+se reconstruye entero.
+
+Consultas (los términos se combinan con AND):
+    12345            cualquier campo clave que empiece por 12345 (o el texto completo)
+    PID-3:12345      sólo ese campo, valor exacto
+    PID-5:GARC*      prefijo
+"""
+
+import sqlite3
+
+from hl7_parser import LazyMessage
+
+# Campos indexados por segmento: número de campo -> nombre en las consultas
+INDEXED_FIELDS = {
+    b"MSH": {7: "MSH-7", 9: "MSH-9", 10: "MSH-10"},
+    b"PID": {3: "PID-3", 5: "PID-5"},
+    b"OBR": {2: "OBR-2", 3: "OBR-3"},
+    b"ORC": {2: "ORC-2"},
+}
+FIELD_NAMES = frozenset(name for fields in INDEXED_FIELDS.values() for name in fields.values())
+
+# Campos de los que se indexa también cada componente (búsqueda por nombre de pila)
+COMPONENT_FIELDS = frozenset(["PID-5"])
+# Identificadores (CX, EI) de los que se indexa también el primer componente
+ID_FIELDS = frozenset(["PID-3", "OBR-2", "OBR-3", "ORC-2"])
+
+# Versión de los términos extraídos: si cambia, el índice se vacía y `catch_up` lo rellena
+TERMS_VERSION = 2
+
+# Longitud máxima de un valor indexado
+VALUE_MAX = 128
+
+# Caché de páginas de SQLite (KiB): las inserciones caen en posiciones aleatorias del B-tree
+CACHE_KIB = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS terms (
+    value TEXT NOT NULL COLLATE NOCASE,
+    field TEXT NOT NULL,
+    msg INTEGER NOT NULL,
+    PRIMARY KEY (value, field, msg)
+) WITHOUT ROWID;
+"""
+
+
+def fts5_available():
+    """Indica si el SQLite de Python incluye FTS5."""
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def extract_terms(data, encoding="latin-1"):
+    """Pares (campo, valor) indexables de un mensaje, sin duplicados."""
+    msg = LazyMessage(bytes(data))
+    delimiters = msg.delimiters
+    terms = set()
+    for segment_name, fields in INDEXED_FIELDS.items():
+        # En MSH el propio separador es MSH-1: los campos quedan desplazados una posición
+        shift = 1 if segment_name == b"MSH" else 0
+        for start, end in msg.find_segments(segment_name):
+            values = msg.data[start:end].split(delimiters.field)
+            for index, name in fields.items():
+                index -= shift
+                value = values[index] if index < len(values) else b""
+                if not value:
+                    continue
+                for repetition in value.split(delimiters.repetition):
+                    if repetition:
+                        terms.add((name, repetition[:VALUE_MAX]))
+                    if name in COMPONENT_FIELDS:
+                        for part in repetition.split(delimiters.component)[1:]:
+                            if part:
+                                terms.add((name, part[:VALUE_MAX]))
+                    elif name in ID_FIELDS:
+                        part = repetition.split(delimiters.component, 1)[0]
+                        if part:
+                            terms.add((name, part[:VALUE_MAX]))
+    return [(name, value.decode(encoding, errors="replace")) for name, value in terms]
+
+
+def _like_prefix(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class MessageIndex:
+    """Índice de un espacio de trabajo; los mensajes se identifican por su número en el almacén."""
+
+    def __init__(self, path, fulltext=False):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self.db.executescript(_SCHEMA)
+        if self._meta("terms_version") != TERMS_VERSION:
+            # Índice creado con otros términos: se vacía para que catch_up lo rellene
+            with self.db:
+                self.db.execute("DELETE FROM terms")
+                self._set_meta("fields", 0)
+                self._set_meta("terms_version", TERMS_VERSION)
+        self.fulltext = False
+        if fulltext:
+            self.set_fulltext(True)
+        elif self._table_exists("fulltext"):
+            # El texto completo se desactivó: se descarta en lugar de dejarlo desactualizado
+            self.set_fulltext(False)
+
+    def _table_exists(self, name):
+        row = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def indexed(self):
+        """Número de mensajes (0..n-1) con los campos clave indexados."""
+        return self._meta("fields")
+
+    def set_fulltext(self, enabled):
+        """Activa o desactiva el índice de texto completo (al activarlo hay que llamar a `catch_up`)."""
+        with self.db:
+            if enabled:
+                # Sin contenido: FTS5 sólo guarda el índice invertido, los cuerpos ya están en el almacén
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(body, content='')")
+            else:
+                self.db.execute("DROP TABLE IF EXISTS fulltext")
+                self._set_meta("fulltext", 0)
+        self.fulltext = enabled
+
+    def add_many(self, first, messages, encoding="latin-1"):
+        """Indexa mensajes consecutivos a partir del número `first` en una sola transacción."""
+        fields_done = self.indexed
+        fulltext_done = self._meta("fulltext") if self.fulltext else None
+        terms = []
+        texts = []
+        count = 0
+        for offset, data in enumerate(messages):
+            msg = first + offset
+            if msg >= fields_done:
+                terms.extend((value, name, msg) for name, value in extract_terms(data, encoding))
+            if fulltext_done is not None and msg >= fulltext_done:
+                texts.append((msg, bytes(data).decode(encoding, errors="replace")))
+            count += 1
+        if not count:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO terms (value, field, msg) VALUES (?, ?, ?)", terms)
+            self._set_meta("fields", max(fields_done, first + count))
+            if fulltext_done is not None:
+                self.db.executemany("INSERT INTO fulltext (rowid, body) VALUES (?, ?)", texts)
+                self._set_meta("fulltext", max(fulltext_done, first + count))
+
+    def catch_up(self, store, batch_size=1024, encoding="latin-1"):
+        """Indexa los mensajes del almacén que aún no están en el índice; devuelve cuántos."""
+        start = self.indexed
+        if self.fulltext:
+            start = min(start, self._meta("fulltext"))
+        total = len(store)
+        for first in range(start, total, batch_size):
+            last = min(total, first + batch_size)
+            self.add_many(first, [store.get(i) for i in range(first, last)], encoding)
+        return max(0, total - start)
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM terms")
+            self._set_meta("fields", 0)
+            if self.fulltext:
+                # Una tabla FTS5 sin contenido no admite DELETE
+                self.db.execute("INSERT INTO fulltext (fulltext) VALUES ('delete-all')")
+                self._set_meta("fulltext", 0)
+
+    def _term_query(self, term):
+        """SQL y parámetros que devuelven los mensajes de un término."""
+        field, sep, value = term.partition(":")
+        if sep and field.upper() in FIELD_NAMES:
+            field = field.upper()
+            if value.endswith("*"):
+                return ("SELECT msg FROM terms WHERE value LIKE ? ESCAPE '\\' AND field = ?",
+                        (_like_prefix(value[:-1]), field))
+            return "SELECT msg FROM terms WHERE value = ? AND field = ?", (value, field)
+        value = term.rstrip("*")
+        sql = "SELECT msg FROM terms WHERE value LIKE ? ESCAPE '\\'"
+        params = [_like_prefix(value)]
+        if self.fulltext:
+            # Prefijo entre comillas para que el término no se interprete como sintaxis FTS5
+            sql += " UNION SELECT rowid FROM fulltext WHERE fulltext MATCH ?"
+            params.append('"%s"*' % value.replace('"', '""'))
+        return sql, tuple(params)
+
+    def search(self, query, limit=None):
+        """Números de mensaje (ordenados) que cumplen todos los términos de la consulta."""
+        terms = query.split()
+        if not terms:
+            return []
+        parts, params = [], []
+        for term in terms:
+            sql, term_params = self._term_query(term)
+            parts.append(sql)
+            params.extend(term_params)
+        # Cada término va en su propia subconsulta: los operadores compuestos de SQLite se asocian por la
+        # izquierda y "A UNION B INTERSECT C" sería (A ∪ B) ∩ C en vez de un AND entre términos.
+        # UNION/INTERSECT ya eliminan duplicados; un único término puede repetir mensaje en varios campos
+        parts = [f"SELECT msg FROM ({part})" for part in parts]
+        sql = " INTERSECT ".join(parts) if len(parts) > 1 else f"SELECT DISTINCT * FROM ({parts[0]})"
+        sql += " ORDER BY 1"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [row[0] for row in self.db.execute(sql, params)]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
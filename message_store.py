@@ -0,0 +1,280 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Almacén en disco de los mensajes del espacio de trabajo.
+
+Los cuerpos de los mensajes se guardan en un fichero append-only
+(`messages.dat`) y sólo se leen (seek + read sin buffer) al abrir o enviar un mensaje.
+En memoria se mantienen por mensaje su posición, su tamaño, un resumen corto
+(MSH-7, MSH-9, MSH-10 y PID-3) y un byte de estado en `status.dat`, de modo
+que decenas de miles de mensajes ocupan unos pocos MB.
+
+Cada registro es una cabecera (longitud del cuerpo y del resumen), el resumen
+con los campos separados por 0x1F y el cuerpo. El resumen se calcula al añadir
+el mensaje y se guarda con él para no volver a analizar los mensajes al abrir
+el espacio de trabajo.
+
+Con `indexed=True` los mensajes se indexan además en `message_index`
+(`index.sqlite`) según se añaden y `search` usa ese índice.
+"""
+
+import os
+import struct
+from array import array
+
+from hl7_parser import detect_delimiters, get_field, iter_message_views, open_mapped
+from message_index import MessageIndex
+
+_HEADER = struct.Struct("<IH")
+_SEP = b"\x1f"
+
+DATA_NAME = "messages.dat"
+STATUS_NAME = "status.dat"
+INDEX_NAME = "index.sqlite"
+
+# Longitud máxima de cada campo del resumen
+SUMMARY_FIELD_MAX = 64
+
+# Columnas del resumen
+COL_DATETIME = 0
+COL_TYPE = 1
+COL_CONTROL_ID = 2
+COL_PATIENT_ID = 3
+
+# Estado del último envío de cada mensaje (un byte por mensaje)
+STATUS_NONE = 0
+STATUS_QUEUED = 1
+STATUS_SENT = 2
+STATUS_AA = 3
+STATUS_AE = 4
+STATUS_AR = 5
+STATUS_CA = 6
+STATUS_CE = 7
+STATUS_CR = 8
+STATUS_TIMEOUT = 9
+STATUS_ERROR = 10
+STATUS_LABELS = ("", "QUEUED", "SENT", "AA", "AE", "AR", "CA", "CE", "CR", "TIMEOUT", "ERROR")
+STATUS_BY_LABEL = {label: code for code, label in enumerate(STATUS_LABELS) if label}
+
+APPEND_BATCH = 1024
+
+
+def summarize(data):
+    """Resumen (MSH-7, MSH-9, MSH-10, PID-3) de un mensaje como bytes separados por 0x1F."""
+    data = bytes(data)
+    delimiters = detect_delimiters(data)
+    start = data.find(b"MSH")
+    msh = b""
+    if start >= 0:
+        end = len(data)
+        for term in (b"\r", b"\n"):
+            pos = data.find(term, start)
+            if 0 <= pos < end:
+                end = pos
+        msh = data[start:end]
+    pid3 = b""
+    for marker in (b"\rPID", b"\nPID"):
+        pos = data.find(marker)
+        if pos >= 0:
+            end = len(data)
+            for term in (b"\r", b"\n"):
+                stop = data.find(term, pos + 1)
+                if 0 <= stop < end:
+                    end = stop
+            pid3 = get_field(data[pos + 1:end], 3, delimiters)
+            break
+    values = [get_field(msh, 7, delimiters), get_field(msh, 9, delimiters), get_field(msh, 10, delimiters), pid3]
+    return _SEP.join(v[:SUMMARY_FIELD_MAX].replace(_SEP, b" ") for v in values)
+
+
+class MessageStore:
+    """Mensajes del espacio de trabajo, numerados por orden de llegada (0..n-1).
+
+    No es seguro para varios hilos: lo usa el hilo de la interfaz.
+    """
+
+    def __init__(self, directory, indexed=False, fulltext=False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, DATA_NAME)
+        self.status_path = os.path.join(directory, STATUS_NAME)
+        self.offsets = array("q")
+        self.lengths = array("I")
+        self.summaries = []
+        self.statuses = bytearray()
+        self._recover()
+        self._writer = open(self.data_path, "ab")
+        # Ficheros propios sin buffer para leer y escribir por posición (os.pread/pwrite no existen en Windows)
+        self._reader = open(self.data_path, "rb", buffering=0)
+        open(self.status_path, "ab").close()
+        self._status_file = open(self.status_path, "r+b", buffering=0)
+        status = self._status_file.read(len(self.offsets))
+        self.statuses = bytearray(status) + bytearray(len(self.offsets) - len(status))
+        self.index = None
+        if indexed:
+            self.index = MessageIndex(os.path.join(directory, INDEX_NAME), fulltext)
+            if self.index.indexed > len(self.offsets):
+                # El índice va por delante del almacén (registro final truncado al recuperar)
+                self.index.clear()
+            self.index.catch_up(self)
+
+    def _recover(self):
+        """Lee las cabeceras y resúmenes del fichero, truncando un registro final incompleto."""
+        if not os.path.exists(self.data_path):
+            return
+        mm = open_mapped(self.data_path)
+        if mm is None:
+            return
+        pos, size = 0, len(mm)
+        try:
+            while pos + _HEADER.size <= size:
+                length, summary_length = _HEADER.unpack_from(mm, pos)
+                summary_start = pos + _HEADER.size
+                body_start = summary_start + summary_length
+                if body_start + length > size:
+                    break
+                self.summaries.append(mm[summary_start:body_start])
+                self.offsets.append(body_start)
+                self.lengths.append(length)
+                pos = body_start + length
+        finally:
+            mm.close()
+        if pos < size:
+            with open(self.data_path, "r+b") as f:
+                f.truncate(pos)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append_many(self, messages):
+        """Añade mensajes (bytes) y devuelve el índice del primero."""
+        first = len(self.offsets)
+        writer = self._writer
+        offset = writer.tell()
+        batch = []
+        for data in messages:
+            summary = summarize(data)
+            writer.write(_HEADER.pack(len(data), len(summary)))
+            writer.write(summary)
+            writer.write(data)
+            offset += _HEADER.size + len(summary)
+            self.summaries.append(summary)
+            self.offsets.append(offset)
+            self.lengths.append(len(data))
+            self.statuses.append(STATUS_NONE)
+            offset += len(data)
+            if self.index is not None:
+                batch.append(data)
+                if len(batch) >= APPEND_BATCH:
+                    self._index_batch(batch)
+                    batch = []
+        writer.flush()
+        if batch:
+            self._index_batch(batch)
+        return first
+
+    def _index_batch(self, batch):
+        # Los mensajes se escriben en el almacén antes que en el índice
+        self._writer.flush()
+        self.index.add_many(len(self.offsets) - len(batch), batch)
+
+    def append(self, data):
+        return self.append_many([data])
+
+    def load_file(self, path, batch_size=APPEND_BATCH):
+        """Añade los mensajes de un fichero (plano o con framing MLLP); devuelve cuántos."""
+        mm = open_mapped(path)
+        if mm is None:
+            return 0
+        count = 0
+        try:
+            batch = []
+            for message in iter_message_views(mm):
+                batch.append(bytes(message))
+                if len(batch) >= batch_size:
+                    self.append_many(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.append_many(batch)
+                count += len(batch)
+        finally:
+            mm.close()
+        return count
+
+    def get(self, index):
+        """Cuerpo del mensaje `index` (bytes)."""
+        reader = self._reader
+        reader.seek(self.offsets[index])
+        return reader.read(self.lengths[index])
+
+    def size(self, index):
+        return self.lengths[index]
+
+    def summary(self, index):
+        """Lista [MSH-7, MSH-9, MSH-10, PID-3] del mensaje como str."""
+        return self.summaries[index].decode("latin-1").split("\x1f")
+
+    def status(self, index):
+        return self.statuses[index]
+
+    def set_status(self, index, status):
+        self.statuses[index] = status
+        self._status_file.seek(index)
+        self._status_file.write(bytes((status,)))
+
+    def set_status_many(self, indices, status):
+        value = bytes((status,))
+        status_file = self._status_file
+        for index in indices:
+            self.statuses[index] = status
+            status_file.seek(index)
+            status_file.write(value)
+
+    def search(self, text, candidates=None):
+        """Índices de los mensajes que cumplen `text`, en orden.
+
+        Con índice es una consulta de `message_index`; sin él, los mensajes cuyo
+        resumen contiene `text` sin distinguir mayúsculas.
+        """
+        if self.index is not None and candidates is None:
+            return self.index.search(text)
+        needle = text.lower().encode("latin-1", errors="replace")
+        summaries = self.summaries
+        indices = range(len(summaries)) if candidates is None else candidates
+        return [i for i in indices if needle in summaries[i].lower()]
+
+    def clear(self):
+        """Elimina todos los mensajes."""
+        self._writer.truncate(0)
+        self._writer.seek(0)
+        self._status_file.truncate(0)
+        self.offsets = array("q")
+        self.lengths = array("I")
+        self.summaries = []
+        self.statuses = bytearray()
+        if self.index is not None:
+            self.index.clear()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader.close()
+            self._status_file.close()
+        if self.index is not None:
+            self.index.close()
+            self.index = None
@@ -0,0 +1,374 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Transporte MLLP (Minimal Lower Layer Protocol): framing, cliente TCP/TLS y pool de conexiones."""
+
+import select
+import socket
+import ssl
+import threading
+import time
+
+from profiling import traced
+
+# Caracteres de control del framing MLLP
+VT = b'\x0b'
+FS = b'\x1c'
+CR = b'\x0d'
+
+RECV_SIZE = 65536
+
+# Modos de verificación TLS: certificado y nombre, sólo certificado, ninguno
+TLS_VERIFY_FULL = "full"
+TLS_VERIFY_CERT = "cert"
+TLS_VERIFY_NONE = "none"
+TLS_VERIFY_MODES = (TLS_VERIFY_FULL, TLS_VERIFY_CERT, TLS_VERIFY_NONE)
+
+
+class MLLPFramingError(Exception):
+    """La respuesta recibida no es un frame MLLP válido."""
+
+    def __init__(self, raw):
+        super().__init__("Invalid MLLP frame")
+        self.raw = raw
+
+
+def wrap(payload):
+    """Envuelve un mensaje (bytes) en un frame MLLP."""
+    return VT + payload + FS + CR
+
+
+class TLSConfig:
+    """Configuración TLS de un destino (clave "tls" del perfil).
+
+    Los SSLContext se comparten entre todas las conexiones con la misma
+    configuración: las sesiones TLS sólo pueden reanudarse dentro del mismo
+    contexto.
+    """
+
+    _contexts = {}
+    _contexts_lock = threading.Lock()
+
+    def __init__(self, enabled=False, ca_file="", cert_file="", key_file="", server_name="",
+                 verify=TLS_VERIFY_FULL):
+        if verify not in TLS_VERIFY_MODES:
+            raise ValueError(f"Invalid TLS verify mode: {verify!r}")
+        self.enabled = enabled
+        self.ca_file = ca_file
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.server_name = server_name
+        self.verify = verify
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(bool(data.get("enabled", False)), data.get("ca_file", ""), data.get("cert_file", ""),
+                   data.get("key_file", ""), data.get("server_name", ""), data.get("verify", TLS_VERIFY_FULL))
+
+    def to_dict(self):
+        return {"enabled": self.enabled, "ca_file": self.ca_file, "cert_file": self.cert_file,
+                "key_file": self.key_file, "server_name": self.server_name, "verify": self.verify}
+
+    def key(self):
+        return (self.ca_file, self.cert_file, self.key_file, self.verify) if self.enabled else None
+
+    def context(self):
+        key = self.key()
+        with self._contexts_lock:
+            ctx = self._contexts.get(key)
+            if ctx is None:
+                ctx = ssl.create_default_context(cafile=self.ca_file or None)
+                if self.cert_file:
+                    ctx.load_cert_chain(self.cert_file, self.key_file or None)
+                if self.verify != TLS_VERIFY_FULL:
+                    ctx.check_hostname = False
+                if self.verify == TLS_VERIFY_NONE:
+                    ctx.verify_mode = ssl.CERT_NONE
+                self._contexts[key] = ctx
+            return ctx
+
+
+def server_context(cert_file, key_file=None, ca_file=None):
+    """SSLContext de servidor; con `ca_file` se exige certificado de cliente."""
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(cert_file, key_file)
+    if ca_file:
+        ctx.load_verify_locations(ca_file)
+        ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+class MLLPDecoder:
+    """Decodificador MLLP incremental: acepta bytes en trozos arbitrarios y devuelve frames completos."""
+
+    def __init__(self, max_frame_size=64 * 1024 * 1024):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """Añade datos y devuelve la lista de mensajes (sin framing) completados."""
+        buf = self.buffer
+        buf += data
+        frames = []
+        while True:
+            start = buf.find(VT)
+            if start < 0:
+                # Nada que pueda iniciar un frame: conservar sólo si no es ruido en blanco
+                if not buf.strip():
+                    buf.clear()
+                break
+            if start > 0:
+                if buf[:start].strip():
+                    # Bytes fuera de frame: se dejan en el buffer para que el llamador decida
+                    break
+                del buf[:start]
+            end = buf.find(FS + CR, 1)
+            if end < 0:
+                if len(buf) > self.max_frame_size:
+                    raise MLLPFramingError(bytes(buf[:256]))
+                break
+            frames.append(bytes(buf[1:end]))
+            del buf[:end + 2]
+        return frames
+
+    def has_garbage(self):
+        """Indica si el buffer contiene bytes que no pertenecen a ningún frame."""
+        buf = self.buffer
+        return bool(buf) and not buf.lstrip(b" \t\r\n").startswith(VT)
+
+    def skip_garbage(self):
+        """Descarta los bytes anteriores al siguiente VT y devuelve cuántos se han descartado."""
+        buf = self.buffer
+        start = buf.find(VT)
+        dropped = len(buf) if start < 0 else start
+        del buf[:dropped]
+        return dropped
+
+    def reset(self):
+        self.buffer.clear()
+
+
+class MLLPClient:
+    """Conexión MLLP persistente que puede enviar varios mensajes sobre el mismo socket.
+
+    Con `tls` habilitado la conexión se cifra y, al reconectar, se intenta
+    reanudar la sesión TLS anterior para evitar el handshake completo.
+    """
+
+    def __init__(self, host, port, timeout=10.0, tls=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.tls = tls if tls is not None and tls.enabled else None
+        self.tls_session = None
+        self.session_reused = False
+        self.sock = None
+        self.decoder = MLLPDecoder()
+
+    @traced("mllp_connect")
+    def connect(self):
+        if self.sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.tls is not None:
+                try:
+                    sock = self.tls.context().wrap_socket(
+                        sock, server_hostname=self.tls.server_name or self.host, session=self.tls_session)
+                except BaseException:
+                    sock.close()
+                    raise
+                self.session_reused = sock.session_reused
+                self.tls_session = sock.session
+            self.sock = sock
+            self.decoder.reset()
+        return self
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                if self.tls is not None and self.sock.session is not None:
+                    # En TLS 1.3 el ticket de sesión llega después del handshake
+                    self.tls_session = self.sock.session
+                self.sock.close()
+            finally:
+                self.sock = None
+                self.decoder.reset()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    @traced("mllp_send")
+    def send(self, payload):
+        """Envía un mensaje (bytes sin framing)."""
+        self.connect()
+        self.sock.sendall(wrap(payload))
+
+    @traced("mllp_send")
+    def send_many(self, payloads):
+        """Envía varios mensajes en pipeline con una sola escritura."""
+        self.connect()
+        self.sock.sendall(b"".join([wrap(p) for p in payloads]))
+
+    @traced("mllp_receive")
+    def receive(self, timeout=None):
+        """Espera el siguiente frame completo.
+
+        Lanza socket.timeout si no llega a tiempo, MLLPFramingError si llegan
+        bytes sin framing MLLP y ConnectionError si el servidor cierra el socket.
+        """
+        if timeout is not None:
+            self.sock.settimeout(timeout)
+        try:
+            return self._receive()
+        finally:
+            if timeout is not None and self.sock is not None:
+                self.sock.settimeout(self.timeout)
+
+    def _receive(self):
+        decoder = self.decoder
+        pending = decoder.feed(b"")
+        while not pending:
+            if decoder.has_garbage():
+                raw = bytes(decoder.buffer)
+                self.close()
+                raise MLLPFramingError(raw)
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                raw = bytes(decoder.buffer)
+                self.close()
+                if raw.strip():
+                    raise MLLPFramingError(raw)
+                raise ConnectionResetError("Connection closed by peer")
+            pending = decoder.feed(chunk)
+        # Los frames adicionales (p.ej. respuestas en pipeline) se devuelven al buffer
+        for extra in reversed(pending[1:]):
+            decoder.buffer[:0] = wrap(extra)
+        return pending[0]
+
+    def send_and_receive(self, payload):
+        self.send(payload)
+        return self.receive()
+
+    def is_idle_alive(self):
+        """Comprueba sin bloquear que una conexión inactiva sigue abierta.
+
+        En reposo no debería haber nada que leer: si el socket es legible el
+        servidor la ha cerrado (o ha enviado algo inesperado) y no se reutiliza.
+        """
+        if self.sock is None:
+            return False
+        if self.decoder.buffer or (self.tls is not None and self.sock.pending()):
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+
+class ConnectionPool:
+    """Conexiones MLLP inactivas reutilizables por destino (host, puerto, configuración TLS).
+
+    Así el coste de conexión y del handshake TLS se paga una vez por conexión y
+    no por mensaje. Las conexiones inactivas más de `idle_timeout` segundos se
+    cierran al volver a pedir una.
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60.0):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.sessions = {}
+
+    @staticmethod
+    def _key(host, port, tls):
+        return (host, port, tls.key() if tls is not None else None)
+
+    def acquire(self, host, port, timeout=10.0, tls=None):
+        """Devuelve una conexión abierta del pool o un cliente nuevo (sin conectar)."""
+        key = self._key(host, port, tls)
+        now = time.monotonic()
+        stale = []
+        client = None
+        with self.lock:
+            entries = self.idle.get(key, [])
+            while entries:
+                candidate, last_used = entries.pop()
+                if now - last_used <= self.idle_timeout and candidate.is_idle_alive():
+                    client = candidate
+                    break
+                stale.append(candidate)
+            session = self.sessions.get(key)
+        for candidate in stale:
+            candidate.close()
+        if client is None:
+            client = MLLPClient(host, port, timeout, tls)
+            client.tls_session = session
+        else:
+            client.timeout = timeout
+            client.sock.settimeout(timeout)
+        return client
+
+    def release(self, client):
+        """Devuelve al pool una conexión tras un intercambio correcto."""
+        key = self._key(client.host, client.port, client.tls)
+        with self.lock:
+            if client.tls_session is not None:
+                self.sessions[key] = client.tls_session
+            entries = self.idle.setdefault(key, [])
+            if client.connected and len(entries) < self.max_idle:
+                entries.append((client, time.monotonic()))
+                return
+        client.close()
+
+    def exchange(self, host, port, payload, timeout=10.0, tls=None, expect_response=True):
+        """Envía un mensaje por una conexión del pool y devuelve la respuesta (None si no se espera).
+
+        Si una conexión reutilizada resulta estar cerrada se reintenta una vez
+        con una conexión nueva.
+        """
+        for attempt in range(2):
+            client = self.acquire(host, port, timeout, tls)
+            reused = client.connected
+            try:
+                client.send(payload)
+                response = client.receive() if expect_response else None
+            except (ConnectionError, ssl.SSLEOFError):
+                client.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                client.close()
+                raise
+            self.release(client)
+            return response
+
+    def close_all(self):
+        with self.lock:
+            clients = [client for entries in self.idle.values() for client, _ in entries]
+            self.idle.clear()
+        for client in clients:
+            client.close()
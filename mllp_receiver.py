@@ -0,0 +1,368 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Receptor MLLP con asyncio: muchas conexiones simultáneas, ACK inmediato y diario en disco.
+
+Cada conexión usa un `MLLPDecoder` incremental, por lo que los mensajes pueden
+llegar partidos en varios paquetes o varios en un mismo paquete (pipeline). Los
+ACK de todos los mensajes completados en una lectura se envían juntos con un
+único `drain`. Los mensajes recibidos se añaden a un diario con framing MLLP
+(legible por `hl7_query` y `hl7_export`) a través de un buffer grande que se
+vuelca periódicamente.
+
+Las estadísticas (`ReceiverStats`) son simples contadores: la interfaz las
+consulta con un temporizador en lugar de recibir un evento por mensaje.
+
+Uso:
+    python mllp_receiver.py --port 2575 --port 2576 --journal recibidos.hl7
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+
+from hl7_parser import detect_delimiters, get_component, get_field
+from mllp import MLLPDecoder, MLLPFramingError, RECV_SIZE, server_context, wrap
+
+ACK_ACCEPT = b"AA"
+ACK_ERROR = b"AE"
+ACK_REJECT = b"AR"
+
+JOURNAL_BUFFER = 1024 * 1024
+JOURNAL_FLUSH_INTERVAL = 1.0
+
+_ack_counter = itertools.count(1)
+
+
+def build_ack(message, code=ACK_ACCEPT, text=b""):
+    """Construye el ACK de un mensaje (bytes) con sus mismos delimitadores y versión."""
+    delims = detect_delimiters(message)
+    start = message.find(b"MSH")
+    if start < 0 or message[:start].strip(b"\r\n"):
+        msh = b""
+        code = ACK_REJECT
+        text = text or b"Missing MSH segment"
+    else:
+        end = len(message)
+        for term in (b"\r", b"\n"):
+            pos = message.find(term, start)
+            if 0 <= pos < end:
+                end = pos
+        msh = message[start:end]
+    sep = delims.field
+    encoding_chars = delims.component + delims.repetition + delims.escape + delims.subcomponent
+
+    def field(index):
+        return get_field(msh, index, delims) if msh else b""
+
+    trigger = get_component(field(9), 2, delims.component)
+    message_type = b"ACK" + delims.component + trigger if trigger else b"ACK"
+    header = sep.join([
+        b"MSH" + sep + encoding_chars, field(5), field(6), field(3), field(4),
+        time.strftime("%Y%m%d%H%M%S").encode("ascii"), b"", message_type,
+        b"ACK%d" % next(_ack_counter), field(11) or b"P", field(12) or b"2.5",
+    ])
+    msa = [b"MSA", code, field(10)]
+    if text:
+        msa.append(text)
+    return header + b"\r" + sep.join(msa)
+
+
+class ReceiverStats:
+    """Contadores del receptor (sólo los modifica el hilo de asyncio)."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.connections_total = 0
+        self.connections_active = 0
+        self.messages = 0
+        self.bytes = 0
+        self.framing_errors = 0
+        self.acks = {ACK_ACCEPT: 0, ACK_ERROR: 0, ACK_REJECT: 0}
+        self.last_message = b""
+        self.last_peer = ""
+
+    def snapshot(self):
+        return {
+            "uptime": time.monotonic() - self.started,
+            "connections_total": self.connections_total,
+            "connections_active": self.connections_active,
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "framing_errors": self.framing_errors,
+            "acks": {k.decode("ascii"): v for k, v in self.acks.items()},
+        }
+
+
+class MessageJournal:
+    """Diario append-only de mensajes recibidos con framing MLLP y rotación por tamaño."""
+
+    def __init__(self, path, max_bytes=0, buffer_size=JOURNAL_BUFFER):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab", buffering=buffer_size)
+        self.size = self.file.tell()
+
+    def write(self, message):
+        frame = wrap(message)
+        self.file.write(frame)
+        self.size += len(frame)
+        if self.max_bytes and self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        os.replace(self.path, self._rotated_path())
+        self.file = open(self.path, "ab", buffering=self.buffer_size)
+        self.size = 0
+
+    def _rotated_path(self):
+        """Reserva un nombre libre para el diario rotado (nunca se sobrescribe uno anterior).
+
+        Varias rotaciones en el mismo segundo añaden un contador al nombre; el
+        fichero se crea con O_EXCL para que otro proceso no pueda tomar el mismo.
+        """
+        base, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for sequence in itertools.count():
+            target = f"{base}-{stamp}{ext}" if not sequence else f"{base}-{stamp}-{sequence}{ext}"
+            try:
+                os.close(os.open(target, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+            return target
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class MLLPReceiver:
+    """Servidor MLLP sobre asyncio en uno o varios puertos.
+
+    `handler(message)` es opcional; se ejecuta en el hilo del receptor y puede
+    devolver (código, texto) para el ACK. Si lanza una excepción se responde AE.
+    Con `ssl_context` (ver `mllp.server_context`) se escucha en MLLP sobre TLS.
+    """
+
+    def __init__(self, host="0.0.0.0", ports=(2575,), journal=None, send_ack=True, handler=None,
+                 ssl_context=None):
+        self.host = host
+        self.ports = list(ports)
+        self.journal = journal
+        self.send_ack = send_ack
+        self.handler = handler
+        self.ssl_context = ssl_context
+        self.stats = ReceiverStats()
+        self.loop = None
+        self.servers = []
+        self._tasks = set()
+        self.thread = None
+        self._stopped = None
+        self.ready = threading.Event()
+        self.error = None
+
+    async def _handle(self, reader, writer):
+        stats = self.stats
+        stats.connections_total += 1
+        stats.connections_active += 1
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = writer.get_extra_info("peername")
+        peer = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else str(peer)
+        decoder = MLLPDecoder()
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                try:
+                    frames = decoder.feed(data)
+                except MLLPFramingError:
+                    # Frame sin terminar y demasiado grande: se descarta
+                    stats.framing_errors += 1
+                    decoder.reset()
+                    continue
+                if decoder.has_garbage():
+                    stats.framing_errors += 1
+                    decoder.skip_garbage()
+                    frames += decoder.feed(b"")
+                if not frames:
+                    continue
+                acks = [self._process(frame, peer) for frame in frames]
+                if self.send_ack:
+                    writer.write(b"".join(acks))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        except asyncio.CancelledError:
+            # Parada del receptor: se cierra la conexión sin propagar la cancelación
+            pass
+        finally:
+            self._tasks.discard(task)
+            stats.connections_active -= 1
+            writer.close()
+
+    def _process(self, message, peer):
+        """Registra un mensaje y devuelve su ACK ya enmarcado."""
+        stats = self.stats
+        stats.messages += 1
+        stats.bytes += len(message)
+        stats.last_message = message
+        stats.last_peer = peer
+        if self.journal is not None:
+            self.journal.write(message)
+        code, text = ACK_ACCEPT, b""
+        if not message.lstrip(b"\r\n").startswith(b"MSH"):
+            code = ACK_REJECT
+        elif self.handler is not None:
+            try:
+                result = self.handler(message)
+                if result:
+                    code, text = result
+            except Exception as e:
+                code, text = ACK_ERROR, str(e).encode("utf-8", errors="replace")[:200]
+        if not self.send_ack:
+            return b""
+        stats.acks[code] = stats.acks.get(code, 0) + 1
+        return wrap(build_ack(message, code, text))
+
+    def _flush_journal(self):
+        if self.journal is not None:
+            self.journal.flush()
+            self.loop.call_later(JOURNAL_FLUSH_INTERVAL, self._flush_journal)
+
+    async def serve(self):
+        """Escucha en todos los puertos hasta que se llama a `stop`."""
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            for port in self.ports:
+                self.servers.append(await asyncio.start_server(self._handle, self.host, port, backlog=1024,
+                                                               ssl=self.ssl_context))
+            self.loop.call_later(JOURNAL_FLUSH_INTERVAL, self._flush_journal)
+        except BaseException as e:
+            # Cualquier error (no sólo OSError: p.ej. OverflowError con un puerto fuera de rango) lo relanza start()
+            self.error = e
+            for server in self.servers:
+                server.close()
+            raise
+        finally:
+            self.ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            for server in self.servers:
+                server.close()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for server in self.servers:
+                await server.wait_closed()
+            self.servers = []
+            if self.journal is not None:
+                self.journal.flush()
+
+    def start(self):
+        """Arranca el receptor en un hilo propio; lanza OSError si algún puerto no está disponible."""
+        def run():
+            try:
+                asyncio.run(self.serve())
+            except Exception as e:
+                # El error al abrir los puertos ya lo relanza start() en el hilo que llama
+                if e is not self.error:
+                    raise
+            finally:
+                self.ready.set()
+        self.ready.clear()
+        self.error = None
+        self.thread = threading.Thread(target=run, name="mllp-receiver", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self.loop is not None and self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+def port_number(text):
+    """Tipo de argparse para un puerto TCP (1-65535)."""
+    try:
+        port = int(text)
+    except ValueError:
+        port = 0
+    if not 0 < port < 65536:
+        raise argparse.ArgumentTypeError(f"invalid port (expected 1-65535): {text!r}")
+    return port
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MLLP receiver")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("-p", "--port", type=port_number, action="append", help="listening port (repeatable, default 2575)")
+    parser.add_argument("--journal", help="file where received messages are appended (MLLP framed)")
+    parser.add_argument("--rotate-mb", type=int, default=0, help="rotate the journal after this size")
+    parser.add_argument("--no-ack", action="store_true", help="do not answer with ACK")
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    parser.add_argument("--tls-cert", help="server certificate (PEM) to listen with TLS")
+    parser.add_argument("--tls-key", help="private key of the certificate (if not in --tls-cert)")
+    parser.add_argument("--tls-ca", help="CA bundle used to require client certificates")
+    args = parser.parse_args(argv)
+
+    ssl_context = server_context(args.tls_cert, args.tls_key, args.tls_ca) if args.tls_cert else None
+    journal = MessageJournal(args.journal, args.rotate_mb * 1024 * 1024) if args.journal else None
+    receiver = MLLPReceiver(args.host, args.port or [2575], journal, not args.no_ack, ssl_context=ssl_context)
+    receiver.start()
+    print(f"Listening on {args.host} ports {', '.join(map(str, receiver.ports))}", file=sys.stderr)
+    last = 0
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            s = receiver.stats.snapshot()
+            rate = (s["messages"] - last) / args.stats_interval
+            last = s["messages"]
+            print(f"{s['messages']} messages ({rate:.0f}/s), {s['connections_active']} connections, "
+                  f"{s['framing_errors']} framing errors, ACK {s['acks']}", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        if journal is not None:
+            journal.close()
+
+
+if __name__ == "__main__":
+    main()
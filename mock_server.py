@@ -1,49 +1,51 @@
-import socket
-import datetime
+import argparse
+import random
+import time
 
-def start_mock_server(host='127.0.0.1', port=2575):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((host, port))
-    server_socket.listen(1)
-    print(f"Mock HL7 Server listening on {host}:{port}")
+from mllp import server_context
+from mllp_receiver import ACK_ERROR, MLLPReceiver
 
-    VT = b'\x0b'
-    FS = b'\x1c'
-    CR = b'\x0d'
 
-    while True:
-        conn, addr = server_socket.accept()
-        print(f"Connection from {addr}")
-        with conn:
-            data = b""
-            while True:
-                chunk = conn.recv(1024)
-                if not chunk:
-                    break
-                data += chunk
-                if data.endswith(FS + CR):
-                    break
-            
-            if data:
-                print(f"Received raw data: {data}")
-                # Unwrap
-                if data.startswith(VT) and data.endswith(FS + CR):
-                    msg_content = data[1:-2].decode('utf-8')
-                    print(f"Received HL7 Message:\n{msg_content}")
-                    
-                    # Generate ACK
-                    # Simple ACK: MSH|^~\&|MOCK_SERVER||SENDER||YYYYMMDDHHMMSS||ACK|MSGID|P|2.3
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-                    ack_msg = f"MSH|^~\\&|MOCK_SERVER||SENDER||{timestamp}||ACK|MSGID|P|2.3\rMSA|AA|MSGID"
-                    
-                    wrapped_ack = VT + ack_msg.encode('utf-8') + FS + CR
-                    conn.sendall(wrapped_ack)
-                    print("Sent ACK")
-                else:
-                    print("Received invalid MLLP frame")
+def start_mock_server(host='127.0.0.1', port=2575, tls_cert=None, tls_key=None, quiet=False, error_rate=0.0,
+                      seed=None):
+    # Receptor asyncio: admite varios clientes simultáneos y mensajes en pipeline.
+    # Con error_rate se responde AE a esa fracción de mensajes (reproducible con seed).
+    rng = random.Random(seed)
+
+    def show(message):
+        if not quiet:
+            print(f"Received HL7 Message:\n{message.decode('utf-8', errors='replace')}")
+        if error_rate and rng.random() < error_rate:
+            if not quiet:
+                print("Sent ACK (AE)")
+            return ACK_ERROR, b"Simulated error"
+        if not quiet:
+            print("Sent ACK")
+
+    ssl_context = server_context(tls_cert, tls_key) if tls_cert else None
+    receiver = MLLPReceiver(host, [port], handler=show, ssl_context=ssl_context)
+    receiver.start()
+    print(f"Mock HL7 Server listening on {host}:{port}{' (TLS)' if ssl_context else ''}")
+    try:
+        while True:
+            time.sleep(1)
+    finally:
+        receiver.stop()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock HL7 MLLP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2575)
+    # Certificado autofirmado para pruebas:
+    # openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 365 -subj /CN=localhost
+    parser.add_argument("--tls-cert", help="certificate (PEM) to listen with TLS")
+    parser.add_argument("--tls-key", help="private key (PEM)")
+    # Para pruebas de carga: sin volcar cada mensaje y con una fracción de errores reproducible
+    parser.add_argument("--quiet", action="store_true", help="do not print the received messages")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of messages answered with AE")
+    parser.add_argument("--seed", type=int, help="random seed for --error-rate")
+    args = parser.parse_args()
     try:
-        start_mock_server()
+        start_mock_server(args.host, args.port, args.tls_cert, args.tls_key, args.quiet, args.error_rate, args.seed)
     except KeyboardInterrupt:
         print("\nServer stopped.")
@@ -0,0 +1,402 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Cola de salida store-and-forward persistida en disco.
+
+Los mensajes se añaden a un log append-only (`queue.log`) y un hilo los drena
+en orden hacia el destino. Cada mensaje resuelto (ACK o dead-letter) añade un
+registro DONE; cuando los registros muertos dominan el log se compacta
+reescribiendo sólo los pendientes. Tras un reinicio el log se reproduce para
+reconstruir la cola.
+"""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from ack_tracker import AckTracker, classify, STATUS_ACCEPT, STATUS_REJECT
+from hl7_parser import LazyMessage, parse_ack
+from mllp import MLLPClient, MLLPFramingError, wrap
+from rate_control import RateLimiter
+
+# Cabecera de registro: tipo, secuencia, longitud del payload, crc32 del payload
+_HEADER = struct.Struct("<BQII")
+REC_ENQUEUE = 1
+REC_DONE = 2
+
+LOG_NAME = "queue.log"
+DEAD_LETTER_NAME = "deadletter.hl7"
+# ACK completos guardados por la captura (errores y muestras, ver ack_capture)
+ACK_SPOOL_NAME = "acks.hl7"
+DESTINATION_NAME = "destination.json"
+
+# Duplicaciones máximas de la espera entre reintentos (después manda max_delay)
+MAX_BACKOFF_EXPONENT = 32
+
+# Resultados posibles de un intento de envío
+OUTCOME_OK = "OK"
+OUTCOME_AE = "AE"
+OUTCOME_AR = "AR"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_REFUSED = "refused"
+
+
+class RetryPolicy:
+    """Política de reintentos por tipo de resultado.
+
+    `max_attempts` = 0 significa reintentar indefinidamente; al agotar los
+    intentos el mensaje va a dead-letter para no bloquear el resto de la cola.
+    """
+
+    DEFAULTS = {
+        OUTCOME_REFUSED: {"max_attempts": 0, "delay": 1.0, "max_delay": 60.0},
+        OUTCOME_TIMEOUT: {"max_attempts": 0, "delay": 2.0, "max_delay": 60.0},
+        OUTCOME_AR: {"max_attempts": 5, "delay": 5.0, "max_delay": 300.0},
+        OUTCOME_AE: {"max_attempts": 1, "delay": 0.0, "max_delay": 0.0},
+    }
+
+    def __init__(self, rules=None):
+        self.rules = {k: dict(v) for k, v in self.DEFAULTS.items()}
+        for outcome, rule in (rules or {}).items():
+            self.rules.setdefault(outcome, {}).update(rule)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data)
+
+    def to_dict(self):
+        return self.rules
+
+    def decide(self, outcome, attempt):
+        """Devuelve (reintentar, espera en segundos) tras el intento `attempt` (1-based)."""
+        rule = self.rules.get(outcome)
+        if rule is None:
+            return False, 0.0
+        max_attempts = rule.get("max_attempts", 0)
+        if max_attempts and attempt >= max_attempts:
+            return False, 0.0
+        # El exponente se acota: con reintentos indefinidos 2 ** attempt acabaría desbordando el float
+        delay = rule.get("delay", 1.0) * (2 ** min(attempt - 1, MAX_BACKOFF_EXPONENT))
+        return True, min(delay, rule.get("max_delay", delay))
+
+
+class OutboundQueue:
+    """Log append-only de mensajes pendientes con compactación.
+
+    Con `max_pending` la cola está acotada: `enqueue_many` espera a que el
+    emisor la vacíe, de modo que un productor rápido (p.ej. el generador) se
+    frena al ritmo del destino.
+    """
+
+    def __init__(self, spool_dir, fsync=False, compact_min_records=10000, max_pending=0):
+        self.spool_dir = spool_dir
+        self.fsync = fsync
+        self.compact_min_records = compact_min_records
+        self.max_pending = max_pending
+        os.makedirs(spool_dir, exist_ok=True)
+        self.log_path = os.path.join(spool_dir, LOG_NAME)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        # seq -> (offset del payload, longitud); dict conserva el orden de inserción
+        self.pending = {}
+        self.dead_records = 0
+        self.next_seq = 1
+        self._recover()
+        self._writer = open(self.log_path, "ab")
+        self._reader = open(self.log_path, "rb")
+
+    def _recover(self):
+        """Reconstruye la cola a partir del log, truncando un registro final incompleto."""
+        if not os.path.exists(self.log_path):
+            return
+        good_end = 0
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+        pos, size = 0, len(data)
+        while pos + _HEADER.size <= size:
+            rec_type, seq, length, crc = _HEADER.unpack_from(data, pos)
+            payload_start = pos + _HEADER.size
+            payload_end = payload_start + length
+            if payload_end > size or zlib.crc32(data[payload_start:payload_end]) != crc:
+                break
+            if rec_type == REC_ENQUEUE:
+                self.pending[seq] = (payload_start, length)
+            elif rec_type == REC_DONE:
+                if self.pending.pop(seq, None) is not None:
+                    self.dead_records += 2
+            self.next_seq = max(self.next_seq, seq + 1)
+            pos = good_end = payload_end
+        if good_end < size:
+            with open(self.log_path, "r+b") as f:
+                f.truncate(good_end)
+
+    def _append(self, rec_type, seq, payload):
+        offset = self._writer.tell() + _HEADER.size
+        self._writer.write(_HEADER.pack(rec_type, seq, len(payload), zlib.crc32(payload)))
+        self._writer.write(payload)
+        return offset
+
+    def _commit(self):
+        self._writer.flush()
+        if self.fsync:
+            os.fsync(self._writer.fileno())
+
+    def enqueue(self, payload):
+        """Añade un mensaje (bytes) y devuelve su número de secuencia."""
+        return self.enqueue_many([payload])[-1]
+
+    def enqueue_many(self, payloads, timeout=None):
+        """Añade varios mensajes con una sola escritura al disco.
+
+        Si la cola está acotada nunca supera `max_pending`: los mensajes se
+        añaden por tramos según se libera sitio. Lanza TimeoutError si no hay
+        sitio para todos en `timeout` segundos (los ya añadidos se quedan en
+        la cola).
+        """
+        payloads = list(payloads)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seqs = []
+        with self.lock:
+            while len(seqs) < len(payloads):
+                room = len(payloads) - len(seqs)
+                if self.max_pending:
+                    wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    if not self.not_full.wait_for(lambda: len(self.pending) < self.max_pending, wait):
+                        raise TimeoutError("Outbound queue is full")
+                    room = min(room, self.max_pending - len(self.pending))
+                for payload in payloads[len(seqs):len(seqs) + room]:
+                    seq = self.next_seq
+                    self.next_seq += 1
+                    self.pending[seq] = (self._append(REC_ENQUEUE, seq, payload), len(payload))
+                    seqs.append(seq)
+                self._commit()
+                self.not_empty.notify_all()
+        return seqs
+
+    def peek(self, timeout=None):
+        """Devuelve (seq, payload) del mensaje más antiguo sin retirarlo, o None."""
+        with self.lock:
+            if not self.pending and not self.not_empty.wait_for(lambda: self.pending, timeout):
+                return None
+            seq, (offset, length) = next(iter(self.pending.items()))
+            self._reader.seek(offset)
+            return seq, self._reader.read(length)
+
+    def complete(self, seq, status=b"OK"):
+        """Marca un mensaje como resuelto y compacta el log si procede."""
+        with self.lock:
+            if self.pending.pop(seq, None) is None:
+                return
+            self._append(REC_DONE, seq, status)
+            self._commit()
+            self.dead_records += 2
+            self.not_full.notify_all()
+            if self.dead_records >= self.compact_min_records and self.dead_records > 2 * len(self.pending):
+                self._compact()
+
+    def dead_letter(self, seq, payload, reason):
+        """Guarda el mensaje en el fichero dead-letter (framing MLLP) y lo retira de la cola."""
+        with open(os.path.join(self.spool_dir, DEAD_LETTER_NAME), "ab") as f:
+            f.write(wrap(payload))
+        self.complete(seq, reason.encode("ascii", errors="replace"))
+
+    def _compact(self):
+        """Reescribe el log sólo con los mensajes pendientes (llamar con el lock tomado)."""
+        tmp_path = self.log_path + ".compact"
+        new_pending = {}
+        with open(tmp_path, "wb") as out:
+            for seq, (offset, length) in self.pending.items():
+                self._reader.seek(offset)
+                payload = self._reader.read(length)
+                out.write(_HEADER.pack(REC_ENQUEUE, seq, length, zlib.crc32(payload)))
+                new_pending[seq] = (out.tell(), length)
+                out.write(payload)
+            out.flush()
+            os.fsync(out.fileno())
+        self._writer.close()
+        self._reader.close()
+        os.replace(tmp_path, self.log_path)
+        self._writer = open(self.log_path, "ab")
+        self._reader = open(self.log_path, "rb")
+        self.pending = new_pending
+        self.dead_records = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            if not self.fsync:
+                os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._reader.close()
+
+
+class QueueDrainer(threading.Thread):
+    """Hilo que envía en orden los mensajes de una cola a un destino MLLP.
+
+    `on_event(kind, seq, detail)` se invoca desde este hilo con kind en
+    'sent', 'retry' o 'dead_letter'. `rate_limiter` (ver `rate_control`)
+    regula el ritmo de envío y se ajusta con la latencia de cada ACK. Con
+    `capture` (ver `ack_capture`) cada intento deja un resumen compacto de su
+    ACK, o del timeout o rechazo, en lugar de conservar la respuesta.
+    """
+
+    def __init__(self, queue, host, port, timeout=10.0, expect_ack=True, policy=None, on_event=None, tls=None,
+                 rate_limiter=None, capture=None):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.expect_ack = expect_ack
+        self.policy = policy or RetryPolicy()
+        self.on_event = on_event
+        self.stop_event = threading.Event()
+        self.tls = tls
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.capture = capture
+        self.client = MLLPClient(host, port, timeout, tls)
+        self.tracker = AckTracker(timeout)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.queue.lock:
+            self.queue.not_empty.notify_all()
+
+    def _emit(self, kind, seq, detail=""):
+        if self.on_event is not None:
+            self.on_event(kind, seq, detail)
+
+    def _attempt(self, payload):
+        """Realiza un intento de envío y devuelve (resultado, detalle)."""
+        reused = self.client.connected
+        outcome, detail = self._attempt_once(payload)
+        if outcome == OUTCOME_REFUSED and reused:
+            # El servidor pudo cerrar una conexión inactiva: probar con una nueva
+            outcome, detail = self._attempt_once(payload)
+        return outcome, detail
+
+    def _capture(self, control_id, ack, start, outcome=None):
+        if self.capture is not None:
+            self.capture.record(control_id, ack, time.monotonic() - start, outcome)
+
+    def _attempt_once(self, payload):
+        control_id = LazyMessage(payload).control_id
+        tracker = self.tracker
+        start = time.monotonic()
+        try:
+            if not self.expect_ack:
+                self.client.send(payload)
+                return OUTCOME_OK, ""
+            tracker.track(control_id, self.timeout)
+            self.client.send(payload)
+            while True:
+                remaining = tracker.time_to_next_deadline()
+                if remaining is None or remaining <= 0:
+                    raise socket.timeout()
+                ack = self.client.receive(remaining)
+                if not control_id:
+                    # Sin MSH-10 no hay nada que correlacionar: aceptar el primer ACK
+                    tracker.discard(control_id)
+                    code, _, text = parse_ack(ack)
+                    break
+                result = tracker.match(ack)
+                if result is not None:
+                    code, text = result.code, result.text
+                    break
+                # ACK tardío de un intento anterior (MSA-2 distinto): descartarlo
+            self._capture(control_id, ack, start)
+        except ConnectionRefusedError as e:
+            tracker.discard(control_id)
+            self.client.close()
+            self._capture(control_id, None, start, OUTCOME_REFUSED)
+            return OUTCOME_REFUSED, str(e)
+        except socket.timeout:
+            tracker.discard(control_id)
+            # Un ACK tardío desincronizaría la conexión: abrir una nueva
+            self.client.close()
+            self._capture(control_id, None, start, OUTCOME_TIMEOUT)
+            return OUTCOME_TIMEOUT, "timeout"
+        except (OSError, MLLPFramingError) as e:
+            tracker.discard(control_id)
+            self.client.close()
+            self._capture(control_id, None, start, OUTCOME_REFUSED)
+            return OUTCOME_REFUSED, str(e)
+        status = classify(code)
+        if status == STATUS_ACCEPT:
+            return OUTCOME_OK, code.decode("ascii", errors="replace")
+        if status == STATUS_REJECT:
+            return OUTCOME_AR, text.decode("latin-1")
+        return OUTCOME_AE, text.decode("latin-1") or code.decode("ascii", errors="replace")
+
+    def run(self):
+        attempt = 0
+        while not self.stop_event.is_set():
+            item = self.queue.peek(timeout=1.0)
+            if item is None:
+                continue
+            seq, payload = item
+            attempt += 1
+            limiter = self.rate_limiter
+            limiter.acquire(len(payload), stop_event=self.stop_event)
+            if self.stop_event.is_set():
+                break
+            start = time.monotonic()
+            outcome, detail = self._attempt(payload)
+            # AE/AR son errores de aplicación, no señales de saturación del destino
+            limiter.observe(time.monotonic() - start, outcome not in (OUTCOME_TIMEOUT, OUTCOME_REFUSED))
+            if outcome == OUTCOME_OK:
+                self.queue.complete(seq)
+                self._emit("sent", seq, detail)
+                attempt = 0
+                continue
+            retry, delay = self.policy.decide(outcome, attempt)
+            if retry:
+                self._emit("retry", seq, f"{outcome}: {detail}")
+                self.stop_event.wait(delay)
+            else:
+                self.queue.dead_letter(seq, payload, outcome)
+                self._emit("dead_letter", seq, f"{outcome}: {detail}")
+                attempt = 0
+        self.client.close()
+
+
+def save_destination(spool_dir, destination):
+    """Guarda los datos del destino junto a la cola para poder reanudarla tras un reinicio."""
+    os.makedirs(spool_dir, exist_ok=True)
+    with open(os.path.join(spool_dir, DESTINATION_NAME), "w", encoding="utf-8") as f:
+        json.dump(destination, f, indent=4)
+
+
+def load_destination(spool_dir):
+    try:
+        with open(os.path.join(spool_dir, DESTINATION_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def spool_dir_for(spool_root, host, port):
+    """Directorio de spool de un destino (una cola por host:puerto)."""
+    safe_host = "".join(c if c.isalnum() or c in "-." else "_" for c in host)
+    return os.path.join(spool_root, f"{safe_host}_{port}")
@@ -0,0 +1,219 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Perfilado opcional por fases con temporizadores y contadores.
+
+Las funciones clave se decoran con `@traced("fase")`. Mientras el perfilado
+está desactivado (lo normal) el decorador sólo añade una llamada y la consulta
+de un booleano global. Activado, cada llamada mide su tiempo con
+`perf_counter_ns` y lo acumula por ruta de fases anidadas (p.ej.
+`parse_message;decompose_components`) en una tabla por hilo, sin locks:
+
+- llamadas, tiempo total, tiempo propio (sin las fases hijas) y máximo.
+
+Los resultados se pueden ver como resumen por fase (`summary`) o volcar en
+formato "folded stacks" (`write_folded`), que aceptan flamegraph.pl,
+speedscope o inferno.
+
+Se activa desde la GUI (Ver > Perfilado) o con la variable de entorno
+HL7_PROFILE=ruta.folded, que vuelca el resultado al terminar el proceso. En
+los procesos hijos (envío en paralelo) se añade el PID al nombre del fichero
+salvo que la ruta ya contenga "{pid}".
+"""
+
+import functools
+import multiprocessing
+import os
+import threading
+from multiprocessing import util
+from time import perf_counter_ns
+
+ENV_VAR = "HL7_PROFILE"
+
+# Posiciones de las estadísticas de cada ruta
+CALLS = 0
+TOTAL = 1
+SELF = 2
+MAX = 3
+
+_enabled = False
+_local = threading.local()
+# (nombre del hilo, tabla ruta -> [llamadas, total, propio, máximo]) de cada hilo que ha medido algo
+_tables = []
+_tables_lock = threading.Lock()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Descarta lo medido hasta ahora (las fases en curso se siguen midiendo)."""
+    with _tables_lock:
+        for _, table in _tables:
+            table.clear()
+
+
+def _thread_state():
+    table = {}
+    with _tables_lock:
+        _tables.append((threading.current_thread().name, table))
+    _local.state = ([], table)
+    return _local.state
+
+
+def _timed(name, func, args, kwargs):
+    try:
+        frames, table = _local.state
+    except AttributeError:
+        frames, table = _thread_state()
+    # Cada marco es [ruta, tiempo de las fases hijas]
+    path = frames[-1][0] + ";" + name if frames else name
+    frame = [path, 0]
+    frames.append(frame)
+    start = perf_counter_ns()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = perf_counter_ns() - start
+        frames.pop()
+        if frames:
+            frames[-1][1] += elapsed
+        entry = table.get(path)
+        if entry is None:
+            entry = table[path] = [0, 0, 0, 0]
+        entry[CALLS] += 1
+        entry[TOTAL] += elapsed
+        entry[SELF] += elapsed - frame[1]
+        if elapsed > entry[MAX]:
+            entry[MAX] = elapsed
+
+
+def traced(name):
+    """Decorador que mide la función como la fase `name` cuando el perfilado está activo."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            return _timed(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Copia de lo medido: {(hilo, ruta): [llamadas, total_ns, propio_ns, máximo_ns]}."""
+    result = {}
+    with _tables_lock:
+        tables = list(_tables)
+    for thread_name, table in tables:
+        for path, entry in list(table.items()):
+            key = (thread_name, path)
+            if key in result:
+                # Hilos distintos con el mismo nombre (p.ej. hilos de trabajo sucesivos)
+                merged = result[key]
+                for i in (CALLS, TOTAL, SELF):
+                    merged[i] += entry[i]
+                merged[MAX] = max(merged[MAX], entry[MAX])
+            else:
+                result[key] = list(entry)
+    return result
+
+
+def summary(data=None):
+    """Resumen por fase, de más a menos tiempo propio.
+
+    Devuelve dicts con phase, calls, total_ns, self_ns y max_ns. El total de
+    una fase recursiva sólo cuenta su llamada más externa.
+    """
+    data = snapshot() if data is None else data
+    phases = {}
+    for (_, path), entry in data.items():
+        parts = path.split(";")
+        phase = parts[-1]
+        row = phases.get(phase)
+        if row is None:
+            row = phases[phase] = {"phase": phase, "calls": 0, "total_ns": 0, "self_ns": 0, "max_ns": 0}
+        row["calls"] += entry[CALLS]
+        row["self_ns"] += entry[SELF]
+        if phase not in parts[:-1]:
+            row["total_ns"] += entry[TOTAL]
+            row["max_ns"] = max(row["max_ns"], entry[MAX])
+    return sorted(phases.values(), key=lambda r: r["self_ns"], reverse=True)
+
+
+def folded_lines(data=None):
+    """Líneas "hilo;fase;subfase microsegundos" con el tiempo propio de cada ruta."""
+    data = snapshot() if data is None else data
+    lines = []
+    for (thread_name, path), entry in sorted(data.items()):
+        micros = entry[SELF] // 1000
+        if micros > 0:
+            lines.append(f"{thread_name.replace(';', '_').replace(' ', '_')};{path} {micros}")
+    return lines
+
+
+def write_folded(path, data=None):
+    """Vuelca lo medido en formato folded stacks; devuelve el número de líneas escritas."""
+    lines = folded_lines(data)
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+    return len(lines)
+
+
+def _output_path(path):
+    if "{pid}" in path:
+        return path.replace("{pid}", str(os.getpid()))
+    if multiprocessing.parent_process() is not None:
+        return f"{path}.{os.getpid()}"
+    return path
+
+
+def _dump_at_exit(path):
+    # Finalize también se ejecuta al salir de los procesos de multiprocessing, donde atexit no se llama
+    util.Finalize(None, lambda: write_folded(_output_path(path)), exitpriority=0)
+
+
+def _after_fork(path):
+    # El hijo hereda lo medido por el padre antes del fork y no sus finalizadores
+    global _tables
+    _tables = []
+    _local.__dict__.clear()
+    _dump_at_exit(path)
+
+
+def install_from_env():
+    """Activa el perfilado si HL7_PROFILE indica un fichero de salida."""
+    path = os.environ.get(ENV_VAR)
+    if not path or _enabled:
+        return
+    enable()
+    _dump_at_exit(path)
+    util.register_after_fork(_tables_lock, lambda _: _after_fork(path))
+
+
+install_from_env()
@@ -0,0 +1,257 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Control del ritmo de envío por destino.
+
+Se configura por perfil con la clave "rate_limit":
+
+    {"mode": "fixed", "messages_per_second": 50, "bytes_per_second": 200000}
+    {"mode": "adaptive", "target_latency_ms": 500, "min_rate": 1, "max_rate": 2000}
+
+En modo fijo un token bucket limita mensajes/s y/o bytes/s. En modo adaptativo
+el ritmo de mensajes se ajusta con AIMD según la latencia de los ACK: crece
+exponencialmente hasta la primera señal de congestión (como el slow start de
+TCP), después de forma lineal, y se reduce a la mitad cuando la latencia media
+supera el objetivo o hay timeouts o errores de conexión. Los ACK AE/AR no se
+consideran congestión.
+
+La contrapresión hacia lectores y generadores la dan las colas acotadas que
+alimentan al emisor (buffers `shm_ring` y `OutboundQueue(max_pending=...)`):
+cuando el emisor espera por el limitador, la cola se llena y el productor se
+bloquea.
+"""
+
+import threading
+import time
+
+MODE_OFF = "off"
+MODE_FIXED = "fixed"
+MODE_ADAPTIVE = "adaptive"
+MODES = (MODE_OFF, MODE_FIXED, MODE_ADAPTIVE)
+
+# Peso de la última muestra en la media móvil de la latencia
+LATENCY_ALPHA = 0.2
+
+
+def _number(name, value, positive=False):
+    """Valor numérico de la configuración como float; ValueError si no es un número >= 0 (> 0 con `positive`)."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid rate limit {name}: {value!r} (expected a number)")
+    if number != number or number < 0 or (positive and number == 0):
+        raise ValueError(f"Invalid rate limit {name}: {value!r} (expected a number {'>' if positive else '>='} 0)")
+    return number
+
+
+class TokenBucket:
+    """Token bucket con deuda: una petición mayor que la ráfaga espera lo proporcional.
+
+    La ráfaga (`burst`, en segundos de ritmo) es corta y el bucket empieza casi
+    vacío, para no lanzar de golpe un segundo de mensajes contra un destino frágil.
+    """
+
+    def __init__(self, rate, burst=0.1, clock=time.monotonic):
+        self.clock = clock
+        self.burst = burst
+        self.rate = 0.0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated = clock()
+        self.set_rate(rate)
+        self.tokens = 1.0
+
+    def set_rate(self, rate):
+        self._refill(self.clock())
+        self.rate = float(rate)
+        # La ráfaga se expresa en segundos de ritmo (mínimo una unidad)
+        self.capacity = max(1.0, self.rate * self.burst)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Descuenta `amount` y devuelve los segundos que hay que esperar antes de usarlo."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(self.clock())
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """Limitador de un destino (mensajes/s, bytes/s o adaptativo por latencia de ACK).
+
+    Es seguro usarlo desde varios hilos; las esperas se hacen fuera del lock.
+    """
+
+    def __init__(self, mode=MODE_OFF, messages_per_second=0, bytes_per_second=0, burst=0.1,
+                 target_latency_ms=500, min_rate=1.0, max_rate=10000.0, initial_rate=None, increase=5.0,
+                 decrease=0.5, clock=time.monotonic):
+        if mode not in MODES:
+            raise ValueError(f"Unknown rate limit mode: {mode!r}")
+        # Los valores vienen del JSON del perfil: tipos y rangos se comprueban aquí y no al enviar
+        messages_per_second = _number("messages_per_second", messages_per_second)
+        bytes_per_second = _number("bytes_per_second", bytes_per_second)
+        burst = _number("burst", burst, positive=True)
+        target_latency_ms = _number("target_latency_ms", target_latency_ms, positive=True)
+        min_rate = _number("min_rate", min_rate, positive=True)
+        max_rate = _number("max_rate", max_rate, positive=True)
+        if min_rate > max_rate:
+            raise ValueError(f"Invalid rate limit: min_rate {min_rate:g} is above max_rate {max_rate:g}")
+        if initial_rate is not None:
+            initial_rate = _number("initial_rate", initial_rate, positive=True)
+        increase = _number("increase", increase, positive=True)
+        decrease = _number("decrease", decrease, positive=True)
+        if decrease > 1:
+            raise ValueError(f"Invalid rate limit decrease: {decrease:g} (expected a factor up to 1)")
+        self.mode = mode
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.config = {
+            "mode": mode, "messages_per_second": messages_per_second, "bytes_per_second": bytes_per_second,
+            "burst": burst, "target_latency_ms": target_latency_ms, "min_rate": min_rate, "max_rate": max_rate,
+            "initial_rate": initial_rate, "increase": increase, "decrease": decrease,
+        }
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency_ms / 1000.0
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_start = True
+        self.latency = None
+        self.last_decrease = float("-inf")
+        self.message_bucket = None
+        self.byte_bucket = None
+        if mode == MODE_ADAPTIVE:
+            rate = initial_rate or max(self.min_rate, min(self.max_rate, 10.0))
+            self.message_bucket = TokenBucket(rate, burst, clock)
+        elif mode == MODE_FIXED:
+            if messages_per_second:
+                self.message_bucket = TokenBucket(messages_per_second, burst, clock)
+            if bytes_per_second:
+                self.byte_bucket = TokenBucket(bytes_per_second, burst, clock)
+
+    @classmethod
+    def from_dict(cls, data):
+        if data and not isinstance(data, dict):
+            raise ValueError(f"Invalid rate limit settings: {data!r}")
+        data = dict(data or {})
+        known = ("mode", "messages_per_second", "bytes_per_second", "burst", "target_latency_ms", "min_rate",
+                 "max_rate", "initial_rate", "increase", "decrease")
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def to_dict(self):
+        return dict(self.config)
+
+    @property
+    def enabled(self):
+        return self.message_bucket is not None or self.byte_bucket is not None
+
+    @property
+    def rate(self):
+        """Ritmo actual en mensajes/s (0 si no hay límite de mensajes)."""
+        return self.message_bucket.rate if self.message_bucket is not None else 0.0
+
+    def acquire(self, size=0, count=1, stop_event=None):
+        """Espera hasta poder enviar `count` mensajes que suman `size` bytes; devuelve lo esperado.
+
+        Con `stop_event` la espera termina en cuanto se activa (para no retrasar la parada).
+        """
+        if not self.enabled:
+            return 0.0
+        with self.lock:
+            delay = 0.0
+            if self.message_bucket is not None:
+                delay = self.message_bucket.reserve(count)
+            if self.byte_bucket is not None and size:
+                delay = max(delay, self.byte_bucket.reserve(size))
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
+
+    def observe(self, latency, ok=True, count=1):
+        """Registra el resultado de un envío (latencia hasta el ACK) y ajusta el ritmo adaptativo.
+
+        `ok` es False en timeouts y errores de conexión.
+        """
+        if self.mode != MODE_ADAPTIVE:
+            return
+        with self.lock:
+            bucket = self.message_bucket
+            rate = bucket.rate
+            if ok:
+                self.latency = latency if self.latency is None else (
+                    LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency)
+            congested = not ok or (self.latency is not None and self.latency > self.target_latency)
+            now = self.clock()
+            if congested:
+                # Como mucho una reducción por intervalo: los ACK ya en vuelo no deben volver a reducirla
+                if now - self.last_decrease >= max(self.target_latency, 1.0 / max(rate, 1e-9)):
+                    self.last_decrease = now
+                    self.slow_start = False
+                    bucket.set_rate(max(self.min_rate, rate * self.decrease))
+                return
+            if bucket.tokens > bucket.capacity / 2:
+                # El emisor no llega al ritmo actual: subirlo no aportaría información
+                return
+            if self.slow_start:
+                # Duplica el ritmo aproximadamente cada segundo
+                new_rate = rate + count
+            else:
+                # Suma `increase` mensajes/s aproximadamente cada segundo
+                new_rate = rate + self.increase * count / max(rate, 1.0)
+            bucket.set_rate(min(self.max_rate, new_rate))
+
+
+def split_rate_limit(config, parts):
+    """Reparte un límite de destino entre `parts` emisores independientes (p.ej. procesos)."""
+    config = dict(config or {})
+    if parts <= 1:
+        return config
+    for key in ("messages_per_second", "bytes_per_second", "min_rate", "max_rate", "initial_rate"):
+        if config.get(key):
+            config[key] = _number(key, config[key]) / parts
+    return config
+
+
+def add_rate_arguments(parser):
+    """Opciones de línea de comandos comunes para limitar el ritmo de envío."""
+    parser.add_argument("--rate", type=float, help="maximum messages per second")
+    parser.add_argument("--byte-rate", type=float, help="maximum bytes per second")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="adapt the message rate to the ACK latency (AIMD)")
+    parser.add_argument("--target-latency", type=float, default=500.0,
+                        help="ACK latency (ms) above which the adaptive rate backs off")
+
+
+def rate_limit_from_args(args):
+    """Configuración "rate_limit" a partir de las opciones, o None si no se pidió ningún límite."""
+    if args.adaptive:
+        config = {"mode": MODE_ADAPTIVE, "target_latency_ms": args.target_latency}
+        if args.rate:
+            config["max_rate"] = args.rate
+        return config
+    if args.rate or args.byte_rate:
+        return {"mode": MODE_FIXED, "messages_per_second": args.rate or 0, "bytes_per_second": args.byte_rate or 0}
+    return None
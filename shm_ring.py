@@ -0,0 +1,281 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Buffer circular en memoria compartida para un productor y un consumidor.
+
+Los mensajes se copian una sola vez al segmento compartido en lugar de
+serializarse con pickle y pasar por una tubería como en `multiprocessing.Queue`.
+El productor puede además construir el registro directamente en el segmento
+(`reserve`/`commit`) y el consumidor leerlo como memoryview sin copiarlo
+(`read`/`release`).
+
+Cabecera (192 bytes): posición de escritura (head), posición de lectura (tail)
+y el indicador de cierre junto a la capacidad, cada uno en su propia línea de
+caché. Las posiciones son contadores de 64 bits que sólo crecen; sólo el
+productor escribe head y sólo el consumidor escribe tail, por lo que no hace
+falta ningún lock.
+
+Cada registro es una longitud (uint32) seguida de los datos, alineado a 8
+bytes. Si un registro no cabe hasta el final del buffer se escribe un marcador
+de salto y continúa desde el principio, así los datos de un registro son
+siempre contiguos.
+"""
+
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+_LENGTH = struct.Struct("<I")
+
+# Índices (en palabras de 64 bits) de los campos de la cabecera
+HEAD = 0
+TAIL = 8
+CLOSED = 16
+CAPACITY = 17
+HEADER_SIZE = 192
+
+WRAP_MARKER = 0xFFFFFFFF
+ALIGN = 8
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+
+# Espera: primero activa, después cediendo la CPU y por último sleeps crecientes hasta el máximo
+_SPIN = 50
+_YIELD = 500
+_MAX_SLEEP = 0.001
+_PREFAULT_CHUNK = 1024 * 1024
+_yield = getattr(os, "sched_yield", lambda: time.sleep(0))
+
+
+def _record_size(length):
+    return (_LENGTH.size + length + ALIGN - 1) & ~(ALIGN - 1)
+
+
+class RingClosed(Exception):
+    """Se intentó escribir en un buffer cuyo productor ya lo cerró."""
+
+
+class ShmRing:
+    """Buffer circular SPSC sobre `multiprocessing.shared_memory`.
+
+    El proceso que lo crea (`create=True`) es el dueño y debe llamar a `unlink`
+    al terminar; el otro extremo se conecta por nombre con `ShmRing(name)`.
+    """
+
+    def __init__(self, name=None, capacity=DEFAULT_CAPACITY, create=False):
+        if create:
+            capacity = max(_record_size(0) * 2, (capacity + ALIGN - 1) & ~(ALIGN - 1))
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity)
+            # Se tocan todas las páginas al crear para no pagar los fallos de página al escribir
+            zeros = bytes(min(_PREFAULT_CHUNK, HEADER_SIZE + capacity))
+            for pos in range(0, HEADER_SIZE + capacity, len(zeros)):
+                chunk = min(len(zeros), HEADER_SIZE + capacity - pos)
+                self.shm.buf[pos:pos + chunk] = zeros[:chunk]
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # Cabecera como palabras nativas alineadas: cada lectura o escritura es un único acceso de 64 bits
+        # (struct con "<Q" copia byte a byte y el otro proceso podría ver una posición a medio escribir)
+        self.header = self.shm.buf[:HEADER_SIZE].cast("Q")
+        if create:
+            self.header[CAPACITY] = capacity
+        else:
+            # El segmento puede estar redondeado a páginas: se usa la capacidad declarada por el creador
+            capacity = self.header[CAPACITY]
+        self.name = self.shm.name
+        self.capacity = capacity
+        self.data = self.shm.buf[HEADER_SIZE:HEADER_SIZE + capacity]
+        self.owner = create
+        # Copias locales de las posiciones: cada extremo sólo lee la del otro cuando la necesita
+        self._head = self.header[HEAD]
+        self._tail = self.header[TAIL]
+        # Consumidor: posición de lectura (aún no liberada) y vistas entregadas
+        self._cursor = self._tail
+        self._views = []
+        # Productor: registro reservado pendiente de commit
+        self._reserved = 0
+        self._write_view = None
+
+    @property
+    def closed(self):
+        return self.header[CLOSED] != 0
+
+    def __len__(self):
+        """Bytes ocupados (incluidas cabeceras de registro y saltos)."""
+        return self.header[HEAD] - self.header[TAIL]
+
+    def max_record(self):
+        """Tamaño máximo de un registro que cabe en el buffer."""
+        return self.capacity - _LENGTH.size
+
+    @staticmethod
+    def _wait(deadline, spins):
+        if spins < _SPIN:
+            return spins + 1
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError("Timed out waiting for the shared-memory ring")
+        if spins < _YIELD:
+            # Con pocos núcleos el otro extremo puede estar esperando a esta CPU
+            _yield()
+        else:
+            time.sleep(min(_MAX_SLEEP, 0.00001 * (spins - _YIELD + 1)))
+        return spins + 1
+
+    def _wait_free(self, size, deadline):
+        """Espera a que haya `size` bytes libres (lo usa el productor)."""
+        spins = 0
+        while self.capacity - (self._head - self._tail) < size:
+            self._tail = self.header[TAIL]
+            if self.capacity - (self._head - self._tail) >= size:
+                return
+            spins = self._wait(deadline, spins)
+
+    def reserve(self, length, timeout=None):
+        """Reserva un registro de `length` bytes y devuelve una vista escribible sobre él.
+
+        Permite construir el registro directamente en la memoria compartida; no
+        es visible para el consumidor hasta `commit()`. Bloquea mientras el buffer
+        está lleno; lanza TimeoutError si se supera `timeout` y ValueError si el
+        registro no cabe en el buffer.
+        """
+        if self.closed:
+            raise RingClosed(self.name)
+        size = _record_size(length)
+        if size > self.capacity:
+            raise ValueError(f"Record of {length} bytes does not fit in a ring of {self.capacity} bytes")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        offset = self._head % self.capacity
+        if offset + size > self.capacity:
+            # No cabe hasta el final: marcador de salto y se continúa en el principio
+            skip = self.capacity - offset
+            self._wait_free(skip, deadline)
+            _LENGTH.pack_into(self.data, offset, WRAP_MARKER)
+            self._head += skip
+            self.header[HEAD] = self._head
+            offset = 0
+        self._wait_free(size, deadline)
+        _LENGTH.pack_into(self.data, offset, length)
+        self._reserved = size
+        self._write_view = self.data[offset + _LENGTH.size:offset + _LENGTH.size + length]
+        return self._write_view
+
+    def commit(self):
+        """Publica el registro reservado con `reserve`."""
+        self._write_view.release()
+        self._write_view = None
+        # Los datos se escriben antes de publicar la nueva posición
+        self._head += self._reserved
+        self.header[HEAD] = self._head
+
+    def put(self, data, timeout=None):
+        """Copia un registro (bytes, bytearray, memoryview o mmap) al buffer."""
+        self.reserve(len(data), timeout)[:] = data
+        self.commit()
+
+    def close_writer(self):
+        """Marca el fin del flujo: el consumidor recibe None al vaciar el buffer."""
+        self.header[CLOSED] = 1
+
+    def read(self, timeout=None):
+        """Devuelve el siguiente registro como memoryview sobre la memoria compartida, sin copiarlo.
+
+        Devuelve None si el productor cerró y no quedan registros. La vista (y
+        las de lecturas anteriores) es válida hasta `release()`, que devuelve su
+        espacio al productor, así que se pueden leer varios registros, usarlos y
+        liberarlos juntos. Mientras se retienen el productor puede quedarse sin
+        sitio: al acumular registros conviene leer los siguientes con timeout=0.
+        Bloquea mientras el buffer está vacío; lanza TimeoutError si se supera
+        `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        spins = 0
+        while True:
+            if self._head == self._cursor:
+                self._head = self.header[HEAD]
+                if self._head == self._cursor:
+                    if self.closed:
+                        # El cierre se publica después del último registro: volver a mirar
+                        self._head = self.header[HEAD]
+                        if self._head == self._cursor:
+                            return None
+                        continue
+                    spins = self._wait(deadline, spins)
+                    continue
+            offset = self._cursor % self.capacity
+            length = _LENGTH.unpack_from(self.data, offset)[0]
+            if length == WRAP_MARKER:
+                self._cursor += self.capacity - offset
+                if not self._views:
+                    # El productor puede estar esperando justo estos bytes para el registro siguiente
+                    self._tail = self._cursor
+                    self.header[TAIL] = self._tail
+                continue
+            start = offset + _LENGTH.size
+            view = self.data[start:start + length]
+            self._views.append(view)
+            self._cursor += _record_size(length)
+            return view
+
+    def release(self):
+        """Invalida las vistas devueltas por `read` y deja su espacio libre para el productor."""
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        if self._cursor != self._tail:
+            self._tail = self._cursor
+            self.header[TAIL] = self._tail
+
+    def get(self, timeout=None):
+        """Como `read` pero devuelve una copia (bytes) y libera el espacio inmediatamente."""
+        view = self.read(timeout)
+        if view is None:
+            return None
+        record = bytes(view)
+        self.release()
+        return record
+
+    def __iter__(self):
+        while True:
+            record = self.get()
+            if record is None:
+                return
+            yield record
+
+    def close(self):
+        """Libera las vistas y desconecta este proceso del segmento."""
+        if self.data is not None:
+            for view in self._views:
+                view.release()
+            self._views.clear()
+            if self._write_view is not None:
+                self._write_view.release()
+                self._write_view = None
+            self.data.release()
+            self.data = None
+            self.header.release()
+            self.shm.close()
+
+    def unlink(self):
+        """Elimina el segmento (sólo el proceso que lo creó)."""
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        self.unlink()
@@ -0,0 +1,74 @@
+# HL7 Sender: A simple HL7 message sender with MLLP support for testing and debugging.
+# Copyright (C) 2025 Victor Chacón + Antigravity by Google
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""Pruebas del buffer circular en memoria compartida: saltos de final de buffer con registros de tamaños mixtos."""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shm_ring import DEFAULT_CAPACITY, ShmRing  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class MixedSizeWrapTest(unittest.TestCase):
+
+    def _roundtrip(self, sizes, capacity=DEFAULT_CAPACITY, rounds=3):
+        ring = ShmRing(capacity=capacity, create=True)
+        reader = ShmRing(ring.name)
+        records = [bytes([i % 251]) * size for i, size in enumerate(sizes * rounds)]
+        errors = []
+
+        def produce():
+            try:
+                for record in records:
+                    ring.put(record, timeout=5)
+                ring.close_writer()
+            except Exception as e:
+                errors.append(e)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        try:
+            received = []
+            while True:
+                record = reader.get(timeout=10)
+                if record is None:
+                    break
+                received.append(record)
+            producer.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(len(received), len(records))
+            self.assertTrue(all(a == b for a, b in zip(received, records)))
+        finally:
+            reader.close()
+            ring.close()
+            ring.unlink()
+
+    def test_wrap_frees_skipped_bytes(self):
+        # 3 MB + 5 MB no caben seguidos en 8 MB: el segundo salta al principio del buffer
+        self._roundtrip([3 * MB, 5 * MB, 200])
+
+    def test_many_wraps(self):
+        self._roundtrip([700 * 1024, 200, 1500 * 1024, 64, 3 * MB], capacity=4 * MB, rounds=10)
+
+
+if __name__ == "__main__":
+    unittest.main()